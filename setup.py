@@ -51,25 +51,19 @@ setup(
         "jsonschema==2.6.0",
         "python-keyczar==0.716",
         "requests==2.18.1",
-        "tornado==4.5.1",
-        "tornado-memcache==0.1",
-    ],
-    dependency_links=[
-        # wow was it tricky (for me) trying to figure out how to get
-        # tornado-memcache to install corectly. there are lots of postings
-        # talking about the basic url structure req'd but only the article
-        # below seemed to highlight the need for the version number on
-        # the end of the url.
-        #
-        #   http://lfhck.com/question/298293/can-pip-install-dependencies-not-specified-in-setuppy-at-install-time
-        #
-        # :TRICKY: the version number @ the end of the URL below matches
-        # the version number in "install_requires" section of this setup.py
-        # and the version number listed in tornado-memcache's setup.py.
-        # all 3 of these version numbers had to match to get this all to
-        # work correctly.
-        "https://github.com/dpnova/tornado-memcache/tarball/master#egg=tornado-memcache-0.1",
+        # yar/util/upstream.py's backpressure for streamed responses
+        # overrides a private method of tornado 4.5's simple HTTP client
+        # (_HTTPConnection.data_received) - tornado 4.6 and later may
+        # change it so check upstream.py before lifting this pin
+        "tornado>=4.5.1,<4.6",
     ],
+    # connections to upstreams (key service, app service and key store)
+    # are only kept alive when pycurl is installed - see yar/util/upstream.py
+    extras_require={
+        "keepalive": [
+            "pycurl==7.43.0",
+        ],
+    },
     # MANIFEST.in in same directory as this setup.py should contain
     # the following:
     #
@@ -28,6 +28,11 @@
 #    doesn't seem typical that locust classes loop forever but this
 #    approach ensures the desired concurrency levels are maintained
 #
+#    3/ signing a request with MAC credentials is CPU intensive enough
+#    to make the load generator rather than the deployment the bottleneck
+#    so each set of MAC credentials gets a single mac.Signer which
+#    is reused for every request signed with those credentials
+#
 
 import json
 import os
@@ -44,6 +49,9 @@ from yar.util import mac
 with open(os.path.expanduser("~/.yar.creds.random.set"), "r") as f:
     _creds = [json.loads(line.strip()) for line in f]
 
+# mac key identifier -> mac.RequestsAuth
+_mac_auths = {}
+
 class Behavior(TaskSet):
     min_wait = 0
     max_wait = 0
@@ -68,10 +76,14 @@ class Behavior(TaskSet):
             return auth
 
         if "mac_key_identifier" in creds:
-            auth = mac.RequestsAuth(
-                mac.MACKeyIdentifier(creds["mac_key_identifier"]),
-                mac.MACKey(creds["mac_key"]),
-                creds["mac_algorithm"])
+            auth = _mac_auths.get(creds["mac_key_identifier"], None)
+            if auth is None:
+                signer = mac.Signer(
+                    mac.MACKeyIdentifier(creds["mac_key_identifier"]),
+                    mac.MACKey(creds["mac_key"]),
+                    creds["mac_algorithm"])
+                auth = signer.requests_auth()
+                _mac_auths[creds["mac_key_identifier"]] = auth
             return auth
 
         return None
@@ -6,6 +6,7 @@ import logging
 import tornado.httputil
 import tornado.httpclient
 
+from yar.util import upstream
 from yar.util.trhutil import get_request_body_if_exists
 
 _logger = logging.getLogger("AUTHSERVICE.%s" % __name__)
@@ -21,6 +22,27 @@ uses the authorization method described by ```app_service_auth_method```
 and the the credential's principal."""
 app_service_auth_method = "YAR"
 
+"""By default the app service's entire response is buffered in memory
+before being returned to the auth service's client. When
+```stream_responses``` is True the response's status and headers are
+relayed as soon as they're received from the app service and the
+response's body is relayed chunk by chunk as it arrives."""
+stream_responses = False
+
+"""When streaming responses these hop-by-hop headers describe the
+auth service's connection to the app service rather than the response
+and so are not relayed."""
+_hop_by_hop_headers = (
+    "Connection",
+    "Keep-Alive",
+    "Proxy-Authenticate",
+    "Proxy-Authorization",
+    "TE",
+    "Trailer",
+    "Transfer-Encoding",
+    "Upgrade",
+)
+
 
 class AsyncAppServiceForwarder(object):
 
@@ -31,25 +53,59 @@ class AsyncAppServiceForwarder(object):
         self._headers = headers
         self._body = body
         self._principal = principal
-
-    def forward(self, callback):
+        self._on_headers = None
+        self._on_chunk = None
+
+    def forward(self, callback, on_headers=None, on_chunk=None):
+        """Async'ly forward the request to the app service. When the
+        app service's response is complete ```callback``` is called.
+
+        If ```on_headers``` and ```on_chunk``` are None the app service's
+        response is buffered and ```callback``` is called with the
+        arguments ```is_ok```, ```http_status_code```, ```headers```
+        and ```body```.
+
+        If ```on_headers``` and ```on_chunk``` are supplied the app
+        service's response is streamed. ```on_headers``` is called with
+        the arguments ```http_status_code```, ```reason``` and ```headers```
+        as soon as the response's headers arrive, ```on_chunk``` is
+        called with each chunk of the response's body and ```callback```
+        is called with the single argument ```is_ok```. If ```on_chunk```
+        returns a ```tornado.concurrent.Future``` no more of the response
+        is read from the app service until the future is done."""
 
         self._callback = callback
+        self._on_headers = on_headers
+        self._on_chunk = on_chunk
 
         headers = tornado.httputil.HTTPHeaders(self._headers)
         headers["Authorization"] = "%s %s" % (
             app_service_auth_method,
             self._principal)
 
+        streaming_args = {}
+        if self._on_headers is not None:
+            self._response_start_line = None
+            self._response_headers = None
+            self._response_headers_relayed = False
+            # :TRICKY: responses are relayed exactly as they're received
+            # so the body must not be decompressed - if it were, the body
+            # wouldn't match the relayed Content-Encoding and Content-Length
+            streaming_args = {
+                "header_callback": self._on_header_line,
+                "streaming_callback": self._on_chunk,
+                "decompress_response": False,
+            }
+
         http_request = tornado.httpclient.HTTPRequest(
             url="http://%s%s" % (app_service, self._uri),
             method=self._method,
             body=self._body,
             headers=headers,
-            follow_redirects=False)
+            follow_redirects=False,
+            **streaming_args)
 
-        http_client = tornado.httpclient.AsyncHTTPClient()
-        http_client.fetch(http_request, self._on_forward_done)
+        upstream.fetch(app_service, http_request, self._on_forward_done)
 
     def _on_forward_done(self, response):
 
@@ -59,6 +115,15 @@ class AsyncAppServiceForwarder(object):
             response.request.method,
             int(response.request_time * 1000))
 
+        if self._on_headers is not None:
+            # status, headers and body have already been relayed. an app
+            # service response code (even a 4xx or 5xx) means the app
+            # service's entire response was relayed and therefore the
+            # forward was successful
+            is_ok = self._response_headers_relayed and response.code != 599
+            self._callback(is_ok)
+            return
+
         if response.error:
             self._callback(False)
             return
@@ -67,3 +132,32 @@ class AsyncAppServiceForwarder(object):
         body = response.body if 0 <= content_length else None
 
         self._callback(True, response.code, response.headers, body)
+
+    def _on_header_line(self, line):
+        """When streaming, called by the HTTP client with the app service
+        response's status line, each header line and finally an empty
+        line to indicate the end of the headers."""
+        if self._response_start_line is None:
+            self._response_start_line = tornado.httputil.parse_response_start_line(line.strip())
+            self._response_headers = tornado.httputil.HTTPHeaders()
+            return
+
+        if line.strip():
+            self._response_headers.parse_line(line)
+            return
+
+        if self._response_start_line.code == 100:
+            # 100 continue is followed by the real response
+            self._response_start_line = None
+            return
+
+        headers = self._response_headers
+        for name in _hop_by_hop_headers:
+            if name in headers:
+                del headers[name]
+
+        self._response_headers_relayed = True
+        self._on_headers(
+            self._response_start_line.code,
+            self._response_start_line.reason,
+            headers)
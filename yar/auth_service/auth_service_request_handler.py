@@ -2,13 +2,14 @@
 
 import httplib
 import logging
-import re
 
+import tornado.concurrent
 import tornado.web
 
 import mac.async_mac_auth
 import basic.async_auth
 import async_app_service_forwarder
+from yar.util import auth_header
 from yar.util import strutil
 from yar.util import trhutil
 
@@ -23,6 +24,17 @@ debug_header_prefix = "X-Yar-Auth-"
 
 auth_failure_detail_header_name = "%sAuth-Failure-Detail" % debug_header_prefix
 
+"""When streaming app service responses (see
+```async_app_service_forwarder.stream_responses```) chunks of the
+app service's response are written to the client as they arrive.
+If the client reads more slowly than the app service writes, once
+```max_stream_buffer_size``` bytes are waiting to be written to the
+client the auth service stops reading the app service's response
+until the client has caught up - TCP flow control then slows the
+app service down to the client's pace. This keeps the memory used
+by each connection bounded without dropping slow clients."""
+max_stream_buffer_size = 1024 * 1024
+
 def _include_auth_failure_debug_details():
     """implementation of ```_include_auth_failure_debug_details()``` is pretty
     obvious. what might be less clear is the motivation for the function.
@@ -35,20 +47,21 @@ AUTH_FAILURE_DETAIL_NO_AUTH_HEADER = 0x0000 + 0x0001
 AUTH_FAILURE_DETAIL_UNKNOWN_AUTHENTICATION_SCHEME = 0x0000 + 0x0002
 AUTH_FAILURE_DETAIL_FOR_TESTING = 0x0000 + 0x00ff
 
-"""When the auth service first recieves a request it extracts the
-authentication scheme from the value associated with the request's
-HTTP authorization header. ```_auth_scheme_reg_ex``` is the regular
-expression used to parse and extract the authentication scheme."""
-_auth_scheme_reg_ex = re.compile(
-    "^\s*(?P<auth_scheme>(MAC|BASIC))\s+.*",
-    re.IGNORECASE)
-
 """The auth service supports a number of authentication mechanisms.
 ```_auth_scheme_to_auth_class``` is used to convert an authentication scheme
 into the class that implements the authentication mechanism."""
 _auth_scheme_to_auth_class = {
-    "MAC": mac.async_mac_auth.AsyncMACAuth,
-    "BASIC": basic.async_auth.Authenticator,
+    auth_header.MAC: mac.async_mac_auth.AsyncMACAuth,
+    auth_header.BASIC: basic.async_auth.Authenticator,
+}
+
+"""When the Authorization header names a supported authentication
+scheme but is otherwise malformed ```_auth_scheme_to_invalid_auth_header```
+is used to convert the authentication scheme into the scheme specific
+authentication failure detail."""
+_auth_scheme_to_invalid_auth_header = {
+    auth_header.MAC: mac.async_mac_auth.AUTH_FAILURE_DETAIL_INVALID_AUTH_HEADER,
+    auth_header.BASIC: basic.async_auth.AUTH_FAILURE_DETAIL_INVALID_AUTH_HEADER_FORMAT_PRE_DECODING,
 }
 
 """The auth service's mainline should use this URL spec
@@ -59,6 +72,8 @@ url_spec = r".*"
 
 class RequestHandler(trhutil.RequestHandler):
 
+    _client_disconnected = False
+
     #
     # :TODO: what happens to "custom" HTTP methods outside of the
     # 7 method listed below?
@@ -100,20 +115,24 @@ class RequestHandler(trhutil.RequestHandler):
                 auth_failure_detail=AUTH_FAILURE_DETAIL_NO_AUTH_HEADER)
             return
 
-        match = _auth_scheme_reg_ex.match(auth_hdr_val)
-        if not match:
+        # the Authorization header is parsed exactly once, here, and the
+        # parsed header is handed to the authenticator
+        parsed_auth_hdr_val = auth_header.parse(auth_hdr_val)
+        if parsed_auth_hdr_val is None:
+            # figuring out why parsing failed is only done on the failure
+            # path so malformed headers cost no more than a failed parse
+            auth_scheme = auth_header.scheme_of(auth_hdr_val)
+            if auth_scheme is None:
+                auth_failure_detail = AUTH_FAILURE_DETAIL_UNKNOWN_AUTHENTICATION_SCHEME
+            else:
+                auth_failure_detail = _auth_scheme_to_invalid_auth_header[auth_scheme]
             self._on_auth_done(
                 is_auth_ok=False,
-                auth_failure_detail=AUTH_FAILURE_DETAIL_UNKNOWN_AUTHENTICATION_SCHEME)
+                auth_failure_detail=auth_failure_detail)
             return
 
-        auth_scheme = match.group("auth_scheme")
-        auth_class = _auth_scheme_to_auth_class.get(auth_scheme.upper(), None)
-        # :TRICKY: assert works because _auth_scheme_reg_ex above
-        # weeds out unsupported authentication types
-        assert auth_class is not None
-
-        aha = auth_class(self.request)
+        auth_class = _auth_scheme_to_auth_class[parsed_auth_hdr_val.scheme]
+        aha = auth_class(self.request, parsed_auth_hdr_val)
         aha.authenticate(self._on_auth_done)
 
     def _on_auth_done(self,
@@ -155,7 +174,91 @@ class RequestHandler(trhutil.RequestHandler):
             self.request.headers,
             self.get_request_body_if_exists(),
             principal)
-        aasf.forward(self._on_app_service_done)
+        if async_app_service_forwarder.stream_responses:
+            self._stream_started = False
+            self._stream_bytes_unflushed = 0
+            self._stream_bytes_flushing = 0
+            self._stream_flush_future = None
+            self._stream_caught_up = None
+            aasf.forward(
+                self._on_app_service_done,
+                self._on_app_service_headers,
+                self._on_app_service_chunk)
+        else:
+            aasf.forward(self._on_app_service_done)
+
+    def _on_app_service_headers(self, http_status_code, reason, headers):
+        """When streaming app service responses this method is called
+        as soon as the app service's response headers arrive. The
+        status and headers are flushed to the client immediately
+        rather than waiting for the response's body."""
+        self._stream_started = True
+
+        if self._client_disconnected:
+            return
+
+        self.set_status(http_status_code, reason)
+        for (name, value) in headers.items():
+            self.set_header(name, value)
+        self.flush()
+
+    def _on_app_service_chunk(self, chunk):
+        """When streaming app service responses this method is called
+        with each chunk of the app service response's body. Returns
+        None if the next chunk can be read from the app service right
+        away otherwise returns a ```tornado.concurrent.Future``` which
+        resolves once the client has caught up - until then the app
+        service's response isn't read."""
+        if self._client_disconnected:
+            return None
+
+        self.write(chunk)
+        self._stream_bytes_unflushed += len(chunk)
+
+        # there's only ever one flush in flight - chunks which arrive
+        # while a flush is in flight are written by the next flush
+        if self._stream_flush_future is None:
+            self._flush_stream()
+
+        if self._stream_bytes_unflushed < max_stream_buffer_size:
+            return None
+
+        if self._stream_caught_up is None:
+            self._stream_caught_up = tornado.concurrent.Future()
+        return self._stream_caught_up
+
+    def _flush_stream(self):
+        self._stream_bytes_flushing = self._stream_bytes_unflushed
+        self._stream_flush_future = self.flush()
+        # if the client's socket accepts everything straight away the
+        # future is already done and the callback is called right here
+        self._stream_flush_future.add_done_callback(self._on_stream_flushed)
+
+    def _on_stream_flushed(self, future):
+        """Called once everything written to the client by
+        ```_flush_stream()``` has been written to the client's socket."""
+        self._stream_flush_future = None
+
+        if future.exception() is not None:
+            # the client's gone - on_connection_close() will be called
+            self._client_disconnected = True
+            self._on_stream_caught_up()
+            return
+
+        self._stream_bytes_unflushed -= self._stream_bytes_flushing
+        self._stream_bytes_flushing = 0
+        if self._stream_bytes_unflushed:
+            self._flush_stream()
+
+        if self._stream_bytes_unflushed < max_stream_buffer_size:
+            self._on_stream_caught_up()
+
+    def _on_stream_caught_up(self):
+        """Resume reading the app service's response."""
+        if self._stream_caught_up is not None:
+            caught_up = self._stream_caught_up
+            self._stream_caught_up = None
+            caught_up.set_result(None)
 
     def _on_app_service_done(self,
                              is_ok,
@@ -163,6 +266,19 @@ class RequestHandler(trhutil.RequestHandler):
                              headers=None,
                              body=None):
 
+        if async_app_service_forwarder.stream_responses and self._stream_started:
+            # status, headers and body have already been relayed so
+            # all that's left to do is finish up. if the app service's
+            # response was cut short, the client's response is also
+            # cut short by closing the connection
+            if self._client_disconnected:
+                return
+            if is_ok:
+                self.finish()
+            else:
+                self.request.connection.close()
+            return
+
         if is_ok:
             self.set_status(http_status_code)
             for (name, value) in headers.items():
@@ -174,6 +290,13 @@ class RequestHandler(trhutil.RequestHandler):
 
         self.finish()
 
+    def on_connection_close(self):
+        trhutil.RequestHandler.on_connection_close(self)
+        self._client_disconnected = True
+        if async_app_service_forwarder.stream_responses and self._stream_started:
+            # the rest of the app service's response is read and discarded
+            self._on_stream_caught_up()
+
     def set_default_headers(self):
         """The less a potential threat knows about security infrastructre
         the better. With that in mind, this method attempts to remove the
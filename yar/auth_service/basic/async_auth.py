@@ -3,7 +3,8 @@ of the basic authentication scheme."""
 
 import base64
 import logging
-import re
+
+from yar.util import auth_header
 
 from async_creds_retriever import AsyncCredsRetriever
 
@@ -17,66 +18,57 @@ AUTH_FAILURE_DETAIL_INVALID_AUTH_HEADER_FORMAT_POST_DECODING = 0x0200 + 0x0004
 AUTH_FAILURE_DETAIL_ERROR_GETTING_CREDS = 0x0200 + 0x0004
 AUTH_FAILURE_DETAIL_CREDS_NOT_FOUND = 0x0200 + 0x0005
 
-"""```_auth_hdr_val_reg_ex``` is used to parse the value of
-the Authorization HTTP header."""
-_auth_hdr_val_reg_ex = re.compile(
-    "^\s*BASIC\s+(?P<api_key_colon>[^\s]+)\s*$",
-    re.IGNORECASE)
-
-"""Once the authorization header's value is base64 decoded,
-```_api_key_colon_reg_ex``` is used to verify the
-decoded value is in the expected format and also extract the
-api key."""
-_api_key_colon_reg_ex = re.compile(
-    "^(?P<api_key>[^:]+):$",
-    re.IGNORECASE)
-
-
 class Authenticator(object):
     """Async'ly authenticate a Tornado request using the basic
     authentication scheme by
     (i) extracting and parsing the Authorization header's value,
     (ii) asking the key store for credentials matching values
-    extracted from the authorization header"""
+    extracted from the authorization header. If the request's
+    Authorization header has already been parsed the resulting
+    ```yar.util.auth_header.AuthHeader``` can be supplied as
+    ```auth_hdr_val``` to avoid parsing it again."""
 
-    def __init__(self, request):
+    def __init__(self, request, auth_hdr_val=None):
         object.__init__(self)
         self._request = request
+        self._auth_hdr_val = auth_hdr_val
 
     def authenticate(self, on_auth_done):
         self._on_auth_done = on_auth_done
 
-        auth_hdr_val = self._request.headers.get("Authorization", None)
+        auth_hdr_val = self._auth_hdr_val
         if auth_hdr_val is None:
-            self._on_auth_done(False, AUTH_FAILURE_DETAIL_NO_AUTH_HEADER)
-            return
-
-        match = _auth_hdr_val_reg_ex.match(auth_hdr_val)
-        if not match:
-            self._on_auth_done(
-                False,
-                AUTH_FAILURE_DETAIL_INVALID_AUTH_HEADER_FORMAT_PRE_DECODING)
-            return
-
-        b64encoded_api_key_colon = match.group("api_key_colon")
+            value = self._request.headers.get("Authorization", None)
+            if value is None:
+                self._on_auth_done(False, AUTH_FAILURE_DETAIL_NO_AUTH_HEADER)
+                return
+
+            auth_hdr_val = auth_header.parse(value)
+            if auth_hdr_val is None or auth_hdr_val.scheme != auth_header.BASIC:
+                self._on_auth_done(
+                    False,
+                    AUTH_FAILURE_DETAIL_INVALID_AUTH_HEADER_FORMAT_PRE_DECODING)
+                return
 
         try:
-            api_key_colon = base64.b64decode(b64encoded_api_key_colon)
+            api_key_colon = base64.b64decode(auth_hdr_val.credentials)
         except TypeError:
             self._on_auth_done(
                 False,
                 AUTH_FAILURE_DETAIL_INVALID_AUTH_HEADER_BAD_ENCODING)
             return
 
-        match = _api_key_colon_reg_ex.match(api_key_colon)
-        if not match:
+        # once base64 decoded the credentials are expected to be
+        # an api key followed by a single colon (ie. an empty password)
+        self._api_key = api_key_colon[:-1]
+        if not self._api_key or \
+           not api_key_colon.endswith(":") or \
+           ":" in self._api_key:
             self._on_auth_done(
                 False,
                 AUTH_FAILURE_DETAIL_INVALID_AUTH_HEADER_FORMAT_POST_DECODING)
             return
 
-        self._api_key = match.group("api_key")
-
         acr = AsyncCredsRetriever(self._api_key)
         acr.fetch(self._on_creds_fetch_done)
 
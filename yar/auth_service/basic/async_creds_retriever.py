@@ -7,14 +7,21 @@ import logging
 
 import tornado.httpclient
 
+from yar.auth_service import creds_cache
+from yar.auth_service import single_flight
 from yar.key_service import jsonschemas
 from yar.util import mac
 from yar.util import trhutil
+from yar.util import upstream
 
 _logger = logging.getLogger("AUTHSERVICE.%s" % __name__)
 
 """This host:port combination define the location of the key service."""
-key_service = "127.0.0.1:8070"
+key_service_address = "127.0.0.1:8070"
+
+"""Concurrent fetches for the same api key share a single
+request to the key service."""
+_in_flight = single_flight.SingleFlight()
 
 
 class AsyncCredsRetriever(object):
@@ -32,15 +39,29 @@ class AsyncCredsRetriever(object):
 
         self._callback = callback
 
+        (is_hit, creds) = creds_cache.creds_cache().get(self._api_key)
+        if is_hit:
+            self._on_creds_found(creds)
+            return
+
+        if not _in_flight.join(self._api_key, self._on_lookup_done):
+            return
+
         url = "http://%s/v1.0/creds/%s" % (
             key_service_address,
             self._api_key)
+        # expired creds are revalidated rather than retrieved again
+        (self._stale_creds, self._etag) = creds_cache.creds_cache().validator(
+            self._api_key)
+        headers = {}
+        if self._etag is not None:
+            headers["If-None-Match"] = self._etag
         http_request = tornado.httpclient.HTTPRequest(
             url=url,
             method="GET",
+            headers=headers,
             follow_redirects=False)
-        http_client = tornado.httpclient.AsyncHTTPClient()
-        http_client.fetch(http_request, self._on_fetch_done)
+        upstream.fetch(key_service_address, http_request, self._on_fetch_done)
 
     def _on_fetch_done(self, response):
         """Called when request to the key service returns."""
@@ -50,16 +71,25 @@ class AsyncCredsRetriever(object):
             response.request.method,
             int(response.request_time * 1000))
 
+        if response.code == httplib.NOT_MODIFIED and self._etag is not None:
+            creds_cache.creds_cache().revalidated(
+                self._api_key,
+                self._stale_creds,
+                self._etag)
+            _in_flight.complete(self._api_key, True, self._stale_creds)
+            return
+
         expected_response_codes = [
             httplib.OK,
             httplib.NOT_FOUND,
         ]
         if response.error or response.code not in expected_response_codes:
-            self._callback(False)
+            _in_flight.complete(self._api_key, False, None)
             return
 
         if response.code == httplib.NOT_FOUND:
-            self._callback(True, None)
+            creds_cache.creds_cache().put_not_found(self._api_key)
+            _in_flight.complete(self._api_key, True, None)
             return
 
         body = trhutil.get_json_body_from_response(
@@ -67,11 +97,37 @@ class AsyncCredsRetriever(object):
             None,
             jsonschemas.get_creds_response)
         if body is None:
-            self._callback(False)
+            _in_flight.complete(self._api_key, False, None)
             return
 
         _logger.info(
             "Successfully retrieved basic auth credentials for api key '%s'",
             self._api_key)
 
+        creds_cache.creds_cache().put(
+            self._api_key,
+            body,
+            response.headers.get("Etag", None))
+
+        _in_flight.complete(self._api_key, True, body)
+
+    def _on_lookup_done(self, is_ok, body):
+        """Called when the (possibly shared) request to the key
+        service for the api key is done. ```is_ok``` is False if
+        the key service couldn't be asked for credentials."""
+        if not is_ok:
+            self._callback(False)
+            return
+
+        self._on_creds_found(body)
+
+    def _on_creds_found(self, body):
+        """Called with the key service's response ```body``` once
+        the credentials are available either from the key service or
+        the creds cache. ```body``` is None when the key service has
+        said there are no credentials for the api key."""
+        if body is None or "basic" not in body:
+            self._callback(True, None)
+            return
+
         self._callback(True, body["principal"])
@@ -91,6 +91,157 @@ class CommandLineParser(optparse.OptionParser):
             type="hostcolonports",
             help=help)
 
+        default = "memcached"
+        help = "nonce store backend [memcached,local,shared] - default = %s" % default
+        self.add_option(
+            "--noncestorebackend",
+            action="store",
+            dest="nonce_store_backend",
+            default=default,
+            type="choice",
+            choices=["memcached", "local", "shared"],
+            help=help)
+
+        default = 1024 * 1024
+        help = "max # nonces in shared nonce store - default = %d" % default
+        self.add_option(
+            "--sharednoncestoresize",
+            action="store",
+            dest="shared_nonce_store_size",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 10000
+        help = "max # entries in creds cache (0 = off) - default = %d" % default
+        self.add_option(
+            "--credscachesize",
+            action="store",
+            dest="creds_cache_size",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 30
+        help = "seconds creds are cached - default = %d" % default
+        self.add_option(
+            "--credscachettl",
+            action="store",
+            dest="creds_cache_ttl",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 5
+        help = "seconds creds not found are cached - default = %d" % default
+        self.add_option(
+            "--credscachenotfoundttl",
+            action="store",
+            dest="creds_cache_not_found_ttl",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 1
+        help = "# of worker processes (0 = # of cores) - default = %d" % default
+        self.add_option(
+            "--processes",
+            action="store",
+            dest="processes",
+            default=default,
+            type=int,
+            help=help)
+
+        default = False
+        help = "workers use SO_REUSEPORT listening sockets - default = %s" % default
+        self.add_option(
+            "--reuseport",
+            action="store",
+            dest="reuse_port",
+            default=default,
+            type="boolean",
+            help=help)
+
+        default = False
+        help = "stream app service responses - default = %s" % default
+        self.add_option(
+            "--streamappserviceresponses",
+            action="store",
+            dest="stream_app_service_responses",
+            default=default,
+            type="boolean",
+            help=help)
+
+        default = 1024 * 1024
+        help = "max bytes buffered per streamed response - default = %d" % default
+        self.add_option(
+            "--maxstreambuffersize",
+            action="store",
+            dest="max_stream_buffer_size",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 256 * 1024
+        help = "min body bytes hashed on the hash pool - default = %d" % default
+        self.add_option(
+            "--hashpoolminsize",
+            action="store",
+            dest="hash_pool_min_size",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 2
+        help = "hash pool threads per process (0 = off) - default = %d" % default
+        self.add_option(
+            "--hashpoolthreads",
+            action="store",
+            dest="hash_pool_threads",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 10
+        help = "max concurrent requests per upstream - default = %d" % default
+        self.add_option(
+            "--upstreammaxclients",
+            action="store",
+            dest="upstream_max_clients",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 0
+        help = "max requests queued per upstream (0 = unbounded) - default = %d" % default
+        self.add_option(
+            "--upstreammaxqueuesize",
+            action="store",
+            dest="upstream_max_queue_size",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 0
+        help = "connections pre-warmed per upstream - default = %d" % default
+        self.add_option(
+            "--upstreamprewarm",
+            action="store",
+            dest="upstream_prewarm_connections",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 0
+        help = "seconds between upstream stats logging (0 = off) - default = %d" % default
+        self.add_option(
+            "--upstreamstatsinterval",
+            action="store",
+            dest="upstream_stats_interval",
+            default=default,
+            type=int,
+            help=help)
+
         default = None
         help = "syslog unix domain socket - default = %s" % default
         self.add_option(
@@ -0,0 +1,154 @@
+"""This module implements the auth service's in-process credentials
+cache. Every MAC and basic authenticated request needs the credentials
+associated with the request's mac key identifier or api key. Without
+a cache each of those lookups is a round trip to the key service which
+in turn queries the key store. Traffic tends to be dominated by a
+relatively small number of hot keys so a bounded, per-process cache
+removes most of that two hop lookup from the request path.
+
+Credentials retrieved from the key service come with an ETag. Once
+the credentials expire the cache remembers them, along with their ETag,
+so the next request to the key service can be a conditional GET. If
+the credentials haven't changed the key service responds with a 304
+(Not Modified) and the remembered credentials are reused."""
+
+import collections
+import logging
+import time
+
+_logger = logging.getLogger("AUTHSERVICE.%s" % __name__)
+
+"""Maximum number of entries (found and not found) the cache will hold
+before the least recently used entries are evicted. A value of 0
+disables the cache."""
+max_size = 10000
+
+"""Number of seconds credentials retrieved from the key service
+are considered fresh."""
+ttl = 30
+
+"""Number of seconds a "not found" response from the key service
+is remembered. This is deliberately much shorter than ```ttl```
+so newly created credentials become usable quickly."""
+not_found_ttl = 5
+
+
+class CredsCache(object):
+    """A bounded LRU cache of credentials keyed by mac key identifier
+    or api key. Entries expire ```ttl``` seconds after they're added
+    and entries recording that no credentials exist for a key expire
+    after ```not_found_ttl``` seconds. Hit, miss and eviction counters
+    are maintained to help size the cache."""
+
+    def __init__(self, max_size, ttl, not_found_ttl):
+        object.__init__(self)
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.not_found_ttl = not_found_ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revalidations = 0
+
+        # key -> (expiry, creds, etag) where creds is None for "not found"
+        # and etag is None if the creds can't be revalidated
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Look up ```key``` in the cache. Returns a tuple of
+        (is_hit, creds). ```creds``` is None on a miss and on a
+        hit for a key the key service said doesn't exist."""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return (False, None)
+
+        (expiry, creds, etag) = entry
+        if expiry <= time.time():
+            if etag is not None:
+                # remembered for revalidation - see validator()
+                self._entries[key] = entry
+            self.misses += 1
+            return (False, None)
+
+        # re-inserting moves the entry to the most recently used end
+        self._entries[key] = entry
+        self.hits += 1
+        return (True, creds)
+
+    def put(self, key, creds, etag=None):
+        """Remember ```creds``` for ```key```. ```etag``` is the ETag
+        of the key service's response containing ```creds```."""
+        self._put(key, creds, self.ttl, etag)
+
+    def put_not_found(self, key):
+        """Remember that the key service has no credentials for ```key```."""
+        self._put(key, None, self.not_found_ttl, None)
+
+    def validator(self, key):
+        """Returns a tuple of (creds, etag) for credentials which have
+        expired but can be revalidated with a conditional GET or (None, None)
+        if ```key```'s credentials can't be revalidated."""
+        entry = self._entries.get(key, None)
+        if entry is None or entry[2] is None:
+            return (None, None)
+        return (entry[1], entry[2])
+
+    def revalidated(self, key, creds, etag):
+        """Called when the key service confirms that the ```creds``` with
+        ```etag``` returned by ```validator()``` are still current."""
+        self.revalidations += 1
+        self._put(key, creds, self.ttl, etag)
+
+    def invalidate(self, key):
+        """Forget anything the cache knows about ```key```."""
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        """Return a dict summarizing the cache's effectiveness."""
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "revalidations": self.revalidations,
+        }
+
+    def _put(self, key, creds, ttl, etag):
+        if self.max_size <= 0 or ttl <= 0:
+            return
+
+        self._entries.pop(key, None)
+        self._entries[key] = (time.time() + ttl, creds, etag)
+
+        while self.max_size < len(self._entries):
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+_creds_cache = None
+
+
+def creds_cache():
+    """Returns the process wide ```CredsCache``` creating it on first
+    use from ```max_size```, ```ttl``` and ```not_found_ttl```. Creation
+    is deferred so the mainline has a chance to configure the cache
+    from the command line before the first lookup."""
+    global _creds_cache
+    if _creds_cache is None:
+        _logger.info(
+            "Creating creds cache - max size %d, ttl %d s, not found ttl %d s",
+            max_size,
+            ttl,
+            not_found_ttl)
+        _creds_cache = CredsCache(max_size, ttl, not_found_ttl)
+    return _creds_cache
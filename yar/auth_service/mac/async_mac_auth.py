@@ -4,6 +4,8 @@ an async MAC validation."""
 import hashlib
 import logging
 
+from yar.util import auth_header
+from yar.util import hash_pool
 from yar.util import mac
 from yar.util.trhutil import get_request_host_and_port
 from yar.util.trhutil import get_request_body_if_exists
@@ -27,11 +29,35 @@ AUTH_FAILURE_DETAIL_NONCE_REUSED = 0x0100 + 0x0006
 AUTH_FAILURE_DETAIL_MACS_DO_NOT_MATCH = 0x0100 + 0x0007
 
 
+def _include_auth_failure_debug_details():
+    """Debug details are only returned to the client when the request
+    handler says so and some of them (the body's SHA1 in particular)
+    are expensive to generate so don't bother generating them unless
+    they'll be used. The request handler's module imports this module
+    so it's imported here rather than at the top of the module."""
+    from yar.auth_service import auth_service_request_handler
+    return auth_service_request_handler._include_auth_failure_debug_details()
+
+
 class AsyncMACAuth(object):
+    """Async'ly authenticate a Tornado request using the MAC
+    authentication scheme. If the request's Authorization header has
+    already been parsed the resulting ```yar.util.auth_header.AuthHeader```
+    can be supplied as ```auth_hdr_val``` to avoid parsing it again."""
 
-    def __init__(self, request):
+    def __init__(self, request, auth_hdr_val=None):
         object.__init__(self)
         self._request = request
+        self._auth_hdr_val = auth_hdr_val
+
+        # the nonce check and the retrieval of the MAC credentials are
+        # run concurrently - these attributes track the results of each
+        # so the results can be joined (see _on_lookup_done())
+        self._anc = None
+        self._is_nonce_ok = False
+        self._is_mac_ok = False
+        self._principal = None
+        self._is_done = False
 
     def _on_async_mac_creds_retriever_done(
         self,
@@ -41,20 +67,54 @@ class AsyncMACAuth(object):
         mac_key=None,
         principal=None):
 
+        if self._is_done:
+            # authentication has already failed because the nonce was reused
+            return
+
         if not is_ok:
             _logger.info(
                 "No MAC credentials found for '%s'",
                 self._request.full_url())
+            self._on_auth_failed()
             self._on_auth_done(False, AUTH_FAILURE_DETAIL_CREDS_NOT_FOUND)
             return
 
+        self._mac_key_identifier = mac_key_identifier
+        self._mac_algorithm = mac_algorithm
+        self._mac_key = mac_key
+        self._principal = principal
+
+        # hashing a large body can take long enough to stall every
+        # other request being serviced by this process so the ext
+        # may be generated on another thread - see hash_pool
+        self._content_type = self._request.headers.get("Content-type", None)
+        self._body = get_request_body_if_exists(self._request, None)
+        hash_pool.ext(self._content_type, self._body, self._on_ext_done)
+
+    def _on_ext_done(self, ext):
+        if self._is_done:
+            # authentication has already failed because the nonce was reused
+            return
+
+        if ext is None:
+            # hash_pool has already logged the error
+            _logger.error(
+                "Couldn't generate ext for '%s' using MAC key identifier '%s'",
+                self._request.full_url(),
+                self._mac_key_identifier)
+            self._on_auth_failed()
+            self._on_macs_do_not_match(None)
+            return
+
+        mac_key_identifier = self._mac_key_identifier
+        mac_algorithm = self._mac_algorithm
+        mac_key = self._mac_key
+        content_type = self._content_type
+
         (host, port) = get_request_host_and_port(
             self._request,
             "127.0.0.1",
             80)
-        content_type = self._request.headers.get("Content-type", None)
-        body = get_request_body_if_exists(self._request, None)
-        ext = mac.Ext.generate(content_type, body)
         normalized_request_string = mac.NormalizedRequestString.generate(
             self._auth_hdr_val.ts,
             self._auth_hdr_val.nonce,
@@ -64,7 +124,7 @@ class AsyncMACAuth(object):
             port,
             ext)
 
-        macs_equal = self._auth_hdr_val.mac.verify(
+        macs_equal = mac.MAC(self._auth_hdr_val.mac).verify(
             mac_key,
             mac_algorithm,
             normalized_request_string)
@@ -79,6 +139,12 @@ class AsyncMACAuth(object):
                 mac_key_identifier,
                 self._auth_hdr_val.mac)
 
+            self._on_auth_failed()
+
+            if not _include_auth_failure_debug_details():
+                self._on_macs_do_not_match(None)
+                return
+
             # When an authentication failure occurs it can be super hard
             # to figure out the root cause of the error. This method is called
             # on authentication failure and, if logging is set to at least
@@ -86,11 +152,6 @@ class AsyncMACAuth(object):
             # core elements that are used to generate the MAC.
             auth_failure_debug_details = {}
 
-            if body:
-                sha1_of_body = hashlib.sha1(body).hexdigest()
-                auth_failure_debug_details["BODY-SHA1"] = sha1_of_body
-                auth_failure_debug_details["BODY-LEN"] = len(body)
-
             auth_failure_debug_details["MAC-KEY-IDENTIFIER"] = mac_key_identifier
             auth_failure_debug_details["MAC-KEY"] = mac_key
             auth_failure_debug_details["MAC-ALGORITHM"] = mac_algorithm
@@ -110,53 +171,90 @@ class AsyncMACAuth(object):
             auth_failure_debug_details["NRS-SHA1"] = sha1_of_nrs
 
             # end of pumping out debug headers - returning to regular headers
-            self._on_auth_done(
-                False,
-                auth_failure_detail=AUTH_FAILURE_DETAIL_MACS_DO_NOT_MATCH,
-                auth_failure_debug_details=auth_failure_debug_details)
+            if not self._body:
+                self._on_macs_do_not_match(auth_failure_debug_details)
+                return
+
+            # the body's SHA1 is another trip through hash_pool
+            def on_sha1_of_body_done(sha1_of_body):
+                auth_failure_debug_details["BODY-SHA1"] = sha1_of_body
+                auth_failure_debug_details["BODY-LEN"] = len(self._body)
+                self._on_macs_do_not_match(auth_failure_debug_details)
+
+            hash_pool.sha1(self._body, on_sha1_of_body_done)
             return
 
-        _logger.info(
-            "Authorization successful for '%s' and MAC '%s'",
-            self._request.full_url(),
-            self._auth_hdr_val.mac)
+        self._is_mac_ok = True
+        self._on_lookup_done()
 
-        self._on_auth_done(True, principal=principal)
+    def _on_macs_do_not_match(self, auth_failure_debug_details):
+        self._on_auth_done(
+            False,
+            auth_failure_detail=AUTH_FAILURE_DETAIL_MACS_DO_NOT_MATCH,
+            auth_failure_debug_details=auth_failure_debug_details)
 
     def _on_async_nonce_checker_done(self, is_ok):
         """this callback is invoked when AsyncNonceChecker has finished.
         ```is_ok``` will be ```True`` AsyncNonceChecker has confirmed that
          the curent request's nonce+mac_key_identifier pair hasn't been
         seen before."""
+        if self._is_done:
+            # authentication has already failed (credentials not found or
+            # MACs don't match) so the nonce must not stay recorded as used
+            if is_ok:
+                self._anc.release()
+            return
+
         if not is_ok:
             _logger.info("Nonce '%s' reused", self._auth_hdr_val.nonce)
+            self._is_done = True
             self._on_auth_done(False, AUTH_FAILURE_DETAIL_NONCE_REUSED)
             return
 
-        # basic request looks good
-        #
-        # 1/ authentication header found and format is valid
-        # 2/ timestamp is recent
-        # 3/ nonce has not previous been used by the mac key identifier
-        #
-        # next steps is to retrieve the credentials associated with
-        # the request's mac key identifier and confirm the request's
-        # MAC is valid ie. final step in confirming the sender's identity
-        acr = AsyncMACCredsRetriever(self._auth_hdr_val.mac_key_identifier)
-        acr.fetch(self._on_async_mac_creds_retriever_done)
+        self._is_nonce_ok = True
+        self._on_lookup_done()
+
+    def _on_lookup_done(self):
+        """Called when either the nonce check or the MAC verification
+        succeeds. The request is authenticated once both have
+        succeeded."""
+        if not self._is_nonce_ok or not self._is_mac_ok:
+            return
+
+        self._is_done = True
+
+        _logger.info(
+            "Authorization successful for '%s' and MAC '%s'",
+            self._request.full_url(),
+            self._auth_hdr_val.mac)
+
+        self._on_auth_done(True, principal=self._principal)
+
+    def _on_auth_failed(self):
+        """Called when the credentials can't be found or the MACs don't
+        match. If the nonce has already been recorded as used it's
+        released so that a forged request can't burn the nonce of
+        a genuine request. If the nonce check is still outstanding
+        ```_on_async_nonce_checker_done()``` does the release."""
+        self._is_done = True
+        if self._is_nonce_ok:
+            self._anc.release()
 
     def authenticate(self, on_auth_done):
         self._on_auth_done = on_auth_done
 
-        auth_hdr_val = self._request.headers.get("Authorization", None)
-        if auth_hdr_val is None:
-            self._on_auth_done(False, AUTH_FAILURE_DETAIL_NO_AUTH_HEADER)
-            return
-
-        self._auth_hdr_val = mac.AuthHeaderValue.parse(auth_hdr_val)
         if self._auth_hdr_val is None:
-            self._on_auth_done(False, AUTH_FAILURE_DETAIL_INVALID_AUTH_HEADER)
-            return
+            auth_hdr_val = self._request.headers.get("Authorization", None)
+            if auth_hdr_val is None:
+                self._on_auth_done(False, AUTH_FAILURE_DETAIL_NO_AUTH_HEADER)
+                return
+
+            self._auth_hdr_val = auth_header.parse(auth_hdr_val)
+            if self._auth_hdr_val is None or \
+               self._auth_hdr_val.scheme != auth_header.MAC:
+                self._auth_hdr_val = None
+                self._on_auth_done(False, AUTH_FAILURE_DETAIL_INVALID_AUTH_HEADER)
+                return
 
         # confirm the request isn't old which is important in protecting
         # against reply attacks - also requests with timestamps in the
@@ -173,11 +271,27 @@ class AsyncMACAuth(object):
             self._on_auth_done(False, AUTH_FAILURE_DETAIL_TS_OLD)
             return
 
-        # time to confirm if the nonce in the request has been used
-        # before. this means async'ly calling out to the memcached
-        # cluster which stores previously used nonce+mac_key_identifer
-        # combinations
-        anc = AsyncNonceChecker(
+        # basic request looks good
+        #
+        # 1/ authentication header found and format is valid
+        # 2/ timestamp is recent
+        #
+        # next steps are to confirm the nonce has not previously been
+        # used by the mac key identifier and to retrieve the credentials
+        # associated with the request's mac key identifier so the request's
+        # MAC can be verified ie. final step in confirming the sender's
+        # identity. the two are independent so both are started at once
+        # and their results joined by _on_lookup_done(). the nonce is
+        # recorded as used by the nonce check and released again if the
+        # MAC turns out to be invalid.
+        self._anc = AsyncNonceChecker(
             self._auth_hdr_val.mac_key_identifier,
             self._auth_hdr_val.nonce)
-        anc.fetch(self._on_async_nonce_checker_done)
+        self._anc.fetch(self._on_async_nonce_checker_done)
+        if self._is_done:
+            # the nonce store responded synchronously (in-process
+            # nonce stores do) and the nonce was reused
+            return
+
+        acr = AsyncMACCredsRetriever(self._auth_hdr_val.mac_key_identifier)
+        acr.fetch(self._on_async_mac_creds_retriever_done)
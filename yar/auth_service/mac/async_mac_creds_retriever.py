@@ -6,15 +6,22 @@ import logging
 
 import tornado.httpclient
 
+from yar.auth_service import creds_cache
+from yar.auth_service import single_flight
 from yar.key_service import jsonschemas
 from yar.util import mac
 from yar.util import trhutil
+from yar.util import upstream
 
 _logger = logging.getLogger("AUTHSERVICE.%s" % __name__)
 
 """This host:port combination define the location of the key service."""
 key_service_address = "127.0.0.1:8070"
 
+"""Concurrent fetches for the same mac key identifier share a single
+request to the key service."""
+_in_flight = single_flight.SingleFlight()
+
 
 class AsyncMACCredsRetriever(object):
     """Wraps the gory details of async crednetials retrieval."""
@@ -29,15 +36,30 @@ class AsyncMACCredsRetriever(object):
 
         self._callback = callback
 
+        (is_hit, creds) = creds_cache.creds_cache().get(
+            self._mac_key_identifier)
+        if is_hit:
+            self._on_creds_found(creds)
+            return
+
+        if not _in_flight.join(self._mac_key_identifier, self._on_lookup_done):
+            return
+
         url = "http://%s/v1.0/creds/%s" % (
             key_service_address,
             self._mac_key_identifier)
+        # expired creds are revalidated rather than retrieved again
+        (self._stale_creds, self._etag) = creds_cache.creds_cache().validator(
+            self._mac_key_identifier)
+        headers = {}
+        if self._etag is not None:
+            headers["If-None-Match"] = self._etag
         http_request = tornado.httpclient.HTTPRequest(
             url=url,
             method="GET",
+            headers=headers,
             follow_redirects=False)
-        http_client = tornado.httpclient.AsyncHTTPClient()
-        http_client.fetch(http_request, self._on_fetch_done)
+        upstream.fetch(key_service_address, http_request, self._on_fetch_done)
 
     def _on_fetch_done(self, response):
         """Called when request to the key service returns."""
@@ -47,8 +69,21 @@ class AsyncMACCredsRetriever(object):
             response.request.method,
             int(response.request_time * 1000))
 
+        if response.code == httplib.NOT_MODIFIED and self._etag is not None:
+            creds_cache.creds_cache().revalidated(
+                self._mac_key_identifier,
+                self._stale_creds,
+                self._etag)
+            _in_flight.complete(self._mac_key_identifier, True, self._stale_creds)
+            return
+
+        if response.code == httplib.NOT_FOUND:
+            creds_cache.creds_cache().put_not_found(self._mac_key_identifier)
+            _in_flight.complete(self._mac_key_identifier, True, None)
+            return
+
         if response.error or response.code != httplib.OK:
-            self._callback(False, self._mac_key_identifier)
+            _in_flight.complete(self._mac_key_identifier, False, None)
             return
 
         body = trhutil.get_json_body_from_response(
@@ -56,7 +91,7 @@ class AsyncMACCredsRetriever(object):
             None,
             jsonschemas.get_creds_response)
         if body is None:
-            self._callback(False, self._mac_key_identifier)
+            _in_flight.complete(self._mac_key_identifier, False, None)
             return
 
         _logger.info(
@@ -64,6 +99,32 @@ class AsyncMACCredsRetriever(object):
             self._mac_key_identifier,
             body)
 
+        creds_cache.creds_cache().put(
+            self._mac_key_identifier,
+            body,
+            response.headers.get("Etag", None))
+
+        _in_flight.complete(self._mac_key_identifier, True, body)
+
+    def _on_lookup_done(self, is_ok, body):
+        """Called when the (possibly shared) request to the key
+        service for the mac key identifier is done. ```is_ok``` is
+        False if the key service couldn't be asked for credentials."""
+        if not is_ok:
+            self._callback(False, self._mac_key_identifier)
+            return
+
+        self._on_creds_found(body)
+
+    def _on_creds_found(self, body):
+        """Called with the key service's response ```body``` once
+        the credentials are available either from the key service or
+        the creds cache. ```body``` is None when the key service has
+        said there are no credentials for the mac key identifier."""
+        if body is None or "mac" not in body:
+            self._callback(False, self._mac_key_identifier)
+            return
+
         self._callback(
             True,
             mac.MACKeyIdentifier(body["mac"]["mac_key_identifier"]),
@@ -5,7 +5,9 @@ nonce combination has been previously used."""
 import datetime
 import logging
 
-import tornadoasyncmemcache
+from yar.util import memcached
+
+import local_nonce_store
 
 _logger = logging.getLogger("AUTHSERVICE.%s" % __name__)
 
@@ -14,13 +16,95 @@ that point to the memcached cluster that implements the
 nonce store."""
 nonce_store = ["127.0.0.1:11211"]
 
+"""```nonce_store_backend``` selects the nonce store implementation.
+One of:
+
+    memcached - the memcached cluster described by ```nonce_store```
+    local - in the auth service's memory (see local_nonce_store)
+    shared - in memory shared by all of a pre-forked auth service's
+    workers (see local_nonce_store)"""
+nonce_store_backend = "memcached"
+
+"""Nonces are remembered for at least ```maxage``` seconds. This is
+expected to be the same value as ```async_mac_auth.maxage``` - once
+a request is more than ```maxage``` seconds old it's rejected
+regardless of its nonce so there's no need to remember the nonce."""
+maxage = 30
+
+"""When ```nonce_store_backend``` is "shared" the nonce store
+has room for ```shared_nonce_store_size``` nonces."""
+shared_nonce_store_size = 1024 * 1024
+
+
+class MemcachedNonceStore(object):
+    """A nonce store implemented by a memcached cluster. Nonces are
+    recorded with a single atomic add so there's no window in which
+    two concurrent replays can both be accepted and recorded nonces
+    expire once they're no longer needed."""
+
+    def __init__(self, servers, maxage):
+        object.__init__(self)
+
+        _logger.info("Creating memcached client for cluster '%s'", servers)
+        self._client = memcached.Client(servers)
+        # the +1 accounts for timestamps having a resolution of one second
+        self._ttl = maxage + 1
+
+    def add(self, key, callback):
+        start_timestamp = datetime.datetime.now()
+
+        def on_add_done(is_ok):
+            duration = datetime.datetime.now() - start_timestamp
+            _logger.info(
+                "Nonce Store (%s - %s) responded in %d us",
+                "add",
+                key,
+                duration.microseconds)
+
+            if is_ok is None:
+                # fail closed - if the nonce store can't confirm the
+                # nonce hasn't been seen before the request is rejected
+                _logger.error("Nonce Store error recording nonce key '%s'", key)
+                is_ok = False
+
+            callback(is_ok)
+
+        self._client.add(key, "1", self._ttl, on_add_done)
+
+    def delete(self, key):
+        def on_delete_done(is_ok):
+            if is_ok is None:
+                _logger.error("Nonce Store error deleting nonce key '%s'", key)
+
+        self._client.delete(key, on_delete_done)
+
+
+"""```_nonce_store_backends``` is used to convert the value of
+```nonce_store_backend``` into a function which creates the
+nonce store."""
+_nonce_store_backends = {
+    "memcached": lambda: MemcachedNonceStore(nonce_store, maxage),
+    "local": lambda: local_nonce_store.LocalNonceStore(maxage),
+    "shared": lambda: local_nonce_store.SharedNonceStore(maxage, shared_nonce_store_size),
+}
+
+
+def create_nonce_store_before_fork():
+    """The shared nonce store must be created before a pre-forked
+    auth service forks its workers so that all workers share the
+    same memory. This function is expected to be called from the
+    auth service's mainline before forking. Other backends are
+    created in each worker on first use."""
+    if nonce_store_backend == "shared":
+        AsyncNonceChecker.nonce_store()
+
 
 class AsyncNonceChecker(object):
     """Wraps the gory details of async'ing confirming that a
     nonce + mac_key_identifer pair isn't known to the nonce
-    store (which is a memcached cluster)."""
+    store."""
 
-    _ccs = None
+    _nonce_store = None
 
     def __init__(self, mac_key_identifier, nonce):
         object.__init__(self)
@@ -40,58 +124,21 @@ class AsyncNonceChecker(object):
         takes a single boolean argument that is True if
         ```nonce``` has not been used by ```mac_key_identifier```
         and otherwise False."""
-        self._callback = callback
-
-        self._key = "%s-%s" % (self._mac_key_identifier, self._nonce)
-
-        _logger.info("Asking for nonce key '%s'", self._key)
-
-        self._start_timestamp = datetime.datetime.now()
+        type(self).nonce_store().add(self._key(), callback)
 
-        type(self).ccs().get(
-            self._key,
-            callback=self._on_async_get_done)
+    def release(self):
+        """Async'ly ask the nonce store to forget that ```nonce```
+        has been used for ```mac_key_identifier```. This is expected
+        to be called after ```fetch()``` has recorded the nonce as
+        used but the request turned out not to be authentic."""
+        type(self).nonce_store().delete(self._key())
 
-    def _on_async_get_done(self, data):
-
-        self._log_duration("get")
-
-        _logger.info(
-            "Answer from asking for nonce key '%s' = '%s'",
-            self._key,
-            data)
-
-        if data is not None:
-            self._callback(False)
-        else:
-            self._start_timestamp = datetime.datetime.now()
-            type(self).ccs().set(
-                self._key,
-                1,
-                callback=self._on_async_set_done)
-
-    def _on_async_set_done(self, data):
-
-        self._log_duration("set")
-
-        self._callback(True)
-
-    def _log_duration(self, operation):
-        stop_timestamp = datetime.datetime.now()
-        duration = stop_timestamp - self._start_timestamp
-        _logger.info(
-            "Nonce Store (%s - %s) responded in %d us",
-            operation,
-            self._key,
-            duration.microseconds)
+    def _key(self):
+        return "%s-%s" % (self._mac_key_identifier, self._nonce)
 
     @classmethod
-    def ccs(cls):
-        if cls._ccs is None:
-            _logger.info(
-                "Creating 'tornadoasyncmemcache.ClientPool()' for cluster '%s'",
-                nonce_store)
-            cls._ccs = tornadoasyncmemcache.ClientPool(
-                nonce_store,
-                maxclients=100)
-        return cls._ccs
+    def nonce_store(cls):
+        if cls._nonce_store is None:
+            _logger.info("Creating '%s' nonce store", nonce_store_backend)
+            cls._nonce_store = _nonce_store_backends[nonce_store_backend]()
+        return cls._nonce_store
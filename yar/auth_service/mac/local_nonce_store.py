@@ -0,0 +1,162 @@
+"""This module implements nonce stores which live in the auth
+service's memory rather than in a memcached cluster. They're a good
+fit when the auth tier is small or when requests from a given client
+always reach the same auth service (sticky load balancing) since,
+unlike memcached, a nonce recorded by one auth service is unknown
+to all other auth services.
+
+A MAC request is only accepted if its timestamp is no more than
+```maxage``` seconds old (see ```async_mac_auth.maxage```) so a nonce
+only needs to be remembered for ```maxage``` seconds - any replay
+after that is rejected because the timestamp is too old. With that
+in mind nonces are recorded in time buckets which are ```maxage``` + 1
+seconds wide. A replay always arrives in the same bucket or the bucket
+immediately after the one in which the nonce was first seen so only
+the current and previous buckets are ever consulted and older buckets
+are dropped wholesale. Memory is therefore bounded by request rate
+times ```maxage``` rather than growing with uptime.
+
+Nonce stores implement two methods:
+
+    add(key, callback)
+    delete(key)
+
+```add()``` async'ly records ```key``` and calls ```callback``` with True
+if ```key``` has not been seen before and otherwise False.
+```delete()``` forgets ```key``` so it can be added again."""
+
+import hashlib
+import logging
+import mmap
+import multiprocessing
+import struct
+import time
+
+_logger = logging.getLogger("AUTHSERVICE.%s" % __name__)
+
+
+def _bucket_id(maxage):
+    """Return the id of the current time bucket. The +1 accounts for
+    timestamps having a resolution of one second."""
+    return int(time.time()) // (maxage + 1)
+
+
+class LocalNonceStore(object):
+    """A nonce store private to the auth service process. Nonces
+    are remembered for at least ```maxage``` seconds."""
+
+    def __init__(self, maxage):
+        object.__init__(self)
+
+        self._maxage = maxage
+        self._current_bucket_id = None
+        self._current_bucket = set()
+        self._previous_bucket = set()
+
+    def add(self, key, callback):
+        bucket_id = _bucket_id(self._maxage)
+        if bucket_id != self._current_bucket_id:
+            if self._current_bucket_id is not None and bucket_id == self._current_bucket_id + 1:
+                self._previous_bucket = self._current_bucket
+            else:
+                self._previous_bucket = set()
+            self._current_bucket = set()
+            self._current_bucket_id = bucket_id
+
+        if key in self._current_bucket or key in self._previous_bucket:
+            callback(False)
+            return
+
+        self._current_bucket.add(key)
+        callback(True)
+
+    def delete(self, key):
+        self._current_bucket.discard(key)
+        self._previous_bucket.discard(key)
+
+    def __len__(self):
+        return len(self._current_bucket) + len(self._previous_bucket)
+
+
+class SharedNonceStore(object):
+    """A nonce store shared by all of a pre-forked auth service's
+    workers. Nonces are recorded in a fixed size, open addressing
+    hash table in anonymous shared memory so the store must be created
+    before forking. Nonces are remembered for at least ```maxage```
+    seconds. Each of the table's ```size``` slots records a
+    64 bit fingerprint of the nonce's key and the time bucket in which
+    the nonce was first seen. Slots from buckets older than the previous
+    bucket are free to be reused.
+
+    If the table is so full that a nonce can't be recorded the store
+    fails closed - the nonce is treated as having been seen before
+    and the request is rejected. Size the table to comfortably exceed
+    2 x request rate x ```maxage```."""
+
+    _slot = struct.Struct("=QQ")
+
+    """When recording a nonce at most ```_max_probes``` slots are
+    examined before the table is considered full."""
+    _max_probes = 16
+
+    def __init__(self, maxage, size):
+        object.__init__(self)
+
+        self._maxage = maxage
+        self._size = size
+        self._table = mmap.mmap(-1, size * self._slot.size)
+        self._lock = multiprocessing.Lock()
+
+    def add(self, key, callback):
+        callback(self._add(key))
+
+    def delete(self, key):
+        (fingerprint, index) = self._fingerprint_and_index(key)
+        # stored buckets are offset by 1 (see _add())
+        oldest_live_bucket = _bucket_id(self._maxage)
+
+        table = self._table
+        slot = self._slot
+
+        with self._lock:
+            for probe in range(self._max_probes):
+                offset = ((index + probe) % self._size) * slot.size
+                (slot_fingerprint, slot_bucket) = slot.unpack_from(table, offset)
+                if oldest_live_bucket <= slot_bucket and slot_fingerprint == fingerprint:
+                    # _add() always examines all ```_max_probes``` slots
+                    # so freeing a slot doesn't hide the slots after it
+                    slot.pack_into(table, offset, 0, 0)
+                    return
+
+    def _fingerprint_and_index(self, key):
+        digest = hashlib.md5(key).digest()
+        return struct.unpack("=QQ", digest)
+
+    def _add(self, key):
+        (fingerprint, index) = self._fingerprint_and_index(key)
+        # a stored bucket of 0 means the slot has never been used
+        # so stored buckets are offset by 1
+        bucket = _bucket_id(self._maxage) + 1
+        oldest_live_bucket = bucket - 1
+
+        table = self._table
+        slot = self._slot
+        free_offset = None
+
+        with self._lock:
+            for probe in range(self._max_probes):
+                offset = ((index + probe) % self._size) * slot.size
+                (slot_fingerprint, slot_bucket) = slot.unpack_from(table, offset)
+                if oldest_live_bucket <= slot_bucket:
+                    if slot_fingerprint == fingerprint:
+                        return False
+                elif free_offset is None:
+                    free_offset = offset
+
+            if free_offset is None:
+                _logger.error("Shared nonce store full - failing closed")
+                return False
+
+            slot.pack_into(table, free_offset, fingerprint, bucket)
+
+        return True
@@ -1,6 +1,7 @@
 """This module implements the unit tests for the auth service's
 async_mac_auth module."""
 
+import hashlib
 import httplib
 import os
 import sys
@@ -9,6 +10,7 @@ import mock
 import tornado.httputil
 
 from yar.auth_service.mac import async_mac_auth
+from yar.util import hash_pool
 from yar.util import mac
 from yar.tests import yar_test_util
 
@@ -25,6 +27,15 @@ class TestAsyncMACAuth(yar_test_util.TestCase):
     def tearDownClass(cls):
         pass
 
+    def setUp(self):
+        name_of_method_to_patch = (
+            "yar.auth_service.mac."
+            "async_nonce_checker.AsyncNonceChecker.release"
+        )
+        patcher = mock.patch(name_of_method_to_patch)
+        self.release_patch = patcher.start()
+        self.addCleanup(patcher.stop)
+
     def test_no_authorization_header(self):
         """When a request contains no Authorization HTTP header, confirm that
         ```async_mac_auth.AsyncMACAuth``` tags this as an authorization
@@ -150,20 +161,30 @@ class TestAsyncMACAuth(yar_test_util.TestCase):
             "async_nonce_checker.AsyncNonceChecker.fetch"
         )
         with mock.patch(name_of_method_to_patch, async_nonce_checker_fetch_patch):
-            auth_header_value = mac.AuthHeaderValue(
-                mac_key_identifier=mac.MACKeyIdentifier.generate(),
-                ts=mac.Timestamp.generate(),
-                nonce=mac.Nonce.generate(),
-                ext=mac.Ext.generate(content_type=None, body=None),
-                mac=mac.MAC("0123456789"))
+            name_of_method_to_patch = (
+                "yar.auth_service.mac."
+                "async_mac_creds_retriever.AsyncMACCredsRetriever.fetch"
+            )
+            with mock.patch(name_of_method_to_patch) as async_creds_retriever_fetch_patch:
+                auth_header_value = mac.AuthHeaderValue(
+                    mac_key_identifier=mac.MACKeyIdentifier.generate(),
+                    ts=mac.Timestamp.generate(),
+                    nonce=mac.Nonce.generate(),
+                    ext=mac.Ext.generate(content_type=None, body=None),
+                    mac=mac.MAC("0123456789"))
 
-            request = mock.Mock()
-            request.headers = tornado.httputil.HTTPHeaders({
-                "Authorization": str(auth_header_value),
-            })
+                request = mock.Mock()
+                request.headers = tornado.httputil.HTTPHeaders({
+                    "Authorization": str(auth_header_value),
+                })
 
-            aha = async_mac_auth.AsyncMACAuth(request)
-            aha.authenticate(on_auth_done)
+                aha = async_mac_auth.AsyncMACAuth(request)
+                aha.authenticate(on_auth_done)
+
+                # the nonce store responded synchronously so there's
+                # no need to retrieve the credentials
+                self.assertFalse(async_creds_retriever_fetch_patch.called)
+                self.assertFalse(self.release_patch.called)
 
     def test_creds_not_found(self):
         """When a request contains Authorization HTTP header with a
@@ -218,7 +239,9 @@ class TestAsyncMACAuth(yar_test_util.TestCase):
                 aha = async_mac_auth.AsyncMACAuth(request)
                 aha.authenticate(on_auth_done)
 
-    def _test_mac_good_or_bad(self, the_method, the_bad_mac):
+                self.assertEqual(self.release_patch.call_count, 1)
+
+    def _test_mac_good_or_bad(self, the_method, the_bad_mac, include_debug_details=False):
         """When a request contains an Authorization HTTP header that
         correctly authenticates a caller."""
 
@@ -324,8 +347,41 @@ class TestAsyncMACAuth(yar_test_util.TestCase):
 
                         self.assertIsNone(principal)
 
-                aha = async_mac_auth.AsyncMACAuth(request)
-                aha.authenticate(on_auth_done)
+                        if include_debug_details:
+                            self.assertIsNotNone(auth_failure_debug_details)
+                            self.assertEqual(
+                                auth_failure_debug_details["MAC-KEY-IDENTIFIER"],
+                                the_mac_key_identifier)
+                            if the_body is None:
+                                self.assertNotIn("BODY-SHA1", auth_failure_debug_details)
+                            else:
+                                self.assertEqual(
+                                    auth_failure_debug_details["BODY-SHA1"],
+                                    hashlib.sha1(the_body).hexdigest())
+                                self.assertEqual(
+                                    auth_failure_debug_details["BODY-LEN"],
+                                    len(the_body))
+                        else:
+                            self.assertIsNone(auth_failure_debug_details)
+
+                name_of_method_to_patch = (
+                    "yar.auth_service.auth_service_request_handler."
+                    "_include_auth_failure_debug_details"
+                )
+                with mock.patch(name_of_method_to_patch, return_value=include_debug_details):
+                    with mock.patch("yar.util.hash_pool.sha1", wraps=hash_pool.sha1) as sha1_patch:
+                        aha = async_mac_auth.AsyncMACAuth(request)
+                        aha.authenticate(on_auth_done)
+
+                # the body is only hashed for the debug details
+                self.assertEqual(
+                    sha1_patch.call_count,
+                    1 if include_debug_details and the_bad_mac and the_body else 0)
+
+                # a nonce is only released if the MACs don't match
+                self.assertEqual(
+                    self.release_patch.call_count,
+                    0 if the_bad_mac is None else 1)
 
     def test_mac_bad_on_get(self):
         self._test_mac_good_or_bad(
@@ -337,7 +393,320 @@ class TestAsyncMACAuth(yar_test_util.TestCase):
             the_method="POST",
             the_bad_mac="dave")
 
+    def test_mac_bad_on_get_with_debug_details(self):
+        self._test_mac_good_or_bad(
+            the_method="GET",
+            the_bad_mac="dave",
+            include_debug_details=True)
+
+    def test_mac_bad_on_post_with_debug_details(self):
+        self._test_mac_good_or_bad(
+            the_method="POST",
+            the_bad_mac="dave",
+            include_debug_details=True)
+
     def test_mac_good(self):
         self._test_mac_good_or_bad(
             the_method="GET",
             the_bad_mac=None)
+
+    def _test_concurrent_lookups(self, nonce_first, is_nonce_ok, is_mac_ok):
+        """Start authenticating a request, confirm that both the nonce
+        check and credentials retrieval are started before either
+        completes, complete them in the requested order and return
+        the result of authentication."""
+
+        the_principal = "das@example.com"
+        the_mac_key_identifier = mac.MACKeyIdentifier.generate()
+        the_mac_key = mac.MACKey.generate()
+        the_mac_algorithm = mac.MAC.algorithm
+        the_ts = mac.Timestamp.generate()
+        the_nonce = mac.Nonce.generate()
+        the_ext = mac.Ext.generate(None, None)
+        the_normalized_request_string = mac.NormalizedRequestString.generate(
+            the_ts,
+            the_nonce,
+            "GET",
+            "/whatever.html",
+            "127.0.0.1",
+            8080,
+            the_ext)
+        if is_mac_ok:
+            the_mac = mac.MAC.generate(
+                the_mac_key,
+                the_mac_algorithm,
+                the_normalized_request_string)
+        else:
+            the_mac = "dave"
+
+        pending = {}
+
+        def async_nonce_checker_fetch_patch(anc, callback):
+            pending["nonce"] = callback
+
+        def async_creds_retriever_fetch_patch(acr, callback):
+            pending["creds"] = callback
+
+        on_auth_done = mock.Mock()
+
+        name_of_method_to_patch = (
+            "yar.auth_service.mac."
+            "async_nonce_checker.AsyncNonceChecker.fetch"
+        )
+        with mock.patch(name_of_method_to_patch, async_nonce_checker_fetch_patch):
+            name_of_method_to_patch = (
+                "yar.auth_service.mac."
+                "async_mac_creds_retriever.AsyncMACCredsRetriever.fetch"
+            )
+            with mock.patch(name_of_method_to_patch, async_creds_retriever_fetch_patch):
+                auth_header_value = mac.AuthHeaderValue(
+                    the_mac_key_identifier,
+                    the_ts,
+                    the_nonce,
+                    the_ext,
+                    the_mac)
+
+                request = mock.Mock()
+                request.method = "GET"
+                request.uri = "/whatever.html"
+                request.headers = tornado.httputil.HTTPHeaders({
+                    "Host": "127.0.0.1:8080",
+                    "Authorization": str(auth_header_value),
+                })
+
+                aha = async_mac_auth.AsyncMACAuth(request)
+                aha.authenticate(on_auth_done)
+
+        self.assertEqual(sorted(pending.keys()), ["creds", "nonce"])
+
+        def complete_nonce():
+            pending["nonce"](is_nonce_ok)
+
+        def complete_creds():
+            pending["creds"](
+                True,
+                the_mac_key_identifier,
+                the_mac_algorithm,
+                the_mac_key,
+                the_principal)
+
+        if nonce_first:
+            complete_nonce()
+            complete_creds()
+        else:
+            complete_creds()
+            complete_nonce()
+
+        self.assertEqual(on_auth_done.call_count, 1)
+        return on_auth_done.call_args
+
+    def test_concurrent_lookups_nonce_first(self):
+        (args, kwargs) = self._test_concurrent_lookups(
+            nonce_first=True,
+            is_nonce_ok=True,
+            is_mac_ok=True)
+        self.assertEqual(args, (True,))
+        self.assertEqual(kwargs, {"principal": "das@example.com"})
+        self.assertFalse(self.release_patch.called)
+
+    def test_concurrent_lookups_creds_first(self):
+        (args, kwargs) = self._test_concurrent_lookups(
+            nonce_first=False,
+            is_nonce_ok=True,
+            is_mac_ok=True)
+        self.assertEqual(args, (True,))
+        self.assertEqual(kwargs, {"principal": "das@example.com"})
+        self.assertFalse(self.release_patch.called)
+
+    def test_concurrent_lookups_nonce_reused_after_creds(self):
+        (args, kwargs) = self._test_concurrent_lookups(
+            nonce_first=False,
+            is_nonce_ok=False,
+            is_mac_ok=True)
+        self.assertEqual(
+            args,
+            (False, async_mac_auth.AUTH_FAILURE_DETAIL_NONCE_REUSED))
+        self.assertFalse(self.release_patch.called)
+
+    def test_concurrent_lookups_nonce_reused_before_creds(self):
+        (args, kwargs) = self._test_concurrent_lookups(
+            nonce_first=True,
+            is_nonce_ok=False,
+            is_mac_ok=True)
+        self.assertEqual(
+            args,
+            (False, async_mac_auth.AUTH_FAILURE_DETAIL_NONCE_REUSED))
+        self.assertFalse(self.release_patch.called)
+
+    def test_concurrent_lookups_mac_bad_before_nonce(self):
+        """When the MACs don't match and the nonce check completes
+        afterwards confirm the nonce is released once it's recorded."""
+        (args, kwargs) = self._test_concurrent_lookups(
+            nonce_first=False,
+            is_nonce_ok=True,
+            is_mac_ok=False)
+        self.assertEqual(
+            kwargs["auth_failure_detail"],
+            async_mac_auth.AUTH_FAILURE_DETAIL_MACS_DO_NOT_MATCH)
+        self.assertEqual(self.release_patch.call_count, 1)
+
+    def test_concurrent_lookups_mac_bad_after_nonce(self):
+        (args, kwargs) = self._test_concurrent_lookups(
+            nonce_first=True,
+            is_nonce_ok=True,
+            is_mac_ok=False)
+        self.assertEqual(
+            kwargs["auth_failure_detail"],
+            async_mac_auth.AUTH_FAILURE_DETAIL_MACS_DO_NOT_MATCH)
+        self.assertEqual(self.release_patch.call_count, 1)
+
+    def test_ext_generated_on_hash_pool(self):
+        """When the body is large enough for its ext to be generated
+        on ```hash_pool```'s threads confirm authentication completes
+        once the ext is delivered and that the nonce being reused while
+        the ext is being generated fails authentication exactly once."""
+
+        the_mac_key_identifier = mac.MACKeyIdentifier.generate()
+        the_mac_key = mac.MACKey.generate()
+        the_ts = mac.Timestamp.generate()
+        the_nonce = mac.Nonce.generate()
+        the_body = "bindle berry"
+        the_content_type = "text/plain"
+        the_ext = mac.Ext.generate(the_content_type, the_body)
+        the_normalized_request_string = mac.NormalizedRequestString.generate(
+            the_ts,
+            the_nonce,
+            "POST",
+            "/whatever.html",
+            "127.0.0.1",
+            8080,
+            the_ext)
+        the_mac = mac.MAC.generate(
+            the_mac_key,
+            mac.MAC.algorithm,
+            the_normalized_request_string)
+
+        for is_nonce_ok in [True, False]:
+            pending_exts = []
+            pending_nonce_checks = []
+
+            def hash_pool_ext_patch(content_type, body, callback):
+                self.assertEqual(content_type, the_content_type)
+                self.assertEqual(body, the_body)
+                pending_exts.append(callback)
+
+            def async_nonce_checker_fetch_patch(anc, callback):
+                pending_nonce_checks.append(callback)
+
+            def async_creds_retriever_fetch_patch(acr, callback):
+                callback(
+                    True,
+                    the_mac_key_identifier,
+                    mac.MAC.algorithm,
+                    the_mac_key,
+                    "das@example.com")
+
+            request = mock.Mock()
+            request.method = "POST"
+            request.uri = "/whatever.html"
+            request.body = the_body
+            request.headers = tornado.httputil.HTTPHeaders({
+                "Host": "127.0.0.1:8080",
+                "Authorization": str(mac.AuthHeaderValue(
+                    the_mac_key_identifier,
+                    the_ts,
+                    the_nonce,
+                    the_ext,
+                    the_mac)),
+                "Content-type": the_content_type,
+                "Content-Length": len(the_body),
+            })
+
+            on_auth_done = mock.Mock()
+
+            with mock.patch("yar.util.hash_pool.ext", hash_pool_ext_patch):
+                with mock.patch(
+                        "yar.auth_service.mac.async_nonce_checker.AsyncNonceChecker.fetch",
+                        async_nonce_checker_fetch_patch):
+                    with mock.patch(
+                            "yar.auth_service.mac.async_mac_creds_retriever.AsyncMACCredsRetriever.fetch",
+                            async_creds_retriever_fetch_patch):
+                        aha = async_mac_auth.AsyncMACAuth(request)
+                        aha.authenticate(on_auth_done)
+
+            # the nonce check completes while the ext is being generated
+            self.assertEqual(len(pending_exts), 1)
+            self.assertEqual(len(pending_nonce_checks), 1)
+            pending_nonce_checks[0](is_nonce_ok)
+
+            if is_nonce_ok:
+                self.assertEqual(on_auth_done.call_count, 0)
+                pending_exts[0](the_ext)
+                on_auth_done.assert_called_once_with(True, principal="das@example.com")
+            else:
+                on_auth_done.assert_called_once_with(
+                    False,
+                    async_mac_auth.AUTH_FAILURE_DETAIL_NONCE_REUSED)
+                pending_exts[0](the_ext)
+                self.assertEqual(on_auth_done.call_count, 1)
+
+    def test_ext_generation_fails(self):
+        """When ```hash_pool``` fails to generate the ext confirm
+        authentication fails as if the MACs don't match and the
+        normalized request string is never generated."""
+
+        the_mac_key_identifier = mac.MACKeyIdentifier.generate()
+        the_mac_key = mac.MACKey.generate()
+        the_body = "bindle berry"
+        the_content_type = "text/plain"
+        the_ext = mac.Ext.generate(the_content_type, the_body)
+
+        def hash_pool_ext_patch(content_type, body, callback):
+            callback(None)
+
+        def async_nonce_checker_fetch_patch(anc, callback):
+            callback(True)
+
+        def async_creds_retriever_fetch_patch(acr, callback):
+            callback(
+                True,
+                the_mac_key_identifier,
+                mac.MAC.algorithm,
+                the_mac_key,
+                "das@example.com")
+
+        request = mock.Mock()
+        request.method = "POST"
+        request.uri = "/whatever.html"
+        request.body = the_body
+        request.headers = tornado.httputil.HTTPHeaders({
+            "Host": "127.0.0.1:8080",
+            "Authorization": str(mac.AuthHeaderValue(
+                the_mac_key_identifier,
+                mac.Timestamp.generate(),
+                mac.Nonce.generate(),
+                the_ext,
+                "dave")),
+            "Content-type": the_content_type,
+            "Content-Length": len(the_body),
+        })
+
+        on_auth_done = mock.Mock()
+
+        with mock.patch("yar.util.hash_pool.ext", hash_pool_ext_patch):
+            with mock.patch(
+                    "yar.auth_service.mac.async_nonce_checker.AsyncNonceChecker.fetch",
+                    async_nonce_checker_fetch_patch):
+                with mock.patch(
+                        "yar.auth_service.mac.async_mac_creds_retriever.AsyncMACCredsRetriever.fetch",
+                        async_creds_retriever_fetch_patch):
+                    with mock.patch("yar.util.mac.NormalizedRequestString.generate") as nrs_generate_patch:
+                        aha = async_mac_auth.AsyncMACAuth(request)
+                        aha.authenticate(on_auth_done)
+
+        on_auth_done.assert_called_once_with(
+            False,
+            auth_failure_detail=async_mac_auth.AUTH_FAILURE_DETAIL_MACS_DO_NOT_MATCH,
+            auth_failure_debug_details=None)
+        self.assertFalse(nrs_generate_patch.called)
+        self.assertEqual(self.release_patch.call_count, 1)
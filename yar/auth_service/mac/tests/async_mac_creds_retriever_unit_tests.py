@@ -10,6 +10,7 @@ import mock
 import tornado.httpclient
 import tornado.httputil
 
+from yar.auth_service import creds_cache
 from yar.auth_service.mac import async_mac_creds_retriever
 from yar import key_service
 from yar.key_service import jsonschemas
@@ -255,3 +256,193 @@ class TestAsyncMACCredsRetriever(yar_test_util.TestCase):
         with mock.patch(name_of_method_to_patch, async_http_client_fetch_patch):
             acr = async_mac_creds_retriever.AsyncMACCredsRetriever(the_mac_key_identifier)
             acr.fetch(on_async_mac_creds_retriever_done)
+
+    def test_creds_served_from_creds_cache(self):
+        """Confirm that once ```AsyncMACCredsRetriever``` has retrieved
+        credentials from the key service subsequent fetches for the
+        same mac key identifier are answered from the creds cache
+        without another request to the key service."""
+        the_mac_key_identifier = mac.MACKeyIdentifier.generate()
+        the_mac_algorithm = "hmac-sha-1"
+        the_mac_key = mac.MACKey.generate()
+        the_principal = "das@example.com"
+
+        self._number_key_service_requests = 0
+
+        def async_http_client_fetch_patch(http_client, request, callback):
+            self.assertKeyServerRequestOk(request, the_mac_key_identifier)
+
+            self._number_key_service_requests += 1
+
+            response = mock.Mock()
+            response.error = None
+            response.code = httplib.OK
+            response.body = json.dumps({
+                "mac": {
+                    "mac_algorithm": the_mac_algorithm,
+                    "mac_key": the_mac_key,
+                    "mac_key_identifier": the_mac_key_identifier,
+                },
+                "principal": the_principal,
+                "links": {
+                    "self": {
+                        "href": "abc",
+                    }
+                }
+            })
+            response.headers = tornado.httputil.HTTPHeaders({
+                "Content-type": "application/json; charset=utf8",
+                "Content-length": str(len(response.body)),
+            })
+            response.request_time = 24
+            callback(response)
+
+        def on_async_mac_creds_retriever_done(is_ok,
+                                              mac_key_identifier,
+                                              mac_algorithm,
+                                              mac_key,
+                                              principal):
+            self.assertTrue(is_ok)
+            self.assertEqual(mac_key_identifier, the_mac_key_identifier)
+            self.assertEqual(mac_key, the_mac_key)
+            self.assertEqual(principal, the_principal)
+
+        name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+        with mock.patch(name_of_method_to_patch, async_http_client_fetch_patch):
+            for i in range(3):
+                acr = async_mac_creds_retriever.AsyncMACCredsRetriever(the_mac_key_identifier)
+                acr.fetch(on_async_mac_creds_retriever_done)
+
+        self.assertEqual(self._number_key_service_requests, 1)
+
+    def test_creds_not_found_served_from_creds_cache(self):
+        """Confirm that when the key service says it has no credentials
+        for a mac key identifier the "not found" answer is remembered by
+        the creds cache."""
+        the_mac_key_identifier = mac.MACKeyIdentifier.generate()
+
+        self._number_key_service_requests = 0
+
+        def async_http_client_fetch_patch(http_client, request, callback):
+            self._number_key_service_requests += 1
+
+            response = mock.Mock()
+            response.error = None
+            response.code = httplib.NOT_FOUND
+            response.request_time = 24
+            callback(response)
+
+        def on_async_mac_creds_retriever_done(is_ok, mac_key_identifier):
+            self.assertFalse(is_ok)
+            self.assertEqual(mac_key_identifier, the_mac_key_identifier)
+
+        name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+        with mock.patch(name_of_method_to_patch, async_http_client_fetch_patch):
+            for i in range(2):
+                acr = async_mac_creds_retriever.AsyncMACCredsRetriever(the_mac_key_identifier)
+                acr.fetch(on_async_mac_creds_retriever_done)
+
+        self.assertEqual(self._number_key_service_requests, 1)
+
+    def test_concurrent_fetches_share_one_key_service_request(self):
+        """Confirm that concurrent fetches for the same mac key
+        identifier result in a single request to the key service
+        and that every fetch's callback is called."""
+        the_mac_key_identifier = mac.MACKeyIdentifier.generate()
+
+        self._pending_callbacks = []
+
+        def async_http_client_fetch_patch(http_client, request, callback):
+            self.assertKeyServerRequestOk(request, the_mac_key_identifier)
+            self._pending_callbacks.append(callback)
+
+        self._number_callbacks = 0
+
+        def on_async_mac_creds_retriever_done(is_ok, mac_key_identifier):
+            self.assertFalse(is_ok)
+            self.assertEqual(mac_key_identifier, the_mac_key_identifier)
+            self._number_callbacks += 1
+
+        name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+        with mock.patch(name_of_method_to_patch, async_http_client_fetch_patch):
+            for i in range(5):
+                acr = async_mac_creds_retriever.AsyncMACCredsRetriever(the_mac_key_identifier)
+                acr.fetch(on_async_mac_creds_retriever_done)
+
+        self.assertEqual(len(self._pending_callbacks), 1)
+        self.assertEqual(self._number_callbacks, 0)
+
+        response = mock.Mock()
+        response.error = "something"
+        response.code = 599
+        response.request_time = 24
+        self._pending_callbacks[0](response)
+
+        self.assertEqual(self._number_callbacks, 5)
+
+    def test_expired_creds_revalidated(self):
+        """Confirm that once credentials in the creds cache have
+        expired ```AsyncMACCredsRetriever``` revalidates them with a
+        conditional GET and reuses them when the key service responds
+        with a 304."""
+        the_mac_key_identifier = mac.MACKeyIdentifier.generate()
+        the_mac_key = mac.MACKey.generate()
+        the_principal = "das@example.com"
+        the_etag = '"1-c81488ccbec47b14cec7010e18459a16"'
+
+        self._if_none_matches = []
+
+        def async_http_client_fetch_patch(http_client, request, callback):
+            self.assertKeyServerRequestOk(request, the_mac_key_identifier)
+
+            if_none_match = request.headers.get("If-None-Match", None)
+            self._if_none_matches.append(if_none_match)
+
+            response = mock.Mock()
+            response.request_time = 24
+            if if_none_match == the_etag:
+                response.error = tornado.httpclient.HTTPError(httplib.NOT_MODIFIED)
+                response.code = httplib.NOT_MODIFIED
+                callback(response)
+                return
+
+            response.error = None
+            response.code = httplib.OK
+            response.body = json.dumps({
+                "mac": {
+                    "mac_algorithm": "hmac-sha-1",
+                    "mac_key": the_mac_key,
+                    "mac_key_identifier": the_mac_key_identifier,
+                },
+                "principal": the_principal,
+                "links": {
+                    "self": {
+                        "href": "abc",
+                    }
+                }
+            })
+            response.headers = tornado.httputil.HTTPHeaders({
+                "Content-type": "application/json; charset=utf8",
+                "Content-length": str(len(response.body)),
+                "Etag": the_etag,
+            })
+            callback(response)
+
+        on_async_mac_creds_retriever_done = mock.Mock()
+
+        cache = creds_cache.CredsCache(10, 30, 5)
+        name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+        with mock.patch.object(creds_cache, "_creds_cache", cache):
+            with mock.patch(name_of_method_to_patch, async_http_client_fetch_patch):
+                for now in [1000.0, 1031.0, 1062.0]:
+                    with mock.patch("time.time", mock.Mock(return_value=now)):
+                        acr = async_mac_creds_retriever.AsyncMACCredsRetriever(the_mac_key_identifier)
+                        acr.fetch(on_async_mac_creds_retriever_done)
+
+        self.assertEqual(self._if_none_matches, [None, the_etag, the_etag])
+        self.assertEqual(cache.revalidations, 2)
+        self.assertEqual(on_async_mac_creds_retriever_done.call_count, 3)
+        for call in on_async_mac_creds_retriever_done.call_args_list:
+            self.assertTrue(call[0][0])
+            self.assertEqual(call[0][3], the_mac_key)
+            self.assertEqual(call[0][4], the_principal)
@@ -7,6 +7,7 @@ import sys
 import mock
 
 from yar.auth_service.mac import async_nonce_checker
+from yar.auth_service.mac import local_nonce_store
 from yar.util import mac
 from yar.tests import yar_test_util
 
@@ -35,46 +36,91 @@ class TestAsyncNonceChecker(yar_test_util.TestCase):
         self._nonce = mac.Nonce.generate()
         self._nonce_store = {}
 
-        self._mock = None
-
-        def client_pool_class_patch(nonce_store, maxclients):
-            self.assertIsNotNone(nonce_store)
-            self.assertEqual(nonce_store, self.__class__._nonce_store)
-            self.assertIsNotNone(maxclients)
-
-            def patched_get(key, callback):
-                self._assertKey(self._mac_key_identifier, self._nonce, key)
-                callback(self._nonce_store.get(key, None))
-
-            def patched_set(key, value, callback):
-                self._assertKey(self._mac_key_identifier, self._nonce, key)
-                self.assertIsNotNone(value)
-                self.assertEqual(value, 1)
-                self._nonce_store[key] = value
-                callback(None)
-
-            self.assertIsNone(self._mock)
-            self._mock = mock.Mock()
-            self._mock.get.side_effect = patched_get
-            self._mock.set.side_effect = patched_set
-            return self._mock
-
-        name_of_class_to_patch = "tornadoasyncmemcache.ClientPool"
-        with mock.patch(name_of_class_to_patch, client_pool_class_patch):
-            def on_fetch_done(is_ok):
-                self.assertIsNotNone(is_ok)
-                self.assertTrue(is_ok)
-
-            aasf = async_nonce_checker.AsyncNonceChecker(
-                self._mac_key_identifier,
-                self._nonce)
-            aasf.fetch(on_fetch_done)
-
-            def on_fetch_done(is_ok):
-                self.assertIsNotNone(is_ok)
-                self.assertFalse(is_ok)
-
-            aasf = async_nonce_checker.AsyncNonceChecker(
-                self._mac_key_identifier,
-                self._nonce)
-            aasf.fetch(on_fetch_done)
+        def patched_add(client, key, value, ttl, callback):
+            self._assertKey(self._mac_key_identifier, self._nonce, key)
+            self.assertEqual(ttl, async_nonce_checker.maxage + 1)
+            if key in self._nonce_store:
+                callback(False)
+                return
+            self._nonce_store[key] = value
+            callback(True)
+
+        with mock.patch.object(async_nonce_checker.AsyncNonceChecker, "_nonce_store", None):
+            with mock.patch("yar.util.memcached.Client.add", patched_add):
+                def on_fetch_done(is_ok):
+                    self.assertIsNotNone(is_ok)
+                    self.assertTrue(is_ok)
+
+                aasf = async_nonce_checker.AsyncNonceChecker(
+                    self._mac_key_identifier,
+                    self._nonce)
+                aasf.fetch(on_fetch_done)
+
+                def on_fetch_done(is_ok):
+                    self.assertIsNotNone(is_ok)
+                    self.assertFalse(is_ok)
+
+                aasf = async_nonce_checker.AsyncNonceChecker(
+                    self._mac_key_identifier,
+                    self._nonce)
+                aasf.fetch(on_fetch_done)
+
+    def test_memcached_error_fails_closed(self):
+        """Verify that if memcached can't record a nonce the nonce
+        is treated as having been previously used."""
+
+        def patched_add(client, key, value, ttl, callback):
+            callback(None)
+
+        with mock.patch.object(async_nonce_checker.AsyncNonceChecker, "_nonce_store", None):
+            with mock.patch("yar.util.memcached.Client.add", patched_add):
+                callback = mock.Mock()
+                aasf = async_nonce_checker.AsyncNonceChecker(
+                    mac.MACKeyIdentifier.generate(),
+                    mac.Nonce.generate())
+                aasf.fetch(callback)
+                callback.assert_called_once_with(False)
+
+    def test_release(self):
+        """Verify ```async_nonce_checker.AsyncNonceChecker.release()```
+        deletes the key recorded by
+        ```async_nonce_checker.AsyncNonceChecker.fetch()```."""
+
+        def patched_add(client, key, value, ttl, callback):
+            callback(True)
+
+        with mock.patch.object(async_nonce_checker.AsyncNonceChecker, "_nonce_store", None):
+            with mock.patch("yar.util.memcached.Client.add", patched_add):
+                with mock.patch("yar.util.memcached.Client.delete") as patched_delete:
+                    mac_key_identifier = mac.MACKeyIdentifier.generate()
+                    nonce = mac.Nonce.generate()
+                    anc = async_nonce_checker.AsyncNonceChecker(mac_key_identifier, nonce)
+                    anc.fetch(mock.Mock())
+                    anc.release()
+
+                    self.assertEqual(patched_delete.call_count, 1)
+                    self.assertEqual(
+                        patched_delete.call_args[0][0],
+                        "%s-%s" % (mac_key_identifier, nonce))
+
+    def test_local_backend(self):
+        """Verify ```async_nonce_checker.nonce_store_backend``` selects
+        the nonce store used by
+        ```async_nonce_checker.AsyncNonceChecker```."""
+        with mock.patch.object(async_nonce_checker, "nonce_store_backend", "local"):
+            with mock.patch.object(async_nonce_checker.AsyncNonceChecker, "_nonce_store", None):
+                mac_key_identifier = mac.MACKeyIdentifier.generate()
+                nonce = mac.Nonce.generate()
+
+                callback = mock.Mock()
+                anc = async_nonce_checker.AsyncNonceChecker(mac_key_identifier, nonce)
+                anc.fetch(callback)
+                callback.assert_called_once_with(True)
+
+                callback = mock.Mock()
+                anc = async_nonce_checker.AsyncNonceChecker(mac_key_identifier, nonce)
+                anc.fetch(callback)
+                callback.assert_called_once_with(False)
+
+                nonce_store = async_nonce_checker.AsyncNonceChecker.nonce_store()
+                self.assertIsInstance(nonce_store, local_nonce_store.LocalNonceStore)
@@ -0,0 +1,105 @@
+"""This module implements the unit tests for the auth service's
+local_nonce_store module."""
+
+import os
+import unittest
+
+import mock
+
+from yar.auth_service.mac import local_nonce_store
+
+
+class NonceStoreTestCaseMixin(object):
+    """Unit tests common to all of local_nonce_store's nonce stores."""
+
+    def setUp(self):
+        self._now = 1000.0
+        patcher = mock.patch("time.time", lambda: self._now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _add(self, nonce_store, key):
+        callback = mock.Mock()
+        nonce_store.add(key, callback)
+        callback.assert_called_once_with(mock.ANY)
+        return callback.call_args[0][0]
+
+    def test_replay_rejected(self):
+        nonce_store = self.create_nonce_store()
+        self.assertTrue(self._add(nonce_store, "dave-1"))
+        self.assertTrue(self._add(nonce_store, "dave-2"))
+        self.assertFalse(self._add(nonce_store, "dave-1"))
+
+    def test_replay_rejected_for_at_least_maxage(self):
+        """However a nonce lines up with the buckets, a replay
+        within ```maxage``` (+ the timestamp's 1 second resolution)
+        of the nonce first being seen is rejected."""
+        for start in range(1000, 1000 + 31):
+            nonce_store = self.create_nonce_store()
+            self._now = start + 0.9
+            self.assertTrue(self._add(nonce_store, "dave"))
+            self._now = start + 0.9 + 30.9
+            self.assertFalse(self._add(nonce_store, "dave"))
+
+    def test_delete(self):
+        nonce_store = self.create_nonce_store()
+        self.assertTrue(self._add(nonce_store, "dave-1"))
+        self.assertTrue(self._add(nonce_store, "dave-2"))
+        nonce_store.delete("dave-1")
+        nonce_store.delete("dave-3")
+        self.assertTrue(self._add(nonce_store, "dave-1"))
+        self.assertFalse(self._add(nonce_store, "dave-2"))
+
+    def test_expired_buckets_dropped(self):
+        nonce_store = self.create_nonce_store()
+        self._now = 31 * 100
+        self.assertTrue(self._add(nonce_store, "dave"))
+        self._now = 31 * 102
+        self.assertTrue(self._add(nonce_store, "dave"))
+
+
+class LocalNonceStoreTestCase(NonceStoreTestCaseMixin, unittest.TestCase):
+    """These unit tests verify the behavior of
+    yar.auth_service.mac.local_nonce_store.LocalNonceStore"""
+
+    def create_nonce_store(self):
+        return local_nonce_store.LocalNonceStore(30)
+
+    def test_memory_bounded(self):
+        nonce_store = self.create_nonce_store()
+        for i in range(10):
+            self._now = 31 * i
+            for j in range(100):
+                self.assertTrue(self._add(nonce_store, "dave-%d-%d" % (i, j)))
+            self.assertTrue(len(nonce_store) <= 200)
+
+
+class SharedNonceStoreTestCase(NonceStoreTestCaseMixin, unittest.TestCase):
+    """These unit tests verify the behavior of
+    yar.auth_service.mac.local_nonce_store.SharedNonceStore"""
+
+    def create_nonce_store(self):
+        return local_nonce_store.SharedNonceStore(30, 1024)
+
+    def test_fails_closed_when_full(self):
+        nonce_store = local_nonce_store.SharedNonceStore(30, 4)
+        for i in range(4):
+            self.assertTrue(self._add(nonce_store, "dave-%d" % i))
+        self.assertFalse(self._add(nonce_store, "dave-4"))
+
+        # once the nonces expire their slots are reused
+        self._now += 2 * 31
+        self.assertTrue(self._add(nonce_store, "dave-4"))
+
+    def test_shared_across_fork(self):
+        nonce_store = self.create_nonce_store()
+
+        pid = os.fork()
+        if pid == 0:
+            callback = lambda is_ok: os._exit(0 if is_ok else 1)
+            nonce_store.add("dave", callback)
+            os._exit(2)
+
+        (pid, status) = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0)
+        self.assertFalse(self._add(nonce_store, "dave"))
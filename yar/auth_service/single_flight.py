@@ -0,0 +1,72 @@
+"""When a popular client bursts, lots of requests carrying the same
+mac key identifier or api key arrive at the auth service at almost the
+same time. Without coordination each of those requests would result
+in its own request to the key service. This module implements an
+in-flight request table so that concurrent lookups for the same key
+share a single outstanding request and all of the lookups' callbacks
+are called from that single response."""
+
+import logging
+import sys
+
+_logger = logging.getLogger("AUTHSERVICE.%s" % __name__)
+
+
+class SingleFlight(object):
+    """Tracks outstanding lookups by key. The first caller to
+    ```join()``` for a key is told to go ahead and do the lookup.
+    Subsequent callers for the same key are queued up until the
+    first caller reports the lookup's result by calling
+    ```complete()```."""
+
+    def __init__(self):
+        object.__init__(self)
+        self._in_flight = {}
+
+        """# of lookups which piggybacked on an outstanding lookup
+        rather than starting their own."""
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    def join(self, key, callback):
+        """Register ```callback``` as wanting the result of the lookup
+        for ```key```. Returns True if the caller should perform the
+        lookup (and then call ```complete()```) or False if a lookup
+        for ```key``` is already in-flight."""
+        callbacks = self._in_flight.get(key, None)
+        if callbacks is not None:
+            callbacks.append(callback)
+            self.coalesced += 1
+            return False
+
+        self._in_flight[key] = [callback]
+        return True
+
+    def complete(self, key, *args, **kwargs):
+        """The lookup for ```key``` has finished. Call every callback
+        registered for ```key``` with ```args``` and ```kwargs```.
+        All callbacks are called even if one of them raises an
+        exception. The first such exception is re-raised once all
+        callbacks have been called."""
+        callbacks = self._in_flight.pop(key, [])
+
+        if 1 < len(callbacks):
+            _logger.info(
+                "Lookup for '%s' satisfied %d callers",
+                key,
+                len(callbacks))
+
+        first_exc_info = None
+        for callback in callbacks:
+            try:
+                callback(*args, **kwargs)
+            except Exception:
+                if first_exc_info is None:
+                    first_exc_info = sys.exc_info()
+                else:
+                    _logger.exception("Lookup callback for '%s' failed", key)
+
+        if first_exc_info is not None:
+            raise first_exc_info[0], first_exc_info[1], first_exc_info[2]
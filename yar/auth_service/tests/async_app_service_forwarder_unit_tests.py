@@ -266,3 +266,94 @@ class TestAsyncCredsForwarder(yar_test_util.TestCase):
                 the_request_body,
                 the_request_principal)
             aasf.forward(on_async_app_service_forward_done)
+
+    def test_streaming(self):
+        """Verify that when streaming callbacks are supplied to
+        ```async_app_service_forwarder.AsyncAppServiceForwarder.forward()```
+        the app service's status, headers (less hop-by-hop headers) and
+        body chunks are relayed as they arrive."""
+
+        the_chunks = ["dave ", "was ", "here"]
+
+        def fetch_patch(http_client, request, callback):
+            self.assertFalse(request.decompress_response)
+            self.assertIsNotNone(request.header_callback)
+            self.assertIsNotNone(request.streaming_callback)
+
+            request.header_callback("HTTP/1.1 100 Continue\r\n")
+            request.header_callback("\r\n")
+            request.header_callback("HTTP/1.1 200 Dave Was Here\r\n")
+            request.header_callback("X-Bindle: one\r\n")
+            request.header_callback("Transfer-Encoding: chunked\r\n")
+            request.header_callback("Connection: keep-alive\r\n")
+            request.header_callback("\r\n")
+            for chunk in the_chunks:
+                request.streaming_callback(chunk)
+
+            response = mock.Mock()
+            response.error = None
+            response.code = httplib.OK
+            response.request_time = 24
+            callback(response)
+
+        relayed = {"chunks": []}
+
+        def on_headers(http_status_code, reason, headers):
+            relayed["http_status_code"] = http_status_code
+            relayed["reason"] = reason
+            relayed["headers"] = headers
+
+        def on_chunk(chunk):
+            self.assertIn("headers", relayed)
+            relayed["chunks"].append(chunk)
+
+        def on_done(is_ok):
+            relayed["is_ok"] = is_ok
+
+        name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+        with mock.patch(name_of_method_to_patch, fetch_patch):
+            aasf = async_app_service_forwarder.AsyncAppServiceForwarder(
+                "GET",
+                "/dave.html",
+                {},
+                None,
+                "das@example.com")
+            aasf.forward(on_done, on_headers, on_chunk)
+
+        self.assertTrue(relayed["is_ok"])
+        self.assertEqual(relayed["http_status_code"], httplib.OK)
+        self.assertEqual(relayed["reason"], "Dave Was Here")
+        self.assertEqual(
+            relayed["headers"],
+            tornado.httputil.HTTPHeaders({"X-Bindle": "one"}))
+        self.assertEqual(relayed["chunks"], the_chunks)
+
+    def test_streaming_error_before_headers(self):
+        """Verify that when streaming and the app service can't be
+        reached ```forward()```'s callback is told the forward failed
+        without any status or headers having been relayed."""
+
+        def fetch_patch(http_client, request, callback):
+            response = mock.Mock()
+            response.error = "something"
+            response.code = 599
+            response.request_time = 24
+            callback(response)
+
+        on_headers = mock.Mock()
+        on_chunk = mock.Mock()
+        on_done = mock.Mock()
+
+        name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+        with mock.patch(name_of_method_to_patch, fetch_patch):
+            aasf = async_app_service_forwarder.AsyncAppServiceForwarder(
+                "GET",
+                "/dave.html",
+                {},
+                None,
+                "das@example.com")
+            aasf.forward(on_done, on_headers, on_chunk)
+
+        on_done.assert_called_once_with(False)
+        self.assertFalse(on_headers.called)
+        self.assertFalse(on_chunk.called)
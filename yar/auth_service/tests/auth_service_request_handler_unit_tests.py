@@ -9,15 +9,25 @@ import uuid
 
 import httplib2
 import mock
+import tornado.concurrent
+import tornado.gen
 import tornado.httpserver
 import tornado.httputil
 import tornado.web
 import tornado.testing
 
 from yar.tests import yar_test_util
+from yar.auth_service import async_app_service_forwarder
 from yar.auth_service import auth_service_request_handler
 from yar.auth_service.auth_service_request_handler import auth_failure_detail_header_name
 from yar.auth_service.auth_service_request_handler import debug_header_prefix
+from yar.auth_service.basic import async_auth
+from yar.auth_service.mac import async_mac_auth
+
+"""A syntactically valid MAC Authorization header value. Tests which
+patch the MAC authenticator need a header which gets past the auth
+service's header parsing but the header's values don't matter."""
+_mac_auth_hdr_val = 'MAC id="dave", ts="42", nonce="was", ext="", mac="here"'
 
 
 class ControlIncludeAuthFailureDebugDetails(object):
@@ -151,6 +161,30 @@ class AuthServerRequestHandlerTestCase(tornado.testing.AsyncHTTPTestCase):
                 response,
                 auth_service_request_handler.AUTH_FAILURE_DETAIL_UNKNOWN_AUTHENTICATION_SCHEME)
 
+    def test_malformed_mac_authorization_header(self):
+        """This test confirms that authentication fails with the MAC
+        authenticator's invalid header failure detail if an Authorization
+        header names the MAC authentication scheme but is malformed."""
+
+        with ControlIncludeAuthFailureDebugDetails(True):
+            response = self.fetch("/", method="GET", headers={"Authorization": "MAC ..."})
+            self.assertEqual(response.code, httplib.UNAUTHORIZED)
+            self.assertAuthFailureDetail(
+                response,
+                async_mac_auth.AUTH_FAILURE_DETAIL_INVALID_AUTH_HEADER)
+
+    def test_malformed_basic_authorization_header(self):
+        """This test confirms that authentication fails with the BASIC
+        authenticator's invalid header failure detail if an Authorization
+        header names the BASIC authentication scheme but is malformed."""
+
+        with ControlIncludeAuthFailureDebugDetails(True):
+            response = self.fetch("/", method="GET", headers={"Authorization": "basic a b"})
+            self.assertEqual(response.code, httplib.UNAUTHORIZED)
+            self.assertAuthFailureDetail(
+                response,
+                async_auth.AUTH_FAILURE_DETAIL_INVALID_AUTH_HEADER_FORMAT_PRE_DECODING)
+
     def test_auth_failure_detail_correctly_in_auth_service_response(self):
         """This test confirms that when an authenticator
         supplies authentication failure detail that the failure
@@ -181,7 +215,7 @@ class AuthServerRequestHandlerTestCase(tornado.testing.AsyncHTTPTestCase):
                 response = self.fetch(
                     "/",
                     method="GET",
-                    headers={"Authorization": "MAC ..."})
+                    headers={"Authorization": _mac_auth_hdr_val})
                 self.assertEqual(response.code, httplib.UNAUTHORIZED)
                 self.assertAuthFailureDetail(response, the_auth_failure_detail)
                 self.assertAuthFailureDebugDetails(
@@ -193,7 +227,7 @@ class AuthServerRequestHandlerTestCase(tornado.testing.AsyncHTTPTestCase):
                 response = self.fetch(
                     "/",
                     method="GET",
-                    headers={"Authorization": "MAC ..."})
+                    headers={"Authorization": _mac_auth_hdr_val})
                 self.assertEqual(response.code, httplib.UNAUTHORIZED)
                 self.assertNoAuthFailureDetail(response)
                 self.assertNoAuthFailureDebugDetails(response)
@@ -224,7 +258,7 @@ class AuthServerRequestHandlerTestCase(tornado.testing.AsyncHTTPTestCase):
                 response = self.fetch(
                     "/",
                     method="GET",
-                    headers={"Authorization": "MAC ..."})
+                    headers={"Authorization": _mac_auth_hdr_val})
 
                 self.assertIsNotNone(response)
                 self.assertEqual(response.code, httplib.INTERNAL_SERVER_ERROR)
@@ -268,7 +302,7 @@ class AuthServerRequestHandlerTestCase(tornado.testing.AsyncHTTPTestCase):
                     "/",
                     method=the_method,
                     body=the_request_body,
-                    headers={"Authorization": "MAC ..."})
+                    headers={"Authorization": _mac_auth_hdr_val})
 
                 self.assertIsNotNone(response)
                 self.assertEqual(response.code, the_status_code)
@@ -324,5 +358,126 @@ class AuthServerRequestHandlerTestCase(tornado.testing.AsyncHTTPTestCase):
             None,
             None)
 
+    def _test_forward_streaming(self, the_forward_is_ok):
+        """Verify that when app service responses are streamed the
+        app service's status, headers and body chunks are relayed."""
+
+        the_principal = str(uuid.uuid4()).replace("-", "")
+        the_chunks = [str(uuid.uuid4()).replace("-", "") for i in range(3)]
+        the_response_headers = tornado.httputil.HTTPHeaders({
+            "X-Dave": str(uuid.uuid4()).replace("-", ""),
+            "Content-Length": str(len("".join(the_chunks))),
+        })
+
+        def authenticate_patch(ignore_this_async_mac_auth, callback):
+            callback(is_auth_ok=True, principal=the_principal)
+
+        name_of_method_to_patch = (
+            "yar.auth_service.mac."
+            "async_mac_auth.AsyncMACAuth.authenticate"
+        )
+        with mock.patch(name_of_method_to_patch, authenticate_patch):
+
+            def forward_patch(async_app_service_forwarder, callback, on_headers, on_chunk):
+                on_headers(httplib.CREATED, "Dave Was Here", the_response_headers)
+                # when the forward fails the app service's response
+                # is cut short after the first chunk
+                for chunk in the_chunks if the_forward_is_ok else the_chunks[:1]:
+                    on_chunk(chunk)
+                callback(the_forward_is_ok)
+
+            name_of_method_to_patch = (
+                "yar.auth_service.async_app_service_forwarder."
+                "AsyncAppServiceForwarder.forward"
+            )
+            with mock.patch(name_of_method_to_patch, forward_patch):
+                with mock.patch.object(async_app_service_forwarder, "stream_responses", True):
+
+                    response = self.fetch(
+                        "/",
+                        method="GET",
+                        headers={"Authorization": _mac_auth_hdr_val})
+
+        if the_forward_is_ok:
+            self.assertEqual(response.code, httplib.CREATED)
+            self.assertEqual(response.reason, "Dave Was Here")
+            self.assertEqual(response.headers["X-Dave"], the_response_headers["X-Dave"])
+            self.assertEqual(response.body, "".join(the_chunks))
+        else:
+            # status & headers were relayed before the forward failed
+            # so the only option is to cut the response short
+            self.assertEqual(response.code, 599)
+
+    def test_forward_streaming(self):
+        self._test_forward_streaming(True)
+
+    def test_forward_streaming_cut_short(self):
+        self._test_forward_streaming(False)
+
+    def test_forward_streaming_slow_client(self):
+        """Verify that when app service responses are streamed and the
+        client isn't keeping up the app service's response stops being
+        read until the client catches up and that the client still gets
+        the app service's entire response."""
+
+        def authenticate_patch(ignore_this_async_mac_auth, callback):
+            callback(is_auth_ok=True, principal="dave")
+
+        name_of_method_to_patch = (
+            "yar.auth_service.mac."
+            "async_mac_auth.AsyncMACAuth.authenticate"
+        )
+        with mock.patch(name_of_method_to_patch, authenticate_patch):
+
+            io_loop = self.io_loop
+
+            def flush_patch(request_handler, *args, **kwargs):
+                # a slow reader - each write to the client's socket
+                # takes a while to complete
+                slow_future = tornado.concurrent.Future()
+
+                def on_flush_done(future):
+                    io_loop.call_later(0.005, slow_future.set_result, None)
+
+                tornado.web.RequestHandler.flush(request_handler, *args, **kwargs).add_done_callback(on_flush_done)
+                return slow_future
+
+            the_chunks = ["%02d" % i * 32 for i in range(32)]
+            pauses = []
+
+            @tornado.gen.coroutine
+            def stream(callback, on_headers, on_chunk):
+                on_headers(httplib.OK, "OK", tornado.httputil.HTTPHeaders())
+                for chunk in the_chunks:
+                    # like Tornado's HTTP/1.x connection the rest of the
+                    # response isn't read until on_chunk's future is done
+                    future = on_chunk(chunk)
+                    if future is not None:
+                        pauses.append(chunk)
+                        yield future
+                callback(True)
+
+            def forward_patch(async_app_service_forwarder, callback, on_headers, on_chunk):
+                stream(callback, on_headers, on_chunk)
+
+            name_of_method_to_patch = (
+                "yar.auth_service.async_app_service_forwarder."
+                "AsyncAppServiceForwarder.forward"
+            )
+            with mock.patch(name_of_method_to_patch, forward_patch):
+                with mock.patch.object(async_app_service_forwarder, "stream_responses", True):
+                    with mock.patch.object(auth_service_request_handler, "max_stream_buffer_size", 128):
+                        with mock.patch.object(auth_service_request_handler.RequestHandler, "flush", flush_patch):
+
+                            response = self.fetch(
+                                "/",
+                                method="GET",
+                                headers={"Authorization": _mac_auth_hdr_val})
+
+        self.assertEqual(response.code, httplib.OK)
+        self.assertEqual(response.body, "".join(the_chunks))
+        self.assertTrue(sum(len(chunk) for chunk in the_chunks) > 128)
+        self.assertTrue(pauses)
+
     # :TODO: need test to verify MAC Authorization header uses MAC Authenticator
     # :TODO: need test to verify BASIC Authorization header uses Basic Authenticator
@@ -27,6 +27,21 @@ class CommandLineParserUnitTase(unittest.TestCase):
         self.assertEqual(clo.app_service, "127.0.0.1:8080")
         self.assertEqual(clo.maxage, 30)
         self.assertEqual(clo.nonce_store, ["127.0.0.1:11211"])
+        self.assertEqual(clo.nonce_store_backend, "memcached")
+        self.assertEqual(clo.shared_nonce_store_size, 1024 * 1024)
+        self.assertEqual(clo.creds_cache_size, 10000)
+        self.assertEqual(clo.creds_cache_ttl, 30)
+        self.assertEqual(clo.creds_cache_not_found_ttl, 5)
+        self.assertEqual(clo.processes, 1)
+        self.assertFalse(clo.reuse_port)
+        self.assertEqual(clo.upstream_max_clients, 10)
+        self.assertEqual(clo.upstream_max_queue_size, 0)
+        self.assertEqual(clo.upstream_prewarm_connections, 0)
+        self.assertEqual(clo.upstream_stats_interval, 0)
+        self.assertFalse(clo.stream_app_service_responses)
+        self.assertEqual(clo.max_stream_buffer_size, 1024 * 1024)
+        self.assertEqual(clo.hash_pool_min_size, 256 * 1024)
+        self.assertEqual(clo.hash_pool_threads, 2)
         self.assertIsNone(clo.logging_file)
         self.assertIsNone(clo.syslog)
 
@@ -170,6 +185,129 @@ class CommandLineParserUnitTase(unittest.TestCase):
         self.assertIsNone(clo.logging_file)
         self.assertIsNone(clo.syslog)
 
+    def test_nonce_store_backend(self):
+        """Verify the command line parser correctly parses
+        the --noncestorebackend and --sharednoncestoresize
+        command line args."""
+        args = [
+            "--noncestorebackend", "shared",
+            "--sharednoncestoresize", "42",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.logging_level, logging.ERROR)
+        self.assertEqual(clo.listen_on, ("127.0.0.1", 8000))
+        self.assertEqual(clo.nonce_store, ["127.0.0.1:11211"])
+        self.assertEqual(clo.nonce_store_backend, "shared")
+        self.assertEqual(clo.shared_nonce_store_size, 42)
+
+    def test_creds_cache(self):
+        """Verify the command line parser correctly parses
+        the --credscachesize, --credscachettl and
+        --credscachenotfoundttl command line args."""
+        args = [
+            "--credscachesize", "42",
+            "--credscachettl", "43",
+            "--credscachenotfoundttl", "44",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.logging_level, logging.ERROR)
+        self.assertEqual(clo.listen_on, ("127.0.0.1", 8000))
+        self.assertEqual(clo.key_service, "127.0.0.1:8070")
+        self.assertEqual(clo.nonce_store, ["127.0.0.1:11211"])
+        self.assertEqual(clo.creds_cache_size, 42)
+        self.assertEqual(clo.creds_cache_ttl, 43)
+        self.assertEqual(clo.creds_cache_not_found_ttl, 44)
+
+    def test_processes(self):
+        """Verify the command line parser correctly parses
+        the --processes command line arg."""
+        args = [
+            "--processes", "4",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.logging_level, logging.ERROR)
+        self.assertEqual(clo.listen_on, ("127.0.0.1", 8000))
+        self.assertEqual(clo.processes, 4)
+        self.assertFalse(clo.reuse_port)
+
+    def test_reuse_port(self):
+        """Verify the command line parser correctly parses
+        the --reuseport command line arg."""
+        args = [
+            "--reuseport", "true",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.logging_level, logging.ERROR)
+        self.assertEqual(clo.listen_on, ("127.0.0.1", 8000))
+        self.assertEqual(clo.processes, 1)
+        self.assertTrue(clo.reuse_port)
+
+    def test_stream_app_service_responses(self):
+        """Verify the command line parser correctly parses
+        the --streamappserviceresponses and --maxstreambuffersize
+        command line args."""
+        args = [
+            "--streamappserviceresponses", "true",
+            "--maxstreambuffersize", "4096",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.logging_level, logging.ERROR)
+        self.assertEqual(clo.listen_on, ("127.0.0.1", 8000))
+        self.assertTrue(clo.stream_app_service_responses)
+        self.assertEqual(clo.max_stream_buffer_size, 4096)
+
+    def test_hash_pool(self):
+        """Verify the command line parser correctly parses
+        the --hashpoolminsize and --hashpoolthreads command
+        line args."""
+        args = [
+            "--hashpoolminsize", "4096",
+            "--hashpoolthreads", "4",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.logging_level, logging.ERROR)
+        self.assertEqual(clo.listen_on, ("127.0.0.1", 8000))
+        self.assertEqual(clo.hash_pool_min_size, 4096)
+        self.assertEqual(clo.hash_pool_threads, 4)
+
+    def test_upstream(self):
+        """Verify the command line parser correctly parses
+        the --upstream* command line args."""
+        args = [
+            "--upstreammaxclients", "42",
+            "--upstreammaxqueuesize", "43",
+            "--upstreamprewarm", "44",
+            "--upstreamstatsinterval", "45",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.logging_level, logging.ERROR)
+        self.assertEqual(clo.listen_on, ("127.0.0.1", 8000))
+        self.assertEqual(clo.upstream_max_clients, 42)
+        self.assertEqual(clo.upstream_max_queue_size, 43)
+        self.assertEqual(clo.upstream_prewarm_connections, 44)
+        self.assertEqual(clo.upstream_stats_interval, 45)
+
     def test_logging_file(self):
         """Verify the command line parser correctly parses
         the --logfile command line arg."""
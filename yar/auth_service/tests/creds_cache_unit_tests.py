@@ -0,0 +1,138 @@
+"""This module implements the unit tests for the auth service's
+creds_cache module."""
+
+import uuid
+
+import mock
+
+from yar.auth_service import creds_cache
+from yar.tests import yar_test_util
+
+
+class TestCredsCache(yar_test_util.TestCase):
+    """A collection of unit tests for ```creds_cache.CredsCache```."""
+
+    def _creds(self):
+        return {
+            "principal": "%s@example.com" % uuid.uuid4().hex,
+            "basic": {
+                "api_key": uuid.uuid4().hex,
+            },
+        }
+
+    def test_miss_on_empty_cache(self):
+        cache = creds_cache.CredsCache(10, 30, 5)
+        (is_hit, creds) = cache.get(uuid.uuid4().hex)
+        self.assertFalse(is_hit)
+        self.assertIsNone(creds)
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(cache.misses, 1)
+
+    def test_hit_after_put(self):
+        cache = creds_cache.CredsCache(10, 30, 5)
+        the_key = uuid.uuid4().hex
+        the_creds = self._creds()
+        cache.put(the_key, the_creds)
+        (is_hit, creds) = cache.get(the_key)
+        self.assertTrue(is_hit)
+        self.assertEqual(creds, the_creds)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 0)
+
+    def test_not_found_is_a_hit_with_no_creds(self):
+        cache = creds_cache.CredsCache(10, 30, 5)
+        the_key = uuid.uuid4().hex
+        cache.put_not_found(the_key)
+        (is_hit, creds) = cache.get(the_key)
+        self.assertTrue(is_hit)
+        self.assertIsNone(creds)
+
+    def test_entries_expire(self):
+        cache = creds_cache.CredsCache(10, 30, 5)
+        found_key = uuid.uuid4().hex
+        not_found_key = uuid.uuid4().hex
+
+        with mock.patch("time.time", mock.Mock(return_value=1000.0)):
+            cache.put(found_key, self._creds())
+            cache.put_not_found(not_found_key)
+
+        with mock.patch("time.time", mock.Mock(return_value=1006.0)):
+            self.assertTrue(cache.get(found_key)[0])
+            self.assertFalse(cache.get(not_found_key)[0])
+
+        with mock.patch("time.time", mock.Mock(return_value=1031.0)):
+            self.assertFalse(cache.get(found_key)[0])
+
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = creds_cache.CredsCache(2, 30, 5)
+        keys = [uuid.uuid4().hex for i in range(3)]
+        cache.put(keys[0], self._creds())
+        cache.put(keys[1], self._creds())
+        # touch keys[0] so keys[1] becomes the least recently used
+        self.assertTrue(cache.get(keys[0])[0])
+        cache.put(keys[2], self._creds())
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+        self.assertTrue(cache.get(keys[0])[0])
+        self.assertFalse(cache.get(keys[1])[0])
+        self.assertTrue(cache.get(keys[2])[0])
+
+    def test_zero_max_size_disables_cache(self):
+        cache = creds_cache.CredsCache(0, 30, 5)
+        the_key = uuid.uuid4().hex
+        cache.put(the_key, self._creds())
+        self.assertFalse(cache.get(the_key)[0])
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidate(self):
+        cache = creds_cache.CredsCache(10, 30, 5)
+        the_key = uuid.uuid4().hex
+        cache.put(the_key, self._creds())
+        cache.invalidate(the_key)
+        self.assertFalse(cache.get(the_key)[0])
+
+    def test_stats(self):
+        cache = creds_cache.CredsCache(10, 30, 5)
+        the_key = uuid.uuid4().hex
+        cache.get(the_key)
+        cache.put(the_key, self._creds())
+        cache.get(the_key)
+        expected_stats = {
+            "size": 1,
+            "max_size": 10,
+            "hits": 1,
+            "misses": 1,
+            "evictions": 0,
+            "revalidations": 0,
+        }
+        self.assertEqual(cache.stats(), expected_stats)
+
+    def test_expired_entries_with_etag_can_be_revalidated(self):
+        cache = creds_cache.CredsCache(10, 30, 5)
+        the_key = uuid.uuid4().hex
+        the_creds = self._creds()
+
+        with mock.patch("time.time", mock.Mock(return_value=1000.0)):
+            cache.put(the_key, the_creds, '"1-abc"')
+            self.assertEqual(cache.validator(the_key), (the_creds, '"1-abc"'))
+
+        with mock.patch("time.time", mock.Mock(return_value=1031.0)):
+            self.assertFalse(cache.get(the_key)[0])
+            self.assertEqual(cache.validator(the_key), (the_creds, '"1-abc"'))
+            cache.revalidated(the_key, the_creds, '"1-abc"')
+            self.assertEqual(cache.get(the_key), (True, the_creds))
+
+        self.assertEqual(cache.revalidations, 1)
+
+    def test_entries_without_etag_cant_be_revalidated(self):
+        cache = creds_cache.CredsCache(10, 30, 5)
+        found_key = uuid.uuid4().hex
+        not_found_key = uuid.uuid4().hex
+        cache.put(found_key, self._creds())
+        cache.put_not_found(not_found_key)
+        self.assertEqual(cache.validator(found_key), (None, None))
+        self.assertEqual(cache.validator(not_found_key), (None, None))
+        self.assertEqual(cache.validator(uuid.uuid4().hex), (None, None))
@@ -0,0 +1,65 @@
+"""This module implements the unit tests for the auth service's
+single_flight module."""
+
+import uuid
+
+from yar.auth_service import single_flight
+from yar.tests import yar_test_util
+
+
+class TestSingleFlight(yar_test_util.TestCase):
+    """A collection of unit tests for ```single_flight.SingleFlight```."""
+
+    def test_first_caller_does_lookup(self):
+        sf = single_flight.SingleFlight()
+        the_key = uuid.uuid4().hex
+        self.assertTrue(sf.join(the_key, lambda *args: None))
+        self.assertEqual(len(sf), 1)
+        self.assertEqual(sf.coalesced, 0)
+
+    def test_concurrent_callers_share_lookup(self):
+        sf = single_flight.SingleFlight()
+        the_key = uuid.uuid4().hex
+        results = []
+
+        def callback(is_ok, body):
+            results.append((is_ok, body))
+
+        self.assertTrue(sf.join(the_key, callback))
+        self.assertFalse(sf.join(the_key, callback))
+        self.assertFalse(sf.join(the_key, callback))
+        self.assertEqual(sf.coalesced, 2)
+
+        sf.complete(the_key, True, "dave")
+
+        self.assertEqual(results, [(True, "dave")] * 3)
+        self.assertEqual(len(sf), 0)
+
+        # once complete the next caller starts a new lookup
+        self.assertTrue(sf.join(the_key, callback))
+
+    def test_different_keys_do_not_share_lookups(self):
+        sf = single_flight.SingleFlight()
+        self.assertTrue(sf.join(uuid.uuid4().hex, lambda *args: None))
+        self.assertTrue(sf.join(uuid.uuid4().hex, lambda *args: None))
+        self.assertEqual(len(sf), 2)
+
+    def test_all_callbacks_called_when_one_raises(self):
+        sf = single_flight.SingleFlight()
+        the_key = uuid.uuid4().hex
+        results = []
+
+        def bad_callback(value):
+            raise ValueError(value)
+
+        def good_callback(value):
+            results.append(value)
+
+        sf.join(the_key, bad_callback)
+        sf.join(the_key, good_callback)
+
+        with self.assertRaises(ValueError):
+            sf.complete(the_key, "dave")
+
+        self.assertEqual(results, ["dave"])
+        self.assertEqual(len(sf), 0)
@@ -0,0 +1,60 @@
+"""This module contains functionality to async'ly create
+many sets of credentials with a single request to the key store."""
+
+import httplib
+import logging
+
+from async_creds_creator import generate_creds
+from ks_util import filter_out_non_model_creds_properties
+from ks_util import AsyncAction
+import key_store_cache
+
+_logger = logging.getLogger("KEYSERVICE.%s" % __name__)
+
+
+class AsyncBulkCredsCreator(AsyncAction):
+    """```AsyncBulkCredsCreator``` implements the async action
+    pattern for creating many sets of credentials with a single
+    bulk request to the key store."""
+
+    def create(self, creds_requests, callback):
+        """```creds_requests``` is a list of dicts each with a
+        "principal" and optionally an "auth_scheme" (see
+        ```AsyncCredsCreator.create()```). Once the credentials
+        have been saved to the key store ```callback``` is called
+        with a list containing, for each item in ```creds_requests```,
+        the newly created credentials or None if the credentials
+        couldn't be saved. If the key store couldn't be reached
+        ```callback``` is called with None."""
+
+        self._callback = callback
+
+        self._docs = [
+            generate_creds(cr["principal"], cr.get("auth_scheme", "basic"))
+            for cr in creds_requests
+        ]
+
+        self.backend.bulk(self._docs, self._on_bulk_done)
+
+    def _on_bulk_done(self, is_ok, code=None, body=None):
+        """Called when the key store backend's bulk() completes."""
+
+        if not is_ok or code != httplib.CREATED or body is None:
+            self._callback(None)
+            return
+
+        # bulk() answers with one result per doc - a successful
+        # result has a "rev" and a failed result has an "error"
+        saved_ids = set([result["id"] for result in body if "rev" in result])
+
+        cache = key_store_cache.key_store_cache()
+        creds = []
+        for doc in self._docs:
+            if doc["_id"] in saved_ids:
+                cache.invalidate_doc(doc)
+                creds.append(filter_out_non_model_creds_properties(doc))
+            else:
+                _logger.error("Key Store failed to save creds '%s'", doc["_id"])
+                creds.append(None)
+
+        self._callback(creds)
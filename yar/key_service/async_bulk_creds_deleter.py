@@ -0,0 +1,91 @@
+"""This module contains functionality to async'ly delete all
+of a principal's credentials with a single request to the key store."""
+
+import httplib
+import logging
+
+from async_creds_retriever import AsyncCredsRetriever
+from ks_util import AsyncAction
+import key_store_cache
+
+_logger = logging.getLogger("KEYSERVICE.%s" % __name__)
+
+
+def _key_from_doc(doc):
+    if "mac" in doc:
+        return doc["mac"]["mac_key_identifier"]
+    return doc["basic"]["api_key"]
+
+
+class AsyncBulkCredsDeleter(AsyncAction):
+    """```AsyncBulkCredsDeleter``` implements the async action
+    pattern for revoking all of a principal's credentials. The
+    principal's credentials are retrieved with ```AsyncCredsRetriever```
+    and then all deleted with a single bulk request to the
+    key store."""
+
+    def delete(self, principal, callback):
+        """Delete all of ```principal```'s credentials. Once done
+        ```callback``` is called with two lists - the keys of the
+        credentials which were deleted and the keys of the credentials
+        which couldn't be deleted. If an error occurs ```callback```
+        is called with (None, None)."""
+
+        self._principal = principal
+        self._callback = callback
+
+        # while the key store is being migrated a creds_v1.0 doc and
+        # the creds_v2.0 doc replacing it can both exist and both must
+        # be deleted or the creds_v1.0 doc's credentials still work
+        acr = AsyncCredsRetriever(self.key_store)
+        acr.fetch(
+            self._on_async_creds_retriever_done,
+            principal=principal,
+            is_include_migrated_v1_docs=True)
+
+    def _on_async_creds_retriever_done(self, creds, is_creds_collection):
+        if creds is None:
+            self._callback(None, None)
+            return
+
+        self._docs = [doc for doc in creds if not doc.get("_deleted", False)]
+        if not self._docs:
+            self._callback([], [])
+            return
+
+        docs = [
+            {"_id": doc["_id"], "_rev": doc["_rev"], "_deleted": True}
+            for doc in self._docs
+        ]
+        self.backend.bulk(docs, self._on_bulk_done)
+
+    def _on_bulk_done(self, is_ok, code=None, body=None):
+        """Called when the key store backend's bulk() completes."""
+
+        if not is_ok or code != httplib.CREATED or body is None:
+            self._callback(None, None)
+            return
+
+        deleted_ids = set([result["id"] for result in body if "rev" in result])
+
+        cache = key_store_cache.key_store_cache()
+        keys = []
+        not_deleted_keys = set()
+        for doc in self._docs:
+            key = _key_from_doc(doc)
+            if key not in keys:
+                keys.append(key)
+            if doc["_id"] in deleted_ids:
+                cache.invalidate_doc(doc)
+            else:
+                _logger.error(
+                    "Key Store failed to delete creds '%s' for principal '%s'",
+                    key,
+                    self._principal)
+                not_deleted_keys.add(key)
+
+        # a key with a creds_v1.0 and a creds_v2.0 doc is only
+        # deleted once both docs have been deleted
+        self._callback(
+            [key for key in keys if key not in not_deleted_keys],
+            [key for key in keys if key in not_deleted_keys])
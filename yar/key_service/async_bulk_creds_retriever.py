@@ -0,0 +1,138 @@
+"""This module contains functionality to async'ly retrieve
+many sets of credentials with as few requests to the key store
+as possible."""
+
+import httplib
+import logging
+
+from ks_util import filter_out_non_model_creds_properties
+from ks_util import AsyncAction
+import async_creds_retriever
+import key_store_cache
+
+_logger = logging.getLogger("KEYSERVICE.%s" % __name__)
+
+
+class AsyncBulkCredsRetriever(AsyncAction):
+    """```AsyncBulkCredsRetriever``` implements the async action
+    pattern for retrieving the credentials for many keys (api keys
+    and/or mac key identifiers). Credentials in the key store cache
+    are served from the cache, all other credentials are retrieved
+    with a single ```get_many()``` request to the key store and,
+    for keys not found that way and if
+    ```async_creds_retriever.v1_fallback``` is True, a single
+    ```by_identifier()``` request."""
+
+    def fetch(self, keys, callback, is_filter_out_non_model_properties=False, stale=None):
+        """Retrieve the credentials for each of ```keys``` and then
+        call ```callback``` with a dict mapping each key to its
+        credentials or None if the key has no credentials. If the
+        key store couldn't be reached ```callback``` is called
+        with None. Credentials are looked up by identifier with the
+        read consistency ```stale``` (see ```ks_util.view_path()```)."""
+
+        self._callback = callback
+        self._is_filter_out_non_model_properties = \
+            is_filter_out_non_model_properties
+        self._stale = stale
+        # keys looked for in a stale view aren't cached - see
+        # AsyncCredsRetriever._on_docs_from_key_store()
+        self._stale_view_keys = set()
+
+        cache = key_store_cache.key_store_cache()
+        self._cache_generation = cache.generation()
+
+        self._docs = {}
+        self._unresolved_keys = []
+        for key in keys:
+            if key in self._docs:
+                continue
+
+            if key.startswith("_"):
+                # see AsyncCredsRetriever.fetch()
+                self._docs[key] = None
+                continue
+
+            (is_hit, docs) = cache.get(key_store_cache.key_entry(key))
+            if is_hit:
+                self._docs[key] = docs[0] if docs else None
+            else:
+                self._unresolved_keys.append(key)
+
+        # every key requested from the key store is cached once
+        # resolved - including keys which turn out not to be found
+        self._keys_not_in_cache = self._unresolved_keys
+
+        if not self._unresolved_keys:
+            self._on_all_keys_resolved()
+            return
+
+        self.backend.get_many(self._unresolved_keys, self._on_get_many_done)
+
+    def _on_get_many_done(self, is_ok, code=None, body=None):
+        """Called when the key store backend is done
+        retrieving docs by _id."""
+
+        if not is_ok or httplib.OK != code or body is None:
+            self._callback(None)
+            return
+
+        for (key, doc) in body:
+            if doc.get("type", None) == "creds_v2.0":
+                self._on_doc_from_key_store(key, doc)
+
+        self._unresolved_keys = [key for key in self._unresolved_keys if key not in self._docs]
+        if not self._unresolved_keys or not async_creds_retriever.v1_fallback:
+            self._on_all_keys_resolved()
+            return
+
+        if self._stale not in [None, "strict"]:
+            self._stale_view_keys = set(self._unresolved_keys)
+
+        self.backend.by_identifier(
+            self._unresolved_keys,
+            self._on_by_identifier_done,
+            stale=self._stale)
+
+    def _on_by_identifier_done(self, is_ok, code=None, body=None):
+        """Called when the key store backend is done
+        retrieving docs by identifier."""
+
+        if not is_ok or httplib.OK != code or body is None:
+            self._callback(None)
+            return
+
+        for (key, doc) in body:
+            self._on_doc_from_key_store(key, doc)
+
+        self._on_all_keys_resolved()
+
+    def _on_doc_from_key_store(self, key, doc):
+        if key in self._docs:
+            # this is an error case with either the view or the
+            # data in the key store - we should never here.
+            _logger.error("Got multiple docs from Key Store for key '%s'", key)
+            return
+        self._docs[key] = doc
+
+    def _on_all_keys_resolved(self):
+        cache = key_store_cache.key_store_cache()
+        for key in self._keys_not_in_cache:
+            doc = self._docs.setdefault(key, None)
+            # see AsyncCredsRetriever._on_docs_from_key_store()
+            if self.is_response_from_primary and key not in self._stale_view_keys:
+                cache.put(
+                    key_store_cache.key_entry(key),
+                    [doc] if doc else [],
+                    self._cache_generation)
+
+        creds = {}
+        for (key, doc) in self._docs.iteritems():
+            if doc is not None:
+                if self._is_filter_out_non_model_properties:
+                    doc = filter_out_non_model_creds_properties(doc)
+                else:
+                    doc = dict(doc)
+            creds[key] = doc
+
+        self._callback(creds)
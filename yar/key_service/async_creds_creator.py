@@ -1,17 +1,68 @@
 """This module contains functionality to async'ly create
-credentials from the key store."""
+credentials from the key store.
+
+Each set of credentials is normally saved with its own PUT to the key
+store and every PUT pays for the key store's fsync. If ```batch_window```
+is greater than 0, creates which arrive within ```batch_window```
+milliseconds of each other are saved together with a single POST to
+the key store's _bulk_docs end-point (a group commit). A batch is saved
+early if it reaches ```max_batch_size``` creates. Each create's callback
+is still called with that create's credentials or None if they couldn't
+be saved."""
 
 import httplib
 import logging
 import uuid
 
+import tornado.ioloop
+
 from ks_util import filter_out_non_model_creds_properties
 from ks_util import AsyncAction
+import key_store_cache
 from yar.util import mac
 from yar.util import basic
 
 _logger = logging.getLogger("KEYSERVICE.%s" % __name__)
 
+"""Creates are collected for up to ```batch_window``` milliseconds
+and saved to the key store with a single request. A value of 0 turns
+batching off."""
+batch_window = 0
+
+"""A batch of creates is saved as soon as it contains
+```max_batch_size``` creates."""
+max_batch_size = 100
+
+
+def generate_creds(principal, auth_scheme):
+    """Generate and return a creds_v2.0 doc for ```principal```.
+    If ```auth_scheme``` equals 'mac' credentials for an MAC
+    authentication scheme are generated otherwise credentials
+    for basic authentication are generated."""
+
+    creds = {
+        "principal": principal,
+        "type": "creds_v2.0",
+    }
+    if auth_scheme == "mac":
+        key = mac.MACKeyIdentifier.generate()
+        creds["mac"] = {
+            "mac_key_identifier": key,
+            "mac_key": mac.MACKey.generate(),
+            "mac_algorithm": mac.MAC.algorithm,
+        }
+    else:
+        key = basic.APIKey.generate()
+        creds["basic"] = {
+            "api_key": key,
+        }
+
+    # creds_v2.0 docs use the mac key identifier or api key
+    # as the doc's _id so creds can be retrieved without a view
+    creds["_id"] = key
+
+    return creds
+
 
 class AsyncCredsCreator(AsyncAction):
     """```AsyncCredsCreator``` implements the async action
@@ -29,33 +80,98 @@ class AsyncCredsCreator(AsyncAction):
 
         self._callback = callback
 
-        self._creds = {
-            "principal": principal,
-            "type": "creds_v1.0",
-        }
-        if auth_scheme == "mac":
-            self._creds["mac"] = {
-                "mac_key_identifier": mac.MACKeyIdentifier.generate(),
-                "mac_key": mac.MACKey.generate(),
-                "mac_algorithm": mac.MAC.algorithm,
-            }
-        else:
-            self._creds["basic"] = {
-                "api_key": basic.APIKey.generate(),
-            }
+        self._creds = generate_creds(principal, auth_scheme)
 
-        self.async_req_to_key_store(
-            "",
-            "POST",
-            self._creds,
-            self._on_async_req_to_key_store_done)
+        if 0 < batch_window:
+            _add_to_batch(self.key_store, self._creds, self._on_saved)
+            return
 
-    def _on_async_req_to_key_store_done(self, is_ok, code=None, body=None):
-        """Called when async_req_to_key_store() completes."""
+        self.backend.put(self._creds, self._on_put_done)
 
-        if not is_ok or code != httplib.CREATED:
+    def _on_put_done(self, is_ok, code=None, body=None):
+        """Called when the key store backend's put() completes."""
+        self._on_saved(is_ok and code == httplib.CREATED)
+
+    def _on_saved(self, is_saved):
+        """Called with True once the creds have been saved to
+        the key store and otherwise False."""
+
+        if not is_saved:
             self._callback(None)
             return
 
+        # forget any cached "not found" for the creds now rather than
+        # waiting for the key store's _changes feed to report the create
+        key_store_cache.key_store_cache().invalidate_doc(self._creds)
+
         creds = filter_out_non_model_creds_properties(self._creds)
         self._callback(creds)
+
+
+class _CreateBatch(AsyncAction):
+    """A batch of creds docs to be saved to the key store with
+    a single bulk request - see ```KeyStoreBackend.bulk()```."""
+
+    def __init__(self, key_store):
+        AsyncAction.__init__(self, key_store)
+
+        self.docs = []
+        self.callbacks = []
+        self.timeout = None
+
+    def add(self, doc, callback):
+        """Add ```doc``` to the batch. Once the batch has been saved
+        ```callback``` is called with True if ```doc``` was saved
+        and otherwise False."""
+        self.docs.append(doc)
+        self.callbacks.append(callback)
+
+    def save(self):
+        self.backend.bulk(self.docs, self._on_bulk_done)
+
+    def _on_bulk_done(self, is_ok, code=None, body=None):
+        """Called when the key store backend's bulk() completes."""
+
+        if not is_ok or code != httplib.CREATED or body is None:
+            _logger.error("Key Store failed to save batch of %d creds", len(self.docs))
+            saved_ids = set()
+        else:
+            # see AsyncBulkCredsCreator._on_bulk_done()
+            saved_ids = set([result["id"] for result in body if "rev" in result])
+
+        # every create in the batch is waiting on its callback so
+        # one callback failing mustn't stop the others being called
+        for (doc, callback) in zip(self.docs, self.callbacks):
+            try:
+                callback(doc["_id"] in saved_ids)
+            except Exception:
+                _logger.exception("Create callback for creds '%s' failed", doc["_id"])
+
+
+"""```_batches``` maps a key store to the batch of creates
+waiting to be saved to the key store."""
+_batches = {}
+
+
+def _add_to_batch(key_store, doc, callback):
+    batch = _batches.get(key_store, None)
+    if batch is None:
+        batch = _CreateBatch(key_store)
+        _batches[key_store] = batch
+        io_loop = tornado.ioloop.IOLoop.current()
+        batch.timeout = io_loop.call_later(
+            batch_window / 1000.0,
+            _save_batch,
+            key_store)
+
+    batch.add(doc, callback)
+
+    if max_batch_size <= len(batch.docs):
+        tornado.ioloop.IOLoop.current().remove_timeout(batch.timeout)
+        _save_batch(key_store)
+
+
+def _save_batch(key_store):
+    batch = _batches.pop(key_store)
+    _logger.info("Saving batch of %d creds to Key Store", len(batch.docs))
+    batch.save()
@@ -1,22 +1,58 @@
 """This module contains functionality to async'ly delete
-credentials from the key store."""
+credentials from the key store.
+
+Credentials are deleted with a single DELETE of the credentials'
+doc which requires the doc's _id and _rev. If the caller knows
+the _rev (for example from an If-Match header) the DELETE is the
+only request made to the key store. If the caller has a list of
+acceptable _revs the doc is retrieved to find out which, if any,
+is the doc's current _rev. Otherwise the doc is first
+retrieved with ```AsyncCredsRetriever``` which is often answered
+by the key store cache."""
 
 import httplib
 import logging
 
 from async_creds_retriever import AsyncCredsRetriever
 from ks_util import AsyncAction
+import key_store_cache
 
 _logger = logging.getLogger("KEYSERVICE.%s" % __name__)
 
 
 class AsyncCredsDeleter(AsyncAction):
 
-    def delete(self, key, callback):
+    def delete(self, key, callback, revs=None):
+        """Delete the credentials identified by ```key```. If ```revs```
+        (a list of _revs) isn't None the credentials are only deleted
+        if their doc's _rev is one of ```revs```. ```callback``` is
+        called with True if the credentials were deleted, False if they
+        weren't found and None if an error occurred. A second argument
+        is passed to ```callback``` and is True if the credentials
+        weren't deleted because their _rev isn't one of ```revs```."""
+
+        self._key = key
+        self._revs = revs
         self._callback = callback
+        self._is_retry = False
+
+        if key.startswith("_"):
+            # see AsyncCredsRetriever.fetch()
+            self._callback(False)
+            return
 
+        if revs is None or len(revs) != 1:
+            self._fetch_creds()
+            return
+
+        # creds_v2.0 docs use the key as the doc's _id - see
+        # _on_delete_done() for other docs
+        self._creds = {"_id": key}
+        self._delete_doc(key, revs[0])
+
+    def _fetch_creds(self):
         acr = AsyncCredsRetriever(self.key_store)
-        acr.fetch(self._on_async_creds_retriever_done, key=key)
+        acr.fetch(self._on_async_creds_retriever_done, key=self._key)
 
     def _on_async_creds_retriever_done(self, creds, is_creds_collection):
         if creds is None:
@@ -29,13 +65,45 @@ class AsyncCredsDeleter(AsyncAction):
             self._callback(True)
             return
 
-        creds["_deleted"] = True
+        if self._revs is not None and creds["_rev"] not in self._revs:
+            self._callback(False, True)
+            return
+
+        self._creds = creds
+        self._delete_doc(creds["_id"], creds["_rev"])
+
+    def _delete_doc(self, doc_id, rev):
+        self.backend.delete(doc_id, rev, self._on_delete_done)
+
+    def _on_delete_done(self, is_ok, code=None, body=None):
+        if is_ok and code == httplib.OK:
+            # forget the creds now rather than waiting for the
+            # key store's _changes feed to report the delete
+            key_store_cache.key_store_cache().invalidate_doc(self._creds)
+            self._callback(True)
+            return
+
+        if is_ok and code == httplib.NOT_FOUND:
+            if "_rev" in self._creds:
+                # deleted since being retrieved
+                self._callback(False)
+            else:
+                # the key isn't a creds_v2.0 doc's _id - the retriever
+                # knows how to find other docs
+                self._fetch_creds()
+            return
+
+        if is_ok and code == httplib.CONFLICT:
+            if self._revs is not None:
+                self._callback(False, True)
+                return
 
-        self.async_req_to_key_store(
-            creds["_id"],
-            "PUT",
-            creds,
-            self._on_async_req_to_key_store_done)
+            if not self._is_retry:
+                # the _rev came from the key store cache which hasn't
+                # yet heard about a change to the creds - try once more
+                self._is_retry = True
+                key_store_cache.key_store_cache().invalidate_doc(self._creds)
+                self._fetch_creds()
+                return
 
-    def _on_async_req_to_key_store_done(self, is_ok, code=None, body=None):
-        self._callback(is_ok and code == httplib.OK)
+        self._callback(None)
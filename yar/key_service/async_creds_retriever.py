@@ -1,14 +1,48 @@
 """This module contains functionality to async'ly retrieve
-credentials from the key store."""
+credentials from the key store.
+
+creds_v2.0 docs use the api key or mac key identifier as the doc's
+_id so retrieving a single set of credentials is a GET of the doc.
+Key stores which haven't been migrated (see yar.key_store.migrations)
+still contain creds_v1.0 docs which can only be found using the
+by_identifier view - if ```v1_fallback``` is True and a doc isn't
+found the by_identifier view is queried."""
 
 import httplib
 import logging
 
 from ks_util import filter_out_non_model_creds_properties
 from ks_util import AsyncAction
+import key_store_cache
 
 _logger = logging.getLogger("KEYSERVICE.%s" % __name__)
 
+"""If ```v1_fallback``` is True credentials which can't be found
+by _id are looked for in the by_identifier view. Once a key store
+has been migrated to creds_v2.0 docs this can be set to False."""
+v1_fallback = True
+
+
+def _without_migrated_v1_docs(docs):
+    """While a key store is being migrated (see yar.key_store.migrations)
+    a creds_v1.0 doc and the creds_v2.0 doc which replaces it both exist
+    for a moment and both are in the principal's by_principal view rows.
+    Returns ```docs``` without the creds_v1.0 docs whose creds_v2.0 doc
+    (the doc whose _id is the creds_v1.0 doc's api key or mac key
+    identifier) is also in ```docs```."""
+    v2_ids = set([doc["_id"] for doc in docs if doc.get("type", None) == "creds_v2.0"])
+    if not v2_ids:
+        return docs
+
+    def is_migrated(doc):
+        if doc.get("type", None) != "creds_v1.0":
+            return False
+        if "basic" in doc:
+            return doc["basic"].get("api_key", None) in v2_ids
+        return doc.get("mac", {}).get("mac_key_identifier", None) in v2_ids
+
+    return [doc for doc in docs if not is_migrated(doc)]
+
 
 class AsyncCredsRetriever(AsyncAction):
 
@@ -16,39 +50,189 @@ class AsyncCredsRetriever(AsyncAction):
               callback,
               key=None,
               principal=None,
-              is_filter_out_non_model_properties=False):
+              is_filter_out_non_model_properties=False,
+              stale=None,
+              is_include_migrated_v1_docs=False):
+        """Retrieve the credentials identified by ```key``` or all
+        of ```principal```'s credentials. If the credentials have to
+        be found by querying a view the view is queried with the read
+        consistency ```stale``` (see ```ks_util.view_path()```).
+        A principal's creds_v1.0 docs which have already been migrated
+        are left out (see ```_without_migrated_v1_docs()```) unless
+        ```is_include_migrated_v1_docs``` is True."""
 
         self._key = key
         self._principal = principal
         self._callback = callback
         self._is_filter_out_non_model_properties = \
             is_filter_out_non_model_properties
+        self._is_include_migrated_v1_docs = is_include_migrated_v1_docs
+        self._stale = stale
+        self._is_stale_view_response = False
 
         if key:
-            fmt = '_design/by_identifier/_view/by_identifier?key="%s"'
-            path = fmt % key
+            self._cache_entry_name = key_store_cache.key_entry(key)
         else:
-            fmt = '_design/by_principal/_view/by_principal?key="%s"'
-            path = fmt % principal
+            self._cache_entry_name = key_store_cache.principal_entry(principal)
+
+        cache = key_store_cache.key_store_cache()
+        (is_hit, docs) = cache.get(self._cache_entry_name)
+        if is_hit:
+            self._on_docs(docs)
+            return
+        self._cache_generation = cache.generation()
+
+        if not key:
+            self._is_stale_view_response = self._stale not in [None, "strict"]
+            self.backend.by_principal(
+                principal,
+                self._on_by_principal_done,
+                stale=self._stale)
+            return
+
+        if key.startswith("_"):
+            # CouchDB reserves _ids which start with _ (_design/, _all_docs
+            # and friends) so ```key``` can't be the _id of a creds doc
+            self._on_docs_from_key_store([])
+            return
+
+        self.backend.get(key, self._on_get_done)
+
+    def fetch_page(self,
+                   callback,
+                   principal,
+                   limit,
+                   start=None,
+                   is_filter_out_non_model_properties=False,
+                   stale=None):
+        """Retrieve at most ```limit``` of ```principal```'s credentials
+        starting with the credentials whose doc _id is ```start```
+        (or the first of ```principal```'s credentials if ```start```
+        is None). Once retrieved, ```callback``` is called with a list
+        of credentials and the ```start``` of the next page or None if
+        this is the last page. If an error occurs ```callback``` is
+        called with (None, None).
+
+        Pages are read directly from the by_principal view (ie. the
+        key store cache is bypassed) so that no matter how many
+        credentials a principal has only one page of them is in
+        memory at a time. Rows with the same key are ordered by
+        doc _id which is what makes the doc _id a stable cursor.
+        The view is queried with the read consistency ```stale```."""
+
+        self._callback = callback
+        self._limit = limit
+        self._is_filter_out_non_model_properties = \
+            is_filter_out_non_model_properties
+
+        self.backend.by_principal(
+            principal,
+            self._on_page_done,
+            stale=stale,
+            # one extra doc to find out if there's a next page
+            limit=limit + 1,
+            start=start)
+
+    def _on_page_done(self, is_ok, code=None, body=None):
+        """Called when the key store backend is done
+        reading a page of the principal's docs."""
+
+        if not is_ok or httplib.OK != code or body is None:
+            self._callback(None, None)
+            return
+
+        docs = body
+        next_start = None
+        if self._limit < len(docs):
+            next_start = docs[self._limit]["_id"]
+            docs = docs[:self._limit]
+        # a creds_v1.0 doc and its creds_v2.0 doc can be on different
+        # pages so this only catches duplicates within a page - good
+        # enough for the moment during which both docs exist
+        docs = _without_migrated_v1_docs(docs)
 
-        self.async_req_to_key_store(
-            path,
-            "GET",
-            None,
-            self._on_async_req_to_key_store_done)
+        creds = []
+        for doc in docs:
+            if self._is_filter_out_non_model_properties:
+                doc = filter_out_non_model_creds_properties(doc)
+            creds.append(doc)
+
+        self._callback(creds, next_start)
+
+    def _on_get_done(self, is_ok, code=None, body=None):
+        """Called when the key store backend is done
+        retrieving a doc by _id."""
+
+        if is_ok and httplib.NOT_FOUND == code:
+            if v1_fallback:
+                self._is_stale_view_response = self._stale not in [None, "strict"]
+                self.backend.by_identifier(
+                    [self._key],
+                    self._on_by_identifier_done,
+                    stale=self._stale)
+            else:
+                self._on_docs_from_key_store([])
+            return
+
+        if not is_ok or httplib.OK != code or body is None:
+            self._callback(None, None)
+            return
 
-    def _on_async_req_to_key_store_done(self, is_ok, code=None, body=None):
-        """Called when async_req_to_key_store() is done."""
+        is_creds_doc = \
+            body.get("type", None) == "creds_v2.0" and \
+            body.get("_id", None) == self._key
+        self._on_docs_from_key_store([body] if is_creds_doc else [])
+
+    def _on_by_principal_done(self, is_ok, code=None, body=None):
+        """Called when the key store backend is done
+        retrieving all of a principal's docs."""
+
+        if not is_ok or httplib.OK != code or body is None:
+            self._callback(None, None)
+            return
+
+        self._on_docs_from_key_store(body)
+
+    def _on_by_identifier_done(self, is_ok, code=None, body=None):
+        """Called when the key store backend is done
+        retrieving docs by identifier."""
 
         if not is_ok or httplib.OK != code or body is None:
             self._callback(None, None)
             return
 
+        self._on_docs_from_key_store([doc for (identifier, doc) in body])
+
+    def _on_docs_from_key_store(self, docs):
+        # a replica or a stale view may not yet know about the latest
+        # changes reported by the _changes feed so only cache what
+        # the primary says without a stale view
+        is_cacheable = \
+            self.is_response_from_primary and \
+            not self._is_stale_view_response
+        if is_cacheable and (not self._key or len(docs) <= 1):
+            key_store_cache.key_store_cache().put(
+                self._cache_entry_name,
+                docs,
+                self._cache_generation)
+
+        self._on_docs(docs)
+
+    def _on_docs(self, docs):
+        """Called with the key store docs found for the key or principal
+        either by querying the key store or from the key store cache.
+        Docs are copied so callers are free to change them without
+        changing the cached docs."""
+
+        if not self._key and not self._is_include_migrated_v1_docs:
+            docs = _without_migrated_v1_docs(docs)
+
         creds = []
-        for row in body.get("rows", []):
-            doc = row.get("value", {})
+        for doc in docs:
             if self._is_filter_out_non_model_properties:
                 doc = filter_out_non_model_creds_properties(doc)
+            else:
+                doc = dict(doc)
             creds.append(doc)
 
         if self._key:
@@ -56,6 +56,184 @@ class CommandLineParser(optparse.OptionParser):
             type="couchdb",
             help=help)
 
+        default = None
+        fmt = (
+            "key store replicas - "
+            "host:port/database, ... host:port/database"
+            " - default = %s"
+        )
+        help = fmt % default
+        self.add_option(
+            "--keystorereplicas",
+            action="store",
+            dest="key_store_replicas",
+            default=default,
+            type="couchdbs",
+            help=help)
+
+        default = "couchdb"
+        help = "key store backend [couchdb,local] - default = %s" % default
+        self.add_option(
+            "--keystorebackend",
+            action="store",
+            dest="key_store_backend",
+            default=default,
+            type="choice",
+            choices=["couchdb", "local"],
+            help=help)
+
+        default = "creds.yks"
+        help = "local key store file - default = %s" % default
+        self.add_option(
+            "--localkeystore",
+            action="store",
+            dest="local_key_store",
+            default=default,
+            type="string",
+            help=help)
+
+        default = 1
+        help = "# of worker processes (0 = # of cores) - default = %d" % default
+        self.add_option(
+            "--processes",
+            action="store",
+            dest="processes",
+            default=default,
+            type=int,
+            help=help)
+
+        default = False
+        help = "workers use SO_REUSEPORT listening sockets - default = %s" % default
+        self.add_option(
+            "--reuseport",
+            action="store",
+            dest="reuse_port",
+            default=default,
+            type="boolean",
+            help=help)
+
+        default = 10
+        help = "max concurrent requests per upstream - default = %d" % default
+        self.add_option(
+            "--upstreammaxclients",
+            action="store",
+            dest="upstream_max_clients",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 0
+        help = "max requests queued per upstream (0 = unbounded) - default = %d" % default
+        self.add_option(
+            "--upstreammaxqueuesize",
+            action="store",
+            dest="upstream_max_queue_size",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 0
+        help = "connections pre-warmed per upstream - default = %d" % default
+        self.add_option(
+            "--upstreamprewarm",
+            action="store",
+            dest="upstream_prewarm_connections",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 0
+        help = "seconds between upstream stats logging (0 = off) - default = %d" % default
+        self.add_option(
+            "--upstreamstatsinterval",
+            action="store",
+            dest="upstream_stats_interval",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 10000
+        help = "key store cache size (0 = no cache) - default = %d" % default
+        self.add_option(
+            "--keystorecachesize",
+            action="store",
+            dest="key_store_cache_size",
+            default=default,
+            type=int,
+            help=help)
+
+        default = True
+        help = "look for creds_v1.0 docs in key store - default = %s" % default
+        self.add_option(
+            "--keystorev1fallback",
+            action="store",
+            dest="key_store_v1_fallback",
+            default=default,
+            type="boolean",
+            help=help)
+
+        default = 0
+        help = "ms to collect creates before saving as a batch (0 = off) - default = %d" % default
+        self.add_option(
+            "--createbatchwindow",
+            action="store",
+            dest="create_batch_window",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 100
+        help = "max # creates saved in one batch - default = %d" % default
+        self.add_option(
+            "--createbatchsize",
+            action="store",
+            dest="create_batch_size",
+            default=default,
+            type=int,
+            help=help)
+
+        default = "update_after"
+        help = "read consistency of lookups by key [strict,ok,update_after] - default = %s" % default
+        self.add_option(
+            "--keylookupstale",
+            action="store",
+            dest="key_lookup_stale",
+            default=default,
+            type="choice",
+            choices=["strict", "ok", "update_after"],
+            help=help)
+
+        default = "strict"
+        help = "read consistency of lookups by principal [strict,ok,update_after] - default = %s" % default
+        self.add_option(
+            "--principallookupstale",
+            action="store",
+            dest="principal_lookup_stale",
+            default=default,
+            type="choice",
+            choices=["strict", "ok", "update_after"],
+            help=help)
+
+        default = 5
+        help = "seconds between key store view refreshes (0 = off) - default = %d" % default
+        self.add_option(
+            "--viewrefreshinterval",
+            action="store",
+            dest="view_refresh_interval",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 30
+        help = "Cache-Control max-age of creds responses - default = %d" % default
+        self.add_option(
+            "--cachemaxage",
+            action="store",
+            dest="cache_max_age",
+            default=default,
+            type=int,
+            help=help)
+
         default = None
         help = "syslog unix domain socket - default = %s" % default
         self.add_option(
@@ -26,6 +26,52 @@ create_creds_request = {
 }
 
 
+"""```max_bulk_size``` is the maximum number of sets of credentials
+which can be created or retrieved with a single bulk request."""
+max_bulk_size = 1000
+
+
+"""```bulk_create_creds_request``` is a JSON schema used to validate
+bulk create credentials requests to the key service."""
+bulk_create_creds_request = {
+    "type": "object",
+    "properties": {
+        "creds": {
+            "type": "array",
+            "items": create_creds_request,
+            "minItems": 1,
+            "maxItems": max_bulk_size,
+        },
+    },
+    "required": [
+        "creds",
+    ],
+    "additionalProperties": False,
+}
+
+
+"""```bulk_get_creds_request``` is a JSON schema used to validate
+bulk get credentials requests to the key service."""
+bulk_get_creds_request = {
+    "type": "object",
+    "properties": {
+        "keys": {
+            "type": "array",
+            "items": {
+                "type": "string",
+                "minLength": 1,
+            },
+            "minItems": 1,
+            "maxItems": max_bulk_size,
+        },
+    },
+    "required": [
+        "keys",
+    ],
+    "additionalProperties": False,
+}
+
+
 """```get_creds_response``` is a JSON schema used to validate
 the key service's response to get creds request."""
 get_creds_response = {
@@ -2,14 +2,20 @@
 Tornado request handler logic."""
 
 import urllib
+import hashlib
 import httplib
+import json
 import logging
 
 import tornado.web
 
+from async_bulk_creds_creator import AsyncBulkCredsCreator
+from async_bulk_creds_deleter import AsyncBulkCredsDeleter
+from async_bulk_creds_retriever import AsyncBulkCredsRetriever
 from async_creds_creator import AsyncCredsCreator
 from async_creds_retriever import AsyncCredsRetriever
 from async_creds_deleter import AsyncCredsDeleter
+from ks_util import filter_out_non_model_creds_properties
 from yar.key_service import jsonschemas
 from yar.util import trhutil
 
@@ -24,9 +30,83 @@ to describe the URLs that ```RequestHandler``` can
 correctly service."""
 url_spec = r"/v1.0/creds(?:/([^/]+))?"
 
+"""POSTs to these resources in the creds collection create or
+retrieve many sets of credentials in a single request. No key
+starts with an underscore so these names can't collide with
+the resource of a specific set of credentials."""
+_bulk_create = "_bulk_create"
+_bulk_get = "_bulk_get"
+
+"""Responses to requests for credentials tell caches the credentials
+can be reused for ```cache_max_age``` seconds. After that caches are
+expected to revalidate using the response's ETag. Credentials contain
+secrets so responses are marked private - only the client (the auth
+service's creds cache) may cache them, never a shared cache."""
+cache_max_age = 30
+
+"""Read consistency (see ```ks_util.view_path()```) of the view
+queries made to retrieve credentials by key - these are the lookups
+made by the auth service on its request path so by default they never
+wait for the key store to index recent writes. Credentials are almost
+always found without a view (see ```async_creds_retriever.v1_fallback```)."""
+key_lookup_stale = "update_after"
+
+"""Read consistency (see ```ks_util.view_path()```) of the view
+queries made to retrieve a principal's credentials. These are
+administrative reads so by default they always reflect recent writes."""
+principal_lookup_stale = "strict"
+
+"""A page of a principal's credentials (see the limit query
+string parameter) contains at most ```max_page_size``` credentials."""
+max_page_size = 1000
+
+"""When a principal's credentials are streamed (see the stream query
+string parameter) they're read from the key store, and written to
+the client, ```stream_page_size``` credentials at a time."""
+stream_page_size = 500
+
+
+def _etag(creds, is_creds_collection):
+    """Returns an ETag for ```creds``` derived from the _rev of the
+    creds' docs or None if the _revs aren't known. A doc's _rev changes
+    every time the doc changes so the ETag of a collection is a digest
+    of the _id and _rev of each doc in the collection."""
+    if not is_creds_collection:
+        rev = creds.get("_rev", None)
+        return None if rev is None else '"%s"' % rev
+
+    digest = hashlib.sha1()
+    for each_creds in creds:
+        rev = each_creds.get("_rev", None)
+        if rev is None:
+            return None
+        digest.update("%s/%s\n" % (each_creds.get("_id", ""), rev))
+    return '"%s"' % digest.hexdigest()
+
+
+def _revs_from_if_match(if_match):
+    """Returns the list of _revs in the value of an If-Match header -
+    a comma separated list of (optionally weak) ETags (see ```_etag()```)
+    or * - or None if the header doesn't restrict the _rev (it's *
+    or contains no ETags)."""
+    revs = []
+    for etag in if_match.split(","):
+        etag = etag.strip()
+        if etag == "*":
+            return None
+        if etag.startswith("W/"):
+            etag = etag[len("W/"):]
+        if 2 <= len(etag) and etag.startswith('"') and etag.endswith('"'):
+            etag = etag[1:-1]
+        if etag:
+            revs.append(etag)
+    return revs or None
+
 
 class RequestHandler(trhutil.RequestHandler):
 
+    _is_client_disconnected = False
+
     @tornado.web.asynchronous
     def get(self, key=None):
         principal = self.get_argument("principal", None)
@@ -41,12 +121,24 @@ class RequestHandler(trhutil.RequestHandler):
             self.finish()
             return
 
+        if principal and self.get_argument("stream", None) == "true":
+            self._stream_creds(principal)
+            return
+
+        limit = self.get_argument("limit", None)
+        if principal and limit is not None:
+            self._get_page_of_creds(principal, limit)
+            return
+
+        # non-model properties are filtered out after the ETag
+        # has been derived from the docs' _revs
         acr = AsyncCredsRetriever(_key_store)
         acr.fetch(
             self._on_async_creds_retrieve_done,
             key=key,
             principal=principal,
-            is_filter_out_non_model_properties=True)
+            is_filter_out_non_model_properties=False,
+            stale=key_lookup_stale if key else principal_lookup_stale)
 
     def _on_async_creds_retrieve_done(self, creds, is_creds_collection):
         if creds is None:
@@ -54,18 +146,147 @@ class RequestHandler(trhutil.RequestHandler):
             self.finish()
             return
 
+        etag = _etag(creds, is_creds_collection)
+        if etag is not None:
+            self.set_header("Etag", etag)
+            self.set_header("Cache-Control", "private, max-age=%d" % cache_max_age)
+            if self.check_etag_header():
+                # the client already has these creds so there's no
+                # need to add links to the creds or serialize them
+                self.set_status(httplib.NOT_MODIFIED)
+                self.finish()
+                return
+
         if is_creds_collection:
+            creds = [filter_out_non_model_creds_properties(each_creds) for each_creds in creds]
             for each_creds in creds:
                 self._add_links_to_creds_dict(each_creds)
             creds = {"creds": creds}
         else:
+            creds = filter_out_non_model_creds_properties(creds)
             location = self._add_links_to_creds_dict(creds)
             self.set_header("Location", location)
         self.write(creds)
         self.finish()
 
+    def _get_page_of_creds(self, principal, limit):
+        """Respond with a page of ```principal```'s credentials. If
+        there are more credentials the response includes a link
+        to the next page."""
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit < 1 or max_page_size < limit:
+            self.set_status(httplib.BAD_REQUEST)
+            self.finish()
+            return
+
+        self._principal = principal
+        self._limit = limit
+
+        acr = AsyncCredsRetriever(_key_store)
+        acr.fetch_page(
+            self._on_async_creds_retrieve_page_done,
+            principal,
+            limit,
+            start=self.get_argument("start", None),
+            is_filter_out_non_model_properties=True,
+            stale=principal_lookup_stale)
+
+    def _on_async_creds_retrieve_page_done(self, creds, next_start):
+        if creds is None:
+            self.set_status(httplib.INTERNAL_SERVER_ERROR)
+            self.finish()
+            return
+
+        for each_creds in creds:
+            self._add_links_to_creds_dict(each_creds)
+        body = {"creds": creds}
+
+        if next_start is not None:
+            (url, _) = urllib.splitquery(self.request.full_url())
+            query_string_args = [
+                ("principal", self._principal),
+                ("limit", self._limit),
+                ("start", next_start),
+            ]
+            next_href = "%s?%s" % (url, urllib.urlencode(query_string_args))
+            body["links"] = {"next": {"href": next_href}}
+
+        self.write(body)
+        self.finish()
+
+    def _stream_creds(self, principal):
+        """Respond with all of ```principal```'s credentials using
+        a chunked response. The credentials are read from the key
+        store one page at a time and each page is written to the
+        client before the next page is read so memory use doesn't
+        grow with the number of credentials."""
+        self._principal = principal
+        self._is_first_streamed_creds = True
+        self._is_client_disconnected = False
+
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.write('{"creds": [')
+        self._stream_next_page_of_creds(None)
+
+    def _stream_next_page_of_creds(self, start):
+        if self._is_client_disconnected:
+            return
+
+        acr = AsyncCredsRetriever(_key_store)
+        acr.fetch_page(
+            self._on_async_creds_retrieve_streamed_page_done,
+            self._principal,
+            stream_page_size,
+            start=start,
+            is_filter_out_non_model_properties=True,
+            stale=principal_lookup_stale)
+
+    def _on_async_creds_retrieve_streamed_page_done(self, creds, next_start):
+        if self._is_client_disconnected:
+            return
+
+        if creds is None:
+            # the status and first part of the body have already been
+            # sent so the only way to tell the client the response is
+            # incomplete is to cut it short by closing the connection
+            _logger.error("Error streaming creds for principal '%s'", self._principal)
+            self.request.connection.close()
+            return
+
+        chunks = []
+        for each_creds in creds:
+            self._add_links_to_creds_dict(each_creds)
+            if not self._is_first_streamed_creds:
+                chunks.append(",")
+            self._is_first_streamed_creds = False
+            chunks.append(json.dumps(each_creds))
+
+        if next_start is None:
+            chunks.append("]}")
+            self.write("".join(chunks))
+            self.finish()
+            return
+
+        self.write("".join(chunks))
+        self.flush(callback=lambda: self._stream_next_page_of_creds(next_start))
+
+    def on_connection_close(self):
+        trhutil.RequestHandler.on_connection_close(self)
+        self._is_client_disconnected = True
+
     @tornado.web.asynchronous
     def post(self, key=None):
+        if key == _bulk_create:
+            self._bulk_create()
+            return
+
+        if key == _bulk_get:
+            self._bulk_get()
+            return
+
         if key is not None:
             self.set_status(httplib.METHOD_NOT_ALLOWED)
             self.finish()
@@ -97,29 +318,135 @@ class RequestHandler(trhutil.RequestHandler):
         self.set_status(httplib.CREATED)
         self.finish()
 
+    def _bulk_create(self):
+        body = self.get_json_request_body(
+            None,
+            jsonschemas.bulk_create_creds_request)
+        if not body:
+            self.set_status(httplib.BAD_REQUEST)
+            self.finish()
+            return
+
+        abcc = AsyncBulkCredsCreator(_key_store)
+        abcc.create(
+            body["creds"],
+            self._on_async_bulk_creds_create_done)
+
+    def _on_async_bulk_creds_create_done(self, creds):
+        if creds is None:
+            self.set_status(httplib.INTERNAL_SERVER_ERROR)
+            self.finish()
+            return
+
+        # items are reported in the order they were requested with
+        # credentials which couldn't be saved reported as errors
+        # rather than failing the whole request
+        collection_url = self._collection_url()
+        for i in range(len(creds)):
+            if creds[i] is None:
+                creds[i] = {"error": "not_saved"}
+            else:
+                self._add_links_to_creds_dict(creds[i], collection_url)
+
+        self.write({"creds": creds})
+        self.set_status(httplib.CREATED)
+        self.finish()
+
+    def _bulk_get(self):
+        body = self.get_json_request_body(
+            None,
+            jsonschemas.bulk_get_creds_request)
+        if not body:
+            self.set_status(httplib.BAD_REQUEST)
+            self.finish()
+            return
+
+        self._bulk_get_keys = body["keys"]
+
+        abcr = AsyncBulkCredsRetriever(_key_store)
+        abcr.fetch(
+            self._bulk_get_keys,
+            self._on_async_bulk_creds_retrieve_done,
+            is_filter_out_non_model_properties=True,
+            stale=key_lookup_stale)
+
+    def _on_async_bulk_creds_retrieve_done(self, creds_by_key):
+        if creds_by_key is None:
+            self.set_status(httplib.INTERNAL_SERVER_ERROR)
+            self.finish()
+            return
+
+        collection_url = self._collection_url()
+        creds = []
+        not_found = []
+        for key in self._bulk_get_keys:
+            each_creds = creds_by_key.get(key, None)
+            if each_creds is None:
+                not_found.append(key)
+            else:
+                self._add_links_to_creds_dict(each_creds, collection_url)
+                creds.append(each_creds)
+
+        self.write({"creds": creds, "not_found": not_found})
+        self.finish()
+
     @tornado.web.asynchronous
     def delete(self, key=None):
         if key is None:
-            self.set_status(httplib.METHOD_NOT_ALLOWED)
-            self.finish()
+            principal = self.get_argument("principal", None)
+            if not principal:
+                self.set_status(httplib.METHOD_NOT_ALLOWED)
+                self.finish()
+                return
+
+            abcd = AsyncBulkCredsDeleter(_key_store)
+            abcd.delete(
+                principal,
+                self._on_async_bulk_creds_delete_done)
             return
 
+        # an If-Match header is expected to contain the ETag (the
+        # quoted _rev of the creds' doc) of the creds to delete and
+        # saves the key service from retrieving the creds' doc
+        if_match = self.request.headers.get("If-Match", None)
+        revs = None if if_match is None else _revs_from_if_match(if_match)
+
         acd = AsyncCredsDeleter(_key_store)
         acd.delete(
             key,
-            self._on_async_creds_delete_done)
+            self._on_async_creds_delete_done,
+            revs=revs)
 
-    def _on_async_creds_delete_done(self, isok):
+    def _on_async_creds_delete_done(self, isok, is_rev_mismatch=False):
         if isok is None:
             status = httplib.INTERNAL_SERVER_ERROR
+        elif is_rev_mismatch:
+            status = httplib.PRECONDITION_FAILED
         else:
             status = httplib.OK if isok else httplib.NOT_FOUND
 
         self.set_status(status)
         self.finish()
 
-    def _add_links_to_creds_dict(self, creds):
-        """Add HATEOAS style links to ```creds```."""
+    def _on_async_bulk_creds_delete_done(self, deleted_keys, not_deleted_keys):
+        if deleted_keys is None:
+            self.set_status(httplib.INTERNAL_SERVER_ERROR)
+            self.finish()
+            return
+
+        self.write({"deleted": deleted_keys, "not_deleted": not_deleted_keys})
+        self.finish()
+
+    def _collection_url(self):
+        """Returns the URL of the creds collection resource for
+        requests made to one of the collection's bulk resources."""
+        (url, _) = urllib.splitquery(self.request.full_url())
+        return url.rsplit("/", 1)[0]
+
+    def _add_links_to_creds_dict(self, creds, collection_url=None):
+        """Add HATEOAS style links to ```creds```. If ```collection_url```
+        isn't None the links are relative to ```collection_url```
+        rather than the request's URL."""
 
         key = self._key_from_creds(creds)
 
@@ -131,8 +458,11 @@ class RequestHandler(trhutil.RequestHandler):
         # essential to understand these request patterns in
         # order to understand this method's code."""
 
-        (url, _) = urllib.splitquery(self.request.full_url())
-        location = url if url.endswith(key) else "%s/%s" % (url, key)
+        if collection_url is not None:
+            location = "%s/%s" % (collection_url, key)
+        else:
+            (url, _) = urllib.splitquery(self.request.full_url())
+            location = url if url.endswith(key) else "%s/%s" % (url, key)
 
         creds["links"] = {"self": {"href": location}}
         return location
@@ -0,0 +1,252 @@
+"""This module defines the interface between the key service's async
+actions (see ks_util) and the key store. ```KeyStoreBackend``` is the
+interface and there are two implementations:
+
+    CouchDBKeyStoreBackend - the CouchDB database (or cluster - see
+    key_store_cluster) identified by an ```AsyncAction```'s key_store
+    LocalKeyStoreBackend - an embedded key store in a local
+    file (see local_key_store)
+
+Every operation is async. Once an operation is done its ```callback```
+is called with ```is_ok``` (False if the key store couldn't answer)
+and, if ```is_ok``` is True, ```code``` (the HTTP status code which
+best describes the answer) and ```body``` (the answer):
+
+    get() - OK and the doc or NOT_FOUND
+    get_many() - OK and a list of (doc _id, doc) tuples
+    put() - CREATED and {"id": ..., "rev": ...} or CONFLICT
+    delete() - OK and {"id": ..., "rev": ...}, NOT_FOUND or CONFLICT
+    bulk() - CREATED and a list of results - one per doc - each
+    either {"id": ..., "rev": ...} or {"id": ..., "error": ...}
+    by_principal() - OK and a list of docs ordered by doc _id
+    by_identifier() - OK and a list of (identifier, doc) tuples
+
+Async actions get their backend from ```ks_util.AsyncAction.backend```."""
+
+import httplib
+import json
+import logging
+import time
+import urllib
+
+import ks_util
+import local_key_store
+
+_logger = logging.getLogger("KEYSERVICE.%s" % __name__)
+
+
+class KeyStoreBackend(object):
+    """The interface every key store backend implements."""
+
+    def get(self, doc_id, callback):
+        """Retrieve the doc whose _id is ```doc_id```."""
+        raise NotImplementedError()
+
+    def get_many(self, doc_ids, callback):
+        """Retrieve the docs whose _ids are ```doc_ids```. Only
+        ```doc_ids``` which are the _id of a doc are answered."""
+        raise NotImplementedError()
+
+    def put(self, doc, callback):
+        """Create ```doc``` whose _id is ```doc["_id"]```. If a doc
+        with the same _id already exists the answer is CONFLICT."""
+        raise NotImplementedError()
+
+    def delete(self, doc_id, rev, callback):
+        """Delete the doc whose _id is ```doc_id``` if and only if
+        the doc's _rev is ```rev```."""
+        raise NotImplementedError()
+
+    def bulk(self, docs, callback):
+        """Create, update or (if a doc's _deleted is True)
+        delete ```docs``` with a single request."""
+        raise NotImplementedError()
+
+    def by_principal(self, principal, callback, stale=None, limit=None, start=None):
+        """Retrieve ```principal```'s docs. If ```start``` isn't None
+        the docs start with the doc whose _id is ```start``` and if
+        ```limit``` isn't None at most ```limit``` docs are retrieved.
+        ```stale``` is the read consistency (see ```ks_util.view_path()```)
+        for backends which index docs asynchronously."""
+        raise NotImplementedError()
+
+    def by_identifier(self, identifiers, callback, stale=None):
+        """Retrieve the docs for each of ```identifiers``` (api keys
+        or mac key identifiers) including creds_v1.0 docs whose _id
+        isn't their identifier. An identifier can have more than one
+        doc if the key store's data is broken."""
+        raise NotImplementedError()
+
+
+class CouchDBKeyStoreBackend(KeyStoreBackend):
+    """Implements ```KeyStoreBackend``` using CouchDB's document API.
+    Requests are made with ```async_action```'s
+    ```async_req_to_key_store()``` which knows about key
+    store clusters and failing over reads."""
+
+    def __init__(self, async_action):
+        KeyStoreBackend.__init__(self)
+        self._async_action = async_action
+
+    def _req(self, path, method, body, callback, answer=None):
+        """Make a ```method``` request for ```path``` and if the key
+        store answers with an OK body call ```answer``` with the body
+        to convert CouchDB's answer to the interface's answer."""
+
+        def on_done(is_ok, code=None, body=None):
+            if is_ok and code == httplib.OK and answer is not None and body is not None:
+                body = answer(body)
+            callback(is_ok, code, body)
+
+        self._async_action.async_req_to_key_store(path, method, body, on_done)
+
+    def get(self, doc_id, callback):
+        self._req(urllib.quote(doc_id, safe=""), "GET", None, callback)
+
+    def get_many(self, doc_ids, callback):
+        self._req(
+            "_all_docs?include_docs=true",
+            "POST",
+            {"keys": doc_ids},
+            callback,
+            _rows_to_keys_and_docs)
+
+    def put(self, doc, callback):
+        doc = dict(doc)
+        doc_id = doc.pop("_id")
+        self._req(urllib.quote(doc_id, safe=""), "PUT", doc, callback)
+
+    def delete(self, doc_id, rev, callback):
+        path = "%s?%s" % (
+            urllib.quote(doc_id, safe=""),
+            urllib.urlencode({"rev": rev}))
+        self._req(path, "DELETE", None, callback)
+
+    def bulk(self, docs, callback):
+        self._req("_bulk_docs", "POST", {"docs": docs}, callback)
+
+    def by_principal(self, principal, callback, stale=None, limit=None, start=None):
+        json_principal = json.dumps(principal)
+        if limit is None and start is None:
+            query_string_args = [
+                ("key", json_principal),
+                ("include_docs", "true"),
+            ]
+        else:
+            query_string_args = [
+                ("startkey", json_principal),
+                ("endkey", json_principal),
+                ("include_docs", "true"),
+            ]
+            if limit is not None:
+                query_string_args.append(("limit", limit))
+            if start is not None:
+                query_string_args.append(("startkey_docid", start))
+        path = "_design/by_principal/_view/by_principal?%s" % urllib.urlencode(query_string_args)
+
+        self._req(
+            ks_util.view_path(path, stale),
+            "GET",
+            None,
+            callback,
+            _rows_to_docs)
+
+    def by_identifier(self, identifiers, callback, stale=None):
+        self._req(
+            ks_util.view_path("_design/by_identifier/_view/by_identifier?include_docs=true", stale),
+            "POST",
+            {"keys": identifiers},
+            callback,
+            _rows_to_keys_and_docs)
+
+
+def _rows_to_docs(body):
+    return [row["doc"] for row in body.get("rows", []) if row.get("doc", None)]
+
+
+def _rows_to_keys_and_docs(body):
+    return [
+        (row.get("key", None), row["doc"])
+        for row in body.get("rows", [])
+        if row.get("doc", None)
+    ]
+
+
+class LocalKeyStoreBackend(KeyStoreBackend):
+    """Implements ```KeyStoreBackend``` using the process wide
+    ```local_key_store.LocalKeyStore```. The local key store answers
+    synchronously so callbacks are called before methods return.
+    The local key store indexes docs as they're saved so ```stale```
+    is ignored."""
+
+    def _call(self, name, callback, func, *args):
+        start_time = time.time()
+        try:
+            rv = func(*args)
+        except EnvironmentError as ex:
+            _logger.error(
+                "Local Key Store '%s' failed %s - %s",
+                local_key_store.path,
+                name,
+                ex)
+            callback(False)
+            return
+        _logger.info(
+            "Local Key Store (%s) responded in %d us",
+            name,
+            int((time.time() - start_time) * 1000000))
+        callback(True, *rv)
+
+    def get(self, doc_id, callback):
+        def get():
+            doc = local_key_store.key_store().get(doc_id)
+            if doc is None:
+                return (httplib.NOT_FOUND, None)
+            return (httplib.OK, doc)
+
+        self._call("get", callback, get)
+
+    def get_many(self, doc_ids, callback):
+        def get_many():
+            return (httplib.OK, local_key_store.key_store().get_many(doc_ids))
+
+        self._call("get_many", callback, get_many)
+
+    def put(self, doc, callback):
+        def put():
+            result = local_key_store.key_store().save([dict(doc)])[0]
+            if "error" in result:
+                return (httplib.CONFLICT, None)
+            return (httplib.CREATED, result)
+
+        self._call("put", callback, put)
+
+    def delete(self, doc_id, rev, callback):
+        def delete():
+            key_store = local_key_store.key_store()
+            if key_store.get(doc_id) is None:
+                return (httplib.NOT_FOUND, None)
+            result = key_store.save([{"_id": doc_id, "_rev": rev, "_deleted": True}])[0]
+            if "error" in result:
+                return (httplib.CONFLICT, None)
+            return (httplib.OK, result)
+
+        self._call("delete", callback, delete)
+
+    def bulk(self, docs, callback):
+        def bulk():
+            return (httplib.CREATED, local_key_store.key_store().save([dict(doc) for doc in docs]))
+
+        self._call("bulk", callback, bulk)
+
+    def by_principal(self, principal, callback, stale=None, limit=None, start=None):
+        def by_principal():
+            return (httplib.OK, local_key_store.key_store().by_principal(principal, limit, start))
+
+        self._call("by_principal", callback, by_principal)
+
+    def by_identifier(self, identifiers, callback, stale=None):
+        def by_identifier():
+            return (httplib.OK, local_key_store.key_store().by_identifier(identifiers))
+
+        self._call("by_identifier", callback, by_identifier)
@@ -0,0 +1,296 @@
+"""This module implements the key service's read-through cache of the
+key store. Without the cache every request to retrieve credentials
+is a query of the key store's by_identifier or by_principal view.
+
+Rather than guessing how long cached credentials can be trusted
+the cache follows the key store's _changes feed and forgets
+credentials as soon as the key store reports that they've been
+created, changed or deleted. Entries therefore never expire - they're
+only evicted (least recently used first) to bound the cache's size.
+
+The cache is only consulted while it's following the _changes feed.
+If the feed is interrupted the cache stops serving (and accepting)
+credentials until the feed has caught up on the changes it missed.
+
+Typical usage from the key service's mainline (per worker process):
+
+    key_store_cache.max_size = clo.key_store_cache_size
+    key_store_cache.start(clo.key_store)
+"""
+
+import collections
+import logging
+import urllib
+
+import tornado.httpclient
+import tornado.ioloop
+
+from yar.util import trhutil
+
+_logger = logging.getLogger("KEYSERVICE.%s" % __name__)
+
+"""Maximum number of entries the cache will hold before the least
+recently used entries are evicted. An entry is either the credentials
+for a key or all credentials for a principal. A value of 0 disables
+the cache."""
+max_size = 10000
+
+"""The key store holds requests for the _changes feed open for up
+to ```feed_timeout``` seconds waiting for changes."""
+feed_timeout = 60
+
+"""If a request for the _changes feed fails it's retried after
+```retry_interval``` seconds."""
+retry_interval = 1
+
+
+def key_entry(key):
+    """Returns the name of the cache entry for the credentials
+    identified by ```key``` (a mac key identifier or api key)."""
+    return ("key", key)
+
+
+def principal_entry(principal):
+    """Returns the name of the cache entry for all of
+    ```principal```'s credentials."""
+    return ("principal", principal)
+
+
+def _key_from_doc(doc):
+    if "basic" in doc:
+        return doc["basic"].get("api_key", None)
+    if "mac" in doc:
+        return doc["mac"].get("mac_key_identifier", None)
+    return None
+
+
+class KeyStoreCache(object):
+    """A bounded LRU cache of key store documents. Each entry is
+    a list of credentials documents."""
+
+    def __init__(self, max_size):
+        object.__init__(self)
+
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        # entry name -> list of docs
+        self._entries = collections.OrderedDict()
+        # doc _id -> set of names of the entries containing the doc -
+        # this is how the entries to invalidate are found when the
+        # _changes feed reports a deleted doc without the doc's body
+        self._doc_ids = {}
+
+        # incremented on every invalidation - see generation()
+        self._generation = 0
+
+        self.is_live = False
+        self._key_store = None
+        self._since = None
+        self._http_client = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, entry_name):
+        """Look up ```entry_name``` in the cache. Returns a tuple of
+        (is_hit, docs)."""
+        if not self.is_live:
+            return (False, None)
+
+        docs = self._entries.pop(entry_name, None)
+        if docs is None:
+            self.misses += 1
+            return (False, None)
+
+        # re-inserting moves the entry to the most recently used end
+        self._entries[entry_name] = docs
+        self.hits += 1
+        return (True, docs)
+
+    def generation(self):
+        """Callers are expected to note the generation before querying
+        the key store and pass it to ```put()``` with the query's
+        results. If an invalidation happened while the query was
+        in flight the results may be stale and aren't cached."""
+        return self._generation
+
+    def put(self, entry_name, docs, generation):
+        """Remember ```docs``` for ```entry_name```."""
+        if not self.is_live or self.max_size <= 0:
+            return
+        if generation != self._generation:
+            return
+
+        self._remove(entry_name)
+        self._entries[entry_name] = docs
+        for doc in docs:
+            self._doc_ids.setdefault(doc.get("_id", None), set()).add(entry_name)
+
+        while self.max_size < len(self._entries):
+            (evicted_entry_name, evicted_docs) = self._entries.popitem(last=False)
+            self._forget_doc_ids(evicted_entry_name, evicted_docs)
+            self.evictions += 1
+
+    def invalidate_doc(self, doc):
+        """Forget all entries which contain or could contain ```doc```.
+        ```doc``` can be a complete credentials document or just the
+        ```_id``` of a deleted document."""
+        self._generation += 1
+
+        entry_names = set(self._doc_ids.get(doc.get("_id", None), ()))
+        key = _key_from_doc(doc)
+        if key is not None:
+            entry_names.add(key_entry(key))
+        principal = doc.get("principal", None)
+        if principal is not None:
+            entry_names.add(principal_entry(principal))
+
+        for entry_name in entry_names:
+            if self._remove(entry_name):
+                self.invalidations += 1
+
+    def clear(self):
+        self._generation += 1
+        self._entries.clear()
+        self._doc_ids.clear()
+
+    def stats(self):
+        """Return a dict summarizing the cache's effectiveness."""
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "is_live": self.is_live,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _remove(self, entry_name):
+        docs = self._entries.pop(entry_name, None)
+        if docs is None:
+            return False
+        self._forget_doc_ids(entry_name, docs)
+        return True
+
+    def _forget_doc_ids(self, entry_name, docs):
+        for doc in docs:
+            doc_id = doc.get("_id", None)
+            entry_names = self._doc_ids.get(doc_id, None)
+            if entry_names is not None:
+                entry_names.discard(entry_name)
+                if not entry_names:
+                    del self._doc_ids[doc_id]
+
+    def start(self, key_store):
+        """Start following ```key_store```'s _changes feed.
+        ```key_store``` is a string of the form host:port/database."""
+        self._key_store = key_store
+        self._http_client = tornado.httpclient.AsyncHTTPClient(force_instance=True)
+        self._follow_changes()
+
+    def _follow_changes(self):
+        if self._since is None:
+            # the feed starts at the key store's current update sequence.
+            # nothing has been cached yet so earlier changes don't matter.
+            url = "http://%s" % self._key_store
+            request = tornado.httpclient.HTTPRequest(url, method="GET")
+            self._http_client.fetch(request, callback=self._on_update_seq_done)
+            return
+
+        query_string_args = {
+            "include_docs": "true",
+            "since": self._since,
+        }
+        if self.is_live:
+            # wait for the next change
+            query_string_args["feed"] = "longpoll"
+            query_string_args["timeout"] = feed_timeout * 1000
+            request_timeout = feed_timeout + 30
+        else:
+            # catching up on changes missed while the feed was
+            # interrupted so don't wait for more changes
+            query_string_args["feed"] = "normal"
+            request_timeout = 20
+
+        url = "http://%s/_changes?%s" % (
+            self._key_store,
+            urllib.urlencode(query_string_args))
+        request = tornado.httpclient.HTTPRequest(
+            url,
+            method="GET",
+            request_timeout=request_timeout)
+        self._http_client.fetch(request, callback=self._on_changes_done)
+
+    def _on_update_seq_done(self, response):
+        body = trhutil.get_json_body_from_response(response)
+        if body is None or "update_seq" not in body:
+            self._on_feed_error(response)
+            return
+
+        self._since = body["update_seq"]
+        self._follow_changes()
+
+    def _on_changes_done(self, response):
+        body = trhutil.get_json_body_from_response(response)
+        if body is None or "last_seq" not in body:
+            self._on_feed_error(response)
+            return
+
+        for change in body.get("results", []):
+            if change.get("id", "").startswith("_design/"):
+                continue
+            doc = change.get("doc", None) or {"_id": change.get("id", None)}
+            self.invalidate_doc(doc)
+        self._since = body["last_seq"]
+
+        if not self.is_live:
+            _logger.info("Key store cache following '%s' changes", self._key_store)
+            self.is_live = True
+
+        self._follow_changes()
+
+    def _on_feed_error(self, response):
+        _logger.error(
+            "Key store cache error following '%s' changes - %d/%s",
+            self._key_store,
+            response.code,
+            response.error)
+
+        self.is_live = False
+        if response.code != 599:
+            # the key store responded but didn't like the request (for
+            # example the database was recreated so ```_since``` means
+            # nothing) - start again from scratch
+            self.clear()
+            self._since = None
+
+        io_loop = tornado.ioloop.IOLoop.current()
+        io_loop.call_later(retry_interval, self._follow_changes)
+
+
+_key_store_cache = None
+
+
+def key_store_cache():
+    """Returns the process wide ```KeyStoreCache``` creating it on
+    first use from ```max_size```."""
+    global _key_store_cache
+    if _key_store_cache is None:
+        _key_store_cache = KeyStoreCache(max_size)
+    return _key_store_cache
+
+
+def start(key_store):
+    """Start the process wide ```KeyStoreCache``` following
+    ```key_store```'s _changes feed. Until this is called (and if
+    ```max_size``` is 0) the cache is never consulted."""
+    if max_size <= 0:
+        return
+    _logger.info("Starting key store cache - max size %d", max_size)
+    key_store_cache().start(key_store)
@@ -0,0 +1,195 @@
+"""This module spreads the key service's requests across a cluster
+of CouchDB nodes which replicate the key store between themselves.
+Writes always go to the primary node (the --key_store node) so
+there's a single place where conflicting writes are detected. Reads
+go to any healthy node - primary or replica.
+
+Reads are load balanced using "power of two choices": two healthy nodes
+are picked at random and the request goes to the node with the lower
+cost where a node's cost is an exponentially weighted moving average
+(EWMA) of its response times multiplied by its number of outstanding
+requests + 1. Slow or overloaded nodes therefore get less traffic
+without the herding that comes from always picking the single best node.
+
+A node which fails ```ejection_threshold``` consecutive requests
+(connection failures and 5xx responses but not requests rejected
+by the key service's own upstream pool - see ```upstream.QueueFullError```)
+is ejected - it gets no reads
+until a health check (a GET of the node's database every
+```health_check_interval``` seconds) succeeds.
+
+Replicas lag the primary so a read from a replica can return
+credentials which have just been created or deleted on the primary.
+See ```ks_util.AsyncAction.is_response_from_primary```.
+
+Typical usage from the key service's mainline:
+
+    key_store_cluster.configure(clo.key_store, clo.key_store_replicas)
+"""
+
+import logging
+import random
+
+import tornado.httpclient
+import tornado.ioloop
+
+from yar.util import upstream
+
+_logger = logging.getLogger("KEYSERVICE.%s" % __name__)
+
+"""A node is ejected after ```ejection_threshold``` consecutive
+failed requests."""
+ejection_threshold = 3
+
+"""Ejected nodes are health checked every ```health_check_interval```
+seconds and re-admitted once a health check succeeds."""
+health_check_interval = 5
+
+"""Weight given to the most recent response time when updating
+a node's EWMA response time."""
+ewma_alpha = 0.3
+
+
+class Node(object):
+    """A single CouchDB node in the key store cluster."""
+
+    def __init__(self, address):
+        object.__init__(self)
+
+        self.address = address
+
+        self.is_healthy = True
+        self.ewma_response_time = 0.0
+        self.outstanding = 0
+        self.consecutive_failures = 0
+
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+
+    def cost(self):
+        return self.ewma_response_time * (self.outstanding + 1)
+
+    def stats(self):
+        return {
+            "is_healthy": self.is_healthy,
+            "ewma_response_time_ms": int(1000 * self.ewma_response_time),
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+        }
+
+
+class KeyStoreCluster(object):
+    """A primary CouchDB node plus its replicas."""
+
+    def __init__(self, primary, replicas):
+        object.__init__(self)
+
+        self.primary = Node(primary)
+        self.nodes = [self.primary] + [Node(replica) for replica in replicas]
+
+    def read_node(self, exclude=None):
+        """Return the node to which the next read should be sent
+        or None if there's no healthy node other than ```exclude```."""
+        nodes = [node for node in self.nodes if node.is_healthy and node is not exclude]
+        if not nodes:
+            if exclude is self.primary:
+                return None
+            # nothing is healthy - the primary is the least bad choice
+            return self.primary
+        if len(nodes) == 1:
+            return nodes[0]
+        (node1, node2) = random.sample(nodes, 2)
+        return node1 if node1.cost() <= node2.cost() else node2
+
+    def write_node(self):
+        return self.primary
+
+    def on_request_start(self, node):
+        node.requests += 1
+        node.outstanding += 1
+
+    def on_request_done(self, node, response):
+        """Update ```node```'s health and response time
+        with ```response```."""
+        node.outstanding -= 1
+
+        if isinstance(response.error, upstream.QueueFullError):
+            # the request was rejected by the key service's own upstream
+            # pool without being sent - it says nothing about the node
+            return
+
+        if response.code == 599 or 500 <= response.code:
+            node.failures += 1
+            node.consecutive_failures += 1
+            if node.is_healthy and ejection_threshold <= node.consecutive_failures:
+                self._eject(node)
+            return
+
+        node.consecutive_failures = 0
+        request_time = response.request_time or 0.0
+        node.ewma_response_time = \
+            ewma_alpha * request_time + \
+            (1 - ewma_alpha) * node.ewma_response_time
+
+    def _eject(self, node):
+        _logger.error(
+            "Ejecting key store node '%s' after %d consecutive failures",
+            node.address,
+            node.consecutive_failures)
+        node.is_healthy = False
+        node.ejections += 1
+        self._schedule_health_check(node)
+
+    def _schedule_health_check(self, node):
+        io_loop = tornado.ioloop.IOLoop.current()
+        io_loop.call_later(health_check_interval, self._health_check, node)
+
+    def _health_check(self, node):
+        request = tornado.httpclient.HTTPRequest(
+            "http://%s" % node.address,
+            method="GET")
+
+        def on_health_check_done(response):
+            if response.error:
+                self._schedule_health_check(node)
+                return
+
+            _logger.info("Re-admitting key store node '%s'", node.address)
+            node.is_healthy = True
+            node.consecutive_failures = 0
+            node.ewma_response_time = response.request_time or 0.0
+
+        upstream.fetch(node.address, request, on_health_check_done)
+
+    def stats(self):
+        """Return a dict of node statistics keyed by node address."""
+        return {node.address: node.stats() for node in self.nodes}
+
+
+_cluster = None
+
+
+def configure(primary, replicas):
+    """Configure the process wide ```KeyStoreCluster```. If there
+    are no ```replicas``` there's nothing to balance so all requests
+    go directly to ```primary```."""
+    global _cluster
+    if replicas:
+        _logger.info(
+            "Key store cluster primary '%s' replicas '%s'",
+            primary,
+            replicas)
+        _cluster = KeyStoreCluster(primary, replicas)
+    else:
+        _cluster = None
+
+
+def cluster(key_store):
+    """Returns the ```KeyStoreCluster``` whose primary is ```key_store```
+    or None if requests to ```key_store``` aren't balanced."""
+    if _cluster is None or _cluster.primary.address != key_store:
+        return None
+    return _cluster
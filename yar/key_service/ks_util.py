@@ -1,14 +1,27 @@
 """This module contains a collection of key service specific utilities."""
 
+import httplib
 import json
 import logging
+import urllib
 
 import tornado.httpclient
 
 from yar.util import trhutil
+from yar.util import upstream
+import key_store_backends
+import key_store_cluster
 
 _logger = logging.getLogger("KEYSERVICE.%s" % __name__)
 
+"""```key_store_backend``` selects the key store implementation
+(see key_store_backends). One of:
+
+    couchdb - the CouchDB database (or cluster - see key_store_cluster)
+    identified by each ```AsyncAction```'s ```key_store```
+    local - an embedded key store in a local file (see local_key_store)"""
+key_store_backend = "couchdb"
+
 
 def filter_out_non_model_creds_properties(creds):
     """When a dictionary representing a set of credentials
@@ -27,6 +40,37 @@ def filter_out_non_model_creds_properties(creds):
     return {k: v for k, v in creds.iteritems() if k in model_creds_properties}
 
 
+def view_path(path, stale):
+    """Returns ```path``` (the path of a view query) changed so
+    that the view is queried with the read consistency ```stale```
+    which is one of:
+
+        strict (or None) - the view's index is brought up to date
+        before the query is answered
+        ok - the query is answered using the view's index as is
+        update_after - like ok but the view's index is brought up to
+        date after the query is answered
+
+    ok and update_after mean reads never wait for the key store to
+    index recent writes at the cost of possibly missing them."""
+    if stale is None or stale == "strict":
+        return path
+    separator = "&" if "?" in path else "?"
+    return "%s%s%s" % (path, separator, urllib.urlencode({"stale": stale}))
+
+
+def _is_read(path, method):
+    """Returns True if a ```method``` request for ```path``` only
+    reads from the key store. Multi-key lookups are POSTs but
+    only read."""
+    if method in ["GET", "HEAD"]:
+        return True
+    if method == "POST":
+        path = path.split("?", 1)[0]
+        return path == "_all_docs" or "/_view/" in path
+    return False
+
+
 class AsyncAction(object):
     """```AsyncAction``` is an abstract base class for all key
     service classes which encapsulate async interaction between
@@ -34,7 +78,16 @@ class AsyncAction(object):
     class is to abstract away all tornado details from the
     derived classes and isolate the async control code into
     a single spot. This isolation makes mock creation in unit
-    tests super easy."""
+    tests super easy.
+
+    Derived classes talk to the key store through ```backend```
+    (see key_store_backends) and never need to know which key
+    store implementation is in use."""
+
+    """When the key store is a cluster (see key_store_cluster) reads
+    can be answered by a replica which lags the primary. Derived classes
+    which cache responses should only do so when this is True."""
+    is_response_from_primary = True
 
     def __init__(self, key_store):
         """```AsyncAction```'s constructor.
@@ -43,35 +96,70 @@ class AsyncAction(object):
         object.__init__(self)
         self.key_store = key_store
 
+        if key_store_backend == "local":
+            self.backend = key_store_backends.LocalKeyStoreBackend()
+        else:
+            self.backend = key_store_backends.CouchDBKeyStoreBackend(self)
+
     def async_req_to_key_store(self,
                                path,
                                method,
                                body,
                                callback):
+        """Make a ```method``` request for ```path``` (relative to the
+        CouchDB database) to the key store - this is how
+        ```key_store_backends.CouchDBKeyStoreBackend``` talks to
+        CouchDB."""
 
         self._my_callback = callback
-
-        url = "http://%s/%s" % (self.key_store, path)
-
-        json_encoded_body = json.dumps(body) if body else None
+        self._path = path
+        self._method = method
+        self._body = body
+        self._is_read = _is_read(path, method)
+        self._is_retry = False
+
+        self._cluster = key_store_cluster.cluster(self.key_store)
+        if self._cluster is None:
+            self._node = None
+        elif self._is_read:
+            self._node = self._cluster.read_node()
+        else:
+            self._node = self._cluster.write_node()
+
+        self._fetch()
+
+    def _fetch(self):
+        if self._node is None:
+            address = self.key_store
+        else:
+            address = self._node.address
+            self._cluster.on_request_start(self._node)
+            # once any response comes from a replica, stays False
+            self.is_response_from_primary = \
+                self.is_response_from_primary and \
+                self._node is self._cluster.primary
+
+        url = "http://%s/%s" % (address, self._path)
+
+        json_encoded_body = json.dumps(self._body) if self._body else None
 
         headers = tornado.httputil.HTTPHeaders({
             "Accept": "application/json",
             "Accept-Encoding": "charset=utf8",
         })
-        if body:
+        if self._body:
             headers["Content-Type"] = "application/json; charset=utf8"
 
         request = tornado.httpclient.HTTPRequest(
             url,
-            method=method,
+            method=self._method,
             headers=headers,
             body=json_encoded_body)
 
-        http_client = tornado.httpclient.AsyncHTTPClient()
-        http_client.fetch(
+        upstream.fetch(
+            address,
             request,
-            callback=self._http_client_fetch_callback)
+            self._http_client_fetch_callback)
 
     def _http_client_fetch_callback(self, response):
         """Called when ```tornado.httpclient.AsyncHTTPClient``` completes."""
@@ -85,6 +173,24 @@ class AsyncAction(object):
             response.request.method,
             int(response.request_time * 1000))
 
+        if self._node is not None:
+            self._cluster.on_request_done(self._node, response)
+
+            if response.code == 599 and self._is_read and not self._is_retry:
+                # couldn't reach the node - reads can fail over
+                # to another node
+                node = self._cluster.read_node(exclude=self._node)
+                if node is not None:
+                    self._node = node
+                    self._is_retry = True
+                    self._fetch()
+                    return
+        if response.error and response.code in [httplib.NOT_FOUND, httplib.CONFLICT]:
+            # the key store not finding a doc or reporting that a doc
+            # has changed is an answer not an error
+            self._my_callback(True, response.code)
+            return
+
         if response.error:
             _logger.error(
                 "Key Store responded to %s on %s with error '%s'",
@@ -0,0 +1,301 @@
+"""This module implements an embedded key store which lives in a
+local file rather than in CouchDB. It's a good fit for single node
+and edge deployments where running CouchDB is overkill and where
+the cost of an HTTP request and a view lookup for every read
+matters more than replication.
+
+The key service's async actions (see ks_util) talk to the key store
+through the backend-neutral interface in key_store_backends and
+```key_store_backends.LocalKeyStoreBackend``` implements that interface
+by calling ```LocalKeyStore```'s methods directly:
+
+    get() - a doc by _id
+    get_many() - docs by _id
+    save() - create, update or delete docs
+    by_principal() - a principal's docs ordered by _id
+    by_identifier() - docs by api key or mac key identifier
+
+The key store is a single append only file of records. Each record
+is a 4 byte length followed by a JSON encoded doc. A deleted doc
+is recorded as {"_id": ..., "_rev": ..., "_deleted": true}. The
+file is memory-mapped and an in-memory index maps each doc's _id
+to the offset of the doc's latest record and each principal to the
+_ids of the principal's docs so reading a doc is a slice of the
+memory map and a json.loads() - there are no system calls.
+
+Each worker of a pre-forked key service opens the file. Records
+are appended under an exclusive flock() and every request starts
+by indexing records appended (by any worker) since the previous
+request so all workers see the same docs. If a record is only
+partially written (for example because the key service crashed
+mid-append) it's ignored and the next append overwrites it. A
+complete record which isn't a doc is logged and skipped - the
+records after it are still read and are never overwritten.
+
+The file only ever grows. ```compact()``` rewrites a key store
+keeping only the latest record for each doc which hasn't been
+deleted - it must not be used while a key service has the key
+store open.
+
+Typical usage from the key service's mainline:
+
+    ks_util.key_store_backend = "local"
+    local_key_store.path = clo.local_key_store
+"""
+
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import uuid
+
+_logger = logging.getLogger("KEYSERVICE.%s" % __name__)
+
+"""```path``` is the name of the file containing the key store.
+The file is created if it doesn't exist."""
+path = "creds.yks"
+
+_header = struct.Struct("=I")
+
+
+def _new_rev(rev):
+    """Generate the _rev of the next revision of a doc whose current
+    _rev is ```rev``` (None for a new doc). Like CouchDB, a _rev is
+    the revision's number and a unique string."""
+    number = int(rev.split("-", 1)[0]) if rev else 0
+    return "%d-%s" % (number + 1, uuid.uuid4().hex)
+
+
+def _parse(data):
+    """Returns the doc encoded in a record's ```data``` or None if
+    ```data``` isn't a doc with an _id and a _rev."""
+    try:
+        doc = json.loads(data)
+    except ValueError:
+        return None
+    if not isinstance(doc, dict) or "_id" not in doc or "_rev" not in doc:
+        return None
+    return doc
+
+
+def _record(doc):
+    data = json.dumps(doc, separators=(",", ":"))
+    return _header.pack(len(data)) + data
+
+
+class LocalKeyStore(object):
+    """An embedded key store in the file ```path```."""
+
+    def __init__(self, path):
+        object.__init__(self)
+
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0600)
+        self._map = None
+
+        # doc _id -> (offset of doc's json, length of doc's json, _rev, principal)
+        self._docs = {}
+        # principal -> set of principal's doc _ids
+        self._principals = {}
+        # records before this offset have been indexed
+        self._indexed_size = 0
+
+        self._catch_up()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        os.close(self._fd)
+        self._fd = None
+
+    def __len__(self):
+        self._catch_up()
+        return len(self._docs)
+
+    def get(self, doc_id):
+        """Returns the doc whose _id is ```doc_id``` or None
+        if there's no such doc."""
+        self._catch_up()
+        return self._get(doc_id)
+
+    def get_many(self, doc_ids):
+        """Returns a list of (doc _id, doc) tuples - one for each of
+        ```doc_ids``` which is the _id of a doc."""
+        self._catch_up()
+        docs = []
+        for doc_id in doc_ids:
+            doc = self._get(doc_id)
+            if doc is not None:
+                docs.append((doc_id, doc))
+        return docs
+
+    def by_principal(self, principal, limit=None, start=None):
+        """Returns a list of ```principal```'s docs ordered by doc _id.
+        If ```start``` isn't None the list starts with the doc whose
+        _id is ```start``` and if ```limit``` isn't None the list
+        contains at most ```limit``` docs."""
+        self._catch_up()
+
+        doc_ids = sorted(self._principals.get(principal, ()))
+        if start is not None:
+            doc_ids = [doc_id for doc_id in doc_ids if start <= doc_id]
+        if limit is not None:
+            doc_ids = doc_ids[:limit]
+
+        return [self._get(doc_id) for doc_id in doc_ids]
+
+    def by_identifier(self, identifiers):
+        """Every doc in the embedded key store is a creds_v2.0 doc
+        whose _id is its identifier so a lookup by identifier is
+        a lookup by _id - see ```get_many()```."""
+        return self.get_many(identifiers)
+
+    def _get(self, doc_id):
+        entry = self._docs.get(doc_id, None)
+        if entry is None:
+            return None
+        (offset, length, rev, principal) = entry
+        return json.loads(self._map[offset:offset + length])
+
+    def save(self, docs):
+        """Create, update or (if a doc's _deleted is True) delete
+        ```docs```. As with CouchDB an update or delete must include
+        the doc's current _rev. Returns a list of results - one per
+        doc - each either {"ok": True, "id": ..., "rev": ...} or
+        {"id": ..., "error": "conflict", ...}. Docs without an _id
+        are given one and every saved doc's _rev is updated."""
+        results = []
+
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            # another worker may have appended since this request started
+            self._catch_up()
+
+            file_size = os.fstat(self._fd).st_size
+            if self._indexed_size < file_size:
+                # a partially written record - see _catch_up()
+                _logger.error(
+                    "Local key store '%s' discarding %d bytes of partially written record",
+                    self.path,
+                    file_size - self._indexed_size)
+                os.ftruncate(self._fd, self._indexed_size)
+
+            records = []
+            revs = {}
+            for doc in docs:
+                doc_id = doc.setdefault("_id", uuid.uuid4().hex)
+                if doc_id in revs:
+                    current_rev = revs[doc_id]
+                else:
+                    entry = self._docs.get(doc_id, None)
+                    current_rev = entry[2] if entry else None
+
+                if doc.get("_rev", None) != current_rev:
+                    results.append({
+                        "id": doc_id,
+                        "error": "conflict",
+                        "reason": "Document update conflict.",
+                    })
+                    continue
+
+                doc["_rev"] = _new_rev(current_rev)
+                revs[doc_id] = None if doc.get("_deleted", False) else doc["_rev"]
+                records.append(_record(doc))
+                results.append({"ok": True, "id": doc_id, "rev": doc["_rev"]})
+
+            data = "".join(records)
+            while data:
+                data = data[os.write(self._fd, data):]
+
+            self._catch_up()
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+        return results
+
+    def _catch_up(self):
+        """Index records appended to the key store since the last time
+        the key store was indexed."""
+        file_size = os.fstat(self._fd).st_size
+        if file_size <= self._indexed_size:
+            return
+
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._fd, file_size, access=mmap.ACCESS_READ)
+
+        offset = self._indexed_size
+        while offset + _header.size <= file_size:
+            (length,) = _header.unpack_from(self._map, offset)
+            doc_offset = offset + _header.size
+            if file_size < doc_offset + length:
+                # a partially written record - only ever the last
+                # record in the file and the next append overwrites it
+                break
+            doc = _parse(self._map[doc_offset:doc_offset + length])
+            if doc is None:
+                # a complete but corrupt record - the records after it
+                # are fine so skip it rather than stopping here (which
+                # would mean the next append overwrites them)
+                _logger.error(
+                    "Local key store '%s' skipping corrupt %d byte record at offset %d",
+                    self.path,
+                    length,
+                    offset)
+            else:
+                self._index(doc, doc_offset, length)
+            offset = doc_offset + length
+
+        self._indexed_size = offset
+
+    def _index(self, doc, offset, length):
+        doc_id = doc["_id"]
+
+        entry = self._docs.pop(doc_id, None)
+        if entry is not None:
+            principal = entry[3]
+            doc_ids = self._principals.get(principal, None)
+            if doc_ids is not None:
+                doc_ids.discard(doc_id)
+                if not doc_ids:
+                    del self._principals[principal]
+
+        if doc.get("_deleted", False):
+            return
+
+        principal = doc.get("principal", None)
+        self._docs[doc_id] = (offset, length, doc["_rev"], principal)
+        self._principals.setdefault(principal, set()).add(doc_id)
+
+
+def compact(src_path, dst_path):
+    """Write the latest record of each doc in the key store
+    ```src_path``` which hasn't been deleted to a new key store
+    ```dst_path```. Returns the number of docs written."""
+    src = LocalKeyStore(src_path)
+    try:
+        with open(dst_path, "wb") as dst:
+            for (offset, length, rev, principal) in sorted(src._docs.itervalues()):
+                dst.write(_header.pack(length))
+                dst.write(src._map[offset:offset + length])
+        return len(src._docs)
+    finally:
+        src.close()
+
+
+_local_key_store = None
+
+
+def key_store():
+    """Returns the process wide ```LocalKeyStore``` opening
+    ```path``` on first use. The key store is opened lazily so
+    each worker of a pre-forked key service gets its own file
+    descriptor and memory map."""
+    global _local_key_store
+    if _local_key_store is None:
+        _logger.info("Opening local key store '%s'", path)
+        _local_key_store = LocalKeyStore(path)
+    return _local_key_store
@@ -0,0 +1,95 @@
+"""This module implements unit tests for the key service's
+async_bulk_creds_creator module."""
+
+import httplib
+import uuid
+
+import mock
+
+from yar.key_service import async_bulk_creds_creator
+from yar.tests import yar_test_util
+
+
+class TestCaseAsyncBulkCredsCreator(yar_test_util.TestCase):
+    """A collection of unit tests for the key service's
+    async_bulk_creds_creator module."""
+
+    _key_store = "dave:42"
+
+    _name_of_method_to_patch = (
+        "yar.key_service.ks_util."
+        "AsyncAction.async_req_to_key_store"
+    )
+
+    def _creds_requests(self):
+        return [
+            {"principal": uuid.uuid4().hex, "auth_scheme": "mac"},
+            {"principal": uuid.uuid4().hex, "auth_scheme": "basic"},
+            {"principal": uuid.uuid4().hex},
+        ]
+
+    def _create(self, creds_requests, results_from_docs, code=httplib.CREATED, is_ok=True):
+        self.docs = None
+
+        def async_req_to_key_store_patch(acc, path, method, body, callback):
+            self.assertEqual(path, "_bulk_docs")
+            self.assertEqual(method, "POST")
+            self.docs = body["docs"]
+            callback(is_ok, code, results_from_docs(self.docs))
+
+        self.creds = "not called"
+
+        def on_async_create_done(creds):
+            self.creds = creds
+
+        with mock.patch(self._name_of_method_to_patch, async_req_to_key_store_patch):
+            abcc = async_bulk_creds_creator.AsyncBulkCredsCreator(type(self)._key_store)
+            abcc.create(creds_requests, on_async_create_done)
+
+        return self.creds
+
+    def test_all_saved(self):
+        creds_requests = self._creds_requests()
+
+        def results_from_docs(docs):
+            return [{"id": doc["_id"], "rev": "1-x"} for doc in docs]
+
+        creds = self._create(creds_requests, results_from_docs)
+        self.assertEqual(len(creds), len(creds_requests))
+        for (doc, each_creds, creds_request) in zip(self.docs, creds, creds_requests):
+            self.assertEqual(doc["type"], "creds_v2.0")
+            self.assertEqual(each_creds["principal"], creds_request["principal"])
+            self.assertNotIn("_id", each_creds)
+            self.assertNotIn("type", each_creds)
+        self.assertEqual(self.docs[0]["_id"], creds[0]["mac"]["mac_key_identifier"])
+        self.assertEqual(self.docs[1]["_id"], creds[1]["basic"]["api_key"])
+        self.assertIn("basic", creds[2])
+
+    def test_some_not_saved(self):
+        def results_from_docs(docs):
+            return [
+                {"id": docs[0]["_id"], "rev": "1-x"},
+                {"id": docs[1]["_id"], "error": "conflict", "reason": "Document update conflict."},
+                {"id": docs[2]["_id"], "rev": "1-y"},
+            ]
+
+        creds = self._create(self._creds_requests(), results_from_docs)
+        self.assertEqual(len(creds), 3)
+        self.assertIsNotNone(creds[0])
+        self.assertIsNone(creds[1])
+        self.assertIsNotNone(creds[2])
+
+    def test_key_store_error(self):
+        creds = self._create(
+            self._creds_requests(),
+            lambda docs: None,
+            code=httplib.INTERNAL_SERVER_ERROR)
+        self.assertIsNone(creds)
+
+    def test_key_store_unreachable(self):
+        creds = self._create(
+            self._creds_requests(),
+            lambda docs: None,
+            code=None,
+            is_ok=False)
+        self.assertIsNone(creds)
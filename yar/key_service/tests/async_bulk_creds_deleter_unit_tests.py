@@ -0,0 +1,142 @@
+"""This module implements unit tests for the key service's
+async_bulk_creds_deleter module."""
+
+import httplib
+
+import mock
+
+from yar.key_service import async_bulk_creds_deleter
+from yar.util import basic
+from yar.util import mac
+from yar.tests import yar_test_util
+
+
+class TestCaseAsyncBulkCredsDeleter(yar_test_util.TestCase):
+    """A collection of unit tests for the key service's
+    async_bulk_creds_deleter module."""
+
+    _key_store = "dave:42"
+
+    def _creds(self):
+        mac_key_identifier = mac.MACKeyIdentifier.generate()
+        api_key = basic.APIKey.generate()
+        return [
+            {
+                "_id": mac_key_identifier,
+                "_rev": "1-mac",
+                "mac": {
+                    "mac_algorithm": mac.MAC.algorithm,
+                    "mac_key": mac.MACKey.generate(),
+                    "mac_key_identifier": mac_key_identifier,
+                },
+                "principal": "dave@example.com",
+                "type": "creds_v2.0",
+            },
+            {
+                "_id": api_key,
+                "_rev": "1-basic",
+                "basic": {
+                    "api_key": api_key,
+                },
+                "principal": "dave@example.com",
+                "type": "creds_v2.0",
+            },
+        ]
+
+    def _delete(self, the_creds, results_from_docs, code=httplib.CREATED):
+        self.bulk_docs = None
+
+        def async_creds_retriever_fetch_patch(acr, callback, principal, is_include_migrated_v1_docs):
+            self.assertEqual(principal, "dave@example.com")
+            self.assertTrue(is_include_migrated_v1_docs)
+            callback(the_creds, True)
+
+        def async_req_to_key_store_patch(abcd, path, method, body, callback):
+            self.assertEqual(path, "_bulk_docs")
+            self.assertEqual(method, "POST")
+            self.bulk_docs = body["docs"]
+            callback(is_ok=True, code=code, body=results_from_docs(self.bulk_docs))
+
+        callback = mock.Mock()
+        name_of_method_to_patch = "yar.key_service.async_creds_retriever.AsyncCredsRetriever.fetch"
+        with mock.patch(name_of_method_to_patch, async_creds_retriever_fetch_patch):
+            name_of_method_to_patch = "yar.key_service.ks_util.AsyncAction.async_req_to_key_store"
+            with mock.patch(name_of_method_to_patch, async_req_to_key_store_patch):
+                abcd = async_bulk_creds_deleter.AsyncBulkCredsDeleter(type(self)._key_store)
+                abcd.delete("dave@example.com", callback)
+
+        self.assertEqual(callback.call_count, 1)
+        return callback.call_args[0]
+
+    def test_all_deleted(self):
+        creds = self._creds()
+
+        def results_from_docs(docs):
+            return [{"id": doc["_id"], "rev": "2-x", "ok": True} for doc in docs]
+
+        (deleted_keys, not_deleted_keys) = self._delete(creds, results_from_docs)
+        self.assertEqual(deleted_keys, [creds[0]["_id"], creds[1]["_id"]])
+        self.assertEqual(not_deleted_keys, [])
+        self.assertEqual(
+            self.bulk_docs,
+            [
+                {"_id": creds[0]["_id"], "_rev": "1-mac", "_deleted": True},
+                {"_id": creds[1]["_id"], "_rev": "1-basic", "_deleted": True},
+            ])
+
+    def test_some_not_deleted(self):
+        creds = self._creds()
+
+        def results_from_docs(docs):
+            return [
+                {"id": docs[0]["_id"], "error": "conflict", "reason": "Document update conflict."},
+                {"id": docs[1]["_id"], "rev": "2-x", "ok": True},
+            ]
+
+        (deleted_keys, not_deleted_keys) = self._delete(creds, results_from_docs)
+        self.assertEqual(deleted_keys, [creds[1]["_id"]])
+        self.assertEqual(not_deleted_keys, [creds[0]["_id"]])
+
+    def test_migrated_v1_doc_deleted_too(self):
+        """While the key store is being migrated a creds_v1.0 doc and
+        the creds_v2.0 doc replacing it can both exist - confirm both
+        are deleted and the key is only reported once."""
+        creds = self._creds()
+        v1_creds = dict(creds[0], _id="9010212ebe184b13aecbd5ca5d72ae64", _rev="1-v1", type="creds_v1.0")
+        creds.append(v1_creds)
+
+        def results_from_docs(docs):
+            return [{"id": doc["_id"], "rev": "2-x", "ok": True} for doc in docs]
+
+        (deleted_keys, not_deleted_keys) = self._delete(creds, results_from_docs)
+        self.assertEqual(deleted_keys, [creds[0]["_id"], creds[1]["_id"]])
+        self.assertEqual(not_deleted_keys, [])
+        self.assertEqual(len(self.bulk_docs), 3)
+        self.assertEqual(self.bulk_docs[2]["_id"], v1_creds["_id"])
+
+    def test_migrated_v1_doc_not_deleted(self):
+        creds = self._creds()
+        creds.append(dict(creds[0], _id="9010212ebe184b13aecbd5ca5d72ae64", _rev="1-v1", type="creds_v1.0"))
+
+        def results_from_docs(docs):
+            return [
+                {"id": docs[0]["_id"], "rev": "2-x", "ok": True},
+                {"id": docs[1]["_id"], "rev": "2-x", "ok": True},
+                {"id": docs[2]["_id"], "error": "conflict", "reason": "Document update conflict."},
+            ]
+
+        (deleted_keys, not_deleted_keys) = self._delete(creds, results_from_docs)
+        self.assertEqual(deleted_keys, [creds[1]["_id"]])
+        self.assertEqual(not_deleted_keys, [creds[0]["_id"]])
+
+    def test_no_creds(self):
+        (deleted_keys, not_deleted_keys) = self._delete([], None)
+        self.assertEqual((deleted_keys, not_deleted_keys), ([], []))
+        self.assertIsNone(self.bulk_docs)
+
+    def test_key_store_error(self):
+        rv = self._delete(
+            self._creds(),
+            lambda docs: None,
+            code=httplib.INTERNAL_SERVER_ERROR)
+        self.assertEqual(rv, (None, None))
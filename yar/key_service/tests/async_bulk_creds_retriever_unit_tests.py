@@ -0,0 +1,176 @@
+"""This module implements unit tests for the key service's
+async_bulk_creds_retriever module."""
+
+import httplib
+
+import mock
+
+from yar.key_service import async_bulk_creds_retriever
+from yar.key_service import async_creds_retriever
+from yar.key_service import key_store_cache
+from yar.util import mac
+from yar.tests import yar_test_util
+
+
+def _mac_creds(doc_id, mac_key_identifier, doc_type="creds_v2.0"):
+    return {
+        "_id": doc_id,
+        "_rev": "1-c81488ccbec47b14cec7010e18459a16",
+        "mac": {
+            "mac_algorithm": mac.MAC.algorithm,
+            "mac_key": mac.MACKey.generate(),
+            "mac_key_identifier": mac_key_identifier,
+        },
+        "principal": "dave@example.com",
+        "type": doc_type,
+    }
+
+
+class TestCaseAsyncBulkCredsRetriever(yar_test_util.TestCase):
+    """A collection of unit tests for the key service's
+    async_bulk_creds_retriever module."""
+
+    _key_store = "dave:42"
+
+    _name_of_method_to_patch = (
+        "yar.key_service.ks_util."
+        "AsyncAction.async_req_to_key_store"
+    )
+
+    def setUp(self):
+        self.key_store_docs = {}
+        self.requests = []
+
+    def _async_req_to_key_store_patch(self, path, method, body, callback):
+        self.requests.append((path, method, body))
+        self.assertEqual(method, "POST")
+
+        rows = []
+        if path.startswith("_all_docs"):
+            for key in body["keys"]:
+                doc = self.key_store_docs.get(key, None)
+                if doc and doc["_id"] == key:
+                    rows.append({"id": key, "key": key, "value": {"rev": doc["_rev"]}, "doc": doc})
+                else:
+                    rows.append({"key": key, "error": "not_found"})
+        else:
+            for key in body["keys"]:
+                doc = self.key_store_docs.get(key, None)
+                if doc and doc["_id"] != key:
+                    rows.append({"id": doc["_id"], "key": key, "value": None, "doc": doc})
+        callback(is_ok=True, code=httplib.OK, body={"rows": rows})
+
+    def _fetch(self, keys, v1_fallback=False, stale=None):
+        callback = mock.Mock()
+        with mock.patch.object(async_creds_retriever, "v1_fallback", v1_fallback):
+            with mock.patch(self._name_of_method_to_patch, self._async_req_to_key_store_patch):
+                abcr = async_bulk_creds_retriever.AsyncBulkCredsRetriever(type(self)._key_store)
+                abcr.fetch(keys, callback, stale=stale)
+        self.assertEqual(callback.call_count, 1)
+        return callback.call_args[0][0]
+
+    def test_all_found(self):
+        keys = [mac.MACKeyIdentifier.generate() for i in range(3)]
+        for key in keys:
+            self.key_store_docs[key] = _mac_creds(key, key)
+
+        creds = self._fetch(keys)
+        self.assertEqual(creds, self.key_store_docs)
+        self.assertEqual(
+            self.requests,
+            [("_all_docs?include_docs=true", "POST", {"keys": keys})])
+
+    def test_some_not_found(self):
+        found_key = mac.MACKeyIdentifier.generate()
+        not_found_key = mac.MACKeyIdentifier.generate()
+        v1_key = mac.MACKeyIdentifier.generate()
+        self.key_store_docs[found_key] = _mac_creds(found_key, found_key)
+        self.key_store_docs[v1_key] = _mac_creds("9010212ebe", v1_key, "creds_v1.0")
+
+        creds = self._fetch([found_key, not_found_key, v1_key, "_design/x"])
+        self.assertEqual(
+            creds,
+            {
+                found_key: self.key_store_docs[found_key],
+                not_found_key: None,
+                v1_key: None,
+                "_design/x": None,
+            })
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(self.requests[0][2], {"keys": [found_key, not_found_key, v1_key]})
+
+    def test_v1_fallback(self):
+        """Keys not found by _id are looked up with a single
+        query of the by_identifier view."""
+        found_key = mac.MACKeyIdentifier.generate()
+        not_found_key = mac.MACKeyIdentifier.generate()
+        v1_key = mac.MACKeyIdentifier.generate()
+        self.key_store_docs[found_key] = _mac_creds(found_key, found_key)
+        self.key_store_docs[v1_key] = _mac_creds("9010212ebe", v1_key, "creds_v1.0")
+
+        creds = self._fetch([found_key, not_found_key, v1_key], v1_fallback=True)
+        self.assertEqual(creds[found_key], self.key_store_docs[found_key])
+        self.assertIsNone(creds[not_found_key])
+        self.assertEqual(creds[v1_key], self.key_store_docs[v1_key])
+
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(
+            self.requests[1],
+            (
+                "_design/by_identifier/_view/by_identifier?include_docs=true",
+                "POST",
+                {"keys": [not_found_key, v1_key]},
+            ))
+
+    def test_stale_v1_fallback(self):
+        """The by_identifier view is queried with the requested read
+        consistency and keys looked up in a stale view aren't cached."""
+        found_key = mac.MACKeyIdentifier.generate()
+        v1_key = mac.MACKeyIdentifier.generate()
+        self.key_store_docs[found_key] = _mac_creds(found_key, found_key)
+        self.key_store_docs[v1_key] = _mac_creds("9010212ebe", v1_key, "creds_v1.0")
+
+        cache = key_store_cache.KeyStoreCache(10)
+        cache.is_live = True
+
+        with mock.patch.object(key_store_cache, "_key_store_cache", cache):
+            creds = self._fetch([found_key, v1_key], v1_fallback=True, stale="update_after")
+
+        self.assertEqual(creds[v1_key], self.key_store_docs[v1_key])
+        self.assertEqual(
+            self.requests[1][0],
+            "_design/by_identifier/_view/by_identifier?include_docs=true&stale=update_after")
+        self.assertEqual(len(cache), 1)
+        self.assertTrue(cache.get(key_store_cache.key_entry(found_key))[0])
+
+    def test_key_store_error(self):
+        def async_req_to_key_store_patch(acr, path, method, body, callback):
+            callback(is_ok=True, code=httplib.INTERNAL_SERVER_ERROR)
+
+        callback = mock.Mock()
+        with mock.patch(self._name_of_method_to_patch, async_req_to_key_store_patch):
+            abcr = async_bulk_creds_retriever.AsyncBulkCredsRetriever(type(self)._key_store)
+            abcr.fetch(["dave"], callback)
+        callback.assert_called_once_with(None)
+
+    def test_served_from_key_store_cache(self):
+        """Only keys missing from the key store cache are requested
+        from the key store and all results, including not found,
+        are cached."""
+        found_key = mac.MACKeyIdentifier.generate()
+        not_found_key = mac.MACKeyIdentifier.generate()
+        self.key_store_docs[found_key] = _mac_creds(found_key, found_key)
+
+        cache = key_store_cache.KeyStoreCache(10)
+        cache.is_live = True
+
+        with mock.patch.object(key_store_cache, "_key_store_cache", cache):
+            self._fetch([found_key, not_found_key])
+            other_key = mac.MACKeyIdentifier.generate()
+            creds = self._fetch([found_key, not_found_key, other_key])
+
+        self.assertEqual(creds[found_key], self.key_store_docs[found_key])
+        self.assertIsNone(creds[not_found_key])
+        self.assertEqual(len(self.requests), 2)
+        self.assertEqual(self.requests[1][2], {"keys": [other_key]})
+        self.assertEqual(cache.stats()["hits"], 2)
@@ -33,10 +33,9 @@ class TestCaseAsyncCredsCreator(yar_test_util.TestCase):
             self.assertIsNotNone(acc)
 
             self.assertIsNotNone(path)
-            self.assertEqual(path, "")
 
             self.assertIsNotNone(method)
-            self.assertEqual(method, "POST")
+            self.assertEqual(method, "PUT")
 
             self.assertIsNotNone(body)
 
@@ -44,13 +43,14 @@ class TestCaseAsyncCredsCreator(yar_test_util.TestCase):
             self.assertEqual(body["principal"], self.the_principal)
 
             self.assertIn("type", body)
-            self.assertEqual(body["type"], "creds_v1.0")
+            self.assertEqual(body["type"], "creds_v2.0")
 
             if the_auth_scheme == "mac":
                 self.assertIn("mac", body)
                 mac_section_of_body = body["mac"]
 
                 self.assertIn("mac_key_identifier", mac_section_of_body)
+                self.assertEqual(path, mac_section_of_body["mac_key_identifier"])
 
                 self.assertIn("mac_key", mac_section_of_body)
 
@@ -63,6 +63,7 @@ class TestCaseAsyncCredsCreator(yar_test_util.TestCase):
                 basic_section_of_body = body["basic"]
 
                 self.assertIn("api_key", basic_section_of_body)
+                self.assertEqual(path, basic_section_of_body["api_key"])
 
             self.assertIsNotNone(callback)
             callback(is_ok=the_is_ok, code=the_http_status_code)
@@ -119,10 +120,9 @@ class TestCaseAsyncCredsCreator(yar_test_util.TestCase):
             self.assertIsNotNone(acc)
 
             self.assertIsNotNone(path)
-            self.assertEqual(path, "")
 
             self.assertIsNotNone(method)
-            self.assertEqual(method, "POST")
+            self.assertEqual(method, "PUT")
 
             self.assertIsNotNone(body)
             self.the_creds = body
@@ -131,13 +131,14 @@ class TestCaseAsyncCredsCreator(yar_test_util.TestCase):
             self.assertEqual(body["principal"], self.the_principal)
 
             self.assertIn("type", body)
-            self.assertEqual(body["type"], "creds_v1.0")
+            self.assertEqual(body["type"], "creds_v2.0")
 
             if the_auth_scheme == "mac":
                 self.assertIn("mac", body)
                 mac_section_of_body = body["mac"]
 
                 self.assertIn("mac_key_identifier", mac_section_of_body)
+                self.assertEqual(path, mac_section_of_body["mac_key_identifier"])
 
                 self.assertIn("mac_key", mac_section_of_body)
 
@@ -150,6 +151,7 @@ class TestCaseAsyncCredsCreator(yar_test_util.TestCase):
                 basic_section_of_body = body["basic"]
 
                 self.assertIn("api_key", basic_section_of_body)
+                self.assertEqual(path, basic_section_of_body["api_key"])
 
             self.assertIsNotNone(callback)
             callback(is_ok=True, code=httplib.CREATED, body=body)
@@ -177,3 +179,117 @@ class TestCaseAsyncCredsCreator(yar_test_util.TestCase):
 
     def test_basic_ok(self):
         self._test_ok("basic")
+
+
+class TestCaseAsyncCredsCreatorBatching(yar_test_util.TestCase):
+    """A collection of unit tests for the key service's
+    async_creds_creator module when creates are batched."""
+
+    _key_store = "dave:42"
+
+    def setUp(self):
+        for (name, value) in [("batch_window", 5), ("max_batch_size", 3), ("_batches", {})]:
+            patcher = mock.patch.object(async_creds_creator, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        patcher = mock.patch("tornado.ioloop.IOLoop.current")
+        self.ioloop_current = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.requests = []
+        self.responses = []
+
+        def async_req_to_key_store_patch(acc, path, method, body, callback):
+            self.requests.append((path, method, body))
+            callback(*self.responses.pop(0))
+
+        name_of_method_to_patch = (
+            "yar.key_service.ks_util."
+            "AsyncAction.async_req_to_key_store"
+        )
+        patcher = mock.patch(name_of_method_to_patch, async_req_to_key_store_patch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _create(self, num_creates):
+        callbacks = []
+        for i in range(num_creates):
+            callback = mock.Mock()
+            acc = async_creds_creator.AsyncCredsCreator(type(self)._key_store)
+            acc.create("dave%d@example.com" % i, "mac", callback)
+            callbacks.append(callback)
+        return callbacks
+
+    def test_saved_after_batch_window(self):
+        callbacks = self._create(2)
+        self.assertEqual(self.requests, [])
+
+        call_later = self.ioloop_current.return_value.call_later
+        self.assertEqual(call_later.call_count, 1)
+        (delay, save_batch, key_store) = call_later.call_args[0]
+        self.assertEqual(delay, 0.005)
+
+        # no result for a doc means the doc wasn't saved
+        self.responses.append((True, httplib.CREATED, []))
+        save_batch(key_store)
+        (path, method, body) = self.requests[0]
+        self.assertEqual((path, method), ("_bulk_docs", "POST"))
+        self.assertEqual(
+            [doc["principal"] for doc in body["docs"]],
+            ["dave0@example.com", "dave1@example.com"])
+        for callback in callbacks:
+            callback.assert_called_once_with(None)
+
+    def test_results_mapped_to_callers(self):
+        def respond(acc, path, method, body, callback):
+            self.requests.append((path, method, body))
+            docs = body["docs"]
+            callback(
+                True,
+                httplib.CREATED,
+                [
+                    {"ok": True, "id": docs[0]["_id"], "rev": "1-a"},
+                    {"id": docs[1]["_id"], "error": "conflict"},
+                    {"ok": True, "id": docs[2]["_id"], "rev": "1-c"},
+                ])
+
+        name_of_method_to_patch = (
+            "yar.key_service.ks_util."
+            "AsyncAction.async_req_to_key_store"
+        )
+        with mock.patch(name_of_method_to_patch, respond):
+            # the third create fills the batch which is saved at once
+            callbacks = self._create(3)
+
+        self.assertEqual(len(self.requests), 1)
+        self.assertTrue(self.ioloop_current.return_value.remove_timeout.called)
+        docs = self.requests[0][2]["docs"]
+
+        callbacks[0].assert_called_once_with(ks_util.filter_out_non_model_creds_properties(docs[0]))
+        callbacks[1].assert_called_once_with(None)
+        callbacks[2].assert_called_once_with(ks_util.filter_out_non_model_creds_properties(docs[2]))
+        self.assertEqual(callbacks[0].call_args[0][0]["principal"], "dave0@example.com")
+        self.assertEqual(callbacks[2].call_args[0][0]["principal"], "dave2@example.com")
+
+        # the next create starts a new batch
+        self._create(1)
+        self.assertEqual(self.ioloop_current.return_value.call_later.call_count, 2)
+
+    def test_key_store_error(self):
+        self.responses.append((False,))
+        callbacks = self._create(3)
+        self.assertEqual(len(self.requests), 1)
+        for callback in callbacks:
+            callback.assert_called_once_with(None)
+
+    def test_callback_error_does_not_stop_other_callbacks(self):
+        callbacks = self._create(2)
+        callbacks[0].side_effect = Exception("oops")
+
+        self.responses.append((False,))
+        (delay, save_batch, key_store) = self.ioloop_current.return_value.call_later.call_args[0]
+        save_batch(key_store)
+
+        for callback in callbacks:
+            callback.assert_called_once_with(None)
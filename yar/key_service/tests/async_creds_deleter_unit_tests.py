@@ -137,10 +137,12 @@ class TestCaseAsyncCredsDeleter(yar_test_util.TestCase):
             self.assertIsNotNone(acd)
 
             self.assertIsNotNone(path)
-            self.assertEqual(the_creds["_id"], path)
+            self.assertEqual("%s?rev=%s" % (the_creds["_id"], the_creds["_rev"]), path)
 
             self.assertIsNotNone(method)
-            self.assertEqual(method, "PUT")
+            self.assertEqual(method, "DELETE")
+
+            self.assertIsNone(body)
 
             self.assertIsNotNone(callback)
             if the_is_ok:
@@ -149,8 +151,7 @@ class TestCaseAsyncCredsDeleter(yar_test_util.TestCase):
                 callback(is_ok=False)
 
         def on_async_delete_done(is_ok):
-            self.assertIsNotNone(is_ok)
-            self.assertFalse(is_ok)
+            self.assertIsNone(is_ok)
 
         name_of_method_to_patch = (
             "yar.key_service.async_creds_retriever."
@@ -180,3 +181,128 @@ class TestCaseAsyncCredsDeleter(yar_test_util.TestCase):
         self._test_creds_update_failure(
             the_is_ok=True,
             the_code=httplib.INTERNAL_SERVER_ERROR)
+
+    def _mac_creds(self, doc_id=None):
+        mac_key_identifier = mac.MACKeyIdentifier.generate()
+        return {
+            "_id": doc_id or mac_key_identifier,
+            "_rev": "1-c81488ccbec47b14cec7010e18459a16",
+            "mac": {
+                "mac_algorithm": mac.MAC.algorithm,
+                "mac_key": mac.MACKey.generate(),
+                "mac_key_identifier": mac_key_identifier,
+            },
+            "principal": "dave@example.com",
+            "type": "creds_v2.0",
+        }
+
+    def _delete(self, key, revs, key_store_docs, codes):
+        """Delete ```key``` with ```revs``` recording the requests made
+        to the key store. ```key_store_docs``` is what the retriever
+        finds. ```codes``` are the key store's responses to DELETEs."""
+        self.requests = []
+        codes = list(codes)
+
+        def async_creds_retriever_fetch_patch(acr, callback, key):
+            self.requests.append(("fetch", key))
+            creds = key_store_docs.get(key, None)
+            callback(dict(creds) if creds else None, False if creds else None)
+
+        def async_req_to_key_store_patch(acd, path, method, body, callback):
+            self.assertEqual(method, "DELETE")
+            self.assertIsNone(body)
+            self.requests.append((method, path))
+            callback(is_ok=True, code=codes.pop(0))
+
+        callback = mock.Mock()
+        name_of_method_to_patch = "yar.key_service.async_creds_retriever.AsyncCredsRetriever.fetch"
+        with mock.patch(name_of_method_to_patch, async_creds_retriever_fetch_patch):
+            name_of_method_to_patch = "yar.key_service.ks_util.AsyncAction.async_req_to_key_store"
+            with mock.patch(name_of_method_to_patch, async_req_to_key_store_patch):
+                acd = async_creds_deleter.AsyncCredsDeleter(type(self)._key_store)
+                acd.delete(key, callback, revs=revs)
+
+        self.assertEqual(callback.call_count, 1)
+        return callback.call_args[0]
+
+    def test_delete_with_rev_is_one_request(self):
+        creds = self._mac_creds()
+        rv = self._delete(creds["_id"], [creds["_rev"]], {}, [httplib.OK])
+        self.assertEqual(rv, (True,))
+        self.assertEqual(
+            self.requests,
+            [("DELETE", "%s?rev=%s" % (creds["_id"], creds["_rev"]))])
+
+    def test_delete_without_rev(self):
+        creds = self._mac_creds()
+        rv = self._delete(creds["_id"], None, {creds["_id"]: creds}, [httplib.OK])
+        self.assertEqual(rv, (True,))
+        self.assertEqual(
+            self.requests,
+            [
+                ("fetch", creds["_id"]),
+                ("DELETE", "%s?rev=%s" % (creds["_id"], creds["_rev"])),
+            ])
+
+    def test_delete_with_rev_mismatch(self):
+        creds = self._mac_creds()
+        rv = self._delete(creds["_id"], ["2-dave"], {}, [httplib.CONFLICT])
+        self.assertEqual(rv, (False, True))
+
+    def test_delete_with_rev_v1_doc(self):
+        """When the key isn't a doc _id the doc is found by the
+        retriever and deleted if it has the expected _rev."""
+        creds = self._mac_creds(doc_id="9010212ebe184b13aecbd5ca5d72ae64")
+        key = creds["mac"]["mac_key_identifier"]
+        rv = self._delete(key, [creds["_rev"]], {key: creds}, [httplib.NOT_FOUND, httplib.OK])
+        self.assertEqual(rv, (True,))
+        self.assertEqual(
+            self.requests,
+            [
+                ("DELETE", "%s?rev=%s" % (key, creds["_rev"])),
+                ("fetch", key),
+                ("DELETE", "%s?rev=%s" % (creds["_id"], creds["_rev"])),
+            ])
+
+        rv = self._delete(key, ["2-dave"], {key: creds}, [httplib.NOT_FOUND])
+        self.assertEqual(rv, (False, True))
+
+    def test_delete_with_revs(self):
+        """With more than one acceptable _rev the doc is retrieved
+        and only deleted if its _rev is one of them."""
+        creds = self._mac_creds()
+        rv = self._delete(creds["_id"], ["2-dave", creds["_rev"]], {creds["_id"]: creds}, [httplib.OK])
+        self.assertEqual(rv, (True,))
+        self.assertEqual(
+            self.requests,
+            [
+                ("fetch", creds["_id"]),
+                ("DELETE", "%s?rev=%s" % (creds["_id"], creds["_rev"])),
+            ])
+
+        rv = self._delete(creds["_id"], ["2-dave", "3-dave"], {creds["_id"]: creds}, [])
+        self.assertEqual(rv, (False, True))
+
+    def test_delete_with_stale_rev_from_retriever(self):
+        """A conflict on a _rev provided by the retriever
+        is retried once."""
+        creds = self._mac_creds()
+        rv = self._delete(
+            creds["_id"],
+            None,
+            {creds["_id"]: creds},
+            [httplib.CONFLICT, httplib.OK])
+        self.assertEqual(rv, (True,))
+        self.assertEqual(len(self.requests), 4)
+
+        rv = self._delete(
+            creds["_id"],
+            None,
+            {creds["_id"]: creds},
+            [httplib.CONFLICT, httplib.CONFLICT])
+        self.assertEqual(rv, (None,))
+
+    def test_delete_not_a_creds_doc(self):
+        rv = self._delete("_all_docs", None, {}, [])
+        self.assertEqual(rv, (False,))
+        self.assertEqual(self.requests, [])
@@ -2,13 +2,17 @@
 async_creds_retriever module."""
 
 import httplib
+import json
 import os
 import sys
+import urllib
+import urlparse
 import uuid
 
 import mock
 
 from yar.key_service import async_creds_retriever
+from yar.key_service import key_store_cache
 from yar.key_service import ks_util
 from yar.util import mac
 from yar.tests import yar_test_util
@@ -36,9 +40,7 @@ class TestCaseAsyncCredsRetriever(yar_test_util.TestCase):
             self.assertIsNotNone(acr)
 
             self.assertIsNotNone(path)
-            expected_path_fmt = '_design/by_identifier/_view/by_identifier?key="%s"'
-            expected_path = expected_path_fmt % self.the_key
-            self.assertEqual(path, expected_path)
+            self.assertEqual(path, self.the_key)
 
             self.assertIsNotNone(method)
             self.assertEqual(method, "GET")
@@ -82,7 +84,7 @@ class TestCaseAsyncCredsRetriever(yar_test_util.TestCase):
 
         the_mac_key_identifier = mac.MACKeyIdentifier.generate()
         the_creds = {
-            "_id": "9010212ebe184b13aecbd5ca5d72ae64",
+            "_id": the_mac_key_identifier,
             "_rev": "1-c81488ccbec47b14cec7010e18459a16",
             "mac": {
                 "mac_algorithm": mac.MAC.algorithm,
@@ -90,17 +92,7 @@ class TestCaseAsyncCredsRetriever(yar_test_util.TestCase):
                 "mac_key_identifier": the_mac_key_identifier,
             },
             "principal": "dave@example.com",
-            "type": "creds_v1.0",
-        }
-
-        the_body = {
-            "rows": [
-                {
-                    "id": the_creds["_id"],
-                    "key": the_creds["mac"]["mac_key_identifier"],
-                    "value": the_creds,
-                },
-            ],
+            "type": "creds_v2.0",
         }
 
         def async_req_to_key_store_patch(acr,
@@ -112,9 +104,7 @@ class TestCaseAsyncCredsRetriever(yar_test_util.TestCase):
             self.assertIsNotNone(acr)
 
             self.assertIsNotNone(path)
-            expected_path_fmt = '_design/by_identifier/_view/by_identifier?key="%s"'
-            expected_path = expected_path_fmt % the_mac_key_identifier
-            self.assertEqual(path, expected_path)
+            self.assertEqual(path, the_mac_key_identifier)
 
             self.assertIsNotNone(method)
             self.assertEqual(method, "GET")
@@ -122,7 +112,7 @@ class TestCaseAsyncCredsRetriever(yar_test_util.TestCase):
             self.assertIsNone(body)
 
             self.assertIsNotNone(callback)
-            callback(is_ok=True, code=httplib.OK, body=the_body)
+            callback(is_ok=True, code=httplib.OK, body=the_creds)
 
         def on_async_create_done(creds, is_creds_collection):
 
@@ -205,7 +195,7 @@ class TestCaseAsyncCredsRetriever(yar_test_util.TestCase):
 
         def _to_couchdb_fmt(creds):
             _id = creds["_id"]
-            rv = {"id": _id, "key": _id, "value": creds}
+            rv = {"id": _id, "key": the_principal, "value": None, "doc": creds}
             return rv
 
         the_body = {
@@ -222,10 +212,10 @@ class TestCaseAsyncCredsRetriever(yar_test_util.TestCase):
 
             self.assertIsNotNone(acr)
 
-            expected_path_fmt = (
-                '_design/by_principal/_view/by_principal?key="%s"'
-            )
-            expected_path = expected_path_fmt % the_principal
+            expected_path = "_design/by_principal/_view/by_principal?%s" % urllib.urlencode([
+                ("key", json.dumps(the_principal)),
+                ("include_docs", "true"),
+            ])
             self.assertIsNotNone(path)
             self.assertEqual(path, expected_path)
 
@@ -270,7 +260,7 @@ class TestCaseAsyncCredsRetriever(yar_test_util.TestCase):
     def test_key_store_returns_multiple_docs_for_one_mac_key_identifier(self):
         """A GET to the key store's
         _design/by_identifier/_view/by_identifier
-        view should return either 1 or 0 creds.
+        view (see test_v1_fallback) should return either 1 or 0 creds.
         This tests verifies how the AsyncCredsRetriever's
         behavior when multiple creds are returned
         from such a GET ie. when there's an error with
@@ -295,12 +285,14 @@ class TestCaseAsyncCredsRetriever(yar_test_util.TestCase):
                 {
                     "id": the_creds["_id"],
                     "key": the_creds["mac"]["mac_key_identifier"],
-                    "value": the_creds,
+                    "value": None,
+                    "doc": the_creds,
                 },
                 {
                     "id": the_creds["_id"],
                     "key": the_creds["mac"]["mac_key_identifier"],
-                    "value": the_creds,
+                    "value": None,
+                    "doc": the_creds,
                 },
             ],
         }
@@ -314,14 +306,17 @@ class TestCaseAsyncCredsRetriever(yar_test_util.TestCase):
             self.assertIsNotNone(acr)
 
             self.assertIsNotNone(path)
-            expected_path_fmt = '_design/by_identifier/_view/by_identifier?key="%s"'
-            expected_path = expected_path_fmt % the_mac_key_identifier
+            if path == the_mac_key_identifier:
+                callback(is_ok=True, code=httplib.NOT_FOUND)
+                return
+
+            expected_path = "_design/by_identifier/_view/by_identifier?include_docs=true"
             self.assertEqual(path, expected_path)
 
             self.assertIsNotNone(method)
-            self.assertEqual(method, "GET")
+            self.assertEqual(method, "POST")
 
-            self.assertIsNone(body)
+            self.assertEqual(body, {"keys": [the_mac_key_identifier]})
 
             self.assertIsNotNone(callback)
             callback(is_ok=True, code=httplib.OK, body=the_body)
@@ -341,3 +336,291 @@ class TestCaseAsyncCredsRetriever(yar_test_util.TestCase):
             acr.fetch(
                 callback=on_async_create_done,
                 key=the_mac_key_identifier)
+
+    def test_served_from_key_store_cache(self):
+        """Verify that once creds have been retrieved from the key store
+        they're served from the key store cache and that changing the
+        creds returned by the retriever doesn't change the cached creds."""
+
+        the_mac_key_identifier = mac.MACKeyIdentifier.generate()
+        the_creds = {
+            "_id": the_mac_key_identifier,
+            "_rev": "1-c81488ccbec47b14cec7010e18459a16",
+            "mac": {
+                "mac_algorithm": mac.MAC.algorithm,
+                "mac_key": mac.MACKey.generate(),
+                "mac_key_identifier": the_mac_key_identifier,
+            },
+            "principal": "dave@example.com",
+            "type": "creds_v2.0",
+        }
+
+        def async_req_to_key_store_patch(acr, path, method, body, callback):
+            callback(is_ok=True, code=httplib.OK, body=the_creds)
+
+        cache = key_store_cache.KeyStoreCache(10)
+        cache.is_live = True
+
+        name_of_method_to_patch = "yar.key_service.ks_util.AsyncAction.async_req_to_key_store"
+        with mock.patch.object(key_store_cache, "_key_store_cache", cache):
+            with mock.patch(name_of_method_to_patch,
+                            side_effect=async_req_to_key_store_patch,
+                            autospec=True) as patched:
+                for i in range(2):
+                    callback = mock.Mock()
+                    acr = async_creds_retriever.AsyncCredsRetriever(type(self)._key_store)
+                    acr.fetch(callback=callback, key=the_mac_key_identifier)
+                    callback.assert_called_once_with(the_creds, False)
+                    callback.call_args[0][0]["_deleted"] = True
+
+                self.assertEqual(patched.call_count, 1)
+                self.assertEqual(cache.stats()["hits"], 1)
+
+    def _test_v1_fallback(self, the_v1_fallback):
+        """When a doc can't be found by _id confirm the
+        by_identifier view is queried if and only if
+        ```async_creds_retriever.v1_fallback``` is True."""
+
+        the_mac_key_identifier = mac.MACKeyIdentifier.generate()
+        the_creds = {
+            "_id": "9010212ebe184b13aecbd5ca5d72ae64",
+            "_rev": "1-c81488ccbec47b14cec7010e18459a16",
+            "mac": {
+                "mac_algorithm": mac.MAC.algorithm,
+                "mac_key": mac.MACKey.generate(),
+                "mac_key_identifier": the_mac_key_identifier,
+            },
+            "principal": "dave@example.com",
+            "type": "creds_v1.0",
+        }
+
+        paths = []
+
+        def async_req_to_key_store_patch(acr, path, method, body, callback):
+            paths.append(path)
+            if path == the_mac_key_identifier:
+                callback(is_ok=True, code=httplib.NOT_FOUND)
+                return
+
+            the_body = {
+                "rows": [
+                    {
+                        "id": the_creds["_id"],
+                        "key": the_mac_key_identifier,
+                        "value": None,
+                        "doc": the_creds,
+                    },
+                ],
+            }
+            callback(is_ok=True, code=httplib.OK, body=the_body)
+
+        callback = mock.Mock()
+
+        name_of_method_to_patch = "yar.key_service.ks_util.AsyncAction.async_req_to_key_store"
+        with mock.patch.object(async_creds_retriever, "v1_fallback", the_v1_fallback):
+            with mock.patch(name_of_method_to_patch, async_req_to_key_store_patch):
+                acr = async_creds_retriever.AsyncCredsRetriever(type(self)._key_store)
+                acr.fetch(callback=callback, key=the_mac_key_identifier)
+
+        if the_v1_fallback:
+            self.assertEqual(
+                paths,
+                [the_mac_key_identifier, "_design/by_identifier/_view/by_identifier?include_docs=true"])
+            callback.assert_called_once_with(the_creds, False)
+        else:
+            self.assertEqual(paths, [the_mac_key_identifier])
+            callback.assert_called_once_with(None, False)
+
+    def test_v1_fallback(self):
+        self._test_v1_fallback(True)
+
+    def test_no_v1_fallback(self):
+        self._test_v1_fallback(False)
+
+    def test_not_a_creds_doc(self):
+        """Keys which CouchDB would treat as something other than a
+        doc _id aren't found and aren't sent to the key store."""
+        name_of_method_to_patch = "yar.key_service.ks_util.AsyncAction.async_req_to_key_store"
+        with mock.patch(name_of_method_to_patch) as async_req_to_key_store_patch:
+            callback = mock.Mock()
+            acr = async_creds_retriever.AsyncCredsRetriever(type(self)._key_store)
+            acr.fetch(callback=callback, key="_all_docs")
+            callback.assert_called_once_with(None, False)
+            self.assertFalse(async_req_to_key_store_patch.called)
+
+    def _test_fetch_page(self, the_start, num_rows, the_limit):
+        the_principal = "dave@example.com"
+        rows = []
+        for i in range(num_rows):
+            doc_id = "%08d" % i
+            doc = {
+                "_id": doc_id,
+                "_rev": "1-c81488ccbec47b14cec7010e18459a16",
+                "basic": {
+                    "api_key": doc_id,
+                },
+                "principal": the_principal,
+                "type": "creds_v2.0",
+            }
+            rows.append({"id": doc_id, "key": the_principal, "value": None, "doc": doc})
+
+        def async_req_to_key_store_patch(acr, path, method, body, callback):
+            (path, query) = path.split("?")
+            self.assertEqual(path, "_design/by_principal/_view/by_principal")
+            query_string_args = dict(urlparse.parse_qsl(query))
+            self.assertEqual(query_string_args["startkey"], '"%s"' % the_principal)
+            self.assertEqual(query_string_args["endkey"], '"%s"' % the_principal)
+            self.assertEqual(query_string_args["include_docs"], "true")
+            self.assertEqual(query_string_args["limit"], str(the_limit + 1))
+            self.assertEqual(query_string_args.get("startkey_docid", None), the_start)
+            callback(is_ok=True, code=httplib.OK, body={"rows": rows[:the_limit + 1]})
+
+        callback = mock.Mock()
+        name_of_method_to_patch = "yar.key_service.ks_util.AsyncAction.async_req_to_key_store"
+        with mock.patch(name_of_method_to_patch, async_req_to_key_store_patch):
+            acr = async_creds_retriever.AsyncCredsRetriever(type(self)._key_store)
+            acr.fetch_page(
+                callback,
+                the_principal,
+                the_limit,
+                start=the_start,
+                is_filter_out_non_model_properties=True)
+
+        self.assertEqual(callback.call_count, 1)
+        return callback.call_args[0]
+
+    def test_fetch_page_with_next_page(self):
+        (creds, next_start) = self._test_fetch_page(None, 5, 3)
+        self.assertEqual([each_creds["basic"]["api_key"] for each_creds in creds], ["00000000", "00000001", "00000002"])
+        self.assertNotIn("_id", creds[0])
+        self.assertEqual(next_start, "00000003")
+
+    def test_fetch_last_page(self):
+        (creds, next_start) = self._test_fetch_page("00000003", 3, 3)
+        self.assertEqual(len(creds), 3)
+        self.assertIsNone(next_start)
+
+    def _migrated_docs(self):
+        """A principal's docs while the key store is being migrated - the
+        creds_v1.0 doc for api key 00000001 has been migrated to a
+        creds_v2.0 doc but hasn't been deleted yet."""
+        docs = []
+        for (doc_id, api_key, doc_type) in [
+                ("00000001", "00000001", "creds_v2.0"),
+                ("00000002", "00000001", "creds_v1.0"),
+                ("00000003", "00000003", "creds_v2.0")]:
+            docs.append({
+                "_id": doc_id,
+                "_rev": "1-c81488ccbec47b14cec7010e18459a16",
+                "basic": {
+                    "api_key": api_key,
+                },
+                "principal": "dave@example.com",
+                "type": doc_type,
+            })
+        return docs
+
+    def test_migrated_v1_docs_left_out(self):
+        the_docs = self._migrated_docs()
+
+        def by_principal_patch(backend, principal, callback, stale=None, limit=None, start=None):
+            callback(True, httplib.OK, the_docs)
+
+        name_of_method_to_patch = "yar.key_service.key_store_backends.CouchDBKeyStoreBackend.by_principal"
+        with mock.patch(name_of_method_to_patch, by_principal_patch):
+            callback = mock.Mock()
+            acr = async_creds_retriever.AsyncCredsRetriever(type(self)._key_store)
+            acr.fetch(callback, principal="dave@example.com")
+            callback.assert_called_once_with([the_docs[0], the_docs[2]], True)
+
+            callback = mock.Mock()
+            acr = async_creds_retriever.AsyncCredsRetriever(type(self)._key_store)
+            acr.fetch(callback, principal="dave@example.com", is_include_migrated_v1_docs=True)
+            callback.assert_called_once_with(the_docs, True)
+
+    def test_fetch_page_migrated_v1_docs_left_out(self):
+        the_docs = self._migrated_docs()
+
+        def by_principal_patch(backend, principal, callback, stale=None, limit=None, start=None):
+            self.assertEqual(limit, 3)
+            callback(True, httplib.OK, the_docs)
+
+        callback = mock.Mock()
+        name_of_method_to_patch = "yar.key_service.key_store_backends.CouchDBKeyStoreBackend.by_principal"
+        with mock.patch(name_of_method_to_patch, by_principal_patch):
+            acr = async_creds_retriever.AsyncCredsRetriever(type(self)._key_store)
+            acr.fetch_page(callback, "dave@example.com", 2)
+        # the next page still starts after the 2 rows of this page
+        callback.assert_called_once_with([the_docs[0]], "00000003")
+
+    def test_fetch_page_error(self):
+        def async_req_to_key_store_patch(acr, path, method, body, callback):
+            callback(is_ok=False)
+
+        callback = mock.Mock()
+        name_of_method_to_patch = "yar.key_service.ks_util.AsyncAction.async_req_to_key_store"
+        with mock.patch(name_of_method_to_patch, async_req_to_key_store_patch):
+            acr = async_creds_retriever.AsyncCredsRetriever(type(self)._key_store)
+            acr.fetch_page(callback, "dave@example.com", 10)
+        callback.assert_called_once_with(None, None)
+
+    def _test_stale_v1_fallback(self, the_stale):
+        """Confirm the by_identifier view is queried with the requested
+        read consistency and that only strict view responses are
+        put in the key store cache."""
+        the_mac_key_identifier = mac.MACKeyIdentifier.generate()
+        the_creds = {
+            "_id": "9010212ebe184b13aecbd5ca5d72ae64",
+            "_rev": "1-c81488ccbec47b14cec7010e18459a16",
+            "principal": "dave@example.com",
+            "type": "creds_v1.0",
+        }
+
+        paths = []
+
+        def async_req_to_key_store_patch(acr, path, method, body, callback):
+            paths.append(path)
+            if path == the_mac_key_identifier:
+                callback(is_ok=True, code=httplib.NOT_FOUND)
+                return
+            the_body = {"rows": [{"id": the_creds["_id"], "doc": the_creds}]}
+            callback(is_ok=True, code=httplib.OK, body=the_body)
+
+        cache = key_store_cache.KeyStoreCache(10)
+        cache.is_live = True
+        callback = mock.Mock()
+
+        name_of_method_to_patch = "yar.key_service.ks_util.AsyncAction.async_req_to_key_store"
+        with mock.patch.object(key_store_cache, "_key_store_cache", cache):
+            with mock.patch.object(async_creds_retriever, "v1_fallback", True):
+                with mock.patch(name_of_method_to_patch, async_req_to_key_store_patch):
+                    acr = async_creds_retriever.AsyncCredsRetriever(type(self)._key_store)
+                    acr.fetch(callback=callback, key=the_mac_key_identifier, stale=the_stale)
+
+        callback.assert_called_once_with(the_creds, False)
+        query_string_args = dict(urlparse.parse_qsl(paths[1].split("?")[1]))
+        return (query_string_args.get("stale", None), len(cache))
+
+    def test_stale_v1_fallback_not_cached(self):
+        self.assertEqual(self._test_stale_v1_fallback("update_after"), ("update_after", 0))
+        self.assertEqual(self._test_stale_v1_fallback("ok"), ("ok", 0))
+
+    def test_strict_v1_fallback_cached(self):
+        self.assertEqual(self._test_stale_v1_fallback("strict"), (None, 1))
+        self.assertEqual(self._test_stale_v1_fallback(None), (None, 1))
+
+    def test_fetch_page_stale(self):
+        paths = []
+
+        def async_req_to_key_store_patch(acr, path, method, body, callback):
+            paths.append(path)
+            callback(is_ok=True, code=httplib.OK, body={"rows": []})
+
+        callback = mock.Mock()
+        name_of_method_to_patch = "yar.key_service.ks_util.AsyncAction.async_req_to_key_store"
+        with mock.patch(name_of_method_to_patch, async_req_to_key_store_patch):
+            acr = async_creds_retriever.AsyncCredsRetriever(type(self)._key_store)
+            acr.fetch_page(callback, "dave@example.com", 10, stale="ok")
+        callback.assert_called_once_with([], None)
+        query_string_args = dict(urlparse.parse_qsl(paths[0].split("?")[1]))
+        self.assertEqual(query_string_args["stale"], "ok")
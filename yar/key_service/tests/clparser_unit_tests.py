@@ -23,6 +23,23 @@ class CommandLineParserUnitTase(unittest.TestCase):
         self.assertEqual(clo.logging_level, logging.ERROR)
         self.assertEqual(clo.listen_on, ("127.0.0.1", 8070))
         self.assertEqual(clo.key_store, "127.0.0.1:5984/creds")
+        self.assertIsNone(clo.key_store_replicas)
+        self.assertEqual(clo.key_store_backend, "couchdb")
+        self.assertEqual(clo.local_key_store, "creds.yks")
+        self.assertEqual(clo.processes, 1)
+        self.assertFalse(clo.reuse_port)
+        self.assertEqual(clo.upstream_max_clients, 10)
+        self.assertEqual(clo.upstream_max_queue_size, 0)
+        self.assertEqual(clo.upstream_prewarm_connections, 0)
+        self.assertEqual(clo.upstream_stats_interval, 0)
+        self.assertEqual(clo.key_store_cache_size, 10000)
+        self.assertTrue(clo.key_store_v1_fallback)
+        self.assertEqual(clo.create_batch_window, 0)
+        self.assertEqual(clo.create_batch_size, 100)
+        self.assertEqual(clo.key_lookup_stale, "update_after")
+        self.assertEqual(clo.principal_lookup_stale, "strict")
+        self.assertEqual(clo.view_refresh_interval, 5)
+        self.assertEqual(clo.cache_max_age, 30)
         self.assertIsNone(clo.logging_file)
         self.assertIsNone(clo.syslog)
 
@@ -74,6 +91,23 @@ class CommandLineParserUnitTase(unittest.TestCase):
         self.assertIsNone(clo.logging_file)
         self.assertIsNone(clo.syslog)
 
+    def test_key_store_replicas(self):
+        """Verify the command line parser correctly parses
+        the --keystorereplicas command line arg."""
+        args = [
+            "--keystorereplicas", "1.1.1.1:7878/bindle, 2.2.2.2:7878/bindle",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.logging_level, logging.ERROR)
+        self.assertEqual(clo.listen_on, ("127.0.0.1", 8070))
+        self.assertEqual(clo.key_store, "127.0.0.1:5984/creds")
+        self.assertEqual(
+            clo.key_store_replicas,
+            ["1.1.1.1:7878/bindle", "2.2.2.2:7878/bindle"])
+
     def test_syslog(self):
         """Verify the command line parser correctly parses
         the --syslog command line arg."""
@@ -90,6 +124,149 @@ class CommandLineParserUnitTase(unittest.TestCase):
         self.assertIsNone(clo.logging_file)
         self.assertEqual(clo.syslog, args[-1])
 
+    def test_processes(self):
+        """Verify the command line parser correctly parses
+        the --processes command line arg."""
+        args = [
+            "--processes", "4",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.logging_level, logging.ERROR)
+        self.assertEqual(clo.listen_on, ("127.0.0.1", 8070))
+        self.assertEqual(clo.processes, 4)
+        self.assertFalse(clo.reuse_port)
+
+    def test_reuse_port(self):
+        """Verify the command line parser correctly parses
+        the --reuseport command line arg."""
+        args = [
+            "--reuseport", "true",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.logging_level, logging.ERROR)
+        self.assertEqual(clo.listen_on, ("127.0.0.1", 8070))
+        self.assertEqual(clo.processes, 1)
+        self.assertTrue(clo.reuse_port)
+
+    def test_upstream(self):
+        """Verify the command line parser correctly parses
+        the --upstream* command line args."""
+        args = [
+            "--upstreammaxclients", "42",
+            "--upstreammaxqueuesize", "43",
+            "--upstreamprewarm", "44",
+            "--upstreamstatsinterval", "45",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.logging_level, logging.ERROR)
+        self.assertEqual(clo.listen_on, ("127.0.0.1", 8070))
+        self.assertEqual(clo.upstream_max_clients, 42)
+        self.assertEqual(clo.upstream_max_queue_size, 43)
+        self.assertEqual(clo.upstream_prewarm_connections, 44)
+        self.assertEqual(clo.upstream_stats_interval, 45)
+
+    def test_key_store_cache_size(self):
+        """Verify the command line parser correctly parses
+        the --keystorecachesize command line arg."""
+        args = [
+            "--keystorecachesize", "0",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.logging_level, logging.ERROR)
+        self.assertEqual(clo.listen_on, ("127.0.0.1", 8070))
+        self.assertEqual(clo.key_store_cache_size, 0)
+
+    def test_key_store_v1_fallback(self):
+        """Verify the command line parser correctly parses
+        the --keystorev1fallback command line arg."""
+        args = [
+            "--keystorev1fallback", "false",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.logging_level, logging.ERROR)
+        self.assertEqual(clo.listen_on, ("127.0.0.1", 8070))
+        self.assertFalse(clo.key_store_v1_fallback)
+
+    def test_key_store_backend(self):
+        """Verify the command line parser correctly parses
+        the --keystorebackend and --localkeystore command line args."""
+        args = [
+            "--keystorebackend", "local",
+            "--localkeystore", "/var/lib/yar/creds.yks",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.logging_level, logging.ERROR)
+        self.assertEqual(clo.listen_on, ("127.0.0.1", 8070))
+        self.assertEqual(clo.key_store_backend, "local")
+        self.assertEqual(clo.local_key_store, "/var/lib/yar/creds.yks")
+
+    def test_create_batch(self):
+        """Verify the command line parser correctly parses
+        the --createbatchwindow and --createbatchsize command line args."""
+        args = [
+            "--createbatchwindow", "5",
+            "--createbatchsize", "42",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.logging_level, logging.ERROR)
+        self.assertEqual(clo.listen_on, ("127.0.0.1", 8070))
+        self.assertEqual(clo.create_batch_window, 5)
+        self.assertEqual(clo.create_batch_size, 42)
+
+    def test_read_consistency(self):
+        """Verify the command line parser correctly parses
+        the --keylookupstale, --principallookupstale and
+        --viewrefreshinterval command line args."""
+        args = [
+            "--keylookupstale", "ok",
+            "--principallookupstale", "update_after",
+            "--viewrefreshinterval", "0",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.logging_level, logging.ERROR)
+        self.assertEqual(clo.listen_on, ("127.0.0.1", 8070))
+        self.assertEqual(clo.key_lookup_stale, "ok")
+        self.assertEqual(clo.principal_lookup_stale, "update_after")
+        self.assertEqual(clo.view_refresh_interval, 0)
+
+    def test_cache_max_age(self):
+        """Verify the command line parser correctly parses
+        the --cachemaxage command line arg."""
+        args = [
+            "--cachemaxage", "42",
+        ]
+
+        clp = CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.logging_level, logging.ERROR)
+        self.assertEqual(clo.listen_on, ("127.0.0.1", 8070))
+        self.assertEqual(clo.cache_max_age, 42)
+
     def test_logging_file(self):
         """Verify the command line parser correctly parses
         the --logfile command line arg."""
@@ -53,6 +53,59 @@ class KeyServerCreateCredsRequestTestCase(unittest.TestCase):
             self._validate(request)
 
 
+class KeyServerBulkCreateCredsRequestTestCase(unittest.TestCase):
+
+    def _validate(self, request):
+        jsonschema.validate(
+            request,
+            jsonschemas.bulk_create_creds_request)
+
+    def test_request_all_good(self):
+        self._validate({
+            "creds": [
+                {"principal": "simonsdave@gmail.com"},
+                {"principal": "simonsdave@gmail.com", "auth_scheme": "mac"},
+            ],
+        })
+
+    def test_request_invalid_item(self):
+        with self.assertRaises(jsonschema.ValidationError):
+            self._validate({"creds": [{"principal": ""}]})
+
+    def test_request_empty(self):
+        with self.assertRaises(jsonschema.ValidationError):
+            self._validate({"creds": []})
+
+    def test_request_too_big(self):
+        creds = [{"principal": "simonsdave@gmail.com"}] * (jsonschemas.max_bulk_size + 1)
+        with self.assertRaises(jsonschema.ValidationError):
+            self._validate({"creds": creds})
+
+
+class KeyServerBulkGetCredsRequestTestCase(unittest.TestCase):
+
+    def _validate(self, request):
+        jsonschema.validate(
+            request,
+            jsonschemas.bulk_get_creds_request)
+
+    def test_request_all_good(self):
+        self._validate({"keys": [mac.MACKeyIdentifier.generate()]})
+
+    def test_request_zero_length_key(self):
+        with self.assertRaises(jsonschema.ValidationError):
+            self._validate({"keys": [""]})
+
+    def test_request_too_big(self):
+        keys = ["dave"] * (jsonschemas.max_bulk_size + 1)
+        with self.assertRaises(jsonschema.ValidationError):
+            self._validate({"keys": keys})
+
+    def test_request_extra_properties(self):
+        with self.assertRaises(jsonschema.ValidationError):
+            self._validate({"keys": ["dave"], "principal": "dave"})
+
+
 class KeyServerGetCredsResponseTestCase(unittest.TestCase):
 
     def _uuid(self):
@@ -10,6 +10,7 @@ import socket
 import sys
 import time
 import unittest
+import urlparse
 import uuid
 
 import mock
@@ -165,13 +166,15 @@ class TestCase(yar_test_util.TestCase):
                         callback,
                         key,
                         principal,
-                        is_filter_out_non_model_properties):
+                        is_filter_out_non_model_properties,
+                        stale):
 
             self.assertIsNotNone(acr)
             self.assertIsNotNone(callback)
             self.assertIsNotNone(key)
             self.assertEqual(key, the_key)
             self.assertIsNone(principal)
+            self.assertEqual(stale, key_service_request_handler.key_lookup_stale)
 
             for creds in self._creds_database:
                 key = self._key_from_creds(creds)
@@ -231,11 +234,13 @@ class TestCase(yar_test_util.TestCase):
                         callback,
                         key,
                         principal,
-                        is_filter_out_non_model_properties):
+                        is_filter_out_non_model_properties,
+                        stale):
 
             self.assertIsNotNone(acr)
             self.assertIsNotNone(callback)
             self.assertIsNone(key)
+            self.assertEqual(stale, key_service_request_handler.principal_lookup_stale)
             if the_principal is None:
                 self.assertIsNone(principal)
             else:
@@ -279,7 +284,7 @@ class TestCase(yar_test_util.TestCase):
         self.assertIsNotNone(the_key)
         self.assertTrue(0 < len(the_key))
 
-        def async_creds_deleter_patch(acd, key, callback):
+        def async_creds_deleter_patch(acd, key, callback, revs=None):
             self.assertIsNotNone(acd)
             self.assertIsNotNone(key)
             self.assertEqual(key, the_key)
@@ -306,7 +311,8 @@ class TestCase(yar_test_util.TestCase):
                         callback,
                         key,
                         principal,
-                        is_filter_out_non_model_properties):
+                        is_filter_out_non_model_properties,
+                        stale):
             self.assertIsNotNone(acr)
             self.assertIsNotNone(callback)
             self.assertEqual(key, the_key)
@@ -410,7 +416,7 @@ class TestCase(yar_test_util.TestCase):
     def test_delete_failure(self):
         the_mac_key_identifier = uuid.uuid4().hex
 
-        def delete_patch(acd, mac_key_identifier, callback):
+        def delete_patch(acd, mac_key_identifier, callback, revs=None):
             self.assertIsNotNone(acd)
             self.assertIsNotNone(mac_key_identifier)
             self.assertEqual(mac_key_identifier, the_mac_key_identifier)
@@ -532,3 +538,397 @@ class TestCase(yar_test_util.TestCase):
 
             self.assertIsNotNone(response)
             self.assertEqual(httplib.INTERNAL_SERVER_ERROR, response.status)
+
+    def _bulk_request(self, resource, body):
+        http_client = httplib2.Http()
+        url = "%s/%s" % (self.url(), resource)
+        response, content = http_client.request(
+            url,
+            "POST",
+            body=json.dumps(body),
+            headers={"Content-Type": "application/json; charset=utf8"})
+        self.assertIsNotNone(response)
+        if response.status not in [httplib.OK, httplib.CREATED]:
+            return (response, None)
+        self.assertIsJsonUtf8ContentType(response["content-type"])
+        return (response, json.loads(content))
+
+    def test_bulk_create(self):
+        the_creds_requests = [
+            {"principal": uuid.uuid4().hex, "auth_scheme": "mac"},
+            {"principal": uuid.uuid4().hex, "auth_scheme": "basic"},
+        ]
+
+        def create_patch(abcc, creds_requests, callback):
+            self.assertEqual(creds_requests, the_creds_requests)
+            callback([
+                {
+                    "principal": creds_requests[0]["principal"],
+                    "mac": {
+                        "mac_key_identifier": mac.MACKeyIdentifier.generate(),
+                        "mac_key": mac.MACKey.generate(),
+                        "mac_algorithm": mac.MAC.algorithm,
+                    },
+                },
+                None,
+            ])
+
+        name_of_method_to_patch = (
+            "yar.key_service.async_bulk_creds_creator."
+            "AsyncBulkCredsCreator.create"
+        )
+        with mock.patch(name_of_method_to_patch, create_patch):
+            (response, body) = self._bulk_request(
+                "_bulk_create",
+                {"creds": the_creds_requests})
+            self.assertEqual(httplib.CREATED, response.status)
+
+        creds = body["creds"]
+        self.assertEqual(len(creds), 2)
+        jsonschema.validate(creds[0], jsonschemas.create_creds_response)
+        self.assertEqual(
+            creds[0]["links"]["self"]["href"],
+            "%s/%s" % (self.url(), self._key_from_creds(creds[0])))
+        self.assertIn("error", creds[1])
+
+    def test_bulk_create_failure(self):
+        def create_patch(abcc, creds_requests, callback):
+            callback(None)
+
+        name_of_method_to_patch = (
+            "yar.key_service.async_bulk_creds_creator."
+            "AsyncBulkCredsCreator.create"
+        )
+        with mock.patch(name_of_method_to_patch, create_patch):
+            (response, body) = self._bulk_request(
+                "_bulk_create",
+                {"creds": [{"principal": uuid.uuid4().hex}]})
+            self.assertEqual(httplib.INTERNAL_SERVER_ERROR, response.status)
+
+    def test_bulk_create_bad_request(self):
+        (response, body) = self._bulk_request("_bulk_create", {"creds": []})
+        self.assertEqual(httplib.BAD_REQUEST, response.status)
+
+    def test_bulk_get(self):
+        principal = uuid.uuid4().hex
+        keys = [self._key_from_creds(self._create_creds(principal)[0]) for i in range(3)]
+        not_found_key = uuid.uuid4().hex
+        the_keys = [keys[0], not_found_key, keys[1], keys[2]]
+
+        def fetch_patch(abcr, keys, callback, is_filter_out_non_model_properties, stale):
+            self.assertEqual(keys, the_keys)
+            self.assertTrue(is_filter_out_non_model_properties)
+            self.assertEqual(stale, key_service_request_handler.key_lookup_stale)
+            creds_by_key = dict([(key, None) for key in keys])
+            for creds in self._creds_database:
+                key = self._key_from_creds(creds)
+                if key in creds_by_key:
+                    creds = dict(creds)
+                    del creds["links"]
+                    creds_by_key[key] = creds
+            callback(creds_by_key)
+
+        name_of_method_to_patch = (
+            "yar.key_service.async_bulk_creds_retriever."
+            "AsyncBulkCredsRetriever.fetch"
+        )
+        with mock.patch(name_of_method_to_patch, fetch_patch):
+            (response, body) = self._bulk_request("_bulk_get", {"keys": the_keys})
+            self.assertEqual(httplib.OK, response.status)
+
+        self.assertEqual(body["not_found"], [not_found_key])
+        self.assertEqual(
+            [self._key_from_creds(creds) for creds in body["creds"]],
+            keys)
+        for creds in body["creds"]:
+            jsonschema.validate(creds, jsonschemas.get_creds_response)
+            self.assertEqual(
+                creds["links"]["self"]["href"],
+                "%s/%s" % (self.url(), self._key_from_creds(creds)))
+
+    def test_bulk_get_failure(self):
+        def fetch_patch(abcr, keys, callback, is_filter_out_non_model_properties, stale):
+            callback(None)
+
+        name_of_method_to_patch = (
+            "yar.key_service.async_bulk_creds_retriever."
+            "AsyncBulkCredsRetriever.fetch"
+        )
+        with mock.patch(name_of_method_to_patch, fetch_patch):
+            (response, body) = self._bulk_request("_bulk_get", {"keys": ["dave"]})
+            self.assertEqual(httplib.INTERNAL_SERVER_ERROR, response.status)
+
+    def test_bulk_get_bad_request(self):
+        (response, body) = self._bulk_request("_bulk_get", {"keys": "dave"})
+        self.assertEqual(httplib.BAD_REQUEST, response.status)
+
+    def _fetch_page_patch(self,
+                          callback,
+                          principal,
+                          limit,
+                          start=None,
+                          is_filter_out_non_model_properties=False,
+                          stale=None):
+        """Pages through ```self._creds_database``` using the
+        creds' keys as doc _ids."""
+        self.assertTrue(is_filter_out_non_model_properties)
+        self.assertEqual(stale, key_service_request_handler.principal_lookup_stale)
+        principals_creds = []
+        for creds in self._creds_database:
+            if principal == creds["principal"]:
+                creds = dict(creds)
+                del creds["links"]
+                principals_creds.append(creds)
+        principals_creds.sort(key=self._key_from_creds)
+
+        keys = [self._key_from_creds(creds) for creds in principals_creds]
+        first = keys.index(start) if start is not None else 0
+        page = principals_creds[first:first + limit]
+        next_start = keys[first + limit] if first + limit < len(keys) else None
+        callback(page, next_start)
+
+    def test_get_by_principal_paginated(self):
+        principal = uuid.uuid4().hex
+        keys = sorted([self._key_from_creds(self._create_creds(principal)[0]) for i in range(5)])
+
+        name_of_method_to_patch = (
+            "yar.key_service.async_creds_retriever."
+            "AsyncCredsRetriever.fetch_page"
+        )
+        with mock.patch(name_of_method_to_patch, self._fetch_page_patch):
+            url = "%s?principal=%s&limit=2" % (self.url(), principal)
+            keys_from_pages = []
+            while url:
+                http_client = httplib2.Http()
+                response, content = http_client.request(url, "GET")
+                self.assertEqual(httplib.OK, response.status)
+                body = json.loads(content)
+                self.assertTrue(len(body["creds"]) <= 2)
+                for creds in body["creds"]:
+                    jsonschema.validate(creds, jsonschemas.get_creds_response)
+                    keys_from_pages.append(self._key_from_creds(creds))
+                url = body.get("links", {}).get("next", {}).get("href", None)
+                if url:
+                    query_string_args = dict(urlparse.parse_qsl(urlparse.urlparse(url).query))
+                    self.assertEqual(query_string_args["principal"], principal)
+                    self.assertEqual(query_string_args["limit"], "2")
+
+        self.assertEqual(keys_from_pages, keys)
+
+    def test_get_by_principal_paginated_bad_limit(self):
+        for limit in ["0", "dave", str(key_service_request_handler.max_page_size + 1)]:
+            url = "%s?principal=dave&limit=%s" % (self.url(), limit)
+            http_client = httplib2.Http()
+            response, content = http_client.request(url, "GET")
+            self.assertEqual(httplib.BAD_REQUEST, response.status)
+
+    def test_get_by_principal_paginated_failure(self):
+        def fetch_page_patch(acr,
+                             callback,
+                             principal,
+                             limit,
+                             start=None,
+                             is_filter_out_non_model_properties=False,
+                             stale=None):
+            callback(None, None)
+
+        name_of_method_to_patch = (
+            "yar.key_service.async_creds_retriever."
+            "AsyncCredsRetriever.fetch_page"
+        )
+        with mock.patch(name_of_method_to_patch, fetch_page_patch):
+            url = "%s?principal=dave&limit=10" % self.url()
+            http_client = httplib2.Http()
+            response, content = http_client.request(url, "GET")
+            self.assertEqual(httplib.INTERNAL_SERVER_ERROR, response.status)
+
+    def _test_get_by_principal_streamed(self, num_creds):
+        principal = uuid.uuid4().hex
+        keys = sorted([self._key_from_creds(self._create_creds(principal)[0]) for i in range(num_creds)])
+
+        name_of_method_to_patch = (
+            "yar.key_service.async_creds_retriever."
+            "AsyncCredsRetriever.fetch_page"
+        )
+        with mock.patch(name_of_method_to_patch, self._fetch_page_patch):
+            with mock.patch.object(key_service_request_handler, "stream_page_size", 2):
+                url = "%s?principal=%s&stream=true" % (self.url(), principal)
+                http_client = httplib2.Http()
+                response, content = http_client.request(url, "GET")
+                if 2 < num_creds:
+                    # more than one page so the response must have been chunked
+                    self.assertNotIn("content-length", response)
+
+        self.assertEqual(httplib.OK, response.status)
+        self.assertIsJsonUtf8ContentType(response["content-type"])
+        body = json.loads(content)
+        for creds in body["creds"]:
+            jsonschema.validate(creds, jsonschemas.get_creds_response)
+        self.assertEqual([self._key_from_creds(creds) for creds in body["creds"]], keys)
+
+    def test_get_by_principal_streamed(self):
+        self._test_get_by_principal_streamed(5)
+
+    def test_get_by_principal_streamed_no_creds(self):
+        self._test_get_by_principal_streamed(0)
+
+    def _test_delete_with_if_match(self, if_match, the_revs, is_rev_mismatch, expected_status):
+        the_key = uuid.uuid4().hex
+
+        def delete_patch(acd, key, callback, revs=None):
+            self.assertEqual(key, the_key)
+            self.assertEqual(revs, the_revs)
+            callback(not is_rev_mismatch, is_rev_mismatch)
+
+        name_of_method_to_patch = (
+            "yar.key_service.async_creds_deleter."
+            "AsyncCredsDeleter.delete"
+        )
+        with mock.patch(name_of_method_to_patch, delete_patch):
+            url = "%s/%s" % (self.url(), the_key)
+            http_client = httplib2.Http()
+            response, content = http_client.request(
+                url,
+                "DELETE",
+                headers={"If-Match": if_match})
+            self.assertEqual(expected_status, response.status)
+
+    def test_delete_with_if_match(self):
+        self._test_delete_with_if_match('"1-dave"', ["1-dave"], False, httplib.OK)
+
+    def test_delete_with_if_match_weak(self):
+        self._test_delete_with_if_match('W/"1-dave"', ["1-dave"], False, httplib.OK)
+
+    def test_delete_with_if_match_list(self):
+        self._test_delete_with_if_match(
+            '"1-dave", W/"2-was" ,"3-here"',
+            ["1-dave", "2-was", "3-here"],
+            False,
+            httplib.OK)
+
+    def test_delete_with_if_match_any(self):
+        self._test_delete_with_if_match("*", None, False, httplib.OK)
+
+    def test_delete_with_if_match_any_in_list(self):
+        self._test_delete_with_if_match('"1-dave", *', None, False, httplib.OK)
+
+    def test_delete_with_if_match_mismatch(self):
+        self._test_delete_with_if_match('"1-dave"', ["1-dave"], True, httplib.PRECONDITION_FAILED)
+
+    def test_bulk_delete_by_principal(self):
+        the_principal = uuid.uuid4().hex
+
+        def delete_patch(abcd, principal, callback):
+            self.assertEqual(principal, the_principal)
+            callback(["dave", "was"], ["here"])
+
+        name_of_method_to_patch = (
+            "yar.key_service.async_bulk_creds_deleter."
+            "AsyncBulkCredsDeleter.delete"
+        )
+        with mock.patch(name_of_method_to_patch, delete_patch):
+            url = "%s?principal=%s" % (self.url(), the_principal)
+            http_client = httplib2.Http()
+            response, content = http_client.request(url, "DELETE")
+            self.assertEqual(httplib.OK, response.status)
+            self.assertIsJsonUtf8ContentType(response["content-type"])
+            self.assertEqual(
+                json.loads(content),
+                {"deleted": ["dave", "was"], "not_deleted": ["here"]})
+
+    def test_bulk_delete_by_principal_failure(self):
+        def delete_patch(abcd, principal, callback):
+            callback(None, None)
+
+        name_of_method_to_patch = (
+            "yar.key_service.async_bulk_creds_deleter."
+            "AsyncBulkCredsDeleter.delete"
+        )
+        with mock.patch(name_of_method_to_patch, delete_patch):
+            url = "%s?principal=dave" % self.url()
+            http_client = httplib2.Http()
+            response, content = http_client.request(url, "DELETE")
+            self.assertEqual(httplib.INTERNAL_SERVER_ERROR, response.status)
+
+    def _conditional_get(self, url, the_creds, is_creds_collection, if_none_match=None):
+        def fetch_patch(acr,
+                        callback,
+                        key,
+                        principal,
+                        is_filter_out_non_model_properties,
+                        stale):
+            self.assertFalse(is_filter_out_non_model_properties)
+            callback(the_creds, is_creds_collection)
+
+        name_of_method_to_patch = (
+            "yar.key_service.async_creds_retriever."
+            "AsyncCredsRetriever.fetch"
+        )
+        with mock.patch(name_of_method_to_patch, fetch_patch):
+            headers = {}
+            if if_none_match is not None:
+                headers["If-None-Match"] = if_none_match
+            http_client = httplib2.Http()
+            return http_client.request(url, "GET", headers=headers)
+
+    def _mac_doc(self, rev="1-c81488ccbec47b14cec7010e18459a16"):
+        mac_key_identifier = mac.MACKeyIdentifier.generate()
+        return {
+            "_id": mac_key_identifier,
+            "_rev": rev,
+            "mac": {
+                "mac_key_identifier": mac_key_identifier,
+                "mac_key": mac.MACKey.generate(),
+                "mac_algorithm": mac.MAC.algorithm,
+            },
+            "principal": "dave@example.com",
+            "type": "creds_v2.0",
+        }
+
+    def test_get_etag(self):
+        the_creds = self._mac_doc()
+        url = "%s/%s" % (self.url(), the_creds["_id"])
+
+        response, content = self._conditional_get(url, dict(the_creds), False)
+        self.assertEqual(httplib.OK, response.status)
+        etag = response["etag"]
+        self.assertEqual(etag, '"%s"' % the_creds["_rev"])
+        self.assertEqual(
+            response["cache-control"],
+            "private, max-age=%d" % key_service_request_handler.cache_max_age)
+        creds = json.loads(content)
+        jsonschema.validate(creds, jsonschemas.get_creds_response)
+
+        response, content = self._conditional_get(url, dict(the_creds), False, etag)
+        self.assertEqual(httplib.NOT_MODIFIED, response.status)
+        self.assertEqual(response["etag"], etag)
+        self.assertEqual(
+            response["cache-control"],
+            "private, max-age=%d" % key_service_request_handler.cache_max_age)
+        self.assertEqual(content, "")
+
+        changed_creds = dict(the_creds)
+        changed_creds["_rev"] = "2-c81488ccbec47b14cec7010e18459a16"
+        response, content = self._conditional_get(url, changed_creds, False, etag)
+        self.assertEqual(httplib.OK, response.status)
+        self.assertNotEqual(response["etag"], etag)
+
+    def test_get_by_principal_etag(self):
+        the_creds = [self._mac_doc(), self._mac_doc()]
+        url = "%s?principal=dave@example.com" % self.url()
+
+        response, content = self._conditional_get(url, [dict(creds) for creds in the_creds], True)
+        self.assertEqual(httplib.OK, response.status)
+        etag = response["etag"]
+        self.assertEqual(
+            response["cache-control"],
+            "private, max-age=%d" % key_service_request_handler.cache_max_age)
+        for creds in json.loads(content)["creds"]:
+            jsonschema.validate(creds, jsonschemas.get_creds_response)
+
+        response, content = self._conditional_get(url, [dict(creds) for creds in the_creds], True, etag)
+        self.assertEqual(httplib.NOT_MODIFIED, response.status)
+
+        response, content = self._conditional_get(url, [dict(the_creds[0])], True, etag)
+        self.assertEqual(httplib.OK, response.status)
+        self.assertNotEqual(response["etag"], etag)
@@ -0,0 +1,217 @@
+"""This module implements unit tests for the key service's
+key_store_backends module."""
+
+import httplib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import urlparse
+
+import mock
+
+from yar.key_service import key_store_backends
+from yar.key_service import local_key_store
+
+
+def _mac_doc(mac_key_identifier, principal):
+    return {
+        "_id": mac_key_identifier,
+        "principal": principal,
+        "mac": {
+            "mac_key_identifier": mac_key_identifier,
+            "mac_key": "key-%s" % mac_key_identifier,
+            "mac_algorithm": "hmac-sha-1",
+        },
+        "type": "creds_v2.0",
+    }
+
+
+class CouchDBKeyStoreBackendTestCase(unittest.TestCase):
+    """These unit tests verify the requests
+    ```key_store_backends.CouchDBKeyStoreBackend``` makes and
+    how it converts CouchDB's answers."""
+
+    def setUp(self):
+        self.async_action = mock.Mock()
+        self.backend = key_store_backends.CouchDBKeyStoreBackend(self.async_action)
+        self.callback = mock.Mock()
+
+    def _answer(self, is_ok, code=None, body=None):
+        """Answer the one request the backend made to the key store
+        and return the request's (path, method, body)."""
+        self.assertEqual(self.async_action.async_req_to_key_store.call_count, 1)
+        (path, method, req_body, callback) = self.async_action.async_req_to_key_store.call_args[0]
+        callback(is_ok, code, body)
+        return (path, method, req_body)
+
+    def test_get(self):
+        self.backend.get("dave/was here", self.callback)
+        doc = _mac_doc("dave", "d@e.com")
+        self.assertEqual(
+            self._answer(True, httplib.OK, doc),
+            ("dave%2Fwas%20here", "GET", None))
+        self.callback.assert_called_once_with(True, httplib.OK, doc)
+
+    def test_get_not_found(self):
+        self.backend.get("dave", self.callback)
+        self._answer(True, httplib.NOT_FOUND)
+        self.callback.assert_called_once_with(True, httplib.NOT_FOUND, None)
+
+    def test_get_many(self):
+        self.backend.get_many(["dave", "was"], self.callback)
+        doc = _mac_doc("dave", "d@e.com")
+        body = {
+            "rows": [
+                {"id": "dave", "key": "dave", "doc": doc},
+                {"key": "was", "error": "not_found"},
+            ],
+        }
+        self.assertEqual(
+            self._answer(True, httplib.OK, body),
+            ("_all_docs?include_docs=true", "POST", {"keys": ["dave", "was"]}))
+        self.callback.assert_called_once_with(True, httplib.OK, [("dave", doc)])
+
+    def test_put(self):
+        doc = _mac_doc("dave", "d@e.com")
+        self.backend.put(doc, self.callback)
+        expected_body = dict(doc)
+        del expected_body["_id"]
+        self.assertEqual(
+            self._answer(True, httplib.CREATED, {"id": "dave", "rev": "1-a"}),
+            ("dave", "PUT", expected_body))
+        self.callback.assert_called_once_with(True, httplib.CREATED, {"id": "dave", "rev": "1-a"})
+        # the caller's doc isn't changed
+        self.assertEqual(doc["_id"], "dave")
+
+    def test_delete(self):
+        self.backend.delete("dave", "1-a", self.callback)
+        self.assertEqual(
+            self._answer(True, httplib.CONFLICT),
+            ("dave?rev=1-a", "DELETE", None))
+        self.callback.assert_called_once_with(True, httplib.CONFLICT, None)
+
+    def test_bulk(self):
+        docs = [_mac_doc("dave", "d@e.com")]
+        self.backend.bulk(docs, self.callback)
+        results = [{"id": "dave", "rev": "1-a"}]
+        self.assertEqual(
+            self._answer(True, httplib.CREATED, results),
+            ("_bulk_docs", "POST", {"docs": docs}))
+        self.callback.assert_called_once_with(True, httplib.CREATED, results)
+
+    def test_by_principal(self):
+        self.backend.by_principal("d@e.com", self.callback)
+        doc = _mac_doc("dave", "d@e.com")
+        body = {"rows": [{"id": "dave", "key": "d@e.com", "doc": doc}]}
+        self.assertEqual(
+            self._answer(True, httplib.OK, body),
+            ("_design/by_principal/_view/by_principal?key=%22d%40e.com%22&include_docs=true", "GET", None))
+        self.callback.assert_called_once_with(True, httplib.OK, [doc])
+
+    def test_by_principal_is_escaped(self):
+        the_principal = 'd"&e#%.com'
+        self.backend.by_principal(the_principal, self.callback)
+        (path, method, body) = self._answer(True, httplib.OK, {"rows": []})
+        (path, query) = path.split("?")
+        self.assertEqual(path, "_design/by_principal/_view/by_principal")
+        self.assertEqual(
+            urlparse.parse_qsl(query),
+            [("key", json.dumps(the_principal)), ("include_docs", "true")])
+
+    def test_by_principal_page(self):
+        self.backend.by_principal("d@e.com", self.callback, stale="ok", limit=3, start="dave")
+        (path, method, body) = self._answer(True, httplib.OK, {"rows": []})
+        self.assertEqual(
+            path,
+            "_design/by_principal/_view/by_principal?"
+            "startkey=%22d%40e.com%22&endkey=%22d%40e.com%22&include_docs=true"
+            "&limit=3&startkey_docid=dave&stale=ok")
+        self.assertEqual(method, "GET")
+        self.callback.assert_called_once_with(True, httplib.OK, [])
+
+    def test_by_identifier(self):
+        self.backend.by_identifier(["dave"], self.callback)
+        doc = _mac_doc("dave", "d@e.com")
+        body = {"rows": [{"id": "dave", "key": "dave", "doc": doc}]}
+        self.assertEqual(
+            self._answer(True, httplib.OK, body),
+            ("_design/by_identifier/_view/by_identifier?include_docs=true", "POST", {"keys": ["dave"]}))
+        self.callback.assert_called_once_with(True, httplib.OK, [("dave", doc)])
+
+    def test_key_store_failed(self):
+        self.backend.by_identifier(["dave"], self.callback)
+        self._answer(False)
+        self.callback.assert_called_once_with(False, None, None)
+
+
+class LocalKeyStoreBackendTestCase(unittest.TestCase):
+    """These unit tests verify ```key_store_backends.LocalKeyStoreBackend```
+    answers with the codes and bodies ```KeyStoreBackend``` describes."""
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+
+        key_store = local_key_store.LocalKeyStore(os.path.join(self._dir, "creds.yks"))
+        self.addCleanup(key_store.close)
+
+        patcher = mock.patch.object(local_key_store, "_local_key_store", key_store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.backend = key_store_backends.LocalKeyStoreBackend()
+
+    def _call(self, name, *args, **kwargs):
+        callback = mock.Mock()
+        getattr(self.backend, name)(*(args + (callback,)), **kwargs)
+        self.assertEqual(callback.call_count, 1)
+        return callback.call_args[0]
+
+    def test_put_get_and_delete(self):
+        (is_ok, code, body) = self._call("put", _mac_doc("dave", "d@e.com"))
+        self.assertTrue(is_ok)
+        self.assertEqual(code, httplib.CREATED)
+        rev = body["rev"]
+
+        (is_ok, code, body) = self._call("put", _mac_doc("dave", "x@e.com"))
+        self.assertEqual((is_ok, code, body), (True, httplib.CONFLICT, None))
+
+        (is_ok, code, body) = self._call("get", "dave")
+        self.assertEqual((is_ok, code), (True, httplib.OK))
+        self.assertEqual(body["principal"], "d@e.com")
+        self.assertEqual(body["_rev"], rev)
+
+        (is_ok, code, body) = self._call("delete", "dave", "1-dave")
+        self.assertEqual((is_ok, code, body), (True, httplib.CONFLICT, None))
+
+        (is_ok, code, body) = self._call("delete", "dave", rev)
+        self.assertEqual((is_ok, code), (True, httplib.OK))
+
+        self.assertEqual(self._call("get", "dave"), (True, httplib.NOT_FOUND, None))
+        self.assertEqual(self._call("delete", "dave", rev), (True, httplib.NOT_FOUND, None))
+
+    def test_bulk_and_queries(self):
+        docs = [_mac_doc("dave", "d@e.com"), _mac_doc("was", "d@e.com")]
+        (is_ok, code, results) = self._call("bulk", docs)
+        self.assertEqual((is_ok, code), (True, httplib.CREATED))
+        self.assertEqual([result["id"] for result in results], ["dave", "was"])
+        # the caller's docs aren't changed
+        self.assertNotIn("_rev", docs[0])
+
+        (is_ok, code, body) = self._call("get_many", ["dave", "here"])
+        self.assertEqual((is_ok, code), (True, httplib.OK))
+        self.assertEqual([doc_id for (doc_id, doc) in body], ["dave"])
+
+        (is_ok, code, body) = self._call("by_principal", "d@e.com", limit=1, start="was")
+        self.assertEqual((is_ok, code), (True, httplib.OK))
+        self.assertEqual([doc["_id"] for doc in body], ["was"])
+
+        (is_ok, code, body) = self._call("by_identifier", ["was"], stale="ok")
+        self.assertEqual((is_ok, code), (True, httplib.OK))
+        self.assertEqual([(identifier, doc["_id"]) for (identifier, doc) in body], [("was", "was")])
+
+    def test_key_store_failed(self):
+        with mock.patch.object(local_key_store.LocalKeyStore, "get", side_effect=IOError("oops")):
+            self.assertEqual(self._call("get", "dave"), (False,))
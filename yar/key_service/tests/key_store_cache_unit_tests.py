@@ -0,0 +1,234 @@
+"""This module implements unit tests for the key service's
+key_store_cache module."""
+
+import httplib
+import json
+import StringIO
+import unittest
+import urlparse
+
+import mock
+import tornado.httpclient
+import tornado.httputil
+
+from yar.key_service import key_store_cache
+
+
+def _mac_doc(doc_id, mac_key_identifier, principal):
+    return {
+        "_id": doc_id,
+        "_rev": "1-%s" % doc_id,
+        "principal": principal,
+        "mac": {
+            "mac_key_identifier": mac_key_identifier,
+            "mac_key": "key-%s" % mac_key_identifier,
+            "mac_algorithm": "hmac-sha-1",
+        },
+        "type": "creds_v1.0",
+    }
+
+
+class KeyStoreCacheTestCase(unittest.TestCase):
+    """These unit tests verify the behavior of
+    ```key_store_cache.KeyStoreCache```'s bookkeeping."""
+
+    def _create_cache(self, max_size=10):
+        cache = key_store_cache.KeyStoreCache(max_size)
+        cache.is_live = True
+        return cache
+
+    def test_not_live(self):
+        """Until the cache is following the key store's _changes
+        feed nothing is cached."""
+        cache = key_store_cache.KeyStoreCache(10)
+        entry_name = key_store_cache.key_entry("dave")
+        cache.put(entry_name, [_mac_doc("1", "dave", "d@e.com")], cache.generation())
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.get(entry_name), (False, None))
+
+    def test_put_and_get(self):
+        cache = self._create_cache()
+        doc = _mac_doc("1", "dave", "d@e.com")
+        entry_name = key_store_cache.key_entry("dave")
+        self.assertEqual(cache.get(entry_name), (False, None))
+        cache.put(entry_name, [doc], cache.generation())
+        self.assertEqual(cache.get(entry_name), (True, [doc]))
+
+        not_found_entry_name = key_store_cache.key_entry("was")
+        cache.put(not_found_entry_name, [], cache.generation())
+        self.assertEqual(cache.get(not_found_entry_name), (True, []))
+
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_stale_generation_not_cached(self):
+        cache = self._create_cache()
+        generation = cache.generation()
+        cache.invalidate_doc({"_id": "2"})
+        entry_name = key_store_cache.key_entry("dave")
+        cache.put(entry_name, [_mac_doc("1", "dave", "d@e.com")], generation)
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidate_by_doc(self):
+        cache = self._create_cache()
+        doc = _mac_doc("1", "dave", "d@e.com")
+        cache.put(key_store_cache.key_entry("dave"), [], cache.generation())
+        cache.put(key_store_cache.principal_entry("d@e.com"), [], cache.generation())
+        cache.put(key_store_cache.principal_entry("x@e.com"), [], cache.generation())
+
+        cache.invalidate_doc(doc)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.stats()["invalidations"], 2)
+        self.assertTrue(cache.get(key_store_cache.principal_entry("x@e.com"))[0])
+
+    def test_invalidate_by_doc_id(self):
+        """A deleted doc can be reported without its body. All entries
+        containing the doc are still invalidated."""
+        cache = self._create_cache()
+        doc1 = _mac_doc("1", "dave", "d@e.com")
+        doc2 = _mac_doc("2", "was", "d@e.com")
+        cache.put(key_store_cache.key_entry("dave"), [doc1], cache.generation())
+        cache.put(key_store_cache.key_entry("was"), [doc2], cache.generation())
+        cache.put(key_store_cache.principal_entry("d@e.com"), [doc1, doc2], cache.generation())
+
+        cache.invalidate_doc({"_id": "1"})
+        self.assertEqual(len(cache), 1)
+        self.assertTrue(cache.get(key_store_cache.key_entry("was"))[0])
+
+    def test_lru_eviction(self):
+        cache = self._create_cache(max_size=2)
+        for key in ["a", "b"]:
+            cache.put(key_store_cache.key_entry(key), [], cache.generation())
+        cache.get(key_store_cache.key_entry("a"))
+        cache.put(key_store_cache.key_entry("c"), [], cache.generation())
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertFalse(cache.get(key_store_cache.key_entry("b"))[0])
+        self.assertTrue(cache.get(key_store_cache.key_entry("a"))[0])
+
+    def test_disabled(self):
+        cache = self._create_cache(max_size=0)
+        cache.put(key_store_cache.key_entry("dave"), [], cache.generation())
+        self.assertEqual(len(cache), 0)
+
+
+class ChangesFeedTestCase(unittest.TestCase):
+    """These unit tests verify how ```key_store_cache.KeyStoreCache```
+    follows the key store's _changes feed."""
+
+    def setUp(self):
+        self._pending = []
+
+        def fetch_patch(http_client, request, callback):
+            self._pending.append((request, callback))
+
+        patcher = mock.patch("tornado.httpclient.AsyncHTTPClient.fetch", fetch_patch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch("tornado.ioloop.IOLoop.current")
+        self.ioloop_current = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _respond(self, body=None, code=httplib.OK):
+        (request, callback) = self._pending.pop(0)
+        if code == httplib.OK:
+            body = json.dumps(body)
+            headers = tornado.httputil.HTTPHeaders({
+                "Content-Type": "application/json",
+                "Content-Length": str(len(body)),
+            })
+            response = tornado.httpclient.HTTPResponse(
+                request,
+                code,
+                headers=headers,
+                buffer=StringIO.StringIO(body))
+        else:
+            response = tornado.httpclient.HTTPResponse(
+                request,
+                code,
+                error=tornado.httpclient.HTTPError(code))
+        callback(response)
+        return request
+
+    def _query_string_args(self):
+        (request, callback) = self._pending[0]
+        query = urlparse.urlparse(request.url).query
+        return dict(urlparse.parse_qsl(query))
+
+    def test_follow_changes(self):
+        cache = key_store_cache.KeyStoreCache(10)
+        cache.start("dave:5984/creds")
+
+        request = self._respond({"db_name": "creds", "update_seq": 42})
+        self.assertEqual(request.url, "http://dave:5984/creds")
+        self.assertFalse(cache.is_live)
+
+        # catch up without waiting for changes
+        args = self._query_string_args()
+        self.assertEqual(args["since"], "42")
+        self.assertEqual(args["feed"], "normal")
+        self._respond({"results": [], "last_seq": 42})
+        self.assertTrue(cache.is_live)
+
+        # now wait for changes
+        args = self._query_string_args()
+        self.assertEqual(args["feed"], "longpoll")
+        self.assertEqual(args["include_docs"], "true")
+
+        doc = _mac_doc("1", "dave", "d@e.com")
+        cache.put(key_store_cache.key_entry("dave"), [doc], cache.generation())
+        cache.put(key_store_cache.key_entry("was"), [], cache.generation())
+        self._respond({
+            "results": [
+                {"seq": 43, "id": "1", "deleted": True, "doc": {"_id": "1", "_deleted": True}},
+                {"seq": 44, "id": "_design/by_principal", "doc": {}},
+            ],
+            "last_seq": 44,
+        })
+        self.assertEqual(len(cache), 1)
+        self.assertFalse(cache.get(key_store_cache.key_entry("dave"))[0])
+        self.assertEqual(self._query_string_args()["since"], "44")
+
+    def test_feed_interrupted(self):
+        cache = key_store_cache.KeyStoreCache(10)
+        cache.start("dave:5984/creds")
+        self._respond({"db_name": "creds", "update_seq": 42})
+        self._respond({"results": [], "last_seq": 42})
+        cache.put(key_store_cache.key_entry("dave"), [], cache.generation())
+
+        self._respond(code=599)
+        self.assertFalse(cache.is_live)
+        self.assertFalse(cache.get(key_store_cache.key_entry("dave"))[0])
+
+        call_later = self.ioloop_current.return_value.call_later
+        self.assertEqual(call_later.call_count, 1)
+        (delay, follow_changes) = call_later.call_args[0]
+        self.assertEqual(delay, key_store_cache.retry_interval)
+
+        # resume where the feed was interrupted and catch up
+        follow_changes()
+        args = self._query_string_args()
+        self.assertEqual(args["since"], "42")
+        self.assertEqual(args["feed"], "normal")
+        self._respond({"results": [], "last_seq": 42})
+        self.assertTrue(cache.is_live)
+        self.assertTrue(cache.get(key_store_cache.key_entry("dave"))[0])
+
+    def test_key_store_error_starts_again(self):
+        cache = key_store_cache.KeyStoreCache(10)
+        cache.start("dave:5984/creds")
+        self._respond({"db_name": "creds", "update_seq": 42})
+        self._respond({"results": [], "last_seq": 42})
+        cache.put(key_store_cache.key_entry("dave"), [], cache.generation())
+
+        self._respond(code=httplib.NOT_FOUND)
+        self.assertFalse(cache.is_live)
+        self.assertEqual(len(cache), 0)
+
+        (delay, follow_changes) = self.ioloop_current.return_value.call_later.call_args[0]
+        follow_changes()
+        (request, callback) = self._pending[0]
+        self.assertEqual(request.url, "http://dave:5984/creds")
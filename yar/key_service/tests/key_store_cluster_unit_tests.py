@@ -0,0 +1,145 @@
+"""This module implements unit tests for the key service's
+key_store_cluster module."""
+
+import unittest
+
+import mock
+import tornado.httpclient
+
+from yar.key_service import key_store_cluster
+from yar.util import upstream
+
+
+def _response(code=200, request_time=0.01):
+    response = mock.Mock()
+    response.code = code
+    response.request_time = request_time
+    response.error = None if code == 200 else tornado.httpclient.HTTPError(code)
+    return response
+
+
+class KeyStoreClusterTestCase(unittest.TestCase):
+    """These unit tests verify the behavior of
+    ```key_store_cluster.KeyStoreCluster```."""
+
+    def setUp(self):
+        patcher = mock.patch("tornado.ioloop.IOLoop.current")
+        self.ioloop_current = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _create_cluster(self, num_replicas=2):
+        replicas = ["replica%d:5984/creds" % i for i in range(num_replicas)]
+        return key_store_cluster.KeyStoreCluster("primary:5984/creds", replicas)
+
+    def test_writes_go_to_primary(self):
+        cluster = self._create_cluster()
+        self.assertIs(cluster.write_node(), cluster.primary)
+
+    def test_reads_prefer_lower_cost(self):
+        cluster = self._create_cluster(num_replicas=1)
+        (primary, replica) = cluster.nodes
+        primary.ewma_response_time = 0.100
+        replica.ewma_response_time = 0.010
+        for i in range(10):
+            self.assertIs(cluster.read_node(), replica)
+
+        # outstanding requests make the faster replica more expensive
+        replica.outstanding = 20
+        self.assertIs(cluster.read_node(), primary)
+
+    def test_reads_spread_across_nodes(self):
+        cluster = self._create_cluster()
+        addresses = set([cluster.read_node().address for i in range(100)])
+        self.assertEqual(len(addresses), 3)
+
+    def test_ewma(self):
+        cluster = self._create_cluster()
+        node = cluster.nodes[1]
+        cluster.on_request_start(node)
+        self.assertEqual(node.outstanding, 1)
+        cluster.on_request_done(node, _response(request_time=1.0))
+        self.assertEqual(node.outstanding, 0)
+        self.assertAlmostEqual(node.ewma_response_time, key_store_cluster.ewma_alpha)
+
+    def test_ejection_and_readmission(self):
+        cluster = self._create_cluster(num_replicas=1)
+        replica = cluster.nodes[1]
+
+        for i in range(key_store_cluster.ejection_threshold):
+            self.assertTrue(replica.is_healthy)
+            cluster.on_request_start(replica)
+            cluster.on_request_done(replica, _response(code=599))
+        self.assertFalse(replica.is_healthy)
+        self.assertEqual(replica.ejections, 1)
+
+        # ejected nodes get no reads
+        for i in range(10):
+            self.assertIs(cluster.read_node(), cluster.primary)
+
+        call_later = self.ioloop_current.return_value.call_later
+        (delay, health_check, node) = call_later.call_args[0]
+        self.assertEqual(delay, key_store_cluster.health_check_interval)
+        self.assertIs(node, replica)
+
+        health_check_responses = [_response(code=599), _response()]
+
+        def upstream_fetch_patch(address, request, callback):
+            self.assertEqual(address, replica.address)
+            self.assertEqual(request.url, "http://%s" % replica.address)
+            callback(health_check_responses.pop(0))
+
+        with mock.patch("yar.util.upstream.fetch", upstream_fetch_patch):
+            # failed health check is rescheduled
+            health_check(node)
+            self.assertFalse(replica.is_healthy)
+            self.assertEqual(call_later.call_count, 2)
+
+            health_check(node)
+            self.assertTrue(replica.is_healthy)
+            self.assertEqual(replica.consecutive_failures, 0)
+
+    def test_success_resets_consecutive_failures(self):
+        cluster = self._create_cluster()
+        node = cluster.nodes[1]
+        for i in range(10):
+            cluster.on_request_done(node, _response(code=500))
+            cluster.on_request_done(node, _response())
+        self.assertTrue(node.is_healthy)
+        self.assertEqual(node.failures, 10)
+
+    def test_queue_full_is_not_a_node_failure(self):
+        cluster = self._create_cluster()
+        node = cluster.nodes[1]
+        node.ewma_response_time = 0.5
+        for i in range(2 * key_store_cluster.ejection_threshold):
+            response = _response(code=503, request_time=0)
+            response.error = upstream.QueueFullError(node.address)
+            cluster.on_request_start(node)
+            cluster.on_request_done(node, response)
+        self.assertTrue(node.is_healthy)
+        self.assertEqual(node.outstanding, 0)
+        self.assertEqual(node.consecutive_failures, 0)
+        self.assertEqual(node.failures, 0)
+        self.assertEqual(node.ewma_response_time, 0.5)
+
+        # a 503 from the node itself is still a failure
+        cluster.on_request_start(node)
+        cluster.on_request_done(node, _response(code=503))
+        self.assertEqual(node.consecutive_failures, 1)
+        self.assertEqual(node.failures, 1)
+
+    def test_nothing_healthy(self):
+        cluster = self._create_cluster()
+        for node in cluster.nodes:
+            node.is_healthy = False
+        self.assertIs(cluster.read_node(), cluster.primary)
+        self.assertIsNone(cluster.read_node(exclude=cluster.primary))
+
+    def test_configure(self):
+        with mock.patch.object(key_store_cluster, "_cluster", None):
+            key_store_cluster.configure("primary:5984/creds", [])
+            self.assertIsNone(key_store_cluster.cluster("primary:5984/creds"))
+
+            key_store_cluster.configure("primary:5984/creds", ["replica:5984/creds"])
+            self.assertIsNotNone(key_store_cluster.cluster("primary:5984/creds"))
+            self.assertIsNone(key_store_cluster.cluster("other:5984/creds"))
@@ -3,14 +3,22 @@
 import httplib
 import json
 import os
+import shutil
 import sys
+import tempfile
 import uuid
 
 import mock
 import tornado.httputil
 
 from yar.tests import yar_test_util
+from yar.key_service import async_creds_creator
+from yar.key_service import async_creds_deleter
+from yar.key_service import async_creds_retriever
+from yar.key_service import key_store_backends
+from yar.key_service import key_store_cluster
 from yar.key_service import ks_util
+from yar.key_service import local_key_store
 
 
 class TestCaseFilterOutNonModelCredProperties(yar_test_util.TestCase):
@@ -46,6 +54,21 @@ class TestCaseFilterOutNonModelCredProperties(yar_test_util.TestCase):
         self.assertEqual(creds, filtered_creds)
 
 
+class TestCaseViewPath(yar_test_util.TestCase):
+    """A collection of unit tests for ks_util's view_path()."""
+
+    def test_strict(self):
+        path = '_design/by_principal/_view/by_principal?key="dave"'
+        self.assertEqual(ks_util.view_path(path, None), path)
+        self.assertEqual(ks_util.view_path(path, "strict"), path)
+
+    def test_stale(self):
+        path = '_design/by_principal/_view/by_principal?key="dave"'
+        self.assertEqual(ks_util.view_path(path, "ok"), path + "&stale=ok")
+        path = "_design/by_identifier/_view/by_identifier"
+        self.assertEqual(ks_util.view_path(path, "update_after"), path + "?stale=update_after")
+
+
 class TestCaseAsyncAction(yar_test_util.TestCase):
     """A collection of unit tests for ks_util's AsyncAction class."""
 
@@ -207,3 +230,181 @@ class TestCaseAsyncAction(yar_test_util.TestCase):
                 "GET",
                 None,
                 on_async_req_to_key_store_done)
+
+    def _test_answer_not_error(self, the_code):
+        def async_http_client_fetch_patch(http_client, request, callback):
+            response = mock.Mock()
+            response.code = the_code
+            response.error = str(uuid.uuid4()).replace("-", "")
+            response.body = None
+            response.headers = tornado.httputil.HTTPHeaders()
+            response.request_time = 24
+
+            callback(response)
+
+        on_async_req_to_key_store_done = mock.Mock()
+
+        name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+        with mock.patch(name_of_method_to_patch, async_http_client_fetch_patch):
+            aa = ks_util.AsyncAction(type(self)._key_store)
+            aa.async_req_to_key_store(
+                "dave",
+                "GET",
+                None,
+                on_async_req_to_key_store_done)
+
+        on_async_req_to_key_store_done.assert_called_once_with(True, the_code)
+
+    def test_not_found(self):
+        """This test verifies that
+        ```ks_util.AsyncAction.async_req_to_key_store```
+        reports a 404 from the key store as a response
+        rather than an error."""
+        self._test_answer_not_error(httplib.NOT_FOUND)
+
+    def test_conflict(self):
+        """This test verifies that
+        ```ks_util.AsyncAction.async_req_to_key_store```
+        reports a 409 from the key store as a response
+        rather than an error."""
+        self._test_answer_not_error(httplib.CONFLICT)
+
+
+class TestCaseAsyncActionWithKeyStoreCluster(yar_test_util.TestCase):
+    """A collection of unit tests for ks_util's AsyncAction class
+    when the key store is a cluster of CouchDB nodes."""
+
+    _primary = "primary:5984/creds"
+    _replica = "replica:5984/creds"
+
+    def setUp(self):
+        self.cluster = key_store_cluster.KeyStoreCluster(type(self)._primary, [type(self)._replica])
+        patcher = mock.patch.object(key_store_cluster, "_cluster", self.cluster)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # make the replica the cheaper node so reads always go to it
+        self.cluster.primary.ewma_response_time = 1.0
+
+    def _req(self, path, method, codes):
+        codes = list(codes)
+        self.urls = []
+
+        def async_http_client_fetch_patch(http_client, request, callback):
+            self.urls.append(request.url)
+            response = mock.Mock()
+            response.code = codes.pop(0)
+            response.error = None if response.code == httplib.OK else str(response.code)
+            response.body = None
+            response.headers = tornado.httputil.HTTPHeaders()
+            response.request_time = 0.01
+            callback(response)
+
+        callback = mock.Mock()
+        name_of_method_to_patch = "tornado.httpclient.AsyncHTTPClient.fetch"
+        with mock.patch(name_of_method_to_patch, async_http_client_fetch_patch):
+            aa = ks_util.AsyncAction(type(self)._primary)
+            aa.async_req_to_key_store(path, method, None, callback)
+        return (aa, callback)
+
+    def test_read_goes_to_replica(self):
+        (aa, callback) = self._req("dave", "GET", [httplib.OK])
+        self.assertEqual(self.urls, ["http://%s/dave" % type(self)._replica])
+        self.assertFalse(aa.is_response_from_primary)
+        callback.assert_called_once_with(True, httplib.OK, None)
+
+    def test_multi_key_lookup_is_a_read(self):
+        self._req("_all_docs?include_docs=true", "POST", [httplib.OK])
+        self.assertEqual(self.urls[0], "http://%s/_all_docs?include_docs=true" % type(self)._replica)
+
+    def test_write_goes_to_primary(self):
+        for (path, method) in [("dave", "PUT"), ("dave?rev=1-x", "DELETE"), ("_bulk_docs", "POST")]:
+            (aa, callback) = self._req(path, method, [httplib.OK])
+            self.assertEqual(self.urls, ["http://%s/%s" % (type(self)._primary, path)])
+            self.assertTrue(aa.is_response_from_primary)
+
+    def test_read_fails_over(self):
+        (aa, callback) = self._req("dave", "GET", [599, httplib.OK])
+        self.assertEqual(
+            self.urls,
+            [
+                "http://%s/dave" % type(self)._replica,
+                "http://%s/dave" % type(self)._primary,
+            ])
+        callback.assert_called_once_with(True, httplib.OK, None)
+        self.assertEqual(self.cluster.nodes[1].consecutive_failures, 1)
+
+    def test_read_fails_over_once(self):
+        (aa, callback) = self._req("dave", "GET", [599, 599])
+        self.assertEqual(len(self.urls), 2)
+        callback.assert_called_once_with(False)
+
+    def test_write_does_not_fail_over(self):
+        (aa, callback) = self._req("dave", "PUT", [599])
+        self.assertEqual(len(self.urls), 1)
+        callback.assert_called_once_with(False)
+
+
+class TestCaseAsyncActionWithLocalKeyStore(yar_test_util.TestCase):
+    """A collection of unit tests for ks_util's AsyncAction class
+    when ```ks_util.key_store_backend``` is "local"."""
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+
+        self.key_store = local_key_store.LocalKeyStore(os.path.join(self._dir, "creds.yks"))
+        self.addCleanup(self.key_store.close)
+
+        patcher = mock.patch.object(local_key_store, "_local_key_store", self.key_store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(ks_util, "key_store_backend", "local")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # the HTTP client should never be used
+        patcher = mock.patch("tornado.httpclient.AsyncHTTPClient.fetch")
+        self.fetch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.assertFalse(self.fetch.called)
+
+    def test_backend(self):
+        aa = ks_util.AsyncAction("dave:42")
+        self.assertIsInstance(aa.backend, key_store_backends.LocalKeyStoreBackend)
+
+        with mock.patch.object(ks_util, "key_store_backend", "couchdb"):
+            aa = ks_util.AsyncAction("dave:42")
+        self.assertIsInstance(aa.backend, key_store_backends.CouchDBKeyStoreBackend)
+
+    def test_create_retrieve_and_delete_creds(self):
+        """Confirm the async actions work unchanged against the
+        local key store."""
+        on_create_done = mock.Mock()
+        acc = async_creds_creator.AsyncCredsCreator("dave:42")
+        acc.create("d@e.com", "mac", on_create_done)
+        creds = on_create_done.call_args[0][0]
+        key = creds["mac"]["mac_key_identifier"]
+
+        on_fetch_done = mock.Mock()
+        acr = async_creds_retriever.AsyncCredsRetriever("dave:42")
+        acr.fetch(on_fetch_done, key=key, is_filter_out_non_model_properties=True)
+        on_fetch_done.assert_called_once_with(creds, False)
+
+        on_fetch_done = mock.Mock()
+        acr = async_creds_retriever.AsyncCredsRetriever("dave:42")
+        acr.fetch(on_fetch_done, principal="d@e.com", is_filter_out_non_model_properties=True)
+        on_fetch_done.assert_called_once_with([creds], True)
+
+        on_delete_done = mock.Mock()
+        acd = async_creds_deleter.AsyncCredsDeleter("dave:42")
+        acd.delete(key, on_delete_done)
+        on_delete_done.assert_called_once_with(True)
+
+        on_fetch_done = mock.Mock()
+        acr = async_creds_retriever.AsyncCredsRetriever("dave:42")
+        acr.fetch(on_fetch_done, key=key)
+        on_fetch_done.assert_called_once_with(None, False)
@@ -0,0 +1,106 @@
+"""This module contains micro-benchmarks comparing retrieving
+credentials from the local key store (see local_key_store) with
+retrieving them from CouchDB. Run this module directly:
+
+    python yar/key_service/tests/local_key_store_benchmarks.py [<creds> [<key store>]]
+
+```creds``` is a file of credentials generated by bulk_gen_creds.
+The credentials are loaded into a new local key store. If ```creds```
+isn't supplied 10,000 credentials are generated instead. If ```key store```
+(host:port/database) is supplied the same credentials are also retrieved
+from that CouchDB key store - the credentials are expected to have
+been loaded into the key store beforehand using something like:
+
+    bulk_gen_creds 10000 50 > creds.json
+    curl -X POST -H "Content-Type: application/json" -d @creds.json http://127.0.0.1:5984/creds/_bulk_docs
+
+Both paths go through ```AsyncCredsRetriever``` (with the key store
+cache off) so the comparison includes everything the key service does
+to retrieve a set of credentials except HTTP between the client and
+the key service."""
+
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import tornado.ioloop
+
+from yar.key_service import async_creds_creator
+from yar.key_service import async_creds_retriever
+from yar.key_service import ks_util
+from yar.key_service import local_key_store
+from yar.tests import yar_benchmark_util
+
+
+def _load_creds(filename):
+    if filename is None:
+        docs = [
+            async_creds_creator.generate_creds("%d@example.com" % i, "mac" if i % 2 else "basic")
+            for i in range(10000)
+        ]
+    else:
+        with open(filename, "rb") as f:
+            docs = json.load(f)["docs"]
+    return docs
+
+
+def main():
+    creds_filename = sys.argv[1] if 1 < len(sys.argv) else None
+    key_store = sys.argv[2] if 2 < len(sys.argv) else None
+
+    docs = _load_creds(creds_filename)
+    keys = [doc["_id"] for doc in docs]
+    random.shuffle(keys)
+    next_key = itertools.cycle(keys).next
+
+    dirname = tempfile.mkdtemp()
+    try:
+        local_key_store.path = os.path.join(dirname, "creds.yks")
+        the_local_key_store = local_key_store.key_store()
+        the_local_key_store.save(docs)
+        print "%d creds in local key store of %d bytes" % (
+            len(the_local_key_store),
+            os.path.getsize(local_key_store.path))
+
+        def local_key_store_get():
+            the_local_key_store.get(next_key())
+
+        def retriever_fetch():
+            acr = async_creds_retriever.AsyncCredsRetriever(key_store)
+            acr.fetch(lambda creds, is_creds_collection: None, key=next_key())
+
+        io_loop = tornado.ioloop.IOLoop.current()
+
+        def retriever_fetch_and_wait():
+            acr = async_creds_retriever.AsyncCredsRetriever(key_store)
+            acr.fetch(lambda creds, is_creds_collection: io_loop.stop(), key=next_key())
+            io_loop.start()
+
+        results = []
+
+        if key_store is not None:
+            ks_util.key_store_backend = "couchdb"
+            results.append(yar_benchmark_util.run(
+                "AsyncCredsRetriever.fetch (couchdb)",
+                retriever_fetch_and_wait,
+                number=1000))
+
+        ks_util.key_store_backend = "local"
+        results.append(yar_benchmark_util.run(
+            "AsyncCredsRetriever.fetch (local)",
+            retriever_fetch))
+        results.append(yar_benchmark_util.run(
+            "LocalKeyStore.get",
+            local_key_store_get))
+
+        yar_benchmark_util.print_results(results, results[0])
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""This module implements unit tests for the key service's
+local_key_store module."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from yar.key_service import local_key_store
+
+
+def _mac_doc(mac_key_identifier, principal):
+    return {
+        "principal": principal,
+        "mac": {
+            "mac_key_identifier": mac_key_identifier,
+            "mac_key": "key-%s" % mac_key_identifier,
+            "mac_algorithm": "hmac-sha-1",
+        },
+        "type": "creds_v2.0",
+    }
+
+
+class LocalKeyStoreTestCase(unittest.TestCase):
+    """These unit tests verify how ```local_key_store.LocalKeyStore```
+    stores, retrieves and deletes docs."""
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+        self._path = os.path.join(self._dir, "creds.yks")
+
+        self.key_store = self._open()
+
+    def _open(self):
+        key_store = local_key_store.LocalKeyStore(self._path)
+        self.addCleanup(key_store.close)
+        return key_store
+
+    def _put(self, key_store, key, principal):
+        (result,) = key_store.save([dict(_mac_doc(key, principal), _id=key)])
+        self.assertTrue(result["ok"])
+        self.assertEqual(result["id"], key)
+        return result["rev"]
+
+    def _delete(self, key_store, key, rev):
+        return key_store.save([{"_id": key, "_rev": rev, "_deleted": True}])[0]
+
+    def test_put_get_and_delete(self):
+        rev = self._put(self.key_store, "dave", "d@e.com")
+        self.assertTrue(rev.startswith("1-"))
+
+        expected_doc = _mac_doc("dave", "d@e.com")
+        expected_doc["_id"] = "dave"
+        expected_doc["_rev"] = rev
+        self.assertEqual(self.key_store.get("dave"), expected_doc)
+
+        # creating a doc that already exists is a conflict
+        (result,) = self.key_store.save([dict(_mac_doc("dave", "x@e.com"), _id="dave")])
+        self.assertEqual(result["error"], "conflict")
+
+        self.assertEqual(self._delete(self.key_store, "dave", "1-abc")["error"], "conflict")
+
+        result = self._delete(self.key_store, "dave", rev)
+        self.assertTrue(result["rev"].startswith("2-"))
+
+        self.assertIsNone(self.key_store.get("dave"))
+        self.assertEqual(len(self.key_store), 0)
+
+    def test_doc_id_is_not_a_path(self):
+        self._put(self.key_store, "da/ve?rev=1", "d@e.com")
+        self.assertEqual(self.key_store.get("da/ve?rev=1")["_id"], "da/ve?rev=1")
+        self.assertIsNone(self.key_store.get("da/ve"))
+
+    def test_by_principal(self):
+        for key in ["c", "a", "b"]:
+            self._put(self.key_store, key, "d@e.com")
+        self._put(self.key_store, "x", "x@e.com")
+
+        docs = self.key_store.by_principal("d@e.com")
+        self.assertEqual([doc["_id"] for doc in docs], ["a", "b", "c"])
+
+        docs = self.key_store.by_principal("d@e.com", limit=2)
+        self.assertEqual([doc["_id"] for doc in docs], ["a", "b"])
+
+        docs = self.key_store.by_principal("d@e.com", limit=2, start="b")
+        self.assertEqual([doc["_id"] for doc in docs], ["b", "c"])
+
+        self.assertEqual(self.key_store.by_principal("w@e.com"), [])
+
+    def test_by_identifier(self):
+        self._put(self.key_store, "dave", "d@e.com")
+        keys_and_docs = self.key_store.by_identifier(["dave", "was"])
+        self.assertEqual([(key, doc["_id"]) for (key, doc) in keys_and_docs], [("dave", "dave")])
+
+    def test_get_many(self):
+        rev = self._put(self.key_store, "dave", "d@e.com")
+        ((key, doc),) = self.key_store.get_many(["dave", "was"])
+        self.assertEqual(key, "dave")
+        self.assertEqual(doc["_rev"], rev)
+        self.assertEqual(doc["principal"], "d@e.com")
+
+    def test_save_many(self):
+        dave_rev = self._put(self.key_store, "dave", "d@e.com")
+
+        docs = [
+            dict(_mac_doc("was", "d@e.com"), _id="was"),
+            dict(_mac_doc("here", "d@e.com"), _id="here"),
+            {"_id": "dave", "_rev": dave_rev, "_deleted": True},
+            {"_id": "here", "_rev": "1-abc", "_deleted": True},
+        ]
+        results = self.key_store.save(docs)
+        self.assertEqual([result["id"] for result in results], ["was", "here", "dave", "here"])
+        self.assertEqual(["rev" in result for result in results], [True, True, True, False])
+        self.assertEqual(results[3]["error"], "conflict")
+
+        self.assertIsNone(self.key_store.get("dave"))
+        self.assertEqual(len(self.key_store), 2)
+
+    def test_reopen(self):
+        """The index is rebuilt from the file when a key store is opened."""
+        self._put(self.key_store, "dave", "d@e.com")
+        was_rev = self._put(self.key_store, "was", "d@e.com")
+        self._delete(self.key_store, "was", was_rev)
+
+        key_store = self._open()
+        self.assertEqual(len(key_store), 1)
+        self.assertIsNotNone(key_store.get("dave"))
+        self.assertIsNone(key_store.get("was"))
+
+    def test_shared_by_workers(self):
+        """Each worker of a pre-forked key service has its own
+        ```LocalKeyStore``` for the same file."""
+        other_key_store = self._open()
+
+        self._put(self.key_store, "dave", "d@e.com")
+        self.assertIsNotNone(other_key_store.get("dave"))
+        self.assertEqual(len(other_key_store.by_principal("d@e.com")), 1)
+
+        # updates are checked against other workers' appends
+        (result,) = other_key_store.save([dict(_mac_doc("dave", "d@e.com"), _id="dave")])
+        self.assertEqual(result["error"], "conflict")
+
+    def test_partially_written_record(self):
+        self._put(self.key_store, "dave", "d@e.com")
+        with open(self._path, "ab") as f:
+            f.write(local_key_store._record(dict(_mac_doc("was", "d@e.com"), _id="was", _rev="1-a"))[:-5])
+
+        key_store = self._open()
+        self.assertEqual(len(key_store), 1)
+
+        # the next append replaces the partially written record
+        self._put(key_store, "here", "d@e.com")
+        key_store = self._open()
+        self.assertEqual(len(key_store), 2)
+        self.assertIsNotNone(key_store.get("here"))
+
+    def test_corrupt_record(self):
+        self._put(self.key_store, "dave", "d@e.com")
+        with open(self._path, "ab") as f:
+            f.write(local_key_store._header.pack(4))
+            f.write("dave")
+            f.write(local_key_store._record([]))
+            f.write(local_key_store._record(dict(_mac_doc("was", "d@e.com"), _id="was", _rev="1-a")))
+
+        key_store = self._open()
+        self.assertEqual(len(key_store), 2)
+
+        # the next append mustn't overwrite the corrupt
+        # record or, more importantly, the records after it
+        size = os.path.getsize(self._path)
+        self._put(key_store, "here", "d@e.com")
+        self.assertLess(size, os.path.getsize(self._path))
+        key_store = self._open()
+        self.assertEqual(len(key_store), 3)
+        self.assertIsNotNone(key_store.get("was"))
+
+    def test_compact(self):
+        dave_rev = self._put(self.key_store, "dave", "d@e.com")
+        self._put(self.key_store, "was", "d@e.com")
+        self._delete(self.key_store, "dave", dave_rev)
+
+        compacted_path = os.path.join(self._dir, "compacted.yks")
+        self.assertEqual(local_key_store.compact(self._path, compacted_path), 1)
+        self.assertLess(os.path.getsize(compacted_path), os.path.getsize(self._path))
+
+        key_store = local_key_store.LocalKeyStore(compacted_path)
+        self.addCleanup(key_store.close)
+        self.assertEqual(len(key_store), 1)
+        self.assertEqual(key_store.get("was")["principal"], "d@e.com")
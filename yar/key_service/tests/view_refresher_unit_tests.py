@@ -0,0 +1,79 @@
+"""This module implements unit tests for the key service's
+view_refresher module."""
+
+import httplib
+import unittest
+
+import mock
+import tornado.httpclient
+
+from yar.key_service import async_creds_retriever
+from yar.key_service import view_refresher
+
+
+class ViewRefresherTestCase(unittest.TestCase):
+    """These unit tests verify how ```view_refresher.ViewRefresher```
+    keeps the key store's views up to date."""
+
+    def setUp(self):
+        self._pending = []
+
+        def fetch_patch(http_client, request, callback):
+            self._pending.append((request, callback))
+
+        patcher = mock.patch("tornado.httpclient.AsyncHTTPClient.fetch", fetch_patch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch("tornado.ioloop.IOLoop.current")
+        self.ioloop_current = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _respond(self, code=httplib.OK):
+        (request, callback) = self._pending.pop(0)
+        response = tornado.httpclient.HTTPResponse(
+            request,
+            code,
+            error=None if code == httplib.OK else tornado.httpclient.HTTPError(code),
+            request_time=0.042)
+        callback(response)
+        return request
+
+    def test_refresh(self):
+        views = [
+            "_design/by_principal/_view/by_principal",
+            "_design/by_identifier/_view/by_identifier",
+        ]
+        vr = view_refresher.ViewRefresher("dave:5984/creds", views)
+        vr.start()
+
+        # views are refreshed one at a time
+        self.assertEqual(len(self._pending), 1)
+        request = self._respond()
+        self.assertEqual(request.url, "http://dave:5984/creds/%s?limit=0" % views[0])
+        self.assertEqual(request.request_timeout, view_refresher.request_timeout)
+
+        request = self._respond(httplib.INTERNAL_SERVER_ERROR)
+        self.assertEqual(request.url, "http://dave:5984/creds/%s?limit=0" % views[1])
+        self.assertEqual(len(self._pending), 0)
+        self.assertEqual(vr.refreshes, 1)
+        self.assertEqual(vr.failures, 1)
+
+        # once all views are refreshed the next round is scheduled
+        call_later = self.ioloop_current.return_value.call_later
+        (delay, refresh_views) = call_later.call_args[0]
+        self.assertEqual(delay, view_refresher.interval)
+        refresh_views()
+        self.assertEqual(len(self._pending), 1)
+
+    def test_start(self):
+        with mock.patch.object(async_creds_retriever, "v1_fallback", False):
+            vrs = view_refresher.start(["dave:5984/creds", "was:5984/creds"])
+        self.assertEqual([vr.key_store for vr in vrs], ["dave:5984/creds", "was:5984/creds"])
+        self.assertEqual(vrs[0].views, ["_design/by_principal/_view/by_principal"])
+        self.assertEqual(len(self._pending), 2)
+
+    def test_off(self):
+        with mock.patch.object(view_refresher, "interval", 0):
+            self.assertEqual(view_refresher.start(["dave:5984/creds"]), [])
+        self.assertEqual(len(self._pending), 0)
@@ -0,0 +1,120 @@
+"""This module implements a background refresher of the key store's
+views. CouchDB only brings a view's index up to date when the view is
+queried so after a burst of writes (a bulk load for example) the next
+strict query of the view waits for the key store to index every write
+in the burst. Queries with stale=ok (see ```ks_util.view_path()```)
+never bring the index up to date.
+
+Every ```interval``` seconds the refresher queries each view with
+limit=0 which brings the view's index up to date without returning
+any rows. Views are refreshed one at a time and the next round of
+refreshes is only scheduled once the current round has completed so
+the refresher never has more than one request outstanding per node.
+
+Typical usage from the key service's mainline (per worker process):
+
+    view_refresher.interval = clo.view_refresh_interval
+    view_refresher.start([clo.key_store] + key_store_replicas)
+
+The key store coalesces concurrent refreshes of the same view so
+there's little harm in every worker running a refresher."""
+
+import logging
+
+import tornado.httpclient
+import tornado.ioloop
+
+import async_creds_retriever
+
+_logger = logging.getLogger("KEYSERVICE.%s" % __name__)
+
+"""Each of the key store's views is refreshed every ```interval```
+seconds. A value of 0 turns the refresher off."""
+interval = 5
+
+"""Indexing a large burst of writes can take a long time - a refresh
+is abandoned (and retried ```interval``` seconds later) if it takes
+longer than ```request_timeout``` seconds."""
+request_timeout = 300
+
+
+def _views():
+    views = ["_design/by_principal/_view/by_principal"]
+    if async_creds_retriever.v1_fallback:
+        views.append("_design/by_identifier/_view/by_identifier")
+    return views
+
+
+class ViewRefresher(object):
+    """Keeps the indexes of ```views``` of the CouchDB
+    database ```key_store``` (host:port/database) up to date."""
+
+    def __init__(self, key_store, views):
+        object.__init__(self)
+
+        self.key_store = key_store
+        self.views = views
+
+        self.refreshes = 0
+        self.failures = 0
+
+        self._http_client = None
+        self._pending_views = []
+
+    def start(self):
+        self._http_client = tornado.httpclient.AsyncHTTPClient(force_instance=True)
+        self._refresh_views()
+
+    def _refresh_views(self):
+        self._pending_views = list(self.views)
+        self._refresh_next_view()
+
+    def _refresh_next_view(self):
+        if not self._pending_views:
+            io_loop = tornado.ioloop.IOLoop.current()
+            io_loop.call_later(interval, self._refresh_views)
+            return
+
+        view = self._pending_views.pop(0)
+        url = "http://%s/%s?limit=0" % (self.key_store, view)
+        request = tornado.httpclient.HTTPRequest(
+            url,
+            method="GET",
+            request_timeout=request_timeout)
+        self._http_client.fetch(request, callback=self._on_refresh_done)
+
+    def _on_refresh_done(self, response):
+        if response.error:
+            self.failures += 1
+            _logger.error(
+                "Key Store error refreshing view '%s' - %s",
+                response.effective_url,
+                response.error)
+        else:
+            self.refreshes += 1
+            _logger.info(
+                "Key Store view '%s' refreshed in %d ms",
+                response.effective_url,
+                int(response.request_time * 1000))
+
+        self._refresh_next_view()
+
+
+def start(key_stores):
+    """Start refreshing the views of each of ```key_stores```. If
+    ```interval``` is 0 nothing is refreshed. Returns the list of
+    ```ViewRefresher```s which were started."""
+    if interval <= 0:
+        return []
+
+    views = _views()
+    view_refreshers = []
+    for key_store in key_stores:
+        _logger.info(
+            "Refreshing views of key store '%s' every %d seconds",
+            key_store,
+            interval)
+        view_refresher = ViewRefresher(key_store, views)
+        view_refresher.start()
+        view_refreshers.append(view_refresher)
+    return view_refreshers
@@ -0,0 +1,420 @@
+"""This module implements bulk_gen_creds - a utility which generates
+large numbers of credentials for loading into a key store ahead of
+a load test. Typical usage:
+
+    bulk_gen_creds 10000 50 > creds.json
+    bulk_gen_creds --format=ndjson 10000000 50 > creds.ndjson
+    bulk_gen_creds --keystore=127.0.0.1:5984/creds 10000000 50
+
+Credentials are generated in batches of --batchsize docs on a pool
+of --processes worker processes. Workers generate each batch's key
+material with a single read of os.urandom() and encode the batch's
+docs as JSON so the mainline does little more than write batches
+out (or upload them) in the order they were generated. At most
+2 x --processes batches are outstanding at once so memory use is
+bounded however many credentials are generated.
+
+Output is one of:
+
+    bulkdocs - a single document suitable for POSTing to CouchDB's
+    _bulk_docs end-point (the default and the only format
+    bulk_gen_creds used to support)
+
+    ndjson - one doc per line
+
+    batches - one _bulk_docs document per line, each containing
+    --batchsize docs
+
+If --keystore is supplied batches are POSTed to the key store's
+_bulk_docs end-point rather than written to stdout. At most
+--maxconcurrency uploads are in flight at once - once that many
+are in flight generation waits for an upload to complete."""
+
+import base64
+import collections
+import httplib
+import json
+import logging
+import multiprocessing
+import multiprocessing.pool
+import optparse
+import os
+import sys
+import threading
+import time
+import uuid
+
+import httplib2
+
+from yar.util import clparserutil
+from yar.util import mac
+
+_logger = logging.getLogger("KEYSTORE.%s" % __name__)
+
+_mac_fmt = (
+    '{'
+    '"_id": "%s", '
+    '"principal": "%s@example.com", '
+    '"type": "creds_v2.0", '
+    '"is_deleted": false, '
+    '"mac": {'
+    '"mac_key_identifier": "%s", '
+    '"mac_key": "%s", '
+    '"mac_algorithm": "%s"'
+    '}'
+    '}'
+)
+
+_basic_fmt = (
+    '{'
+    '"_id": "%s", '
+    '"principal": "%s@example.com", '
+    '"type": "creds_v2.0", '
+    '"is_deleted": false, '
+    '"basic": {'
+    '"api_key": "%s"'
+    '}'
+    '}'
+)
+
+"""# of random bytes in a MAC key - see ```mac.MACKey.generate()```."""
+_mac_key_size = mac.MACKey._key_size_in_bits / 8
+
+
+def _uuid_hexes(number):
+    """Returns ```number``` uuid4 style hex strings like those generated
+    by ```mac.MACKeyIdentifier.generate()``` and ```basic.APIKey.generate()```
+    with a single read of os.urandom()."""
+    random_bytes = os.urandom(16 * number)
+    return [
+        uuid.UUID(bytes=random_bytes[16 * i:16 * (i + 1)], version=4).hex
+        for i in xrange(number)
+    ]
+
+
+def _mac_keys(number):
+    """Returns ```number``` MAC keys with a single read of os.urandom().
+    Keys are encoded just like keyczar encodes the keys generated by
+    ```mac.MACKey.generate()``` - web safe base64 without padding."""
+    random_bytes = os.urandom(_mac_key_size * number)
+    return [
+        base64.urlsafe_b64encode(random_bytes[_mac_key_size * i:_mac_key_size * (i + 1)]).rstrip("=")
+        for i in xrange(number)
+    ]
+
+
+def generate_batch(batch_spec):
+    """Generate a batch of credentials. ```batch_spec``` is a tuple
+    of the number of MAC credentials and the number of basic
+    credentials to generate. Returns a list of JSON encoded
+    creds_v2.0 docs. Runs in a worker process."""
+    (number_of_mac_creds, number_of_basic_creds) = batch_spec
+
+    hexes = _uuid_hexes(2 * number_of_mac_creds + 2 * number_of_basic_creds)
+    mac_keys = _mac_keys(number_of_mac_creds)
+    mac_algorithm = mac.MAC.algorithm
+
+    docs = []
+    for i in xrange(number_of_mac_creds):
+        mac_key_identifier = hexes[2 * i]
+        docs.append(_mac_fmt % (
+            mac_key_identifier,
+            hexes[2 * i + 1],
+            mac_key_identifier,
+            mac_keys[i],
+            mac_algorithm))
+
+    offset = 2 * number_of_mac_creds
+    for i in xrange(number_of_basic_creds):
+        api_key = hexes[offset + 2 * i]
+        docs.append(_basic_fmt % (api_key, hexes[offset + 2 * i + 1], api_key))
+
+    return docs
+
+
+def batch_specs(number_of_creds, percent_basic_creds, batch_size):
+    """Split ```number_of_creds``` into batches of at most ```batch_size```
+    credentials. Basic credentials are spread across the batches so that
+    ```percent_basic_creds``` percent of all the credentials are basic.
+    Returns a generator of ```generate_batch()``` batch specs."""
+    number_of_basic_creds = int(number_of_creds * float(percent_basic_creds) / 100.00)
+    for start in xrange(0, number_of_creds, batch_size):
+        end = min(start + batch_size, number_of_creds)
+        number_of_basic_creds_in_batch = \
+            number_of_basic_creds * end // number_of_creds - \
+            number_of_basic_creds * start // number_of_creds
+        yield (end - start - number_of_basic_creds_in_batch, number_of_basic_creds_in_batch)
+
+
+def generate(number_of_creds, percent_basic_creds, batch_size=1000, processes=1):
+    """Generate ```number_of_creds``` credentials on ```processes```
+    worker processes. Returns a generator of batches (see
+    ```generate_batch()```) in the order they were generated."""
+    specs = batch_specs(number_of_creds, percent_basic_creds, batch_size)
+
+    if processes <= 1:
+        for spec in specs:
+            yield generate_batch(spec)
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        max_pending = 2 * processes
+        pending = collections.deque()
+        for spec in specs:
+            pending.append(pool.apply_async(generate_batch, (spec,)))
+            if max_pending <= len(pending):
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _bulk_docs_body(batch):
+    return '{"docs": [' + ", ".join(batch) + ']}'
+
+
+def write_bulk_docs(batches, f):
+    """Write ```batches``` to ```f``` as a single _bulk_docs document.
+    Returns the number of docs written."""
+    number_of_docs = 0
+    f.write('{"docs": [\n')
+    for batch in batches:
+        if not batch:
+            continue
+        if number_of_docs:
+            f.write(",\n")
+        f.write(",\n".join(batch))
+        number_of_docs += len(batch)
+    f.write("\n]}\n")
+    return number_of_docs
+
+
+def write_ndjson(batches, f):
+    """Write ```batches``` to ```f``` one doc per line.
+    Returns the number of docs written."""
+    number_of_docs = 0
+    for batch in batches:
+        if not batch:
+            continue
+        f.write("\n".join(batch))
+        f.write("\n")
+        number_of_docs += len(batch)
+    return number_of_docs
+
+
+def write_batches(batches, f):
+    """Write ```batches``` to ```f``` one _bulk_docs document per
+    line. Returns the number of docs written."""
+    number_of_docs = 0
+    for batch in batches:
+        if not batch:
+            continue
+        f.write(_bulk_docs_body(batch))
+        f.write("\n")
+        number_of_docs += len(batch)
+    return number_of_docs
+
+
+_writers = {
+    "bulkdocs": write_bulk_docs,
+    "ndjson": write_ndjson,
+    "batches": write_batches,
+}
+
+
+class Uploader(object):
+    """Uploads batches to the _bulk_docs end-point of ```key_store```
+    (host:port/database) on a pool of ```max_concurrency``` threads.
+    ```upload()``` blocks while ```max_concurrency``` uploads are
+    in flight which stops generation getting ahead of the key store."""
+
+    def __init__(self, key_store, max_concurrency):
+        object.__init__(self)
+
+        self.key_store = key_store
+
+        self.number_of_docs = 0
+        self.number_of_failed_docs = 0
+
+        self._url = "http://%s/_bulk_docs" % key_store
+        self._pool = multiprocessing.pool.ThreadPool(max_concurrency)
+        self._in_flight = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def upload(self, batch):
+        self._in_flight.acquire()
+        self._pool.apply_async(self._post, (batch,), callback=self._on_post_done)
+
+    def close(self):
+        """Wait for all uploads to complete. Returns True if
+        every doc was saved otherwise returns False."""
+        self._pool.close()
+        self._pool.join()
+        return self.number_of_failed_docs == 0
+
+    def _post(self, batch):
+        """Runs on a pool thread. Returns a tuple of the number of
+        docs in ```batch``` which were saved and which weren't."""
+        try:
+            http_client = getattr(self._local, "http_client", None)
+            if http_client is None:
+                http_client = httplib2.Http()
+                self._local.http_client = http_client
+
+            response, content = http_client.request(
+                self._url,
+                "POST",
+                body=_bulk_docs_body(batch),
+                headers={"Content-Type": "application/json; charset=utf8"})
+            if httplib.CREATED != response.status:
+                _logger.error("Failed to POST to '%s' - %d", self._url, response.status)
+                return (0, len(batch))
+
+            number_of_failed_docs = len([result for result in json.loads(content) if "error" in result])
+            if number_of_failed_docs:
+                _logger.error("'%s' failed to save %d docs", self._url, number_of_failed_docs)
+            return (len(batch) - number_of_failed_docs, number_of_failed_docs)
+        except Exception as ex:
+            _logger.error("Failed to POST to '%s' - %s", self._url, ex)
+            return (0, len(batch))
+
+    def _on_post_done(self, rv):
+        (number_of_docs, number_of_failed_docs) = rv
+        with self._lock:
+            self.number_of_docs += number_of_docs
+            self.number_of_failed_docs += number_of_failed_docs
+        self._in_flight.release()
+
+
+class CommandLineParser(optparse.OptionParser):
+
+    def __init__(self):
+        description = (
+            "bulk_gen_creds generates large numbers of credentials "
+            "for loading into a key store ahead of a load test."
+        )
+        optparse.OptionParser.__init__(
+            self,
+            "usage: %prog [options] <number of creds> <% basic creds>",
+            description=description,
+            option_class=clparserutil.Option)
+
+        default = logging.ERROR
+        fmt = (
+            "logging level [DEBUG,INFO,WARNING,ERROR,CRITICAL,FATAL] - "
+            "default = %s"
+        )
+        help = fmt % logging.getLevelName(default)
+        self.add_option(
+            "--log",
+            action="store",
+            dest="logging_level",
+            default=default,
+            type="logginglevel",
+            help=help)
+
+        default = multiprocessing.cpu_count()
+        help = "worker processes generating creds - default = %d" % default
+        self.add_option(
+            "--processes",
+            action="store",
+            dest="processes",
+            default=default,
+            type=int,
+            help=help)
+
+        default = 1000
+        help = "creds per batch - default = %d" % default
+        self.add_option(
+            "--batchsize",
+            action="store",
+            dest="batch_size",
+            default=default,
+            type=int,
+            help=help)
+
+        default = "bulkdocs"
+        fmt = "output format [bulkdocs,ndjson,batches] - default = %s"
+        help = fmt % default
+        self.add_option(
+            "--format",
+            action="store",
+            dest="format",
+            default=default,
+            type="choice",
+            choices=sorted(_writers.keys()),
+            help=help)
+
+        default = None
+        help = "upload to this key store rather than stdout - default = %s" % default
+        self.add_option(
+            "--keystore",
+            action="store",
+            dest="key_store",
+            default=default,
+            type="couchdb",
+            help=help)
+
+        default = 4
+        help = "max concurrent uploads to key store - default = %d" % default
+        self.add_option(
+            "--maxconcurrency",
+            action="store",
+            dest="max_concurrency",
+            default=default,
+            type=int,
+            help=help)
+
+    def parse_args(self, *args, **kwargs):
+        (clo, cla) = optparse.OptionParser.parse_args(self, *args, **kwargs)
+        if len(cla) != 2:
+            self.error("expected <number of creds> and <% basic creds>")
+        try:
+            clo.number_of_creds = int(cla[0])
+            clo.percent_basic_creds = float(cla[1])
+        except ValueError:
+            self.error("<number of creds> and <% basic creds> must be numbers")
+        if clo.processes < 1 or clo.batch_size < 1 or clo.max_concurrency < 1:
+            self.error("--processes, --batchsize and --maxconcurrency must be at least 1")
+        return (clo, cla)
+
+
+def main(clp=None):
+    """```main``` implements bulk_gen_creds' mainline."""
+    if clp is None:
+        clp = CommandLineParser()
+    (clo, cla) = clp.parse_args()
+
+    logging.basicConfig(level=clo.logging_level)
+
+    start_time = time.time()
+
+    batches = generate(
+        clo.number_of_creds,
+        clo.percent_basic_creds,
+        clo.batch_size,
+        clo.processes)
+
+    if clo.key_store is None:
+        number_of_docs = _writers[clo.format](batches, sys.stdout)
+        is_ok = True
+    else:
+        uploader = Uploader(clo.key_store, clo.max_concurrency)
+        for batch in batches:
+            uploader.upload(batch)
+        is_ok = uploader.close()
+        number_of_docs = uploader.number_of_docs
+
+    _logger.info(
+        "Generated %d creds in %.1f seconds",
+        number_of_docs,
+        time.time() - start_time)
+
+    sys.exit(0 if is_ok else 1)
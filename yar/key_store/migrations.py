@@ -0,0 +1,40 @@
+"""This module contains the migrations between versions of the
+key store's document layout.
+
+creds_v1.0 docs are POSTed to the key store so CouchDB picks the
+doc's _id and the by_identifier view is required to find a doc by
+api key or mac key identifier. creds_v2.0 docs are identical
+except that the api key or mac key identifier is the doc's _id
+so a doc can be retrieved without a view."""
+
+import logging
+
+from yar.util import couchdb_installer
+
+_logger = logging.getLogger("KEYSTORE_INSTALLER.%s" % __name__)
+
+"""Docs are migrated in batches of ```batch_size``` docs."""
+batch_size = 500
+
+
+def creds_v1_to_v2(doc):
+    """Returns the creds_v2.0 version of the creds_v1.0 ```doc```."""
+    new_doc = {k: v for k, v in doc.iteritems() if k not in ["_id", "_rev"]}
+    new_doc["type"] = "creds_v2.0"
+    if "basic" in doc:
+        new_doc["_id"] = doc["basic"]["api_key"]
+    else:
+        new_doc["_id"] = doc["mac"]["mac_key_identifier"]
+    return new_doc
+
+
+def migrate(database, host):
+    """Migrate all creds_v1.0 docs in ```database``` on ```host```
+    to creds_v2.0 docs. The by_identifier view only emits creds_v1.0
+    docs which is how the migration finds the docs to migrate."""
+    return couchdb_installer.migrate_docs(
+        database,
+        host,
+        "_design/by_identifier/_view/by_identifier",
+        creds_v1_to_v2,
+        batch_size)
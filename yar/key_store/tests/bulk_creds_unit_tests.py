@@ -0,0 +1,232 @@
+"""This module implements unit tests for the
+yar.key_store.bulk_creds module."""
+
+import httplib
+import json
+import logging
+import multiprocessing
+import StringIO
+import threading
+import unittest
+
+import mock
+
+from yar.key_store import bulk_creds
+from yar.util import mac
+
+
+class GenerateTestCase(unittest.TestCase):
+
+    def test_batch_specs(self):
+        specs = list(bulk_creds.batch_specs(7, 30, 3))
+        self.assertEqual(specs, [(3, 0), (2, 1), (0, 1)])
+
+        specs = list(bulk_creds.batch_specs(10000, 50, 1000))
+        self.assertEqual(len(specs), 10)
+        self.assertEqual(sum(mac_creds for (mac_creds, basic_creds) in specs), 5000)
+        self.assertEqual(sum(basic_creds for (mac_creds, basic_creds) in specs), 5000)
+
+        self.assertEqual(list(bulk_creds.batch_specs(0, 50, 1000)), [])
+
+    def test_generate_batch(self):
+        docs = [json.loads(doc) for doc in bulk_creds.generate_batch((3, 2))]
+        self.assertEqual(len(docs), 5)
+
+        for doc in docs[:3]:
+            self.assertEqual(doc["type"], "creds_v2.0")
+            self.assertFalse(doc["is_deleted"])
+            self.assertEqual(doc["_id"], doc["mac"]["mac_key_identifier"])
+            self.assertEqual(len(doc["_id"]), 32)
+            self.assertTrue(doc["principal"].endswith("@example.com"))
+            self.assertEqual(doc["mac"]["mac_algorithm"], mac.MAC.algorithm)
+            # raises ValueError if the key isn't well formed
+            mac_key = mac.MACKey(str(doc["mac"]["mac_key"]))
+            self.assertEqual(len(mac_key.as_bytes()), 32)
+
+        for doc in docs[3:]:
+            self.assertEqual(doc["type"], "creds_v2.0")
+            self.assertEqual(doc["_id"], doc["basic"]["api_key"])
+            self.assertEqual(len(doc["_id"]), 32)
+
+        ids = [doc["_id"] for doc in docs] + [doc["principal"] for doc in docs]
+        self.assertEqual(len(set(ids)), len(ids))
+
+    def test_generate(self):
+        batches = list(bulk_creds.generate(25, 20, batch_size=10))
+        self.assertEqual([len(batch) for batch in batches], [10, 10, 5])
+
+    def test_generate_on_worker_processes(self):
+        batches = list(bulk_creds.generate(25, 20, batch_size=2, processes=2))
+        self.assertEqual(len(batches), 13)
+        docs = [json.loads(doc) for batch in batches for doc in batch]
+        self.assertEqual(len(docs), 25)
+        self.assertEqual(len([doc for doc in docs if "basic" in doc]), 5)
+        self.assertEqual(len(set([doc["_id"] for doc in docs])), 25)
+
+
+class WriteTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = [
+            bulk_creds.generate_batch((2, 1)),
+            [],
+            bulk_creds.generate_batch((1, 1)),
+        ]
+
+    def test_write_bulk_docs(self):
+        f = StringIO.StringIO()
+        self.assertEqual(bulk_creds.write_bulk_docs(self.batches, f), 5)
+        self.assertEqual(len(json.loads(f.getvalue())["docs"]), 5)
+
+    def test_write_bulk_docs_with_no_docs(self):
+        f = StringIO.StringIO()
+        self.assertEqual(bulk_creds.write_bulk_docs([], f), 0)
+        self.assertEqual(json.loads(f.getvalue()), {"docs": []})
+
+    def test_write_ndjson(self):
+        f = StringIO.StringIO()
+        self.assertEqual(bulk_creds.write_ndjson(self.batches, f), 5)
+        lines = f.getvalue().splitlines()
+        self.assertEqual(len(lines), 5)
+        for line in lines:
+            self.assertIn("_id", json.loads(line))
+
+    def test_write_batches(self):
+        f = StringIO.StringIO()
+        self.assertEqual(bulk_creds.write_batches(self.batches, f), 5)
+        lines = f.getvalue().splitlines()
+        self.assertEqual([len(json.loads(line)["docs"]) for line in lines], [3, 2])
+
+
+class UploaderTestCase(unittest.TestCase):
+
+    def _http_client_patch(self, request):
+        patcher = mock.patch("httplib2.Http")
+        http = patcher.start()
+        self.addCleanup(patcher.stop)
+        http.return_value.request.side_effect = request
+        return http
+
+    def test_upload(self):
+        bodies = []
+
+        def request(url, method, body, headers):
+            self.assertEqual(url, "http://dave:5984/creds/_bulk_docs")
+            self.assertEqual(method, "POST")
+            docs = json.loads(body)["docs"]
+            bodies.append(docs)
+            results = [{"ok": True, "id": doc["_id"], "rev": "1-a"} for doc in docs]
+            # pretend the key store already had the batch's first doc
+            results[0] = {"id": docs[0]["_id"], "error": "conflict"}
+            return (mock.Mock(status=httplib.CREATED), json.dumps(results))
+
+        self._http_client_patch(request)
+
+        uploader = bulk_creds.Uploader("dave:5984/creds", 2)
+        uploader.upload(bulk_creds.generate_batch((2, 1)))
+        uploader.upload(bulk_creds.generate_batch((1, 0)))
+        self.assertFalse(uploader.close())
+
+        self.assertEqual(sorted(len(docs) for docs in bodies), [1, 3])
+        self.assertEqual(uploader.number_of_docs, 2)
+        self.assertEqual(uploader.number_of_failed_docs, 2)
+
+    def test_upload_fails(self):
+        responses = [
+            (mock.Mock(status=httplib.INTERNAL_SERVER_ERROR), ""),
+            Exception("connection refused"),
+        ]
+
+        def request(url, method, body, headers):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        self._http_client_patch(request)
+
+        uploader = bulk_creds.Uploader("dave:5984/creds", 1)
+        uploader.upload(bulk_creds.generate_batch((2, 0)))
+        uploader.upload(bulk_creds.generate_batch((0, 1)))
+        self.assertFalse(uploader.close())
+        self.assertEqual(uploader.number_of_docs, 0)
+        self.assertEqual(uploader.number_of_failed_docs, 3)
+
+    def test_upload_waits_for_uploads_in_flight(self):
+        in_flight = threading.Semaphore(0)
+        may_complete = threading.Event()
+
+        def request(url, method, body, headers):
+            in_flight.release()
+            may_complete.wait()
+            docs = json.loads(body)["docs"]
+            results = [{"ok": True, "id": doc["_id"], "rev": "1-a"} for doc in docs]
+            return (mock.Mock(status=httplib.CREATED), json.dumps(results))
+
+        self._http_client_patch(request)
+
+        uploader = bulk_creds.Uploader("dave:5984/creds", 1)
+        uploader.upload(bulk_creds.generate_batch((1, 0)))
+        in_flight.acquire()
+
+        # with 1 upload in flight the next upload must wait
+        upload_done = threading.Event()
+
+        def upload():
+            uploader.upload(bulk_creds.generate_batch((1, 0)))
+            upload_done.set()
+
+        thread = threading.Thread(target=upload)
+        thread.start()
+        self.assertFalse(upload_done.wait(0.05))
+
+        may_complete.set()
+        self.assertTrue(upload_done.wait(5))
+        thread.join()
+        self.assertTrue(uploader.close())
+        self.assertEqual(uploader.number_of_docs, 2)
+
+
+class CommandLineParserTestCase(unittest.TestCase):
+
+    def test_defaults(self):
+        clp = bulk_creds.CommandLineParser()
+        (clo, cla) = clp.parse_args(["100", "50"])
+
+        self.assertEqual(clo.logging_level, logging.ERROR)
+        self.assertEqual(clo.processes, multiprocessing.cpu_count())
+        self.assertEqual(clo.batch_size, 1000)
+        self.assertEqual(clo.format, "bulkdocs")
+        self.assertIsNone(clo.key_store)
+        self.assertEqual(clo.max_concurrency, 4)
+        self.assertEqual(clo.number_of_creds, 100)
+        self.assertEqual(clo.percent_basic_creds, 50.0)
+
+    def test_options(self):
+        args = [
+            "--processes", "8",
+            "--batchsize", "500",
+            "--format", "ndjson",
+            "--keystore", "dave:5984/creds",
+            "--maxconcurrency", "2",
+            "1000000", "25",
+        ]
+        clp = bulk_creds.CommandLineParser()
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertEqual(clo.processes, 8)
+        self.assertEqual(clo.batch_size, 500)
+        self.assertEqual(clo.format, "ndjson")
+        self.assertEqual(clo.key_store, "dave:5984/creds")
+        self.assertEqual(clo.max_concurrency, 2)
+        self.assertEqual(clo.number_of_creds, 1000000)
+        self.assertEqual(clo.percent_basic_creds, 25.0)
+
+    def test_bad_args(self):
+        for args in [[], ["100"], ["dave", "50"], ["--batchsize", "0", "100", "50"]]:
+            clp = bulk_creds.CommandLineParser()
+            with mock.patch.object(clp, "exit", side_effect=SystemExit) as exit_patch:
+                with mock.patch.object(clp, "print_usage"):
+                    with mock.patch("sys.stderr"):
+                        self.assertRaises(SystemExit, clp.parse_args, args)
+            self.assertEqual(exit_patch.call_count, 1)
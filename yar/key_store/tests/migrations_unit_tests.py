@@ -0,0 +1,122 @@
+"""This module implements unit tests for the
+yar.key_store.migrations module."""
+
+import httplib
+import json
+import unittest
+import urlparse
+
+import mock
+
+from yar.key_store import migrations
+
+
+class _KeyStore(object):
+    """Just enough of a CouchDB key store to exercise migrations -
+    the by_identifier view and the _bulk_docs end-point."""
+
+    def __init__(self, docs):
+        object.__init__(self)
+        self.docs = {doc["_id"]: doc for doc in docs}
+        self.on_bulk_docs = None
+
+    def request(self, url, method, body=None, headers=None):
+        url = urlparse.urlparse(url)
+        if url.path.endswith("/_bulk_docs"):
+            if self.on_bulk_docs:
+                self.on_bulk_docs()
+            results = [self._save(doc) for doc in json.loads(body)["docs"]]
+            return (mock.Mock(status=httplib.CREATED), json.dumps(results))
+
+        query = dict(urlparse.parse_qsl(url.query))
+        rows = []
+        for doc in self.docs.values():
+            if doc["type"] != "creds_v1.0":
+                continue
+            key = doc["basic"]["api_key"] if "basic" in doc else doc["mac"]["mac_key_identifier"]
+            rows.append({"id": doc["_id"], "key": key, "value": None, "doc": doc})
+        rows.sort(key=lambda row: row["key"])
+        if "startkey" in query:
+            startkey = json.loads(query["startkey"])
+            rows = [row for row in rows if startkey <= row["key"]]
+        rows = rows[:int(query["limit"])]
+        return (mock.Mock(status=httplib.OK), json.dumps({"rows": rows}))
+
+    def _save(self, doc):
+        existing_doc = self.docs.get(doc["_id"], None)
+        existing_rev = existing_doc["_rev"] if existing_doc else None
+        if doc.get("_rev", None) != existing_rev:
+            return {"id": doc["_id"], "error": "conflict"}
+
+        rev = "%d-x" % (int(existing_rev.split("-")[0]) + 1 if existing_rev else 1)
+        if doc.get("_deleted", False):
+            del self.docs[doc["_id"]]
+        else:
+            doc = dict(doc)
+            doc["_rev"] = rev
+            self.docs[doc["_id"]] = doc
+        return {"id": doc["_id"], "rev": rev}
+
+
+def _v1_doc(i):
+    if i % 2:
+        creds = {"basic": {"api_key": "key%03d" % i}}
+    else:
+        creds = {
+            "mac": {
+                "mac_key_identifier": "key%03d" % i,
+                "mac_key": "mac_key%03d" % i,
+                "mac_algorithm": "hmac-sha-1",
+            },
+        }
+    creds["_id"] = "doc%03d" % i
+    creds["_rev"] = "1-x"
+    creds["principal"] = "dave%d@example.com" % i
+    creds["type"] = "creds_v1.0"
+    return creds
+
+
+class MigrationsTestCase(unittest.TestCase):
+
+    def test_creds_v1_to_v2(self):
+        doc = _v1_doc(2)
+        new_doc = migrations.creds_v1_to_v2(doc)
+        self.assertEqual(new_doc["_id"], "key002")
+        self.assertNotIn("_rev", new_doc)
+        self.assertEqual(new_doc["type"], "creds_v2.0")
+        self.assertEqual(new_doc["mac"], doc["mac"])
+        self.assertEqual(new_doc["principal"], doc["principal"])
+
+        doc = _v1_doc(3)
+        new_doc = migrations.creds_v1_to_v2(doc)
+        self.assertEqual(new_doc["_id"], "key003")
+        self.assertEqual(new_doc["basic"], doc["basic"])
+
+    def test_migrate(self):
+        key_store = _KeyStore([_v1_doc(i) for i in range(25)])
+        with mock.patch("httplib2.Http.request", key_store.request):
+            with mock.patch.object(migrations, "batch_size", 10):
+                self.assertTrue(migrations.migrate("creds", "dave:5984"))
+
+        self.assertEqual(len(key_store.docs), 25)
+        for (doc_id, doc) in key_store.docs.items():
+            self.assertEqual(doc["type"], "creds_v2.0")
+            self.assertTrue(doc_id.startswith("key"))
+
+    def test_concurrent_delete_not_lost(self):
+        """If credentials are deleted while they're being migrated
+        confirm the migration doesn't resurrect them."""
+        key_store = _KeyStore([_v1_doc(i) for i in range(5)])
+
+        def on_bulk_docs():
+            # delete doc001 after it's been read but before it's migrated
+            if key_store.docs.pop("doc001", None):
+                key_store.on_bulk_docs = None
+
+        key_store.on_bulk_docs = on_bulk_docs
+        with mock.patch("httplib2.Http.request", key_store.request):
+            self.assertTrue(migrations.migrate("creds", "dave:5984"))
+
+        self.assertEqual(
+            sorted(key_store.docs.keys()),
+            ["key000", "key002", "key003", "key004"])
@@ -0,0 +1,132 @@
+"""This module implements a collection of utilities for writing
+micro-benchmarks of yar's hot code paths. Benchmarks live next to
+the unit tests they complement (for example yar/util/tests/mac_benchmarks.py)
+and are run directly rather than by nose:
+
+    python yar/util/tests/mac_benchmarks.py
+
+A benchmark is just a named, zero argument callable. ```run()``` times
+the callable and ```print_results()``` summarizes a collection of
+results so that a baseline and an optimized implementation can be
+compared side by side. ```write_results()``` saves a collection of
+results as JSON so runs can be compared by a script (across commits
+for example) rather than by eye.
+
+```run()``` can also count the objects a callable allocates and
+doesn't free. Python 2 has no tracemalloc so the count is the growth
+in the number of objects tracked by the garbage collector - that's
+containers (lists, dicts, instances, ...) and not strings or numbers.
+It's a count of what a call leaves behind (cache entries, leaks)
+rather than of every allocation a call makes."""
+
+import gc
+import json
+import platform
+import time
+import timeit
+
+
+class Result(object):
+    """The outcome of timing a single benchmark."""
+
+    def __init__(self, name, number, seconds, objects=None):
+        object.__init__(self)
+        self.name = name
+        self.number = number
+        self.seconds = seconds
+        self.objects = objects
+
+    @property
+    def ops_per_sec(self):
+        return self.number / self.seconds if self.seconds else 0.0
+
+    @property
+    def usec_per_op(self):
+        return 1000000.0 * self.seconds / self.number
+
+    @property
+    def objects_per_op(self):
+        if self.objects is None:
+            return None
+        return float(self.objects) / self.number
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "number": self.number,
+            "seconds": self.seconds,
+            "ops_per_sec": self.ops_per_sec,
+            "usec_per_op": self.usec_per_op,
+            "objects_per_op": self.objects_per_op,
+        }
+
+
+def _count_objects(func, number):
+    """Returns the growth in the number of objects tracked by the
+    garbage collector over ```number``` calls of ```func```."""
+    func()
+    gc.collect()
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        before = len(gc.get_objects())
+        for _ in xrange(number):
+            func()
+        gc.collect()
+        after = len(gc.get_objects())
+    finally:
+        if was_enabled:
+            gc.enable()
+    return max(0, after - before)
+
+
+def run(name, func, number=10000, repeat=3, count_objects=False):
+    """Time ```number``` calls of ```func``` ```repeat``` times and
+    return a ```Result``` describing the fastest of the repeats. The
+    fastest repeat is used because slower repeats are almost always
+    the result of interference from other processes rather than
+    variability in ```func```. If ```count_objects``` is True the
+    objects ```number``` calls of ```func``` leave behind are also
+    counted (on an extra, untimed, run)."""
+    timer = timeit.Timer(func)
+    seconds = min(timer.repeat(repeat=repeat, number=number))
+    objects = _count_objects(func, number) if count_objects else None
+    return Result(name, number, seconds, objects)
+
+
+def print_results(results, baseline=None):
+    """Print a table summarizing ```results```. If ```baseline```
+    is a ```Result``` each row also shows the speed up relative
+    to ```baseline```."""
+    width = max([len(result.name) for result in results] + [len("name")])
+    fmt = "%-*s  %12s  %10s  %8s  %10s"
+    print fmt % (width, "name", "ops/sec", "usec/op", "speedup", "objects/op")
+    for result in results:
+        if baseline is not None and result.usec_per_op:
+            speedup = "%.2fx" % (baseline.usec_per_op / result.usec_per_op)
+        else:
+            speedup = "-"
+        print fmt % (
+            width,
+            result.name,
+            "%.0f" % result.ops_per_sec,
+            "%.2f" % result.usec_per_op,
+            speedup,
+            "-" if result.objects is None else "%.2f" % result.objects_per_op)
+
+
+def write_results(results, filename):
+    """Write ```results``` to ```filename``` as a JSON document
+    along with enough about the machine and the Python running
+    the benchmarks to know whether two runs are comparable."""
+    doc = {
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "python_implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "node": platform.node(),
+        "results": [result.as_dict() for result in results],
+    }
+    with open(filename, "w") as f:
+        json.dump(doc, f, indent=4, separators=(",", ": "), sort_keys=True)
+        f.write("\n")
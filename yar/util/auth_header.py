@@ -0,0 +1,123 @@
+"""This module implements a single pass tokenizer for the value of
+an HTTP Authorization header. Every request the auth service sees
+has its Authorization header parsed so the tokenizer is on the auth
+service's hot path and, just as importantly, on the hot path for
+every malformed header an attacker chooses to send. With that in
+mind the tokenizer:
+
+    1/ uses a single, precompiled regular expression which
+    understands both the MAC and BASIC authentication schemes
+
+    2/ rejects headers longer than ```max_length``` without
+    looking at them
+
+    3/ produces a compact ```AuthHeader``` rather than a collection
+    of objects - ```AuthHeader``` fields are plain strings
+
+Typical usage:
+
+    auth_header = auth_header.parse(value)
+    if auth_header is None:
+        # malformed or unsupported header
+    elif auth_header.scheme == auth_header.MAC:
+        # use auth_header.mac_key_identifier, auth_header.ts, ...
+    else:
+        # use auth_header.credentials"""
+
+import re
+
+"""Authentication scheme names. ```AuthHeader.scheme``` is always
+one of these values regardless of the case used in the header."""
+MAC = "MAC"
+BASIC = "BASIC"
+
+_schemes = (MAC, BASIC)
+
+"""Authorization header values longer than ```max_length``` are
+rejected without being parsed. Well formed MAC and BASIC headers
+are typically less than 200 characters."""
+max_length = 1024
+
+_reg_ex = re.compile(
+    r'^\s*(?:'
+    r'(?P<mac_scheme>MAC)\s+'
+    r'id\s*=\s*"(?P<mac_key_identifier>[^"]+)"\s*,\s*'
+    r'ts\s*=\s*"(?P<ts>\d+)"\s*,\s*'
+    r'nonce\s*=\s*"(?P<nonce>[^"]+)"\s*,\s*'
+    r'ext\s*=\s*"(?P<ext>[^"]*)"\s*,\s*'
+    r'mac\s*=\s*"(?P<mac>[^"]+)"'
+    r'|'
+    r'BASIC\s+(?P<credentials>\S+)'
+    r')\s*$',
+    re.IGNORECASE)
+
+
+class AuthHeader(object):
+    """A parsed Authorization header. For the MAC scheme
+    ```credentials``` is None and for the BASIC scheme
+    only ```credentials``` is set."""
+
+    __slots__ = (
+        "scheme",
+        "mac_key_identifier",
+        "ts",
+        "nonce",
+        "ext",
+        "mac",
+        "credentials",
+    )
+
+    def __init__(self,
+                 scheme,
+                 mac_key_identifier=None,
+                 ts=None,
+                 nonce=None,
+                 ext=None,
+                 mac=None,
+                 credentials=None):
+        self.scheme = scheme
+        self.mac_key_identifier = mac_key_identifier
+        self.ts = ts
+        self.nonce = nonce
+        self.ext = ext
+        self.mac = mac
+        self.credentials = credentials
+
+
+def parse(value):
+    """Parse ```value```, the value of an HTTP Authorization header.
+    Returns an ```AuthHeader``` on success and None if ```value```
+    is None, too long or malformed."""
+    if value is None or max_length < len(value):
+        return None
+
+    match = _reg_ex.match(value)
+    if match is None:
+        return None
+
+    if match.group("mac_scheme") is None:
+        return AuthHeader(BASIC, credentials=match.group("credentials"))
+
+    (mac_key_identifier, ts, nonce, ext, mac) = match.group(
+        "mac_key_identifier",
+        "ts",
+        "nonce",
+        "ext",
+        "mac")
+    return AuthHeader(MAC, mac_key_identifier, ts, nonce, ext, mac)
+
+
+def scheme_of(value):
+    """Return the authentication scheme (```MAC``` or ```BASIC```)
+    that ```value``` claims to use or None if the scheme isn't
+    supported. Only the start of ```value``` is examined so this
+    is a cheap way of figuring out why ```parse()``` failed."""
+    if value is None:
+        return None
+
+    value = value.lstrip()
+    for scheme in _schemes:
+        length = len(scheme)
+        if value[length:length + 1].isspace() and value[:length].upper() == scheme:
+            return scheme
+    return None
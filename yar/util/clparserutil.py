@@ -19,6 +19,25 @@ def _check_couchdb(option, opt, value):
     raise optparse.OptionValueError(msg)
 
 
+def _check_couchdbs(option, opt, value):
+    """Type checking function for command line parser's 'couchdbs' type.
+    ```value``` is expected to be a series of host:port/database
+    seperated by commas."""
+    split_reg_ex = re.compile("\s*\,\s*")
+
+    rv = []
+    for couchdb in split_reg_ex.split(value.strip()):
+        try:
+            rv.append(_check_couchdb(option, opt, couchdb))
+        except optparse.OptionValueError:
+            fmt = (
+                "option %s: should be 'host:port/database, ... "
+                "host:port/database' format"
+            )
+            raise optparse.OptionValueError(fmt % opt)
+    return rv
+
+
 def _check_logging_level(option, opt, value):
     """Type checking function for command line parser's 'logginglevel' type."""
     reg_ex_pattern = "^(DEBUG|INFO|WARNING|ERROR|CRITICAL|FATAL)$"
@@ -147,7 +166,7 @@ def _check_unix_domain_socket(option, opt, value):
 
 
 class Option(optparse.Option):
-    """Adds couchdb, hostcolonport, hostcolonports, boolean & logginglevel
+    """Adds couchdb, couchdbs, hostcolonport, hostcolonports, boolean & logginglevel
     types to the command line parser's list of available types."""
     new_types = (
         "hostcolonport",
@@ -157,6 +176,7 @@ class Option(optparse.Option):
         "logginglevel",
         "boolean",
         "couchdb",
+        "couchdbs",
         "unixdomainsocket",
     )
     TYPES = optparse.Option.TYPES + new_types
@@ -168,4 +188,5 @@ class Option(optparse.Option):
     TYPE_CHECKER["logginglevel"] = _check_logging_level
     TYPE_CHECKER["boolean"] = _check_boolean
     TYPE_CHECKER["couchdb"] = _check_couchdb
+    TYPE_CHECKER["couchdbs"] = _check_couchdbs
     TYPE_CHECKER["unixdomainsocket"] = _check_unix_domain_socket
@@ -31,7 +31,12 @@ created create a mainline for the installer like the example below:
     if __name__ == "__main__":
         couchdb_installer.main(CommandLineParser(), design_docs)
 
-And that's all there is too it! Sweet:-)"""
+And that's all there is too it! Sweet:-)
+
+If the database's document layout changes over time, pass a function
+that migrates an existing database as ```main()```'s ```migrate```
+argument - ```migrate_docs()``` does most of the work of implementing
+such a function."""
 
 import logging
 import os
@@ -39,7 +44,9 @@ import sys
 import glob
 import httplib
 import httplib2
+import json
 import optparse
+import urllib
 
 from yar.util import clparserutil
 
@@ -112,6 +119,19 @@ def _create_design_docs(database, host, design_docs_module):
             "PUT",
             body=design_doc,
             headers={"Content-Type": "application/json; charset=utf8"})
+        if httplib.CONFLICT == response.status:
+            # the design doc already exists so update it - this is
+            # how an existing database gets the design docs that go
+            # along with a migration
+            response, content = http_client.request(url, "GET")
+            if httplib.OK == response.status:
+                design_doc = json.loads(design_doc)
+                design_doc["_rev"] = json.loads(content)["_rev"]
+                response, content = http_client.request(
+                    url,
+                    "PUT",
+                    body=json.dumps(design_doc),
+                    headers={"Content-Type": "application/json; charset=utf8"})
         if httplib.CREATED != response.status:
             _logger.error("Failed to create design doc '%s'", url)
             return False
@@ -145,6 +165,151 @@ def _delete_database(database, host):
     return True
 
 
+def _bulk_docs(database, host, docs):
+    """POST ```docs``` to ```database```'s _bulk_docs end-point.
+    Returns a dict mapping each doc's _id to the doc's new _rev or
+    None if the doc wasn't saved. Returns None on error."""
+    url = "http://%s/%s/_bulk_docs" % (host, database)
+    http_client = httplib2.Http()
+    response, content = http_client.request(
+        url,
+        "POST",
+        body=json.dumps({"docs": docs}),
+        headers={"Content-Type": "application/json; charset=utf8"})
+    if httplib.CREATED != response.status:
+        _logger.error("Failed to POST to '%s' - %d", url, response.status)
+        return None
+
+    return {result["id"]: result.get("rev", None) for result in json.loads(content)}
+
+
+def migrate_docs(database, host, view, convert, batch_size=500):
+    """Migrate the docs emitted by ```view``` (for example
+    _design/by_identifier/_view/by_identifier) to a new doc layout.
+    ```convert``` is called with each doc and returns the replacement
+    doc which must have a different _id to the original doc. Docs are
+    processed in batches of ```batch_size``` so the migration streams
+    through a database of any size and can be run against a database
+    that's in use:
+
+        1/ replacement docs are created
+        2/ original docs are deleted
+        3/ if an original doc can't be deleted because it changed after
+        it was read (for example it was deleted) the replacement doc is
+        deleted so the change isn't lost
+
+    At every point each doc can be found either in its original or its
+    replacement form. ```view``` is expected to only emit docs which
+    haven't been migrated so a migration that's interrupted can just
+    be run again. Returns True if the migration completed otherwise
+    False."""
+
+    _logger.info(
+        "Migrating docs in database '%s' on '%s' using '%s'",
+        database,
+        host,
+        view)
+
+    http_client = httplib2.Http()
+
+    # ids of docs which couldn't be migrated - they're still emitted
+    # by the view so need to be skipped
+    failed_ids = set()
+    number_migrated = 0
+    startkey = None
+
+    while True:
+        query_string_args = {
+            "include_docs": "true",
+            "limit": batch_size,
+        }
+        if startkey is not None:
+            # migrated docs drop out of the view so rather than skipping
+            # rows the next batch starts at the last key of this batch
+            query_string_args["startkey"] = json.dumps(startkey)
+        url = "http://%s/%s/%s?%s" % (
+            host,
+            database,
+            view,
+            urllib.urlencode(query_string_args))
+        response, content = http_client.request(url, "GET")
+        if httplib.OK != response.status:
+            _logger.error("Failed to GET '%s' - %d", url, response.status)
+            return False
+
+        rows = json.loads(content).get("rows", [])
+        if not rows:
+            break
+
+        next_startkey = rows[-1]["key"]
+        docs = [row["doc"] for row in rows if row["doc"]["_id"] not in failed_ids]
+        if not docs:
+            if next_startkey == startkey:
+                break
+            startkey = next_startkey
+            continue
+        startkey = next_startkey
+
+        new_docs = {}
+        for doc in docs:
+            new_doc = convert(doc)
+            new_doc.pop("_rev", None)
+            new_docs[doc["_id"]] = new_doc
+
+        new_revs = _bulk_docs(database, host, new_docs.values())
+        if new_revs is None:
+            return False
+
+        deleted_docs = []
+        for doc in docs:
+            new_doc_id = new_docs[doc["_id"]]["_id"]
+            if new_revs.get(new_doc_id, None) is None:
+                # assume the doc was created by a previous, interrupted,
+                # migration and carry on deleting the original doc
+                _logger.info("'%s' already exists", new_doc_id)
+            deleted_docs.append({
+                "_id": doc["_id"],
+                "_rev": doc["_rev"],
+                "_deleted": True,
+            })
+
+        deleted_revs = _bulk_docs(database, host, deleted_docs)
+        if deleted_revs is None:
+            return False
+
+        rolled_back_docs = []
+        for doc in docs:
+            if deleted_revs.get(doc["_id"], None) is not None:
+                number_migrated += 1
+                continue
+
+            failed_ids.add(doc["_id"])
+            new_doc_id = new_docs[doc["_id"]]["_id"]
+            _logger.error("Failed to migrate '%s' to '%s'", doc["_id"], new_doc_id)
+            new_rev = new_revs.get(new_doc_id, None)
+            if new_rev is not None:
+                rolled_back_docs.append({
+                    "_id": new_doc_id,
+                    "_rev": new_rev,
+                    "_deleted": True,
+                })
+
+        if rolled_back_docs:
+            if _bulk_docs(database, host, rolled_back_docs) is None:
+                return False
+
+        _logger.info("Migrated %d docs", number_migrated)
+
+    _logger.info(
+        "Successfully migrated %d docs in database '%s' on '%s' (%d failed)",
+        number_migrated,
+        database,
+        host,
+        len(failed_ids))
+
+    return True
+
+
 class CommandLineParser(optparse.OptionParser):
     """```CommandLineParser``` is an abstract base class used to
     parse command line arguments for a CouchDB installer.
@@ -222,11 +387,23 @@ class CommandLineParser(optparse.OptionParser):
             type="boolean",
             help=help)
 
+        default = False
+        help = "migrate existing docs - default = %s" % default
+        self.add_option(
+            "--migrate",
+            action="store",
+            dest="migrate",
+            default=default,
+            type="boolean",
+            help=help)
+
 
-def main(clp, design_docs_module):
+def main(clp, design_docs_module, migrate=None):
     """```main``` is used to implement the core main line logic
     for a CouchDB installer. See this module's complete example
-    for how to use this class."""
+    for how to use this class. If supplied, ```migrate``` is called
+    with the database and host when the --migrate option is used
+    and is expected to return True if the migration succeeded."""
 
     (clo, cla) = clp.parse_args()
 
@@ -248,4 +425,11 @@ def main(clp, design_docs_module):
         if not _create_design_docs(clo.database, clo.host, design_docs_module):
             sys.exit(1)
 
+    if clo.migrate:
+        if migrate is None:
+            _logger.fatal("No migration for database '%s'", clo.database)
+            sys.exit(1)
+        if not migrate(clo.database, clo.host):
+            sys.exit(1)
+
     sys.exit(0)
@@ -0,0 +1,93 @@
+"""This module hashes large request bodies on a small pool of threads
+rather than on the IOLoop's thread. Hashing a multi-megabyte body takes
+milliseconds and while the IOLoop's thread is hashing every other request
+being serviced by the process waits. hashlib releases the GIL while it
+hashes buffers of more than a couple of KB so while a pool thread is
+hashing a body the IOLoop's thread keeps servicing other requests.
+
+Handing a body to a pool thread and getting the result back onto the
+IOLoop's thread costs tens of microseconds so bodies smaller than
+```min_size``` bytes are hashed on the calling thread and the callback
+is called before the function returns.
+
+Typical usage (from the IOLoop's thread):
+
+    hash_pool.ext(content_type, body, callback)
+
+The pool is created on first use so in a pre-forked service each
+worker gets its own threads."""
+
+import hashlib
+import logging
+import multiprocessing.pool
+
+import tornado.ioloop
+
+from yar.util import mac
+
+_logger = logging.getLogger("UTIL.%s" % __name__)
+
+"""Bodies of at least ```min_size``` bytes are hashed
+on a pool thread."""
+min_size = 256 * 1024
+
+"""The pool has ```max_threads``` threads so at most ```max_threads```
+bodies are hashed at once - others wait their turn. A value of 0
+means bodies are always hashed on the calling thread."""
+max_threads = 2
+
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _logger.info("Creating hash pool with %d threads", max_threads)
+        _pool = multiprocessing.pool.ThreadPool(max_threads)
+    return _pool
+
+
+def _sha1_hexdigest(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def _call(func, args):
+    """Runs on a pool thread or, for small bodies, the calling thread.
+    Exceptions are caught so that either way an error means the
+    callback is called with None - on a pool thread they must be
+    caught anyway because ```multiprocessing.pool.ThreadPool```
+    doesn't call the callback of a function which raises an exception."""
+    try:
+        return func(*args)
+    except Exception:
+        _logger.exception("Error hashing")
+        return None
+
+
+def _run(size, func, args, callback):
+    if size < min_size or max_threads <= 0:
+        callback(_call(func, args))
+        return
+
+    # the pool calls back on one of its threads and
+    # add_callback() is the only thread safe way back
+    io_loop = tornado.ioloop.IOLoop.current()
+
+    def on_done(rv):
+        io_loop.add_callback(callback, rv)
+
+    _get_pool().apply_async(_call, (func, args), callback=on_done)
+
+
+def ext(content_type, body, callback):
+    """Generate the ```mac.Ext``` for ```content_type``` and ```body```
+    (see ```mac.Ext.generate()```) and call ```callback``` with the ext.
+    If an error occurs ```callback``` is called with None."""
+    size = len(body) if body is not None else 0
+    _run(size, mac.Ext.generate, (content_type, body), callback)
+
+
+def sha1(data, callback):
+    """Call ```callback``` with the hex encoded SHA1 of ```data```.
+    If an error occurs ```callback``` is called with None."""
+    _run(len(data), _sha1_hexdigest, (data,), callback)
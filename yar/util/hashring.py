@@ -0,0 +1,45 @@
+"""This module implements consistent hashing - a way of assigning
+keys to a collection of nodes so that adding or removing a node only
+moves the keys that belong on the added or removed node. Compare this
+to the more common hash(key) % number of nodes which moves almost
+every key when the number of nodes changes.
+
+Each node is placed at a number of pseudo random points on a ring
+of 32 bit hash values and a key belongs to the first node found by
+moving clockwise around the ring from the key's hash. The placement
+of nodes is compatible with the ketama algorithm used by many
+memcached clients."""
+
+import bisect
+import hashlib
+import struct
+
+
+class HashRing(object):
+    """A consistent hash ring of ```nodes``` (strings, typically
+    host:port). Each node is placed at ```points_per_node``` points
+    on the ring - more points means keys are more evenly spread
+    across nodes."""
+
+    def __init__(self, nodes, points_per_node=160):
+        object.__init__(self)
+
+        points = []
+        for node in nodes:
+            for i in range(points_per_node // 4):
+                digest = hashlib.md5("%s-%d" % (node, i)).digest()
+                for point in struct.unpack("<4I", digest):
+                    points.append((point, node))
+        points.sort()
+
+        self._points = [point for (point, node) in points]
+        self._nodes = [node for (point, node) in points]
+
+    def get_node(self, key):
+        """Return the node to which ```key``` belongs or None
+        if the ring has no nodes."""
+        if not self._nodes:
+            return None
+        (point,) = struct.unpack_from("<I", hashlib.md5(key).digest())
+        index = bisect.bisect(self._points, point) % len(self._points)
+        return self._nodes[index]
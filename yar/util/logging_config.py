@@ -5,6 +5,15 @@ centralized in the configure() function of this module."""
 import logging
 import time
 
+"""The load testing infrastructure scrapes logs and expects tab
+separated fields with the message in the 5th field. Don't add
+or remove fields without also changing the load tests."""
+_location_format = "%(module)s.%(funcName)s:%(lineno)d"
+_format = (
+    "%(relativeCreated)d\t%(asctime)s\t%(levelname)s\t"
+    "{location}\t%(message)s"
+)
+
 
 def configure(level, filename, syslog):
     """This function is expected to be called from the server's
@@ -12,10 +21,7 @@ def configure(level, filename, syslog):
     the server's command line parser."""
 
     logging.Formatter.converter = time.gmtime
-    format = (
-        "%(relativeCreated)d\t%(asctime)s\t%(levelname)s\t"
-        "%(module)s.%(funcName)s:%(lineno)d\t%(message)s"
-    )
+    format = _format.format(location=_location_format)
     logging.basicConfig(
         level=level,
         format=format,
@@ -24,3 +30,16 @@ def configure(level, filename, syslog):
     if syslog:
         handler = logging.handlers.SysLogHandler(address=syslog)
         logging.getLogger().addHandler(handler)
+
+
+def tag_worker(worker_id):
+    """Called in each worker process of a pre-forked server (see
+    yar.util.prefork) so that every log record identifies the worker
+    (and its process id) which generated the record. The worker
+    identification is added to the location field so the number and
+    order of fields is unchanged."""
+    location = "w%d/%%(process)d:%s" % (worker_id, _location_format)
+    formatter = logging.Formatter(_format.format(location=location))
+    for handler in logging.getLogger().handlers:
+        if handler.formatter is not None:
+            handler.setFormatter(formatter)
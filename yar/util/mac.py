@@ -3,6 +3,7 @@ used in HTTP MAC access authentication scheme. See [1] for details.
 
 [1] http://tools.ietf.org/html/draft-ietf-oauth-v2-http-mac-01"""
 
+import base64
 import binascii
 import datetime
 import hashlib
@@ -17,6 +18,8 @@ import uuid
 
 from keyczar import keyczar
 
+from yar.util import auth_header
+
 _logger = logging.getLogger("UTIL.%s" % __name__)
 
 
@@ -41,6 +44,57 @@ def _dehexify(bytes_encoded_as_hex_string):
         return None
 
 
+def _compare_digest_fallback(a, b):
+    """Constant time comparison of ```a``` and ```b``` for Pythons
+    which predate ```hmac.compare_digest()```."""
+    if len(a) != len(b):
+        return False
+    rv = 0
+    for (x, y) in zip(a, b):
+        rv |= ord(x) ^ ord(y)
+    return rv == 0
+
+_compare_digest = getattr(hmac, "compare_digest", _compare_digest_fallback)
+
+
+class _HMACTemplate(object):
+    """A keyed HMAC-SHA1 state. The HMAC inner and outer hashes are
+    primed with the key xor'ed with the inner and outer pads once
+    when the template is created. Signing a message then only
+    needs to clone those two primed hashes rather than re-deriving
+    them from the key. Signatures are identical to those produced
+    by ```keyczar.keys.HmacKey.Sign()```."""
+
+    __slots__ = ("_inner", "_outer")
+
+    _digestmod = hashlib.sha1
+
+    _trans_5c = "".join(chr(x ^ 0x5C) for x in xrange(256))
+    _trans_36 = "".join(chr(x ^ 0x36) for x in xrange(256))
+
+    def __init__(self, key_bytes):
+        blocksize = self._digestmod().block_size
+        if blocksize < len(key_bytes):
+            key_bytes = self._digestmod(key_bytes).digest()
+        key_bytes = key_bytes + chr(0) * (blocksize - len(key_bytes))
+
+        self._inner = self._digestmod(key_bytes.translate(self._trans_36))
+        self._outer = self._digestmod(key_bytes.translate(self._trans_5c))
+
+    def sign(self, msg):
+        """Return the raw HMAC of ```msg```."""
+        inner = self._inner.copy()
+        inner.update(msg)
+        outer = self._outer.copy()
+        outer.update(inner.digest())
+        return outer.digest()
+
+    def verify(self, msg, sig_bytes):
+        """Returns True if ```sig_bytes``` is the HMAC of ```msg```.
+        The comparison is done in constant time."""
+        return _compare_digest(self.sign(msg), sig_bytes)
+
+
 class Nonce(str):
     """This class generates a 16 character random string intend
     for use as a nonce when computing an HMAC."""
@@ -99,19 +153,53 @@ class Ext(str):
         content type header was supplied in the request.
 
         If ```body``` is None it is assumed to mean that no
-        body was supplied in the request."""
-        if content_type is None and body is None:
-            ext = ""
-        else:
-            content_type_plus_body = \
-                (content_type if content_type is not None else "") \
-                + \
-                (body if body is not None else "")
-            content_type_plus_body_hash = hashlib.sha1(content_type_plus_body)
-            print content_type_plus_body
-            ext = content_type_plus_body_hash.hexdigest()
+        body was supplied in the request.
+
+        ```body``` can be a str or any object supporting the buffer
+        interface (buffer, memoryview, bytearray). ```body``` is
+        hashed in place - it's never copied. To generate an ext for
+        a body which arrives in chunks use ```ExtHasher```."""
+        ext_hasher = ExtHasher(content_type)
+        if body is not None:
+            ext_hasher.update(body)
+        return ext_hasher.ext(cls)
+
+
+class ExtHasher(object):
+    """Incrementally generates an ext (see ```Ext.generate()```) for
+    a request body which is supplied in one or more chunks. Each chunk
+    is fed straight into an incremental SHA1 so neither the body nor
+    its chunks are copied or concatenated. Typical usage with a body
+    that's streamed:
+
+        ext_hasher = ExtHasher(content_type)
+        for chunk in chunks:
+            ext_hasher.update(chunk)
+        ext = ext_hasher.ext()
+
+    If ```update()``` is never called the request is assumed to have
+    no body."""
+
+    def __init__(self, content_type):
+        object.__init__(self)
+
+        self._is_content_type = content_type is not None
+        self._is_body = False
+        self._hash = hashlib.sha1()
+        if content_type is not None:
+            self._hash.update(content_type)
 
-        return cls(ext)
+    def update(self, chunk):
+        """Add the next ```chunk``` of the body to the ext."""
+        self._is_body = True
+        self._hash.update(chunk)
+
+    def ext(self, cls=Ext):
+        """Returns the ext (an instance of ```cls```)
+        for the content type and body chunks so far."""
+        if not self._is_content_type and not self._is_body:
+            return cls("")
+        return cls(self._hash.hexdigest())
 
 
 class NormalizedRequestString(str):
@@ -165,6 +253,14 @@ class MACKey(str):
     """# of bits in the generated key."""
     _key_size_in_bits = 256
 
+    """Decoding a key and priming the HMAC state is done once per
+    key and the result remembered in ```_hmac_templates```. The auth
+    service sees the same keys over and over so this takes key
+    derivation out of the per request cost of verifying a MAC.
+    ```_max_hmac_templates``` bounds the memory used."""
+    _hmac_templates = {}
+    _max_hmac_templates = 10000
+
     @classmethod
     def _is_value_ok(cls, value):
         if value is None:
@@ -182,6 +278,24 @@ class MACKey(str):
             raise ValueError(msg)
         return str.__new__(cls, value)
 
+    def as_bytes(self):
+        """Decode self into the raw key bytes. mac keys are
+        keyczar style web safe base64 encodings with the
+        trailing padding removed."""
+        return base64.urlsafe_b64decode(str(self) + "=" * (-len(self) % 4))
+
+    def hmac_template(self):
+        """Return the ```_HMACTemplate``` for this key creating it on
+        first use."""
+        cls = type(self)
+        template = cls._hmac_templates.get(self, None)
+        if template is None:
+            template = _HMACTemplate(self.as_bytes())
+            if cls._max_hmac_templates <= len(cls._hmac_templates):
+                cls._hmac_templates.clear()
+            cls._hmac_templates[str(self)] = template
+        return template
+
     def as_keyczar_hmac_key(self):
         """Decode self into a instance of ```keyczar.keys.HmacKey```."""
         keyczar_hmac_key = keyczar.keys.HmacKey(
@@ -213,22 +327,20 @@ class MAC(str):
 
         To prevent timing attacks this method is should be instead of
         direct MAC comparision."""
-        keyczar_hmac_key = mac_key.as_keyczar_hmac_key()
         dehexified_self = _dehexify(self)
         if not dehexified_self:
             return False
-        rv = keyczar_hmac_key.Verify(
+        return mac_key.hmac_template().verify(
             normalized_request_string,
             dehexified_self)
-        return rv
 
     @classmethod
     def generate(cls, mac_key, mac_algorithm, normalized_request_string):
         """Generate a request's MAC given a normalized request sring (aka
         a summary of the key elements of the request, the mac key and
         the algorithm."""
-        keyczar_hmac_key = mac_key.as_keyczar_hmac_key()
-        return cls(_hexify(keyczar_hmac_key.Sign(normalized_request_string)))
+        hmac_template = mac_key.hmac_template()
+        return cls(_hexify(hmac_template.sign(normalized_request_string)))
 
 
 class AuthHeaderValue(object):
@@ -259,111 +371,192 @@ class AuthHeaderValue(object):
         """Parse a string which is the value from an HTTP authorization
         header. If parsing is successful create and return a AuthHeaderValue
         otherwise return None."""
-        if value is None:
-            return None
-
-        reg_ex_pattern = (
-            '^\s*'
-            'MAC\s+'
-            'id\s*\=\s*"(?P<mac_key_identifier>[^"]+)"\s*\,\s*'
-            'ts\s*\=\s*"(?P<ts>[^"]+)"\s*\,\s*'
-            'nonce\s*\=\s*"(?P<nonce>[^"]+)"\s*\,\s*'
-            'ext\s*\=\s*"(?P<ext>[^"]*)"\s*\,\s*'
-            'mac\s*\=\s*"(?P<mac>[^"]+)"\s*'
-            '$'
-        )
-        reg_ex = re.compile(reg_ex_pattern, re.IGNORECASE)
-        match = reg_ex.match(value)
-        if not match:
-            _logger.info(
-                "Invalid format for authorization header '%s'",
-                value)
+        parsed = auth_header.parse(value)
+        if parsed is None or parsed.scheme != auth_header.MAC:
+            _logger.debug("Invalid format for authorization header")
             return None
-        _logger.info(
-            "Valid format for authorization header '%s'",
-            value)
-
-        assert 0 == match.start()
-        assert len(value) == match.end()
-        assert 5 == len(match.groups())
-
-        mac_key_identifier = match.group("mac_key_identifier")
-        assert mac_key_identifier
-        assert 0 < len(mac_key_identifier)
-
-        ts = match.group("ts")
-        assert ts
-        assert 0 < len(ts)
-        ts = Timestamp(ts)
-
-        nonce = match.group("nonce")
-        assert nonce
-        assert 0 < len(nonce)
-        nonce = Nonce(nonce)
-
-        ext = match.group("ext")
-        assert ext is not None
-        assert 0 <= len(ext)
-        ext = Ext(ext)
-
-        mac = match.group("mac")
-        assert mac
-        assert 0 < len(mac)
-        mac = MAC(mac)
-
-        return cls(mac_key_identifier, ts, nonce, ext, mac)
 
+        return cls(
+            parsed.mac_key_identifier,
+            Timestamp(parsed.ts),
+            Nonce(parsed.nonce),
+            Ext(parsed.ext),
+            MAC(parsed.mac))
+
+
+def _content_type(headers):
+    """Returns the value of the content type header in ```headers```
+    or None if there isn't one. ```headers``` is usually a case
+    insensitive dict but ```tornado.httpclient.HTTPRequest``` keeps
+    a plain dict of headers as is."""
+    content_type = headers.get("content-type", None)
+    if content_type is None:
+        for (name, value) in headers.items():
+            if name.lower() == "content-type":
+                return value
+    return content_type
+
+
+class Signer(object):
+    """A Signer signs requests on behalf of a single set of MAC
+    credentials. It's intended for clients (load generators for
+    example) which sign lots of requests with the same credentials
+    so everything which doesn't change from one request to the next
+    is worked out once:
+
+        -- the MAC key is decoded and the HMAC state primed when
+        the signer is created (see ```MACKey.hmac_template()```)
+        -- the path, host and port of each URL are remembered so
+        signing another request for the same URL doesn't re-parse it
+        -- the ext of a request with no body or a small body is
+        remembered so signing another request with the same content
+        type and body doesn't re-hash the body
+
+    Requests are anything with ```method```, ```url```, ```headers```
+    and ```body``` attributes - ```requests.PreparedRequest``` and
+    ```tornado.httpclient.HTTPRequest``` both fit. Typical usage:
+
+        signer = Signer(mac_key_identifier, mac_key, mac_algorithm)
+
+        response = requests.get(url, auth=signer.requests_auth())
+
+        request = tornado.httpclient.HTTPRequest(url)
+        http_client.fetch(signer.sign_request(request), callback=...)
+    """
+
+    """Exts are only remembered for bodies of at most
+    ```_max_cached_body_size``` bytes."""
+    _max_cached_body_size = 1024
+
+    """Bounds on the number of URLs and exts remembered."""
+    _max_urls = 1024
+    _max_exts = 1024
+
+    def __init__(self, mac_key_identifier, mac_key, mac_algorithm=MAC.algorithm):
+        object.__init__(self)
 
-class RequestsAuth(requests.auth.AuthBase):
-    """RequestsAuth allows mac authentication to be used with the
-    popular Requests package. For more details on Requests authentiation
-    see http://docs.python-requests.org/en/latest/user/authentication/."""
-
-    def __init__(self, mac_key_identifier, mac_key, mac_algorithm):
         self.mac_key_identifier = mac_key_identifier
         self.mac_key = mac_key
         self.mac_algorithm = mac_algorithm
 
-    def __call__(self, r):
-
-        ts = Timestamp.generate()
-        nonce = Nonce.generate()
+        self._hmac_template = mac_key.hmac_template()
+        self._urls = {}
+        self._exts = {}
 
-        content_type = r.headers.get("content-type", None)
-        ext = Ext.generate(content_type, r.body)
+    def sign(self, method, url, content_type=None, body=None, ts=None, nonce=None):
+        """Returns the value of the Authorization header for a
+        request. If ```ts``` and/or ```nonce``` are None they're
+        generated."""
+        if ts is None:
+            ts = Timestamp.generate()
+        if nonce is None:
+            nonce = Nonce.generate()
 
-        parsed_url = urllib2.urlparse.urlparse(r.url)
-        path = parsed_url.path
-        host = parsed_url.netloc.split(":")[0]
-        port = self._port(parsed_url)
+        ext = self._ext(content_type, body)
+        (path, host, port) = self._parse_url(url)
 
         nrs = NormalizedRequestString.generate(
             ts,
             nonce,
-            r.method,
+            method,
             path,
             host,
             port,
             ext)
-        my_mac = MAC.generate(
-            self.mac_key,
-            self.mac_algorithm,
-            nrs)
-        ahv = AuthHeaderValue(
+        the_mac = _hexify(self._hmac_template.sign(nrs))
+
+        return 'MAC id="%s", ts="%s", nonce="%s", ext="%s", mac="%s"' % (
             self.mac_key_identifier,
             ts,
             nonce,
             ext,
-            my_mac)
-        r.headers["Authorization"] = str(ahv)
-        return r
-
-    def _port(self, parsed_url):
-        parsed_netloc = parsed_url.netloc.split(":")
-        if 2 == len(parsed_netloc):
-            return parsed_netloc[1]
-        scheme_to_port = {
-            "http": 80,
-            "https": 443,
-        }
-        return scheme_to_port.get(parsed_url.scheme, 80)
+            the_mac)
+
+    def sign_request(self, request, ts=None, nonce=None):
+        """Add an Authorization header to ```request```.
+        Returns ```request```."""
+        request.headers["Authorization"] = self.sign(
+            request.method,
+            request.url,
+            _content_type(request.headers),
+            request.body,
+            ts,
+            nonce)
+        return request
+
+    def sign_many(self, requests_to_sign):
+        """Add an Authorization header to each of ```requests_to_sign```
+        - all the requests are given the same timestamp and the nonces
+        are generated together. Returns the list of requests. The auth
+        service rejects requests with a timestamp more than its
+        --maxage seconds old so requests must be sent soon after
+        they're signed."""
+        requests_to_sign = list(requests_to_sign)
+        ts = Timestamp.generate()
+        nonces = _hexify(os.urandom(8 * len(requests_to_sign)))
+        for (i, request) in enumerate(requests_to_sign):
+            self.sign_request(request, ts, Nonce(nonces[16 * i:16 * (i + 1)]))
+        return requests_to_sign
+
+    def requests_auth(self):
+        """Returns a ```RequestsAuth``` which signs using this signer."""
+        return RequestsAuth(
+            self.mac_key_identifier,
+            self.mac_key,
+            self.mac_algorithm,
+            signer=self)
+
+    def _ext(self, content_type, body):
+        if body is not None:
+            # bytearrays and the like can't be dict keys
+            if not isinstance(body, str) or self._max_cached_body_size < len(body):
+                return Ext.generate(content_type, body)
+
+        key = (content_type, body)
+        ext = self._exts.get(key, None)
+        if ext is None:
+            ext = Ext.generate(content_type, body)
+            if self._max_exts <= len(self._exts):
+                self._exts.clear()
+            self._exts[key] = ext
+        return ext
+
+    def _parse_url(self, url):
+        rv = self._urls.get(url, None)
+        if rv is None:
+            parsed_url = urllib2.urlparse.urlparse(url)
+            parsed_netloc = parsed_url.netloc.split(":")
+            if 2 == len(parsed_netloc):
+                port = parsed_netloc[1]
+            else:
+                scheme_to_port = {
+                    "http": 80,
+                    "https": 443,
+                }
+                port = scheme_to_port.get(parsed_url.scheme, 80)
+            rv = (parsed_url.path, parsed_netloc[0], port)
+            if self._max_urls <= len(self._urls):
+                self._urls.clear()
+            self._urls[url] = rv
+        return rv
+
+
+class RequestsAuth(requests.auth.AuthBase):
+    """RequestsAuth allows mac authentication to be used with the
+    popular Requests package. For more details on Requests authentiation
+    see http://docs.python-requests.org/en/latest/user/authentication/.
+
+    Requests are signed by a ```Signer```. To share a signer (and so
+    the URLs and exts it remembers) between ```RequestsAuth```s use
+    ```Signer.requests_auth()```."""
+
+    def __init__(self, mac_key_identifier, mac_key, mac_algorithm, signer=None):
+        self.mac_key_identifier = mac_key_identifier
+        self.mac_key = mac_key
+        self.mac_algorithm = mac_algorithm
+        if signer is None:
+            signer = Signer(mac_key_identifier, mac_key, mac_algorithm)
+        self.signer = signer
+
+    def __call__(self, r):
+        return self.signer.sign_request(r)
@@ -0,0 +1,188 @@
+"""This module implements a minimal async memcached client. It only
+implements the commands yar needs (add and delete) which is what lets
+it stay small: every response to these commands is a single line.
+
+Keys are spread across a cluster of memcached servers using consistent
+hashing (see yar.util.hashring) so that adding a server to the cluster
+only moves the keys which now belong on the new server. Each server
+gets one persistent connection on which commands are pipelined -
+commands are written as soon as they're issued and responses are
+matched to commands in the order they arrive.
+
+Typical usage:
+
+    client = memcached.Client(["127.0.0.1:11211", "127.0.0.1:11212"])
+    client.add(key, "1", 30, callback)
+
+where ```callback``` is called with True if the command succeeded
+(for add, the key didn't already exist), False if it didn't and None
+if an error occurred talking to memcached."""
+
+import collections
+import hashlib
+import logging
+import re
+import socket
+
+import tornado.ioloop
+import tornado.iostream
+
+from yar.util import hashring
+
+_logger = logging.getLogger("UTIL.%s" % __name__)
+
+"""If a server doesn't respond to a command within ```timeout```
+seconds the connection to the server is closed and all commands
+waiting for a response from the server fail."""
+timeout = 1.0
+
+"""memcached keys can be at most 250 characters and can't contain
+whitespace or control characters. Keys which don't match this
+regular expression are replaced by a hash of the key."""
+_safe_key_reg_ex = re.compile(r"^[\x21-\x7e]{1,250}$")
+
+
+def _safe_key(key):
+    if _safe_key_reg_ex.match(key):
+        return key
+    return hashlib.sha1(key).hexdigest()
+
+
+class Client(object):
+    """A client for a cluster of memcached servers."""
+
+    def __init__(self, servers):
+        object.__init__(self)
+
+        self._hash_ring = hashring.HashRing(servers)
+        self._connections = {}
+
+    def add(self, key, value, ttl, callback):
+        """Async'ly store ```value``` for ```key``` for ```ttl``` seconds
+        only if ```key``` doesn't already exist. ```callback``` is called
+        with True if ```value``` was stored, False if ```key``` already
+        existed and None on error."""
+        key = _safe_key(key)
+        command = "add %s 0 %d %d\r\n%s\r\n" % (key, ttl, len(value), value)
+        self._connection(key).send(command, "STORED", "NOT_STORED", callback)
+
+    def delete(self, key, callback=None):
+        """Async'ly delete ```key```. If ```callback``` isn't None it's
+        called with True if ```key``` was deleted, False if ```key```
+        didn't exist and None on error."""
+        key = _safe_key(key)
+        command = "delete %s\r\n" % key
+        self._connection(key).send(command, "DELETED", "NOT_FOUND", callback)
+
+    def _connection(self, key):
+        server = self._hash_ring.get_node(key)
+        connection = self._connections.get(server, None)
+        if connection is None:
+            connection = _Connection(server)
+            self._connections[server] = connection
+        return connection
+
+
+class _Connection(object):
+    """A single persistent connection to a memcached server."""
+
+    def __init__(self, server):
+        object.__init__(self)
+
+        (host, port) = server.split(":")
+        self._address = (host, int(port))
+        self._stream = None
+        self._connected = False
+        self._pending = collections.deque()
+        self._timeout = None
+
+    def send(self, command, ok_response, not_ok_response, callback):
+        if self._stream is None:
+            self._connect()
+
+        self._pending.append((ok_response, not_ok_response, callback))
+        # :TRICKY: writes are buffered until the connection is established
+        self._stream.write(command)
+        if len(self._pending) == 1:
+            self._read_response()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._stream = tornado.iostream.IOStream(sock)
+        self._stream.set_close_callback(self._on_close)
+        self._stream.connect(self._address, self._on_connect)
+
+    def _on_connect(self):
+        self._connected = True
+        if self._pending:
+            self._stream.read_until("\r\n", self._on_response)
+
+    def _read_response(self):
+        """Wait for the response to the oldest command waiting for a
+        response. The timeout also covers establishing the connection."""
+        io_loop = tornado.ioloop.IOLoop.current()
+        self._timeout = io_loop.call_later(timeout, self._on_timeout)
+        if self._connected:
+            self._stream.read_until("\r\n", self._on_response)
+
+    def _on_response(self, line):
+        tornado.ioloop.IOLoop.current().remove_timeout(self._timeout)
+        self._timeout = None
+
+        (ok_response, not_ok_response, callback) = self._pending.popleft()
+        if self._pending:
+            self._read_response()
+
+        line = line.rstrip("\r\n")
+        if line == ok_response:
+            rv = True
+        elif line == not_ok_response:
+            rv = False
+        else:
+            _logger.error(
+                "memcached %s:%d responded with '%s'",
+                self._address[0],
+                self._address[1],
+                line)
+            rv = None
+
+        if callback is not None:
+            callback(rv)
+
+    def _on_timeout(self):
+        _logger.error(
+            "memcached %s:%d didn't respond within %.1f seconds",
+            self._address[0],
+            self._address[1],
+            timeout)
+        self._timeout = None
+        self._reset()
+
+    def _on_close(self):
+        _logger.error(
+            "Connection to memcached %s:%d closed - %s",
+            self._address[0],
+            self._address[1],
+            self._stream.error)
+        self._reset()
+
+    def _reset(self):
+        """Close the connection to the server and fail all commands
+        waiting for a response. The next command sent opens a new
+        connection."""
+        stream = self._stream
+        self._stream = None
+        self._connected = False
+        stream.set_close_callback(None)
+        stream.close()
+
+        if self._timeout is not None:
+            tornado.ioloop.IOLoop.current().remove_timeout(self._timeout)
+            self._timeout = None
+
+        pending = self._pending
+        self._pending = collections.deque()
+        for (ok_response, not_ok_response, callback) in pending:
+            if callback is not None:
+                callback(None)
@@ -0,0 +1,117 @@
+"""yar servers are single threaded Tornado applications so a single
+server process only ever uses one core. This module lets a server's
+mainline start a collection of worker processes which all accept
+connections on the same address:port so that one box can saturate
+all its cores without an external load balancer. Typical usage from
+a mainline:
+
+    app = tornado.web.Application(handlers=handlers)
+    prefork.start(app, clo.listen_on, clo.processes, clo.reuse_port)
+
+When ```processes``` is 1 there's no forking and the server behaves
+exactly as it always did.
+
+The parent process becomes a supervisor - it does no request
+processing and respawns any worker that dies unexpectedly.
+Workers share listening sockets in one of two ways:
+
+    1/ shared socket - the parent binds the listening socket before
+    forking and all workers inherit it. the kernel hands each new
+    connection to one of the workers blocked in accept()
+
+    2/ SO_REUSEPORT - each worker binds its own listening socket
+    after forking and the kernel load balances new connections
+    across the sockets. this typically spreads load more evenly
+    than a shared socket but requires Linux 3.9+
+
+Everything imported and created before forking is shared copy-on-write
+with the workers. To keep those pages shared for as long as possible
+a full garbage collection is done just before forking and, on Pythons
+which support it, the surviving objects are frozen so the collector
+doesn't touch (and therefore copy) them in the workers."""
+
+import gc
+import logging
+import os
+
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+import tornado.process
+
+from yar.util import logging_config
+
+_logger = logging.getLogger("UTIL.%s" % __name__)
+
+"""Workers that die unexpectedly are respawned. If more than
+```max_restarts``` workers have to be respawned the supervisor
+gives up and exits."""
+max_restarts = 100
+
+
+def start(app, listen_on, processes=1, reuse_port=False, on_start=None):
+    """Start serving ```app``` on ```listen_on``` (an (address, port)
+    tuple) using ```processes``` worker processes. A ```processes``` value
+    of 0 or None means start one worker per core. If ```reuse_port```
+    is True each worker binds its own SO_REUSEPORT listening socket
+    otherwise workers share the listening socket bound by the parent.
+    If ```on_start``` isn't None it's called (with no arguments) by
+    each worker once the worker's IOLoop is running - this is the place
+    to do anything which can't be done before forking such as opening
+    connections to upstream services. This function only returns
+    when the IOLoop is stopped."""
+
+    (address, port) = listen_on
+
+    if processes == 1:
+        sockets = tornado.netutil.bind_sockets(port, address)
+        _serve(app, sockets, on_start)
+        return
+
+    sockets = None
+    if not reuse_port:
+        sockets = tornado.netutil.bind_sockets(port, address)
+
+    _freeze_heap()
+
+    fmt = "Forking %s worker processes %s"
+    _logger.info(
+        fmt,
+        processes or tornado.process.cpu_count(),
+        "with SO_REUSEPORT" if reuse_port else "sharing listening socket")
+
+    worker_id = tornado.process.fork_processes(processes, max_restarts)
+
+    # from here on we're in a worker process
+    logging_config.tag_worker(worker_id)
+
+    if sockets is None:
+        sockets = tornado.netutil.bind_sockets(port, address, reuse_port=True)
+
+    _logger.info(
+        "Worker %d (pid %d) listening on %s:%d",
+        worker_id,
+        os.getpid(),
+        address,
+        port)
+
+    _serve(app, sockets, on_start)
+
+
+def _freeze_heap():
+    """Collect garbage before forking and, where supported, move all
+    surviving objects into the collector's permanent generation so
+    that workers don't copy shared pages by collecting them."""
+    gc.collect()
+    freeze = getattr(gc, "freeze", None)
+    if freeze is not None:
+        freeze()
+
+
+def _serve(app, sockets, on_start):
+    http_server = tornado.httpserver.HTTPServer(app, xheaders=True)
+    http_server.add_sockets(sockets)
+    io_loop = tornado.ioloop.IOLoop.instance()
+    if on_start is not None:
+        io_loop.add_callback(on_start)
+    io_loop.start()
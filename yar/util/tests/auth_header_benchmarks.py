@@ -0,0 +1,140 @@
+"""This module contains micro-benchmarks for yar/util/auth_header.py.
+Run this module directly:
+
+    python yar/util/tests/auth_header_benchmarks.py
+
+Every request the auth service sees has its Authorization header
+parsed - including requests from clients (or attackers) sending
+malformed headers. The benchmarks below run a corpus of valid headers
+and a corpus of hostile headers through the previous implementation
+(a scheme regex in the request handler followed by a per scheme regex
+compiled on every call) and through ```auth_header.parse()```."""
+
+import re
+
+from yar.tests import yar_benchmark_util
+from yar.util import auth_header
+from yar.util import mac
+
+_valid_corpus = [
+    str(mac.AuthHeaderValue(
+        mac.MACKeyIdentifier.generate(),
+        mac.Timestamp.generate(),
+        mac.Nonce.generate(),
+        mac.Ext.generate("application/json; charset=utf8", "{}"),
+        "7f6b1d2c0a1e4f3b9c8d7e6f5a4b3c2d1e0f9a8b")),
+    str(mac.AuthHeaderValue(
+        mac.MACKeyIdentifier.generate(),
+        mac.Timestamp.generate(),
+        mac.Nonce.generate(),
+        "",
+        "7f6b1d2c0a1e4f3b9c8d7e6f5a4b3c2d1e0f9a8b")),
+    "BASIC ZGF2ZXdhc2hlcmUxMjM0NTY3ODkwYWJjZGVmOg==",
+]
+
+_hostile_corpus = [
+    "",
+    "DAVE",
+    "BEARER abc",
+    "MAC " + ("x" * 64),
+    'MAC id="dave", ts="42", nonce="was", ext="", mac=',
+    'MAC id="dave", ' * 64,
+    "MAC " + ('"' * 4096),
+    "BASIC " + ("a " * 2048),
+    " " * 8192,
+]
+
+_old_scheme_reg_ex = re.compile(
+    "^\s*(?P<auth_scheme>(MAC|BASIC))\s+.*",
+    re.IGNORECASE)
+
+_old_basic_reg_ex = re.compile(
+    "^\s*BASIC\s+(?P<api_key_colon>[^\s]+)\s*$",
+    re.IGNORECASE)
+
+_old_mac_reg_ex_pattern = (
+    '^\s*'
+    'MAC\s+'
+    'id\s*\=\s*"(?P<mac_key_identifier>[^"]+)"\s*\,\s*'
+    'ts\s*\=\s*"(?P<ts>[^"]+)"\s*\,\s*'
+    'nonce\s*\=\s*"(?P<nonce>[^"]+)"\s*\,\s*'
+    'ext\s*\=\s*"(?P<ext>[^"]*)"\s*\,\s*'
+    'mac\s*\=\s*"(?P<mac>[^"]+)"\s*'
+    '$'
+)
+
+
+def _old_parse(value):
+    """Roughly how the auth service used to parse Authorization headers."""
+    match = _old_scheme_reg_ex.match(value)
+    if not match:
+        return None
+    if match.group("auth_scheme").upper() == "BASIC":
+        match = _old_basic_reg_ex.match(value)
+        return match.group("api_key_colon") if match else None
+    # re.compile() hits re's internal cache but still costs
+    # a cache lookup on every call
+    match = re.compile(_old_mac_reg_ex_pattern, re.IGNORECASE).match(value)
+    if not match:
+        return None
+    return (
+        match.group("mac_key_identifier"),
+        mac.Timestamp(match.group("ts")),
+        mac.Nonce(match.group("nonce")),
+        mac.Ext(match.group("ext")),
+        mac.MAC(match.group("mac")),
+    )
+
+
+def _new_parse(value):
+    parsed = auth_header.parse(value)
+    if parsed is None:
+        return auth_header.scheme_of(value)
+    return parsed
+
+
+def main():
+
+    def old_valid():
+        for value in _valid_corpus:
+            _old_parse(value)
+
+    def new_valid():
+        for value in _valid_corpus:
+            _new_parse(value)
+
+    def old_hostile():
+        for value in _hostile_corpus:
+            _old_parse(value)
+
+    def new_hostile():
+        for value in _hostile_corpus:
+            _new_parse(value)
+
+    valid_baseline = yar_benchmark_util.run("valid corpus (old)", old_valid)
+    yar_benchmark_util.print_results(
+        [
+            valid_baseline,
+            yar_benchmark_util.run("valid corpus (auth_header)", new_valid),
+        ],
+        valid_baseline)
+
+    print ""
+
+    hostile_baseline = yar_benchmark_util.run(
+        "hostile corpus (old)",
+        old_hostile,
+        number=1000)
+    yar_benchmark_util.print_results(
+        [
+            hostile_baseline,
+            yar_benchmark_util.run(
+                "hostile corpus (auth_header)",
+                new_hostile,
+                number=1000),
+        ],
+        hostile_baseline)
+
+
+if __name__ == "__main__":
+    main()
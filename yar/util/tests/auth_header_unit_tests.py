@@ -0,0 +1,76 @@
+"""This module contains a series of unit tests which
+validate yar/util/auth_header.py"""
+
+import unittest
+
+from yar.util import auth_header
+
+
+class ParseTestCase(unittest.TestCase):
+    """These unit tests verify the behavior of
+    yar.util.auth_header.parse()"""
+
+    def test_mac(self):
+        value = 'MAC id="dave", ts="42", nonce="was", ext="", mac="here"'
+        parsed = auth_header.parse(value)
+        self.assertIsNotNone(parsed)
+        self.assertEqual(parsed.scheme, auth_header.MAC)
+        self.assertEqual(parsed.mac_key_identifier, "dave")
+        self.assertEqual(parsed.ts, "42")
+        self.assertEqual(parsed.nonce, "was")
+        self.assertEqual(parsed.ext, "")
+        self.assertEqual(parsed.mac, "here")
+        self.assertIsNone(parsed.credentials)
+
+    def test_mac_whitespace_and_case(self):
+        value = ' mac  ID = "dave" ,ts="42",nonce="was",ext="x",MAC="here"  '
+        parsed = auth_header.parse(value)
+        self.assertIsNotNone(parsed)
+        self.assertEqual(parsed.scheme, auth_header.MAC)
+        self.assertEqual(parsed.mac_key_identifier, "dave")
+        self.assertEqual(parsed.ext, "x")
+        self.assertEqual(parsed.mac, "here")
+
+    def test_basic(self):
+        parsed = auth_header.parse("Basic ZGF2ZTo=")
+        self.assertIsNotNone(parsed)
+        self.assertEqual(parsed.scheme, auth_header.BASIC)
+        self.assertEqual(parsed.credentials, "ZGF2ZTo=")
+        self.assertIsNone(parsed.mac_key_identifier)
+
+    def test_malformed(self):
+        values = [
+            None,
+            "",
+            "MAC",
+            "BASIC",
+            "BASIC a b",
+            "DAVE was=here",
+            'MAC id="dave", ts="forty-two", nonce="was", ext="", mac="here"',
+            'MAC id="", ts="42", nonce="was", ext="", mac="here"',
+            'MAC id="dave", ts="42", nonce="was", ext=""',
+            'MAC id="dave", ts="42", nonce="was", ext="", mac="here", x="y"',
+        ]
+        for value in values:
+            self.assertIsNone(auth_header.parse(value), value)
+
+    def test_too_long(self):
+        value = "BASIC %s" % ("a" * auth_header.max_length)
+        self.assertIsNone(auth_header.parse(value))
+
+
+class SchemeOfTestCase(unittest.TestCase):
+    """These unit tests verify the behavior of
+    yar.util.auth_header.scheme_of()"""
+
+    def test_it(self):
+        self.assertEqual(auth_header.scheme_of("MAC ..."), auth_header.MAC)
+        self.assertEqual(auth_header.scheme_of("  mac\t..."), auth_header.MAC)
+        self.assertEqual(auth_header.scheme_of("basic a b"), auth_header.BASIC)
+        self.assertEqual(auth_header.scheme_of("BASIC "), auth_header.BASIC)
+        self.assertIsNone(auth_header.scheme_of(None))
+        self.assertIsNone(auth_header.scheme_of(""))
+        self.assertIsNone(auth_header.scheme_of("MAC"))
+        self.assertIsNone(auth_header.scheme_of("BASIC"))
+        self.assertIsNone(auth_header.scheme_of("MACBASIC x"))
+        self.assertIsNone(auth_header.scheme_of("DAVE"))
@@ -39,6 +39,35 @@ class TestCase(unittest.TestCase):
                 with self.assertRaises(optparse.OptionValueError):
                     type_checker(option, opt_string, value[0])
 
+    def test_check_couchdbs(self):
+        option = clparserutil.Option(
+            "--replicas",
+            action="store",
+            dest="couchdbs",
+            default="bindle:8909/berry",
+            type="couchdbs",
+            help="whatever")
+        values = [
+            ["bindle:8909/berry", ["bindle:8909/berry"]],
+            ["b:8/y, d:9/z", ["b:8/y", "d:9/z"]],
+            [" b:8/y ,d:9/z ", ["b:8/y", "d:9/z"]],
+
+            ["dave", None],
+            ["b:8/y, dave:89", None],
+            ["b:8/y,", None],
+        ]
+        type_checker = clparserutil.Option.TYPE_CHECKER["couchdbs"]
+        self.assertIsNotNone(type_checker)
+        opt_string = option.get_opt_string()
+        for value in values:
+            if value[1] is not None:
+                msg = "Failed to parse '%s' correctly." % value[0]
+                result = type_checker(option, opt_string, value[0])
+                self.assertEqual(result, value[1], msg)
+            else:
+                with self.assertRaises(optparse.OptionValueError):
+                    type_checker(option, opt_string, value[0])
+
     def test_check_logginglevel(self):
         option = clparserutil.Option(
             "--create",
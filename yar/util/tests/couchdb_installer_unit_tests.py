@@ -23,6 +23,7 @@ class CommandLineParserUnitTase(unittest.TestCase):
         self.assertFalse(clo.delete)
         self.assertTrue(clo.create)
         self.assertTrue(clo.create_design_docs)
+        self.assertFalse(clo.migrate)
         self.assertEqual(clo.database, "creds")
         self.assertEqual(clo.host, "127.0.0.1:5984")
         self.assertEqual(clo.logging_level, logging.ERROR)
@@ -128,3 +129,21 @@ class CommandLineParserUnitTase(unittest.TestCase):
         self.assertEqual(clo.database, "creds")
         self.assertEqual(clo.host, "127.0.0.1:5984")
         self.assertEqual(clo.logging_level, logging.ERROR)
+
+    def test_migrate(self):
+        """Verify the command line parser correctly parses
+        the --migrate command line arg."""
+        args = [
+            "--migrate", "t",
+        ]
+
+        clp = CommandLineParser("description", "creds")
+        (clo, cla) = clp.parse_args(args)
+
+        self.assertFalse(clo.delete)
+        self.assertTrue(clo.create)
+        self.assertTrue(clo.create_design_docs)
+        self.assertTrue(clo.migrate)
+        self.assertEqual(clo.database, "creds")
+        self.assertEqual(clo.host, "127.0.0.1:5984")
+        self.assertEqual(clo.logging_level, logging.ERROR)
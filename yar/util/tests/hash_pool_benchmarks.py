@@ -0,0 +1,78 @@
+"""This module contains a benchmark for yar/util/hash_pool.py.
+Run this module directly:
+
+    python yar/util/tests/hash_pool_benchmarks.py [<body size in MB> [<ms between requests>]]
+
+Rather than timing the hashing itself (which costs the same wherever
+it happens) the benchmark measures how late the IOLoop services other
+work while large bodies are being hashed. A probe is scheduled with
+```call_later()``` every millisecond and the lag is how long after its
+deadline the probe actually runs. Requests with large bodies arrive
+every 100 ms (by default) and each one's ext is generated either on
+the IOLoop's thread or by ```hash_pool```. Hashing on the pool only
+helps when the machine has a core to spare for the pool's threads."""
+
+import os
+import sys
+import time
+
+import tornado.ioloop
+
+from yar.util import hash_pool
+
+_probe_interval = 0.001
+_number_of_requests = 50
+
+
+def _measure(body, request_interval, use_pool):
+    hash_pool.min_size = 0 if use_pool else len(body) + 1
+    io_loop = tornado.ioloop.IOLoop.current()
+    lags = []
+    state = {"requests": 0, "exts": 0}
+
+    def probe(deadline):
+        lags.append(time.time() - deadline)
+        if state["exts"] < _number_of_requests:
+            io_loop.call_later(_probe_interval, probe, time.time() + _probe_interval)
+        else:
+            io_loop.stop()
+
+    def on_ext_done(ext):
+        state["exts"] += 1
+
+    def request():
+        state["requests"] += 1
+        hash_pool.ext("application/octet-stream", body, on_ext_done)
+        if state["requests"] < _number_of_requests:
+            io_loop.call_later(request_interval, request)
+
+    io_loop.call_later(_probe_interval, probe, time.time() + _probe_interval)
+    io_loop.add_callback(request)
+    io_loop.start()
+
+    lags.sort()
+    return (
+        1000.0 * sum(lags) / len(lags),
+        1000.0 * lags[int(len(lags) * 0.99)],
+        1000.0 * lags[-1])
+
+
+def main():
+    size_in_mb = int(sys.argv[1]) if 1 < len(sys.argv) else 4
+    request_interval = int(sys.argv[2]) / 1000.0 if 2 < len(sys.argv) else 0.100
+    body = os.urandom(size_in_mb * 1024 * 1024)
+
+    print "%d requests with %d MB bodies every %d ms" % (
+        _number_of_requests,
+        size_in_mb,
+        int(request_interval * 1000))
+
+    fmt = "%-10s  %14s  %14s  %14s"
+    print fmt % ("ext on", "mean lag (ms)", "p99 lag (ms)", "max lag (ms)")
+    for (name, use_pool) in [("ioloop", False), ("hash pool", True)]:
+        (mean_lag, p99_lag, max_lag) = _measure(body, request_interval, use_pool)
+        print fmt % (name, "%.2f" % mean_lag, "%.2f" % p99_lag, "%.2f" % max_lag)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""This module contains a collection of unit tests which
+validate yar.util.hash_pool"""
+
+import hashlib
+import unittest
+
+import mock
+
+from yar.util import hash_pool
+from yar.util import mac
+
+
+class HashPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(hash_pool, "min_size", 16)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(hash_pool, "max_threads", 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch("tornado.ioloop.IOLoop.current")
+        self.ioloop_current = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # a stand in for the pool which runs functions on the calling thread
+        self.pool = mock.Mock()
+
+        def apply_async_patch(func, args, callback):
+            callback(func(*args))
+
+        self.pool.apply_async.side_effect = apply_async_patch
+
+        patcher = mock.patch.object(hash_pool, "_get_pool", return_value=self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.callback = mock.Mock()
+
+    def _add_callback(self):
+        """Verify the pool's result was handed back to the IOLoop
+        and call the callback the way the IOLoop would."""
+        add_callback = self.ioloop_current.return_value.add_callback
+        self.assertEqual(add_callback.call_count, 1)
+        self.assertEqual(self.callback.call_count, 0)
+        (callback, rv) = add_callback.call_args[0]
+        callback(rv)
+
+    def test_small_body_is_hashed_inline(self):
+        hash_pool.ext("application/json", "dave", self.callback)
+        self.callback.assert_called_once_with(mac.Ext.generate("application/json", "dave"))
+        self.assertEqual(self.pool.apply_async.call_count, 0)
+
+    def test_no_body_is_hashed_inline(self):
+        hash_pool.ext(None, None, self.callback)
+        self.callback.assert_called_once_with(mac.Ext.generate(None, None))
+        self.assertEqual(self.pool.apply_async.call_count, 0)
+
+    def test_large_body_is_hashed_on_pool(self):
+        body = "dave was here " * 10
+        hash_pool.ext("text/plain", body, self.callback)
+        self.assertEqual(self.pool.apply_async.call_count, 1)
+        self._add_callback()
+        self.callback.assert_called_once_with(mac.Ext.generate("text/plain", body))
+
+    def test_pool_off(self):
+        body = "dave was here " * 10
+        with mock.patch.object(hash_pool, "max_threads", 0):
+            hash_pool.sha1(body, self.callback)
+        self.callback.assert_called_once_with(hashlib.sha1(body).hexdigest())
+        self.assertEqual(self.pool.apply_async.call_count, 0)
+
+    def test_sha1(self):
+        body = "dave was here " * 10
+        hash_pool.sha1(body, self.callback)
+        self._add_callback()
+        self.callback.assert_called_once_with(hashlib.sha1(body).hexdigest())
+
+    def test_error_inline(self):
+        with mock.patch.object(mac.Ext, "generate", side_effect=Exception("oops")):
+            hash_pool.ext("application/json", "dave", self.callback)
+        self.callback.assert_called_once_with(None)
+        self.assertEqual(self.pool.apply_async.call_count, 0)
+
+    def test_error_with_pool_off(self):
+        body = "dave was here " * 10
+        with mock.patch.object(hash_pool, "max_threads", 0):
+            with mock.patch.object(mac.Ext, "generate", side_effect=Exception("oops")):
+                hash_pool.ext("text/plain", body, self.callback)
+        self.callback.assert_called_once_with(None)
+
+    def test_error_on_pool(self):
+        body = "dave was here " * 10
+        with mock.patch.object(mac.Ext, "generate", side_effect=Exception("oops")):
+            hash_pool.ext("text/plain", body, self.callback)
+        self._add_callback()
+        self.callback.assert_called_once_with(None)
+
+
+class GetPoolTestCase(unittest.TestCase):
+
+    def test_pool_is_created_once(self):
+        pool = mock.Mock()
+        with mock.patch.object(hash_pool, "_pool", None):
+            with mock.patch("multiprocessing.pool.ThreadPool", return_value=pool) as thread_pool:
+                with mock.patch.object(hash_pool, "max_threads", 3):
+                    self.assertIs(hash_pool._get_pool(), pool)
+                    self.assertIs(hash_pool._get_pool(), pool)
+        thread_pool.assert_called_once_with(3)
@@ -0,0 +1,36 @@
+"""This module contains a series of unit tests which
+validate yar/util/hashring.py"""
+
+import unittest
+
+from yar.util import hashring
+
+
+class HashRingTestCase(unittest.TestCase):
+    """These unit tests verify the behavior of
+    yar.util.hashring.HashRing"""
+
+    def test_no_nodes(self):
+        self.assertIsNone(hashring.HashRing([]).get_node("dave"))
+
+    def test_keys_spread_across_nodes(self):
+        nodes = ["10.0.0.%d:11211" % i for i in range(4)]
+        ring = hashring.HashRing(nodes)
+        counts = dict((node, 0) for node in nodes)
+        for i in range(4000):
+            counts[ring.get_node("key-%d" % i)] += 1
+        for count in counts.values():
+            self.assertTrue(600 < count < 1400, counts)
+
+    def test_adding_a_node_moves_few_keys(self):
+        nodes = ["10.0.0.%d:11211" % i for i in range(4)]
+        ring = hashring.HashRing(nodes)
+        bigger_ring = hashring.HashRing(nodes + ["10.0.0.4:11211"])
+
+        keys = ["key-%d" % i for i in range(4000)]
+        moved = [key for key in keys if ring.get_node(key) != bigger_ring.get_node(key)]
+
+        # about 1/5th of the keys should move and all to the new node
+        self.assertTrue(len(moved) < 4000 * 0.3, len(moved))
+        for key in moved:
+            self.assertEqual(bigger_ring.get_node(key), "10.0.0.4:11211")
@@ -0,0 +1,259 @@
+"""This module contains micro-benchmarks for the functions in
+yar/util/mac.py and yar/util/trhutil.py which run on every request
+the auth service or key service sees. Run this module directly:
+
+    python yar/util/tests/hot_path_benchmarks.py [<results.json>]
+
+Each benchmark runs one function over a corpus of inputs which look
+like what the services see in production (a mix of MAC and basic
+Authorization headers, Host headers with and without ports, JSON
+bodies from a few bytes to tens of KB, ...) so a benchmark's ops/sec
+is for a pass over its corpus rather than for a single input. Along
+with ops/sec each benchmark reports the objects a pass leaves behind
+(see ```yar_benchmark_util.run()```) which should be 0 - anything else
+means a cache is growing or something is leaking.
+
+If ```results.json``` is supplied the results are also written to it
+(see ```yar_benchmark_util.write_results()```) so a run can be compared
+with the results of a previous run."""
+
+import httplib
+import json
+import StringIO
+import sys
+
+import requests
+import tornado.httpclient
+import tornado.httputil
+
+from yar.key_service import async_creds_creator
+from yar.tests import yar_benchmark_util
+from yar.util import mac
+from yar.util import trhutil
+
+_content_types = [
+    "application/json; charset=utf8",
+    "application/json; charset=UTF-8",
+    "application/json",
+    "text/plain",
+    "application/x-www-form-urlencoded",
+    None,
+]
+
+_bodies = [
+    None,
+    "",
+    json.dumps({"principal": "dave@example.com", "auth_scheme": "mac"}),
+    json.dumps([async_creds_creator.generate_creds("%d@example.com" % i, "mac") for i in range(10)]),
+    json.dumps([async_creds_creator.generate_creds("%d@example.com" % i, "mac") for i in range(100)]),
+]
+
+_hosts = [
+    "127.0.0.1:8000",
+    "api.example.com",
+    "api.example.com:443",
+    "  api.example.com:8080  ",
+    "[::1]:8000",
+    None,
+]
+
+_methods_and_uris = [
+    ("GET", "/v1.0/creds/6b39c3a1f1a34e3f8f1b9a8a3c2b1d0e"),
+    ("GET", "/v1.0/creds?principal=dave@example.com&limit=100"),
+    ("POST", "/v1.0/creds"),
+    ("DELETE", "/v1.0/creds/6b39c3a1f1a34e3f8f1b9a8a3c2b1d0e"),
+    ("PUT", "/dave/was/here.html"),
+]
+
+
+def _auth_header_values():
+    values = []
+    for (content_type, body) in zip(_content_types, _bodies):
+        values.append(str(mac.AuthHeaderValue(
+            mac.MACKeyIdentifier.generate(),
+            mac.Timestamp.generate(),
+            mac.Nonce.generate(),
+            mac.Ext.generate(content_type, body),
+            mac.MAC.generate(mac.MACKey.generate(), mac.MAC.algorithm, "dave"))))
+    values.extend([
+        "BASIC ZGF2ZXdhc2hlcmUxMjM0NTY3ODkwYWJjZGVmOg==",
+        'MAC id="dave", ts="42", nonce="was", ext="", mac=',
+        "",
+    ])
+    return values
+
+
+def _server_requests():
+    server_requests = []
+    for (host, (method, uri)) in zip(_hosts, _methods_and_uris * 2):
+        headers = tornado.httputil.HTTPHeaders()
+        if host is not None:
+            headers["Host"] = host
+        server_requests.append(tornado.httputil.HTTPServerRequest(
+            method=method,
+            uri=uri,
+            headers=headers))
+    return server_requests
+
+
+def _responses():
+    responses = []
+    request = tornado.httpclient.HTTPRequest("http://127.0.0.1:8070/v1.0/creds")
+    for (code, content_type, body) in [
+            (httplib.OK, "application/json; charset=utf8", _bodies[2]),
+            (httplib.OK, "application/json; charset=utf8", _bodies[3]),
+            (httplib.OK, "application/json", _bodies[4]),
+            (httplib.CREATED, "application/json; charset=utf8", _bodies[2]),
+            (httplib.OK, "text/plain", "dave was here"),
+            (httplib.OK, "application/json; charset=utf8", "{dave"),
+            (httplib.NOT_FOUND, "application/json; charset=utf8", "{}")]:
+        headers = tornado.httputil.HTTPHeaders({
+            "Content-Type": content_type,
+            "Content-Length": str(len(body)),
+        })
+        response = tornado.httpclient.HTTPResponse(
+            request,
+            code,
+            headers=headers,
+            buffer=StringIO.StringIO(body))
+        # HTTPResponse.body reads the buffer on first use - read
+        # it now so the benchmark doesn't measure the read
+        response.body
+        responses.append(response)
+    return responses
+
+
+def _prepared_requests():
+    prepared_requests = []
+    for ((method, uri), content_type, body) in zip(_methods_and_uris, _content_types, _bodies):
+        headers = {}
+        if content_type is not None:
+            headers["Content-Type"] = content_type
+        prepared_requests.append(requests.Request(
+            method,
+            "http://api.example.com:8000%s" % uri,
+            headers=headers,
+            data=body).prepare())
+    return prepared_requests
+
+
+def main():
+    auth_header_values = _auth_header_values()
+
+    def auth_header_value_parse():
+        for value in auth_header_values:
+            mac.AuthHeaderValue.parse(value)
+
+    nrs_args = [
+        (mac.Timestamp.generate(), mac.Nonce.generate(), method, uri, host, port, ext)
+        for ((method, uri), (host, port), ext) in zip(
+            _methods_and_uris,
+            [("127.0.0.1", 8000), ("api.example.com", 80), ("api.example.com", "443")] * 2,
+            [mac.Ext.generate(content_type, body) for (content_type, body) in zip(_content_types, _bodies)])
+    ]
+
+    def normalized_request_string_generate():
+        for args in nrs_args:
+            mac.NormalizedRequestString.generate(*args)
+
+    ext_args = zip(_content_types, _bodies)
+
+    def ext_generate():
+        for (content_type, body) in ext_args:
+            mac.Ext.generate(content_type, body)
+
+    mac_args = []
+    for args in nrs_args:
+        mac_key = mac.MACKey.generate()
+        normalized_request_string = mac.NormalizedRequestString.generate(*args)
+        the_mac = mac.MAC.generate(mac_key, mac.MAC.algorithm, normalized_request_string)
+        mac_args.append((the_mac, str(mac_key), normalized_request_string))
+
+    def mac_verify():
+        # the auth service creates a new MACKey for each request
+        for (the_mac, mac_key, normalized_request_string) in mac_args:
+            the_mac.verify(mac.MACKey(mac_key), mac.MAC.algorithm, normalized_request_string)
+
+    def mac_generate():
+        for (the_mac, mac_key, normalized_request_string) in mac_args:
+            mac.MAC.generate(mac.MACKey(mac_key), mac.MAC.algorithm, normalized_request_string)
+
+    requests_auth = mac.RequestsAuth(
+        mac.MACKeyIdentifier.generate(),
+        mac.MACKey.generate(),
+        mac.MAC.algorithm)
+    prepared_requests = _prepared_requests()
+
+    def requests_auth_call():
+        for prepared_request in prepared_requests:
+            requests_auth(prepared_request)
+
+    server_requests = _server_requests()
+
+    def get_request_host_and_port():
+        for server_request in server_requests:
+            trhutil.get_request_host_and_port(server_request, "127.0.0.1", 80)
+
+    responses = _responses()
+
+    def get_json_body_from_response():
+        for response in responses:
+            trhutil.get_json_body_from_response(response)
+
+    content_types = _content_types * 2
+
+    def is_json_utf8_content_type():
+        for content_type in content_types:
+            trhutil._is_json_utf8_content_type(content_type)
+
+    results = [
+        yar_benchmark_util.run(
+            "AuthHeaderValue.parse",
+            auth_header_value_parse,
+            count_objects=True),
+        yar_benchmark_util.run(
+            "NormalizedRequestString.generate",
+            normalized_request_string_generate,
+            count_objects=True),
+        yar_benchmark_util.run(
+            "Ext.generate",
+            ext_generate,
+            number=1000,
+            count_objects=True),
+        yar_benchmark_util.run(
+            "MAC.verify",
+            mac_verify,
+            number=1000,
+            count_objects=True),
+        yar_benchmark_util.run(
+            "MAC.generate",
+            mac_generate,
+            number=1000,
+            count_objects=True),
+        yar_benchmark_util.run(
+            "RequestsAuth.__call__",
+            requests_auth_call,
+            number=1000,
+            count_objects=True),
+        yar_benchmark_util.run(
+            "get_request_host_and_port",
+            get_request_host_and_port,
+            count_objects=True),
+        yar_benchmark_util.run(
+            "get_json_body_from_response",
+            get_json_body_from_response,
+            number=1000,
+            count_objects=True),
+        yar_benchmark_util.run(
+            "_is_json_utf8_content_type",
+            is_json_utf8_content_type,
+            count_objects=True),
+    ]
+    yar_benchmark_util.print_results(results)
+
+    if 1 < len(sys.argv):
+        yar_benchmark_util.write_results(results, sys.argv[1])
+
+
+if __name__ == "__main__":
+    main()
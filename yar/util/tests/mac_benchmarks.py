@@ -0,0 +1,162 @@
+"""This module contains micro-benchmarks for yar/util/mac.py.
+Run this module directly:
+
+    python yar/util/tests/mac_benchmarks.py
+
+MAC verification is the only CPU bound step in the auth service's
+request path. The benchmarks below compare the per verify cost of
+building a keyczar HmacKey for every request (how yar used to verify
+MACs) with verifying using a MACKey's cached HMAC template. They also
+compare generating the ext of a large body by concatenating the
+content type and body (how yar used to generate exts) with hashing
+the content type and body incrementally. Finally they compare signing
+requests with ```RequestsAuth``` as it used to be implemented (parsing
+the URL and generating the ext for every request) with signing
+requests with a ```Signer```."""
+
+import hashlib
+import os
+import urllib2
+
+import requests
+
+from yar.tests import yar_benchmark_util
+from yar.util import mac
+
+
+def _keyczar_verify(the_mac, mac_key, normalized_request_string):
+    """How ```mac.MAC.verify()``` used to be implemented."""
+    keyczar_hmac_key = mac_key.as_keyczar_hmac_key()
+    dehexified_mac = mac._dehexify(the_mac)
+    return keyczar_hmac_key.Verify(normalized_request_string, dehexified_mac)
+
+
+def _concatenating_ext(content_type, body):
+    """How ```mac.Ext.generate()``` used to be implemented
+    (less printing the body)."""
+    return hashlib.sha1(content_type + body).hexdigest()
+
+
+def _old_requests_auth(mac_key_identifier, mac_key, mac_algorithm, r):
+    """How ```mac.RequestsAuth.__call__()``` used to be implemented."""
+    ts = mac.Timestamp.generate()
+    nonce = mac.Nonce.generate()
+
+    content_type = r.headers.get("content-type", None)
+    ext = mac.Ext.generate(content_type, r.body)
+
+    parsed_url = urllib2.urlparse.urlparse(r.url)
+    path = parsed_url.path
+    parsed_netloc = parsed_url.netloc.split(":")
+    host = parsed_netloc[0]
+    port = parsed_netloc[1] if 2 == len(parsed_netloc) else 80
+
+    nrs = mac.NormalizedRequestString.generate(
+        ts,
+        nonce,
+        r.method,
+        path,
+        host,
+        port,
+        ext)
+    my_mac = mac.MAC.generate(mac_key, mac_algorithm, nrs)
+    ahv = mac.AuthHeaderValue(mac_key_identifier, ts, nonce, ext, my_mac)
+    r.headers["Authorization"] = str(ahv)
+    return r
+
+
+def main():
+    mac_key = mac.MACKey.generate()
+    normalized_request_string = mac.NormalizedRequestString.generate(
+        mac.Timestamp.generate(),
+        mac.Nonce.generate(),
+        "POST",
+        "/v1.0/dave/was/here.html",
+        "127.0.0.1",
+        8000,
+        mac.Ext.generate("application/json; charset=utf8", "{}"))
+    the_mac = mac.MAC.generate(
+        mac_key,
+        mac.MAC.algorithm,
+        normalized_request_string)
+
+    def keyczar_verify():
+        _keyczar_verify(the_mac, mac_key, normalized_request_string)
+
+    def template_verify():
+        the_mac.verify(mac_key, mac.MAC.algorithm, normalized_request_string)
+
+    def template_verify_new_mac_key_instance():
+        # the auth service creates a new MACKey for each request
+        # so this is the more realistic measurement
+        the_mac.verify(
+            mac.MACKey(str(mac_key)),
+            mac.MAC.algorithm,
+            normalized_request_string)
+
+    def template_generate():
+        mac.MAC.generate(mac_key, mac.MAC.algorithm, normalized_request_string)
+
+    baseline = yar_benchmark_util.run("MAC.verify (keyczar)", keyczar_verify)
+    results = [
+        baseline,
+        yar_benchmark_util.run("MAC.verify (template)", template_verify),
+        yar_benchmark_util.run(
+            "MAC.verify (template + new MACKey)",
+            template_verify_new_mac_key_instance),
+        yar_benchmark_util.run("MAC.generate (template)", template_generate),
+    ]
+    yar_benchmark_util.print_results(results, baseline)
+
+    print ""
+
+    content_type = "application/octet-stream"
+    body = os.urandom(4 * 1024 * 1024)
+
+    def concatenating_ext():
+        _concatenating_ext(content_type, body)
+
+    def incremental_ext():
+        mac.Ext.generate(content_type, body)
+
+    baseline = yar_benchmark_util.run("Ext.generate 4MB (concatenate)", concatenating_ext, number=100)
+    results = [
+        baseline,
+        yar_benchmark_util.run("Ext.generate 4MB (incremental)", incremental_ext, number=100),
+    ]
+    yar_benchmark_util.print_results(results, baseline)
+
+    print ""
+
+    mac_key_identifier = mac.MACKeyIdentifier.generate()
+    signer = mac.Signer(mac_key_identifier, mac_key, mac.MAC.algorithm)
+    requests_auth = signer.requests_auth()
+    prepared_request = requests.Request(
+        "POST",
+        "http://127.0.0.1:8000/dave.html",
+        headers={"Content-Type": "application/json; charset=utf8"},
+        data='{"dave": "was here"}').prepare()
+    prepared_requests = [prepared_request] * 100
+
+    def old_requests_auth():
+        _old_requests_auth(mac_key_identifier, mac_key, mac.MAC.algorithm, prepared_request)
+
+    def signer_requests_auth():
+        requests_auth(prepared_request)
+
+    def signer_sign_many():
+        signer.sign_many(prepared_requests)
+
+    baseline = yar_benchmark_util.run("RequestsAuth (old)", old_requests_auth)
+    results = [
+        baseline,
+        yar_benchmark_util.run("RequestsAuth (Signer)", signer_requests_auth),
+        yar_benchmark_util.run("Signer.sign_many / 100", signer_sign_many, number=100),
+    ]
+    # sign_many() signs 100 requests per call
+    results[-1].number *= 100
+    yar_benchmark_util.print_results(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
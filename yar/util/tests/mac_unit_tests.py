@@ -7,12 +7,14 @@ import string
 import time
 import uuid
 import hashlib
+import hmac
 import base64
 import json
 import os
 
 import mock
 import requests
+import tornado.httpclient
 
 from yar.util import mac
 
@@ -66,6 +68,58 @@ class MACKeyTestCase(unittest.TestCase):
             mac_key = mac.MACKey(value)
 
 
+class HMACTemplateTestCase(unittest.TestCase):
+    """These unit tests verify the behavior of
+    yar.util.mac._HMACTemplate and yar.util.mac.MACKey.hmac_template()"""
+
+    def test_signature_matches_keyczar(self):
+        for i in range(25):
+            mac_key = mac.MACKey.generate()
+            msg = os.urandom(i * 7)
+            self.assertEqual(
+                mac_key.hmac_template().sign(msg),
+                mac_key.as_keyczar_hmac_key().Sign(msg))
+
+    def test_as_bytes_matches_keyczar(self):
+        mac_key = mac.MACKey.generate()
+        self.assertEqual(
+            mac_key.as_bytes(),
+            mac_key.as_keyczar_hmac_key().key_bytes)
+
+    def test_long_key_is_hashed_first(self):
+        key_bytes = os.urandom(100)
+        hmac_template = mac._HMACTemplate(key_bytes)
+        self.assertEqual(
+            hmac_template.sign("dave"),
+            hmac.new(key_bytes, "dave", hashlib.sha1).digest())
+
+    def test_template_is_reused(self):
+        mac_key = mac.MACKey.generate()
+        self.assertIs(
+            mac.MACKey(mac_key).hmac_template(),
+            mac.MACKey(mac_key).hmac_template())
+
+    def test_template_cache_is_bounded(self):
+        name_of_attr_to_patch = "yar.util.mac.MACKey._max_hmac_templates"
+        with mock.patch(name_of_attr_to_patch, 5):
+            for i in range(20):
+                mac.MACKey.generate().hmac_template()
+                self.assertTrue(len(mac.MACKey._hmac_templates) <= 5)
+
+    def test_verify(self):
+        hmac_template = mac.MACKey.generate().hmac_template()
+        sig = hmac_template.sign("dave")
+        self.assertTrue(hmac_template.verify("dave", sig))
+        self.assertFalse(hmac_template.verify("was here", sig))
+        self.assertFalse(hmac_template.verify("dave", sig[:-1]))
+
+    def test_compare_digest_fallback(self):
+        self.assertTrue(mac._compare_digest_fallback("dave", "dave"))
+        self.assertFalse(mac._compare_digest_fallback("dave", "davf"))
+        self.assertFalse(mac._compare_digest_fallback("dave", "dav"))
+        self.assertTrue(mac._compare_digest_fallback("", ""))
+
+
 class MACKeyIdentifierTestCase(unittest.TestCase):
 
     def test_generate_returns_non_none_MACKeyIdentifier(self):
@@ -179,6 +233,41 @@ class ExtTestCase(unittest.TestCase):
         self.assertIsNotNone(ext)
         self.assertEqual(ext, content)
 
+    def test_body_is_buffer(self):
+        content_type = "application/json"
+        body = '{"dave": "was here"}'
+        expected_ext = hashlib.sha1(content_type + body).hexdigest()
+        for buffer_body in [buffer(body), memoryview(body), bytearray(body)]:
+            ext = mac.Ext.generate(content_type, buffer_body)
+            self.assertEqual(ext, expected_ext)
+
+    def test_generate_does_not_print(self):
+        with mock.patch("sys.stdout") as stdout:
+            mac.Ext.generate("application/json", "dave was here")
+        self.assertFalse(stdout.write.called)
+
+
+class ExtHasherTestCase(unittest.TestCase):
+
+    def test_chunks_same_as_generate(self):
+        content_type = "text/plain"
+        chunks = ["dave ", "was ", "", "here"]
+        ext_hasher = mac.ExtHasher(content_type)
+        for chunk in chunks:
+            ext_hasher.update(chunk)
+        ext = ext_hasher.ext()
+        self.assertIsInstance(ext, mac.Ext)
+        self.assertEqual(ext, mac.Ext.generate(content_type, "".join(chunks)))
+
+    def test_no_chunks(self):
+        self.assertEqual(mac.ExtHasher(None).ext(), mac.Ext.generate(None, None))
+        self.assertEqual(mac.ExtHasher("text/plain").ext(), mac.Ext.generate("text/plain", None))
+
+    def test_zero_length_chunk(self):
+        ext_hasher = mac.ExtHasher(None)
+        ext_hasher.update("")
+        self.assertEqual(ext_hasher.ext(), mac.Ext.generate(None, ""))
+
 
 class AuthHeaderValueTestCase(unittest.TestCase):
 
@@ -499,3 +588,160 @@ class TestRequestsAuth(unittest.TestCase):
         self.assertIsNotNone(ahv)
         self.assertEqual(ahv.mac_key_identifier, mac_key_identifier)
         self.assertNotEqual(ahv.ext, "")
+
+    def test_signer(self):
+        """Verify yar.util.mac.RequestsAuth shares the signer it's
+        given by yar.util.mac.Signer.requests_auth()."""
+        signer = mac.Signer(
+            mac.MACKeyIdentifier.generate(),
+            mac.MACKey.generate(),
+            mac.MAC.algorithm)
+        auth = signer.requests_auth()
+        self.assertIs(auth.signer, signer)
+        self.assertEqual(auth.mac_key_identifier, signer.mac_key_identifier)
+
+        mock_request = mock.Mock()
+        mock_request.headers = {}
+        mock_request.body = None
+        mock_request.method = "GET"
+        mock_request.url = "http://localhost:8000/dave.html"
+
+        auth(mock_request)
+        self.assertIn("http://localhost:8000/dave.html", signer._urls)
+
+
+class TestSigner(unittest.TestCase):
+    """These unit tests verify the behavior of
+    yar.util.mac.Signer"""
+
+    def setUp(self):
+        self.mac_key_identifier = mac.MACKeyIdentifier.generate()
+        self.mac_key = mac.MACKey.generate()
+        self.signer = mac.Signer(
+            self.mac_key_identifier,
+            self.mac_key,
+            mac.MAC.algorithm)
+
+    def _assert_mac_ok(self, value, method, path, host, port, content_type, body):
+        """Verify ```value``` is an Authorization header that the
+        auth service would accept for the request."""
+        ahv = mac.AuthHeaderValue.parse(value)
+        self.assertIsNotNone(ahv)
+        self.assertEqual(ahv.mac_key_identifier, self.mac_key_identifier)
+        self.assertEqual(ahv.ext, mac.Ext.generate(content_type, body))
+        nrs = mac.NormalizedRequestString.generate(
+            ahv.ts,
+            ahv.nonce,
+            method,
+            path,
+            host,
+            port,
+            ahv.ext)
+        self.assertTrue(ahv.mac.verify(self.mac_key, mac.MAC.algorithm, nrs))
+        return ahv
+
+    def test_sign(self):
+        value = self.signer.sign(
+            "POST",
+            "https://dave.example.com/was/here.html",
+            "application/json",
+            '{"dave": "was here"}')
+        self._assert_mac_ok(
+            value,
+            "POST",
+            "/was/here.html",
+            "dave.example.com",
+            443,
+            "application/json",
+            '{"dave": "was here"}')
+
+        # the signer remembers the URL and the ext
+        with mock.patch("urllib2.urlparse.urlparse") as urlparse_patch:
+            with mock.patch.object(mac.Ext, "generate") as ext_generate_patch:
+                value = self.signer.sign(
+                    "POST",
+                    "https://dave.example.com/was/here.html",
+                    "application/json",
+                    '{"dave": "was here"}')
+        self.assertEqual(urlparse_patch.call_count, 0)
+        self.assertEqual(ext_generate_patch.call_count, 0)
+        self._assert_mac_ok(
+            value,
+            "POST",
+            "/was/here.html",
+            "dave.example.com",
+            443,
+            "application/json",
+            '{"dave": "was here"}')
+
+    def test_sign_with_ts_and_nonce(self):
+        ts = mac.Timestamp.generate()
+        nonce = mac.Nonce.generate()
+        value = self.signer.sign("GET", "http://localhost:8000/dave.html", ts=ts, nonce=nonce)
+        ahv = self._assert_mac_ok(value, "GET", "/dave.html", "localhost", "8000", None, None)
+        self.assertEqual(ahv.ts, ts)
+        self.assertEqual(ahv.nonce, nonce)
+        self.assertEqual(ahv.ext, "")
+
+    def test_large_and_buffer_bodies_are_not_remembered(self):
+        body = "x" * (mac.Signer._max_cached_body_size + 1)
+        value = self.signer.sign("PUT", "http://localhost/dave.html", "text/plain", body)
+        self._assert_mac_ok(value, "PUT", "/dave.html", "localhost", 80, "text/plain", body)
+
+        body = bytearray("dave was here")
+        value = self.signer.sign("PUT", "http://localhost/dave.html", "text/plain", body)
+        self._assert_mac_ok(value, "PUT", "/dave.html", "localhost", 80, "text/plain", str(body))
+
+        self.assertEqual(self.signer._exts, {})
+
+    def test_caches_are_bounded(self):
+        with mock.patch.object(mac.Signer, "_max_urls", 2):
+            with mock.patch.object(mac.Signer, "_max_exts", 2):
+                for i in range(5):
+                    self.signer.sign("POST", "http://localhost/%d" % i, "text/plain", str(i))
+                    self.assertTrue(len(self.signer._urls) <= 2)
+                    self.assertTrue(len(self.signer._exts) <= 2)
+
+    def test_sign_request_with_tornado_request(self):
+        request = tornado.httpclient.HTTPRequest(
+            "http://localhost:8000/dave.html",
+            method="POST",
+            headers={"Content-Type": "application/json"},
+            body='{"dave": "was here"}')
+        rv = self.signer.sign_request(request)
+        self.assertIs(rv, request)
+        self._assert_mac_ok(
+            request.headers["Authorization"],
+            "POST",
+            "/dave.html",
+            "localhost",
+            "8000",
+            "application/json",
+            '{"dave": "was here"}')
+
+    def test_sign_many(self):
+        prepared_requests = [
+            requests.Request("GET", "http://localhost:8000/%d.html" % i).prepare()
+            for i in range(10)
+        ]
+        rv = self.signer.sign_many(iter(prepared_requests))
+        self.assertEqual(rv, prepared_requests)
+
+        ahvs = [
+            self._assert_mac_ok(
+                prepared_request.headers["Authorization"],
+                "GET",
+                "/%d.html" % i,
+                "localhost",
+                "8000",
+                None,
+                None)
+            for (i, prepared_request) in enumerate(prepared_requests)
+        ]
+        self.assertEqual(len(set([ahv.ts for ahv in ahvs])), 1)
+        self.assertEqual(len(set([ahv.nonce for ahv in ahvs])), len(ahvs))
+        for ahv in ahvs:
+            self.assertEqual(len(ahv.nonce), 16)
+
+    def test_sign_many_with_no_requests(self):
+        self.assertEqual(self.signer.sign_many([]), [])
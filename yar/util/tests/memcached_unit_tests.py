@@ -0,0 +1,145 @@
+"""This module contains a series of unit tests which
+validate yar/util/memcached.py"""
+
+import mock
+import tornado.tcpserver
+import tornado.testing
+
+from yar.util import memcached
+
+
+class _FakeMemcached(tornado.tcpserver.TCPServer):
+    """Just enough of memcached's text protocol to test
+    ```memcached.Client``` - add and delete. Expiry
+    times are recorded but not enforced."""
+
+    def __init__(self):
+        tornado.tcpserver.TCPServer.__init__(self)
+        self.data = {}
+        self.commands = []
+        self.respond = True
+
+    def handle_stream(self, stream, address):
+        self._read_command(stream)
+
+    def _read_command(self, stream):
+        stream.read_until("\r\n", lambda line: self._on_command(stream, line))
+
+    def _on_command(self, stream, line):
+        words = line.split()
+        self.commands.append(words)
+        if words[0] == "add":
+            num_bytes = int(words[4])
+            stream.read_bytes(
+                num_bytes + 2,
+                lambda data: self._on_add_data(stream, words, data[:-2]))
+            return
+
+        if words[0] == "delete":
+            response = "DELETED" if self.data.pop(words[1], None) else "NOT_FOUND"
+        else:
+            response = "ERROR"
+        self._respond(stream, response)
+
+    def _on_add_data(self, stream, words, data):
+        if words[1] in self.data:
+            response = "NOT_STORED"
+        else:
+            self.data[words[1]] = (data, int(words[3]))
+            response = "STORED"
+        self._respond(stream, response)
+
+    def _respond(self, stream, response):
+        if self.respond:
+            stream.write(response + "\r\n")
+        self._read_command(stream)
+
+
+class ClientTestCase(tornado.testing.AsyncTestCase):
+    """These unit tests verify the behavior of
+    yar.util.memcached.Client"""
+
+    def setUp(self):
+        tornado.testing.AsyncTestCase.setUp(self)
+
+        self.servers = []
+        self.fake_memcacheds = []
+        for i in range(2):
+            (sock, port) = tornado.testing.bind_unused_port()
+            fake_memcached = _FakeMemcached()
+            fake_memcached.add_sockets([sock])
+            self.servers.append("127.0.0.1:%d" % port)
+            self.fake_memcacheds.append(fake_memcached)
+
+    def tearDown(self):
+        for fake_memcached in self.fake_memcacheds:
+            fake_memcached.stop()
+        tornado.testing.AsyncTestCase.tearDown(self)
+
+    def _wait_for(self, number_of_results):
+        results = []
+
+        def callback(result):
+            results.append(result)
+            if len(results) == number_of_results:
+                self.stop()
+
+        return (results, callback)
+
+    def test_add_and_delete(self):
+        client = memcached.Client(self.servers)
+        (results, callback) = self._wait_for(4)
+
+        # pipelined - all commands are sent before any responses arrive
+        client.add("dave", "1", 31, callback)
+        client.add("dave", "1", 31, callback)
+        client.delete("dave", callback)
+        client.delete("dave", callback)
+        self.wait()
+
+        self.assertEqual(results, [True, False, True, False])
+
+        commands = sum([fake.commands for fake in self.fake_memcacheds], [])
+        self.assertEqual(commands[0], ["add", "dave", "0", "31", "1"])
+
+    def test_keys_spread_across_servers(self):
+        client = memcached.Client(self.servers)
+        (results, callback) = self._wait_for(100)
+        for i in range(100):
+            client.add("dave-%d" % i, "1", 31, callback)
+        self.wait()
+
+        self.assertEqual(results, [True] * 100)
+        for fake_memcached in self.fake_memcacheds:
+            self.assertTrue(0 < len(fake_memcached.data) < 100)
+
+    def test_unsafe_key_hashed(self):
+        client = memcached.Client(self.servers[:1])
+        (results, callback) = self._wait_for(1)
+        client.add("dave was\r\nhere", "1", 31, callback)
+        self.wait()
+
+        self.assertEqual(results, [True])
+        (key,) = self.fake_memcacheds[0].data.keys()
+        self.assertEqual(len(key), 40)
+
+    def test_timeout(self):
+        self.fake_memcacheds[0].respond = False
+        client = memcached.Client(self.servers[:1])
+        (results, callback) = self._wait_for(2)
+        with mock.patch.object(memcached, "timeout", 0.05):
+            client.add("dave", "1", 31, callback)
+            client.add("was", "1", 31, callback)
+            self.wait()
+
+        self.assertEqual(results, [None, None])
+
+    def test_connection_refused(self):
+        (sock, port) = tornado.testing.bind_unused_port()
+        sock.close()
+        client = memcached.Client(["127.0.0.1:%d" % port])
+        (results, callback) = self._wait_for(1)
+        client.add("dave", "1", 31, callback)
+        self.wait()
+
+        self.assertEqual(results, [None])
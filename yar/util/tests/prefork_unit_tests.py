@@ -0,0 +1,115 @@
+"""This module contains a series of unit tests which
+validate yar/util/prefork.py"""
+
+import logging
+import unittest
+
+import mock
+
+from yar.util import logging_config
+from yar.util import prefork
+
+
+class PreforkTestCase(unittest.TestCase):
+    """These unit tests verify the behavior of yar.util.prefork.start()
+    with all of Tornado's socket binding, forking and serving patched
+    out so that no processes are actually forked."""
+
+    def setUp(self):
+        self._patchers = []
+
+        self.bind_sockets = self._patch("tornado.netutil.bind_sockets")
+        self.bind_sockets.return_value = ["socket"]
+        self.fork_processes = self._patch("tornado.process.fork_processes")
+        self.fork_processes.return_value = 3
+        self.http_server = self._patch("tornado.httpserver.HTTPServer")
+        self.ioloop_instance = self._patch("tornado.ioloop.IOLoop.instance")
+        self.tag_worker = self._patch("yar.util.logging_config.tag_worker")
+
+    def tearDown(self):
+        for patcher in self._patchers:
+            patcher.stop()
+
+    def _patch(self, name):
+        patcher = mock.patch(name)
+        self._patchers.append(patcher)
+        return patcher.start()
+
+    def _assertServed(self, app):
+        self.http_server.assert_called_once_with(app, xheaders=True)
+        self.http_server.return_value.add_sockets.assert_called_once_with(["socket"])
+        self.ioloop_instance.return_value.start.assert_called_once_with()
+
+    def test_on_start_called_once_serving(self):
+        app = mock.Mock()
+        on_start = mock.Mock()
+        prefork.start(app, ("127.0.0.1", 8000), 4, False, on_start)
+
+        self.assertFalse(on_start.called)
+        self.ioloop_instance.return_value.add_callback.assert_called_once_with(on_start)
+        self._assertServed(app)
+
+    def test_single_process_does_not_fork(self):
+        app = mock.Mock()
+        prefork.start(app, ("127.0.0.1", 8000), 1, False)
+
+        self.bind_sockets.assert_called_once_with(8000, "127.0.0.1")
+        self.assertFalse(self.fork_processes.called)
+        self.assertFalse(self.tag_worker.called)
+        self.assertFalse(self.ioloop_instance.return_value.add_callback.called)
+        self._assertServed(app)
+
+    def test_shared_socket_bound_before_fork(self):
+        app = mock.Mock()
+        prefork.start(app, ("127.0.0.1", 8000), 4, False)
+
+        self.bind_sockets.assert_called_once_with(8000, "127.0.0.1")
+        self.fork_processes.assert_called_once_with(4, prefork.max_restarts)
+        self.tag_worker.assert_called_once_with(3)
+        self._assertServed(app)
+
+    def test_reuse_port_sockets_bound_after_fork(self):
+        def fork_processes_patch(processes, max_restarts):
+            self.assertFalse(self.bind_sockets.called)
+            return 2
+
+        self.fork_processes.side_effect = fork_processes_patch
+
+        app = mock.Mock()
+        prefork.start(app, ("127.0.0.1", 8000), 0, True)
+
+        self.bind_sockets.assert_called_once_with(
+            8000,
+            "127.0.0.1",
+            reuse_port=True)
+        self.tag_worker.assert_called_once_with(2)
+        self._assertServed(app)
+
+
+class TagWorkerTestCase(unittest.TestCase):
+    """These unit tests verify the behavior of
+    yar.util.logging_config.tag_worker()"""
+
+    def test_worker_id_in_location_field(self):
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        syslog_like_handler = logging.StreamHandler()
+
+        root_logger = logging.getLogger()
+        root_logger.addHandler(handler)
+        root_logger.addHandler(syslog_like_handler)
+        try:
+            logging_config.tag_worker(7)
+        finally:
+            root_logger.removeHandler(handler)
+            root_logger.removeHandler(syslog_like_handler)
+
+        self.assertIsNone(syslog_like_handler.formatter)
+
+        record = logging.LogRecord(
+            "dave", logging.INFO, "/dave/was/here.py", 42, "hello", None, None)
+        fields = handler.formatter.format(record).split("\t")
+        self.assertEqual(len(fields), 5)
+        self.assertTrue(fields[3].startswith("w7/"))
+        self.assertTrue(fields[3].endswith(":42"))
+        self.assertEqual(fields[4], "hello")
@@ -525,9 +525,9 @@ class GetJSONBodyFromResponseTestCase(unittest.TestCase):
         value_if_not_found = "dave"
         self._test_response_body_jsonschmea_validation_failure(value_if_not_found)
 
-    def _test_response_ok_body(self, the_body, schema):
+    def _test_response_ok_body(self, the_body, schema, code=httplib.OK):
         response = mock.Mock()
-        response.code = httplib.OK
+        response.code = code
         response.body = json.dumps(the_body)
         response.headers = {
             "Content-length": len(response.body),
@@ -547,6 +547,13 @@ class GetJSONBodyFromResponseTestCase(unittest.TestCase):
         schema = None
         self._test_response_ok_body(body, schema)
 
+    def test_response_created_something_in_body(self):
+        body = [
+            {"id": "dave", "rev": "1-was"},
+        ]
+        schema = None
+        self._test_response_ok_body(body, schema, httplib.CREATED)
+
     def test_response_ok_something_in_body(self):
         body = {
             "dave": 1,
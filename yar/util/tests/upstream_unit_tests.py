@@ -0,0 +1,320 @@
+"""This module contains a series of unit tests which
+validate yar/util/upstream.py"""
+
+import httplib
+import unittest
+
+import mock
+import tornado.concurrent
+import tornado.httpclient
+import tornado.simple_httpclient
+
+from yar.util import upstream
+
+
+class PoolTestCase(unittest.TestCase):
+    """These unit tests verify the behavior of yar.util.upstream.Pool"""
+
+    def setUp(self):
+        self._pending = []
+
+        self._http_clients = []
+
+        def fetch_patch(http_client, request, callback):
+            self._http_clients.append(http_client)
+            self._pending.append((request, callback))
+
+        patcher = mock.patch("tornado.httpclient.AsyncHTTPClient.fetch", fetch_patch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch("tornado.ioloop.IOLoop.current")
+        self.ioloop_current = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _complete(self, code=httplib.OK, error=None):
+        (request, callback) = self._pending.pop(0)
+        response = tornado.httpclient.HTTPResponse(
+            request,
+            code,
+            error=error,
+            request_time=0.5)
+        callback(response)
+
+    def test_fetch_and_stats(self):
+        pool = upstream.Pool("dave:42", 2, 1)
+        callback = mock.Mock()
+
+        request = tornado.httpclient.HTTPRequest("http://dave:42/was/here")
+        pool.fetch(request, callback)
+        pool.fetch(request, callback)
+        self.assertEqual(pool.stats()["active"], 2)
+
+        self._complete()
+        error = tornado.httpclient.HTTPError(599)
+        self._complete(599, error)
+        self.assertEqual(callback.call_count, 2)
+
+        stats = pool.stats()
+        self.assertEqual(stats["requests"], 2)
+        self.assertEqual(stats["active"], 0)
+        self.assertEqual(stats["peak_active"], 2)
+        self.assertEqual(stats["errors"], 1)
+        self.assertEqual(stats["rejected"], 0)
+        self.assertEqual(stats["avg_request_time_ms"], 500)
+
+    def test_queue_full(self):
+        pool = upstream.Pool("dave:42", 2, 1)
+        callback = mock.Mock()
+
+        request = tornado.httpclient.HTTPRequest("http://dave:42/was/here")
+        for i in range(3):
+            pool.fetch(request, callback)
+        self.assertEqual(len(self._pending), 2)
+        self.assertEqual(pool.stats()["queued"], 1)
+
+        pool.fetch(request, callback)
+        self.assertEqual(len(self._pending), 2)
+        self.assertEqual(pool.stats()["rejected"], 1)
+
+        add_callback = self.ioloop_current.return_value.add_callback
+        self.assertEqual(add_callback.call_count, 1)
+        (the_callback, response) = add_callback.call_args[0]
+        self.assertEqual(the_callback, callback)
+        self.assertEqual(response.code, httplib.SERVICE_UNAVAILABLE)
+        self.assertIsInstance(response.error, upstream.QueueFullError)
+
+    def test_queue_unbounded(self):
+        pool = upstream.Pool("dave:42", 2, 0)
+        callback = mock.Mock()
+
+        request = tornado.httpclient.HTTPRequest("http://dave:42/was/here")
+        for i in range(50):
+            pool.fetch(request, callback)
+        self.assertEqual(len(self._pending), 2)
+        self.assertEqual(pool.stats()["queued"], 48)
+        self.assertEqual(pool.stats()["rejected"], 0)
+
+    def test_queued_request_sent_when_request_completes(self):
+        pool = upstream.Pool("dave:42", 1, 0)
+        callback = mock.Mock()
+
+        request = tornado.httpclient.HTTPRequest("http://dave:42/was/here")
+        queued_request = tornado.httpclient.HTTPRequest("http://dave:42/was/there")
+        pool.fetch(request, callback)
+        pool.fetch(queued_request, callback)
+        self.assertEqual(len(self._pending), 1)
+
+        self._complete()
+        self.assertEqual(callback.call_count, 1)
+        self.assertEqual(len(self._pending), 1)
+        self.assertIs(self._pending[0][0], queued_request)
+        self.assertEqual(pool.stats()["queued"], 0)
+        self.assertEqual(self.ioloop_current.return_value.remove_timeout.call_count, 1)
+
+        self._complete()
+        self.assertEqual(callback.call_count, 2)
+        self.assertEqual(pool.stats()["active"], 0)
+
+    def test_queue_timeout(self):
+        pool = upstream.Pool("dave:42", 1, 0)
+        callback = mock.Mock()
+
+        pool.fetch(tornado.httpclient.HTTPRequest("http://dave:42/was/here"), callback)
+        pool.fetch(
+            tornado.httpclient.HTTPRequest(
+                "http://dave:42/was/there",
+                connect_timeout=5,
+                request_timeout=10),
+            callback)
+
+        call_later = self.ioloop_current.return_value.call_later
+        self.assertEqual(call_later.call_count, 1)
+        (timeout, on_timeout, queued_request) = call_later.call_args[0]
+        self.assertEqual(timeout, 5)
+        on_timeout(queued_request)
+
+        self.assertEqual(callback.call_count, 1)
+        response = callback.call_args[0][0]
+        self.assertEqual(response.code, 599)
+        self.assertEqual(response.request.url, "http://dave:42/was/there")
+
+        stats = pool.stats()
+        self.assertEqual(stats["active"], 1)
+        self.assertEqual(stats["queued"], 0)
+        self.assertEqual(stats["errors"], 1)
+
+        # nothing queued so completing the request in flight sends nothing
+        self._complete()
+        self.assertEqual(len(self._pending), 0)
+        self.assertEqual(pool.stats()["active"], 0)
+
+    def test_prewarm(self):
+        pool = upstream.Pool("dave:42", 2, 1)
+        with mock.patch.object(upstream, "_curl_http_client_class", mock.Mock()):
+            pool.prewarm(5, "/creds")
+        self.assertEqual(len(self._pending), 2)
+        for (request, callback) in self._pending:
+            self.assertEqual(request.url, "http://dave:42/creds")
+            self.assertEqual(request.method, "GET")
+        self._complete(httplib.NOT_FOUND)
+
+    def test_prewarm_without_pycurl(self):
+        pool = upstream.Pool("dave:42", 2, 1)
+        with mock.patch.object(upstream, "_curl_http_client_class", None):
+            pool.prewarm(5)
+        self.assertEqual(len(self._pending), 0)
+
+    def test_streaming_requests_use_backpressure_client(self):
+        pool = upstream.Pool("dave:42", 2, 1)
+        callback = mock.Mock()
+
+        request = tornado.httpclient.HTTPRequest("http://dave:42/was/here")
+        pool.fetch(request, callback)
+        streaming_request = tornado.httpclient.HTTPRequest(
+            "http://dave:42/was/here",
+            streaming_callback=mock.Mock())
+        pool.fetch(streaming_request, callback)
+        self._complete()
+        pool.fetch(streaming_request, callback)
+
+        self.assertNotIsInstance(self._http_clients[0], upstream._BackpressureHTTPClient)
+        self.assertIsInstance(self._http_clients[1], upstream._BackpressureHTTPClient)
+        self.assertIs(self._http_clients[1], self._http_clients[2])
+        self.assertEqual(pool.stats()["active"], 2)
+
+    def test_streaming_and_other_requests_share_limits(self):
+        pool = upstream.Pool("dave:42", 2, 1)
+        callback = mock.Mock()
+
+        request = tornado.httpclient.HTTPRequest("http://dave:42/was/here")
+        streaming_request = tornado.httpclient.HTTPRequest(
+            "http://dave:42/was/here",
+            streaming_callback=mock.Mock())
+        pool.fetch(request, callback)
+        pool.fetch(streaming_request, callback)
+        pool.fetch(streaming_request, callback)
+        self.assertEqual(len(self._pending), 2)
+        self.assertEqual(pool.stats()["queued"], 1)
+
+        pool.fetch(streaming_request, callback)
+        self.assertEqual(pool.stats()["rejected"], 1)
+        add_callback = self.ioloop_current.return_value.add_callback
+        (the_callback, response) = add_callback.call_args[0]
+        self.assertIsInstance(response.error, upstream.QueueFullError)
+
+    def test_pycurl_not_installed(self):
+        with mock.patch.object(upstream, "_curl_http_client_class", None):
+            with mock.patch.object(upstream, "_logger") as logger:
+                pool = upstream.Pool("dave:42", 2, 1)
+        self.assertEqual(logger.warning.call_count, 1)
+        self.assertIsInstance(pool._http_client, tornado.simple_httpclient.SimpleAsyncHTTPClient)
+        self.assertFalse(pool.stats()["keep_alive"])
+
+    def test_pycurl_installed(self):
+        http_client_class = mock.Mock()
+        with mock.patch.object(upstream, "_curl_http_client_class", http_client_class):
+            with mock.patch.object(upstream, "_logger") as logger:
+                pool = upstream.Pool("dave:42", 2, 1)
+                self.assertTrue(pool.stats()["keep_alive"])
+        self.assertEqual(logger.warning.call_count, 0)
+        http_client_class.assert_called_once_with(force_instance=True, max_clients=2)
+        self.assertIs(pool._http_client, http_client_class.return_value)
+
+
+class BackpressureHTTPConnectionTestCase(unittest.TestCase):
+    """These unit tests verify the behavior of
+    yar.util.upstream._BackpressureHTTPConnection"""
+
+    def _connection(self, request, code=httplib.OK):
+        # bypass __init__() which wants to connect to the upstream
+        connection = upstream._BackpressureHTTPConnection.__new__(
+            upstream._BackpressureHTTPConnection)
+        connection.request = request
+        connection.code = code
+        connection.chunks = []
+        return connection
+
+    def test_streaming_callback_return_value_is_returned(self):
+        future = tornado.concurrent.Future()
+        streaming_callback = mock.Mock(return_value=future)
+        request = tornado.httpclient.HTTPRequest(
+            "http://dave:42/was/here",
+            streaming_callback=streaming_callback)
+        connection = self._connection(request)
+        self.assertIs(connection.data_received("dave"), future)
+        streaming_callback.assert_called_once_with("dave")
+        self.assertEqual(connection.chunks, [])
+
+    def test_no_streaming_callback(self):
+        request = tornado.httpclient.HTTPRequest("http://dave:42/was/here")
+        connection = self._connection(request)
+        self.assertIsNone(connection.data_received("dave"))
+        self.assertEqual(connection.chunks, ["dave"])
+
+    def test_tornado_version(self):
+        """_BackpressureHTTPConnection overrides a private method of
+        Tornado 4.5's simple HTTP client - if this fails Tornado has
+        been upgraded and _BackpressureHTTPConnection needs checking
+        against the new version before setup.py's pin is lifted."""
+        self.assertLess(tornado.version_info, (4, 6))
+
+    def test_redirect_body_is_discarded(self):
+        streaming_callback = mock.Mock()
+        request = tornado.httpclient.HTTPRequest(
+            "http://dave:42/was/here",
+            follow_redirects=True,
+            max_redirects=5,
+            streaming_callback=streaming_callback)
+        connection = self._connection(request, httplib.FOUND)
+        self.assertIsNone(connection.data_received("dave"))
+        self.assertEqual(streaming_callback.call_count, 0)
+
+
+class GetPoolTestCase(unittest.TestCase):
+    """These unit tests verify the behavior of yar.util.upstream.get_pool()"""
+
+    def test_one_pool_per_upstream(self):
+        with mock.patch.object(upstream, "_pools", {}):
+            pool = upstream.get_pool("127.0.0.1:5984/creds")
+            self.assertEqual(pool.upstream, "127.0.0.1:5984")
+            self.assertIs(upstream.get_pool("127.0.0.1:5984"), pool)
+            self.assertIsNot(upstream.get_pool("127.0.0.1:5985"), pool)
+            self.assertEqual(
+                sorted(upstream.stats().keys()),
+                ["127.0.0.1:5984", "127.0.0.1:5985"])
+
+
+class StartTestCase(unittest.TestCase):
+    """These unit tests verify the behavior of yar.util.upstream.start()"""
+
+    def setUp(self):
+        patcher = mock.patch.object(upstream, "_pools", {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(upstream.Pool, "prewarm")
+        self.prewarm = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_only_prewarm_addresses_are_prewarmed(self):
+        with mock.patch.object(upstream, "prewarm_connections", 3):
+            upstream.start(
+                ["127.0.0.1:8070", "127.0.0.1:8080", "127.0.0.1:5984/creds"],
+                prewarm_addresses=["127.0.0.1:8070", "127.0.0.1:5984/creds"])
+        self.assertEqual(
+            sorted(upstream.stats().keys()),
+            ["127.0.0.1:5984", "127.0.0.1:8070", "127.0.0.1:8080"])
+        self.assertEqual(
+            self.prewarm.call_args_list,
+            [mock.call(3, "/"), mock.call(3, "/creds")])
+
+    def test_prewarm_off(self):
+        with mock.patch.object(upstream, "prewarm_connections", 0):
+            upstream.start(["127.0.0.1:8070"], prewarm_addresses=["127.0.0.1:8070"])
+        self.assertEqual(self.prewarm.call_count, 0)
+
+    def test_no_prewarm_addresses(self):
+        with mock.patch.object(upstream, "prewarm_connections", 3):
+            upstream.start(["127.0.0.1:8070", "127.0.0.1:8080"])
+        self.assertEqual(self.prewarm.call_count, 0)
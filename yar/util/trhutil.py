@@ -145,7 +145,7 @@ def get_json_body_from_response(response,
     if response is None:
         return value_if_not_found
 
-    if httplib.OK != response.code:
+    if response.code not in [httplib.OK, httplib.CREATED]:
         return value_if_not_found
 
     content_length = response.headers.get("Content-length", None)
@@ -0,0 +1,348 @@
+"""All of yar's outbound HTTP requests (auth service to key service,
+auth service to app service and key service to key store) go through
+this module. Each upstream (identified by its host:port) gets its own
+pool of connections so that one slow upstream can't starve requests
+to the others and so that connection limits can be configured per
+upstream rather than per process.
+
+When pycurl is installed (it's an optional dependency - ```pip install
+yar[keepalive]```) pools use Tornado's curl based HTTP client which keeps
+connections to the upstream alive between requests - under load this
+removes TCP connection setup from the latency of most upstream requests.
+Without pycurl pools use Tornado's simple HTTP client which opens a new
+connection for every request but still honors the pool's connection and
+queue limits - since that's rarely what's wanted in production a warning
+is logged as each pool is created.
+
+Requests with a ```streaming_callback``` always use a variant of
+Tornado's simple HTTP client (see ```_BackpressureHTTPConnection```)
+which stops reading the upstream's response whenever the streaming
+callback returns a ```tornado.concurrent.Future``` and resumes once
+the future is done - this is how a slow consumer of a streamed
+response pushes back on the upstream. Streamed and other requests
+share the pool's connection and queue limits - the pool, rather than
+either of its HTTP clients, decides when a request is sent.
+
+Typical usage:
+
+    upstream.fetch(key_service_address, http_request, self._on_fetch_done)
+
+and from a server's mainline (in each worker once it has started - see
+yar.util.prefork):
+
+    upstream.start([key_service_address, app_service_address])"""
+
+import collections
+import functools
+import httplib
+import logging
+import time
+
+import tornado.httpclient
+import tornado.ioloop
+import tornado.simple_httpclient
+
+try:
+    import tornado.curl_httpclient
+    _curl_http_client_class = tornado.curl_httpclient.CurlAsyncHTTPClient
+except ImportError:
+    _curl_http_client_class = None
+
+_logger = logging.getLogger("UTIL.%s" % __name__)
+
+"""Max # of concurrent requests (and therefore connections) a pool
+will make to its upstream."""
+max_clients = 10
+
+"""Once a pool has ```max_clients``` requests in flight further requests
+are queued. If ```max_queue_size``` is 0 the queue is unbounded otherwise
+once ```max_queue_size``` requests are queued additional requests aren't
+sent to the upstream - they fail immediately with a 503 response whose
+error is a ```QueueFullError```. Like Tornado's HTTP clients, a queued
+request which isn't sent before its connect or request timeout fails
+with a 599 response."""
+max_queue_size = 0
+
+"""Tornado's default connect and request timeouts (in seconds) used
+for queued requests which don't have their own."""
+_default_timeout = 20.0
+
+"""# of connections ```start()``` opens to each upstream it's asked to
+pre-warm so that early requests don't pay for connection setup. Only
+useful when pycurl is installed since only then are connections kept
+alive."""
+prewarm_connections = 0
+
+"""If not 0, every ```stats_interval``` seconds ```start()``` arranges
+for each pool's statistics to be logged."""
+stats_interval = 0
+
+"""Pools are created on first use and there's one pool per
+upstream host:port - see ```get_pool()```."""
+_pools = {}
+
+
+class QueueFullError(tornado.httpclient.HTTPError):
+    """The error of the response to a request which a pool rejected
+    without sending it to the upstream because the pool's queue was
+    full - see ```max_queue_size```. Lets callers tell a locally
+    overloaded pool apart from an upstream that's failing."""
+
+    def __init__(self, upstream):
+        tornado.httpclient.HTTPError.__init__(
+            self,
+            httplib.SERVICE_UNAVAILABLE,
+            "Upstream '%s' queue full" % upstream)
+
+
+class _BackpressureHTTPConnection(tornado.simple_httpclient._HTTPConnection):
+    """Tornado's simple HTTP client discards the value returned by a
+    request's ```streaming_callback```. This connection returns it to
+    Tornado's HTTP/1.x connection which, when the value is a future,
+    doesn't read any more of the response until the future is done.
+
+    ```_HTTPConnection``` is private to Tornado - this override matches
+    Tornado 4.5's ```data_received()``` which is why setup.py pins
+    Tornado to < 4.6."""
+
+    def data_received(self, chunk):
+        if self._should_follow_redirect():
+            return None
+        if self.request.streaming_callback is not None:
+            return self.request.streaming_callback(chunk)
+        self.chunks.append(chunk)
+        return None
+
+
+class _BackpressureHTTPClient(tornado.simple_httpclient.SimpleAsyncHTTPClient):
+
+    def _connection_class(self):
+        return _BackpressureHTTPConnection
+
+
+class Pool(object):
+    """A pool of connections to a single upstream."""
+
+    def __init__(self, upstream, max_clients, max_queue_size):
+        object.__init__(self)
+
+        self.upstream = upstream
+        self.max_clients = max_clients
+        self.max_queue_size = max_queue_size
+
+        if _curl_http_client_class is not None:
+            http_client_class = _curl_http_client_class
+        else:
+            _logger.warning(
+                "pycurl not installed - connections to upstream '%s' won't be kept alive",
+                upstream)
+            http_client_class = tornado.simple_httpclient.SimpleAsyncHTTPClient
+        self._http_client = http_client_class(
+            force_instance=True,
+            max_clients=max_clients)
+        self._streaming_http_client = None
+
+        # requests waiting for one of the pool's max_clients requests
+        # in flight to complete - see fetch()
+        self._queue = collections.deque()
+        self._in_flight = 0
+
+        self.requests = 0
+        self.active = 0
+        self.peak_active = 0
+        self.rejected = 0
+        self.errors = 0
+        self.request_time = 0.0
+
+    def fetch(self, request, callback):
+        """Async'ly make ```request``` to the pool's upstream. When
+        the request completes ```callback``` is called with a
+        ```tornado.httpclient.HTTPResponse```.
+
+        The pool's HTTP clients each have their own queue so the pool
+        keeps its own count of requests in flight and queues requests
+        itself - that way streamed and other requests count against
+        the same ```max_clients``` and ```max_queue_size```."""
+        if self.max_queue_size and self.max_queue_size <= len(self._queue):
+            self.rejected += 1
+            response = tornado.httpclient.HTTPResponse(
+                request,
+                httplib.SERVICE_UNAVAILABLE,
+                error=QueueFullError(self.upstream),
+                request_time=0)
+            tornado.ioloop.IOLoop.current().add_callback(callback, response)
+            return
+
+        self.requests += 1
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+
+        if self._in_flight < self.max_clients:
+            self._send(request, callback)
+            return
+
+        timeout = min(
+            request.connect_timeout or _default_timeout,
+            request.request_timeout or _default_timeout)
+        queued_request = [request, callback, time.time(), None]
+        queued_request[3] = tornado.ioloop.IOLoop.current().call_later(
+            timeout,
+            self._on_queue_timeout,
+            queued_request)
+        self._queue.append(queued_request)
+
+    def _send(self, request, callback):
+        self._in_flight += 1
+        self._get_http_client(request).fetch(
+            request,
+            functools.partial(self._on_fetch_done, callback))
+
+    def _get_http_client(self, request):
+        """Streamed responses need a client which supports backpressure
+        (see ```_BackpressureHTTPConnection```) - it's only created once
+        the pool sees its first streaming request."""
+        if request.streaming_callback is None:
+            return self._http_client
+        if self._streaming_http_client is None:
+            self._streaming_http_client = _BackpressureHTTPClient(
+                force_instance=True,
+                max_clients=self.max_clients)
+        return self._streaming_http_client
+
+    def _on_fetch_done(self, callback, response):
+        self._in_flight -= 1
+        self.active -= 1
+        if response.error:
+            self.errors += 1
+        self.request_time += response.request_time or 0
+
+        if self._queue:
+            (request, queued_callback, queued_at, timeout) = self._queue.popleft()
+            tornado.ioloop.IOLoop.current().remove_timeout(timeout)
+            self._send(request, queued_callback)
+
+        callback(response)
+
+    def _on_queue_timeout(self, queued_request):
+        self._queue.remove(queued_request)
+        (request, callback, queued_at, timeout) = queued_request
+
+        self.active -= 1
+        self.errors += 1
+        request_time = time.time() - queued_at
+        self.request_time += request_time
+
+        response = tornado.httpclient.HTTPResponse(
+            request,
+            599,
+            error=tornado.httpclient.HTTPError(599, "Timeout in request queue"),
+            request_time=request_time)
+        callback(response)
+
+    def prewarm(self, connections, path="/"):
+        """Open ```connections``` connections to the upstream by
+        making that many concurrent GET requests for ```path```.
+        Responses, including error responses, are ignored so ```path```
+        should be something that's cheap and safe for the upstream to
+        serve. Connections are only kept alive when pycurl is installed
+        so without pycurl this does nothing."""
+        if _curl_http_client_class is None:
+            return
+        for i in range(min(connections, self.max_clients)):
+            request = tornado.httpclient.HTTPRequest(
+                "http://%s%s" % (self.upstream, path),
+                method="GET")
+            self.fetch(request, self._on_prewarm_done)
+
+    def _on_prewarm_done(self, response):
+        pass
+
+    def stats(self):
+        """Return a dict summarizing the pool's activity
+        since it was created."""
+        completed = self.requests - self.active
+        return {
+            "requests": self.requests,
+            "active": self.active,
+            "queued": len(self._queue),
+            "peak_active": self.peak_active,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "avg_request_time_ms": int(1000 * self.request_time / completed) if completed else 0,
+            "keep_alive": _curl_http_client_class is not None,
+        }
+
+
+def _upstream_of(address):
+    """Addresses like the key store's (127.0.0.1:5984/creds) can
+    include a path. Pools are per host:port so strip the path."""
+    return address.split("/", 1)[0]
+
+
+def _path_of(address):
+    """The path part of ```address``` - '/' if there isn't one."""
+    return "/" + address.split("/", 1)[1] if "/" in address else "/"
+
+
+def get_pool(address):
+    """Return the pool for the upstream described by ```address```
+    creating it if it doesn't already exist."""
+    upstream = _upstream_of(address)
+    pool = _pools.get(upstream, None)
+    if pool is None:
+        pool = Pool(upstream, max_clients, max_queue_size)
+        _pools[upstream] = pool
+    return pool
+
+
+def fetch(address, request, callback):
+    """Async'ly make ```request``` using the pool for the upstream
+    described by ```address```. See ```Pool.fetch()```."""
+    get_pool(address).fetch(request, callback)
+
+
+def stats():
+    """Return a dict of pool statistics keyed by upstream."""
+    return {upstream: pool.stats() for (upstream, pool) in _pools.items()}
+
+
+def log_stats():
+    for (upstream, pool_stats) in sorted(stats().items()):
+        fmt = (
+            "Upstream '%s' requests %d active %d queued %d peak active %d "
+            "rejected %d errors %d avg request time %d ms"
+        )
+        _logger.info(
+            fmt,
+            upstream,
+            pool_stats["requests"],
+            pool_stats["active"],
+            pool_stats["queued"],
+            pool_stats["peak_active"],
+            pool_stats["rejected"],
+            pool_stats["errors"],
+            pool_stats["avg_request_time_ms"])
+
+
+def start(addresses, prewarm_addresses=()):
+    """Called from a server's mainline once the IOLoop is running (in
+    each worker process when pre-forking) to create pools for each of
+    ```addresses```, pre-warm the connections of the pools for each of
+    ```prewarm_addresses``` and start periodic logging of pool statistics.
+
+    Pre-warming makes real requests (see ```Pool.prewarm()```) for the
+    address's path so only upstreams for which those requests are
+    harmless (a key store's database for example but not the app
+    service) should be in ```prewarm_addresses```."""
+    for address in addresses:
+        get_pool(address)
+
+    if prewarm_connections:
+        for address in prewarm_addresses:
+            get_pool(address).prewarm(prewarm_connections, _path_of(address))
+
+    if stats_interval:
+        periodic_callback = tornado.ioloop.PeriodicCallback(
+            log_stats,
+            1000 * stats_interval)
+        periodic_callback.start()